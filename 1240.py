@@ -1,456 +1,118 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
-import datetime
-import re
-import time
 
 # --- PyQt5 Imports ---
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QComboBox, QLabel, QLineEdit, QFileDialog,
-                             QTextEdit, QStatusBar, QMessageBox, QCheckBox, QGroupBox)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer, QMutex, QMutexLocker, pyqtSlot
-from PyQt5.QtGui import QImage, QPixmap, QIntValidator, QTextCursor
+                             QPlainTextEdit, QStatusBar, QMessageBox, QCheckBox, QGroupBox, QSizePolicy)
+from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer, pyqtSlot, QEvent
+from PyQt5.QtGui import QIntValidator, QFont
 
 # --- Other Imports ---
-import cv2
 try:
-    import can
+    import can # noqa: F401 (engine dùng python-can; báo thiếu thư viện sớm)
 except ImportError:
     print("Lỗi: Thư viện 'python-can' chưa được cài đặt.")
     print("Vui lòng chạy: pip install python-can")
     sys.exit(1)
-import numpy as np
+
+from video_pipeline import OVERFLOW_DROP_OLDEST, PACING_CAMERA
+from video_widget import VideoWidget, NEEDS_RB_SWAP
+from can_pipeline import format_can_row, parse_trigger_id
+from can_recorder import FORMAT_BINARY
+from encoders import ENCODER_AUTO, PRESET_BALANCED
+from segment_recorder import RECORDING_EVENT
+from clip_index import ClipCanTap
+from camera_group import CameraGroup
+from clip_finalizer import shared_finalizer
+from shm_capture import CAPTURE_INPROCESS
+from camera_discovery import (DEFAULT_PROBE_TIMEOUT, camera_label, discover_cameras,
+                              load_cached_cameras)
+from engine import EngineConfig
+from metrics import HOP_DISPATCH, MetricsExporter, format_panel, shared_metrics
+from qt_engine import CameraThread, CanThread
 
 # ---- Global Settings ----
 DEFAULT_SAVE_DIR = os.path.join(os.path.expanduser("~"), "CameraCAN_Recordings")
 CAMERA_SCAN_LIMIT = 5 # Quét từ index 0 đến 4
 DEFAULT_BITRATE = 500000
+PREROLL_SECONDS = 5 # Số giây giữ lại trước lệnh Start từ CAN (0 = tắt)
+PREROLL_MAX_BYTES = 64 * 1024 * 1024 # Ngân sách bộ nhớ cho pre-roll (frame nén JPEG)
+WRITER_QUEUE_SIZE = 64 # Hàng đợi frame cho luồng mã hóa
+WRITER_OVERFLOW_POLICY = OVERFLOW_DROP_OLDEST # block | drop_oldest | drop_newest
+CAPTURE_PACING = PACING_CAMERA # camera: chỉ chờ camera | fixed: sleep 0.9/fps mỗi frame (cũ)
+PREVIEW_FPS = 15 # Tần số cập nhật preview (Hz), 0 = mọi frame
+CAN_LOG_REFRESH_MS = 100 # Chu kỳ rút log CAN lên giao diện
+CAN_LOG_BATCH_ROWS = 200 # Số dòng tối đa được định dạng mỗi lần rút
+MAX_LOG_LINES = 500 # Giới hạn cứng số dòng trong khung log
+CAN_RECORD_ENABLED = True # Ghi liên tục mọi frame CAN vào <thư mục lưu>/can_logs
+CAN_RECORD_FORMAT = FORMAT_BINARY # ccl (nhị phân gọn) | blf | asc
+CAN_RECORD_ROTATE_BYTES = 256 * 1024 * 1024 # Xoay file theo kích thước (0 = tắt)
+CAN_RECORD_ROTATE_SECONDS = 3600 # Xoay file theo thời gian (0 = tắt)
+CAN_RECORD_QUOTA_BYTES = 4 * 1024 * 1024 * 1024 # Quota tổng log CAN, xóa file cũ nhất trước (0 = tắt)
+CAN_RECORD_SUBDIR = "can_logs"
+CLIP_INDEX_ENABLED = True # Sidecar <clip>.idx.npz: timestamp từng frame + frame CAN trong clip
+TRIGGER_DEBOUNCE_SECONDS = 0.5 # Frame trigger lặp lại (ECU phát 10-100 Hz) trong khoảng này bị gộp ngay ở listener
+MIN_CLIP_SECONDS = 0 # Lệnh dừng đến sớm hơn được hoãn đến đủ độ dài clip (0 = tắt)
+TRIGGER_HOLDOFF_SECONDS = 1.0 # Bỏ qua lệnh bắt đầu trong khoảng này sau khi dừng
+CAN_FD_ENABLED = False # Mở bus ở chế độ CAN FD (payload đến 64 byte)
+ISOTP_STOP_PAYLOAD = False # Chuỗi sự kiện của frame Dừng gửi bằng ISO-TP (nhiều frame), được ghép trước khi xử lý
+ISOTP_FC_ID = "" # ID (hex) để gửi Flow Control khi không có ECU nào khác trả lời ("" = chỉ nghe)
+DBC_FILE = "" # File DBC để giải mã tín hiệu xe ("" = tắt)
+DBC_SIGNALS = [] # Chỉ giải mã các tín hiệu này, 'Message.Signal' hoặc tên trần ([] = mọi tín hiệu trong DBC)
+TRIGGER_RULES_FILE = "" # File luật trigger, vd 'stop(Overspeed): speed > 80 for 2s' ("" = chỉ dùng ID ở trên)
+CATALOG_ENABLED = True # Danh mục SQLite <thư mục lưu>/catalog.sqlite3: tra cứu clip, cấp tên file O(1)
+CAPTURE_MODE = CAPTURE_INPROCESS # inprocess | process: camera đọc ở tiến trình riêng (GIL riêng), frame qua shared memory
+RECORDING_MODE = RECORDING_EVENT # event: ghi từ Start đến Stop | segments: ghi liên tục theo đoạn, sự kiện link đoạn
+SEGMENT_SECONDS = 10 # Độ dài mỗi đoạn ở chế độ segments
+SEGMENT_QUOTA_BYTES = 8 * 1024 * 1024 * 1024 # Hạn mức đoạn mỗi camera trong <thư mục lưu>/segments, xóa cũ nhất trước
+VIDEO_ENCODER = ENCODER_AUTO # auto (theo hiệu chuẩn 'python encoders.py --calibrate') | mjpg | mp4v | xvid | raw | x264 | ffv1
+VIDEO_ENCODER_PRESET = PRESET_BALANCED # fast | balanced | quality
+METRICS_EXPORT_ENABLED = False # Ghi metrics.json + metrics.prom (độ trễ trigger, jitter, hàng đợi ghi, CPU) vào <thư mục lưu>/metrics
+METRICS_EXPORT_SECONDS = 5 # Chu kỳ ghi file metrics
+METRICS_HTTP_PORT = 0 # Cổng 127.0.0.1 phục vụ /metrics và /metrics.json (0 = tắt)
+METRICS_REFRESH_MS = 1000 # Chu kỳ cập nhật khung hiệu năng
 
 os.makedirs(DEFAULT_SAVE_DIR, exist_ok=True)
 
-# ---- Thread cho Camera ----
-class CameraThread(QThread):
-    changePixmap = pyqtSignal(QPixmap)
-    recordingStartedSignal = pyqtSignal()
-    recordingStoppedSignal = pyqtSignal(str)
-    cameraErrorSignal = pyqtSignal(str)
-
-    def __init__(self, camera_index, save_dir, parent=None): # Thay camera_source thành camera_index
-        super().__init__(parent)
-        self.camera_index = camera_index # Lưu index
-        self.save_dir = save_dir
-        self._running = False
-        self._recording = False
-        self.video_writer = None
-        self.cap = None
-        self.error_string_from_can = "UnknownEvent"
-        self.temp_filename = None
-        self.mutex = QMutex()
-
-    def set_save_dir(self, directory):
-        if directory and os.path.isdir(directory):
-            with QMutexLocker(self.mutex):
-                self.save_dir = directory
-        else:
-            print(f"CameraThread: Cảnh báo: Thư mục lưu '{directory}' không hợp lệ.")
-
-    def run(self):
-        self._running = True
-        print(f"CameraThread: Attempting to open camera index: {self.camera_index}")
-        try:
-            # --- Đơn giản hóa việc mở camera ---
-            # Thử mở trực tiếp bằng index, cách này thường hoạt động với webcam
-            self.cap = cv2.VideoCapture(self.camera_index)
-
-            if not self.cap or not self.cap.isOpened():
-                # Thử thêm backend DSHOW cho Windows nếu lần đầu thất bại
-                if os.name == 'nt':
-                     print(f"CameraThread: Failed with default backend, trying CAP_DSHOW for index {self.camera_index}...")
-                     self.cap = cv2.VideoCapture(self.camera_index, cv2.CAP_DSHOW)
-
-                # Nếu vẫn không mở được
-                if not self.cap or not self.cap.isOpened():
-                    raise ConnectionError(f"Không thể mở camera index {self.camera_index}")
-
-            print(f"CameraThread: Camera index {self.camera_index} opened successfully.")
-
-            # --- Lấy thông số Camera ---
-            frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            # Thử lấy FPS, nếu không được hoặc quá cao/thấp thì dùng mặc định
-            try:
-                fps = self.cap.get(cv2.CAP_PROP_FPS)
-                if not (0 < fps <= 120): # Check FPS trong khoảng hợp lý
-                     print(f"CameraThread: Invalid FPS ({fps}) from camera index {self.camera_index}, using default 25.")
-                     fps = 25
-            except:
-                 print(f"CameraThread: Could not get FPS for camera index {self.camera_index}, using default 25.")
-                 fps = 25
-
-            if frame_width <= 0 or frame_height <= 0:
-                 # Thử lấy lại kích thước nếu lần đầu lỗi (một số camera cần thời gian)
-                 time.sleep(0.5)
-                 frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                 frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                 if frame_width <= 0 or frame_height <= 0:
-                      raise ValueError(f"Không lấy được kích thước frame hợp lệ từ camera index {self.camera_index}.")
-
-            print(f"CameraThread: Resolution: {frame_width}x{frame_height}, FPS: {fps:.2f}")
-
-            # --- Vòng lặp đọc frame ---
-            while self._running:
-                ret, frame = self.cap.read()
-                if not ret:
-                    print(f"CameraThread: Warning: Failed to grab frame from index {self.camera_index}.")
-                    if not self.cap.isOpened():
-                         print(f"CameraThread: Error: Connection lost for camera index {self.camera_index}.")
-                         self._running = False
-                         self.cameraErrorSignal.emit(f"Mất kết nối camera index {self.camera_index}.")
-                         break
-                    time.sleep(0.05) # Đợi nếu đọc lỗi frame
-                    continue
-
-                # Xử lý hiển thị
-                try:
-                    rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    h, w, ch = rgb_image.shape
-                    convert_to_qt_format = QImage(rgb_image.data, w, h, w * ch, QImage.Format_RGB888)
-                    if not convert_to_qt_format.isNull():
-                        p = QPixmap.fromImage(convert_to_qt_format)
-                        if not p.isNull(): self.changePixmap.emit(p)
-                except Exception as display_e: print(f"CameraThread: Display error: {display_e}")
-
-                # Xử lý ghi video
-                with QMutexLocker(self.mutex):
-                    if self._recording and self.video_writer and self.video_writer.isOpened():
-                        try: self.video_writer.write(frame)
-                        except Exception as write_e:
-                            print(f"CameraThread: Write frame error: {write_e}")
-                            self._recording = False
-                            try: self.video_writer.release()
-                            except Exception: pass
-                            self.video_writer = None
-                            self.cameraErrorSignal.emit(f"Lỗi ghi frame video: {write_e}")
-
-                # Sleep để kiểm soát tốc độ
-                sleep_duration = max(0.01, (1.0 / fps) * 0.9 if fps > 0 else 0.04) # 0.04s tương đương 25fps
-                time.sleep(sleep_duration)
-
-        except (ConnectionError, ValueError) as e:
-             print(f"CameraThread: Initialization/runtime error: {e}")
-             self.cameraErrorSignal.emit(str(e))
-        except Exception as e:
-             print(f"CameraThread: Unexpected error: {type(e).__name__}: {e}")
-             self.cameraErrorSignal.emit(f"Lỗi camera không xác định: {e}")
-        finally:
-            # --- Dọn dẹp ---
-            print(f"CameraThread: Finishing for index {self.camera_index}...")
-            if self.cap:
-                self.cap.release()
-                print("CameraThread: cv2.VideoCapture released.")
-            with QMutexLocker(self.mutex):
-                if self.video_writer:
-                     try:
-                         if self._recording:
-                            print("CameraThread: Releasing VideoWriter...")
-                            self.video_writer.release()
-                            print("CameraThread: VideoWriter released.")
-                     except Exception as release_e:
-                         print(f"CameraThread: Error releasing VideoWriter: {release_e}")
-                     finally: self.video_writer = None
-            self._recording = False
-            print(f"CameraThread: Thread finished for index {self.camera_index}.")
-
-    def stop(self):
-        print(f"CameraThread: Stop request for index {self.camera_index}.")
-        self._running = False
-        if self.isRunning():
-             if not self.wait(3000): # Đợi tối đa 3 giây
-                 print(f"CameraThread: Warning: Thread for index {self.camera_index} unresponsive. Terminating.")
-                 self.terminate()
-
-    # --- start_recording và stop_recording_and_save giữ nguyên logic như trước ---
-    # (Chúng không cần thay đổi khi bỏ cam IP)
-    def start_recording(self):
-        with QMutexLocker(self.mutex):
-            if self._recording:
-                print("CameraThread: Start recording called, but already recording.")
-                return False
-            if not self.cap or not self.cap.isOpened():
-                err_msg = "Lỗi: Không thể bắt đầu ghi hình vì camera chưa sẵn sàng."
-                print(f"CameraThread: {err_msg}")
-                return False
-
-            if not self.save_dir or not os.path.isdir(self.save_dir):
-                err_msg = f"Lỗi: Thư mục lưu '{self.save_dir}' không hợp lệ."
-                print(f"CameraThread: {err_msg}")
-                self.cameraErrorSignal.emit(err_msg)
-                return False
-
-            frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = self.cap.get(cv2.CAP_PROP_FPS)
-            if not (0 < fps <= 120): fps = 25
-            if frame_width <= 0 or frame_height <= 0:
-                err_msg = "Lỗi: Không lấy được kích thước frame hợp lệ."
-                print(f"CameraThread: {err_msg}")
-                self.cameraErrorSignal.emit(err_msg)
-                return False
-
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-            self.temp_filename = os.path.join(self.save_dir, f"rec_{timestamp}_temp.mp4")
-
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-
-            try:
-                print(f"CameraThread: Starting recording -> {self.temp_filename} ({frame_width}x{frame_height} @ {fps:.2f}fps)")
-                self.video_writer = cv2.VideoWriter(self.temp_filename, fourcc, fps, (frame_width, frame_height))
-
-                if not self.video_writer.isOpened():
-                     print("CameraThread: Warning: Failed with mp4v, trying XVID...")
-                     fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                     self.video_writer = cv2.VideoWriter(self.temp_filename, fourcc, fps, (frame_width, frame_height))
-                     if not self.video_writer.isOpened():
-                          raise IOError("Không thể mở VideoWriter (mp4v, XVID).")
-
-                self._recording = True
-                self.recordingStartedSignal.emit()
-                print("CameraThread: Recording started signal.")
-                return True
-
-            except Exception as e:
-                err_msg = f"Lỗi VideoWriter: {e}"
-                print(f"CameraThread: {err_msg}")
-                self.cameraErrorSignal.emit(err_msg)
-                if self.video_writer:
-                    try: self.video_writer.release()
-                    except: pass
-                self.video_writer = None
-                self._recording = False
-                if self.temp_filename and os.path.exists(self.temp_filename):
-                     try: os.remove(self.temp_filename); print(f"Removed failed temp: {self.temp_filename}")
-                     except: pass
-                self.temp_filename = None
-                return False
-
-    def stop_recording_and_save(self, error_string="UnknownEvent"):
-        final_filepath = ""
-        writer_instance = None # Biến tạm để lưu writer
-        temp_file_to_rename = None # Biến tạm để lưu tên file
-
-        with QMutexLocker(self.mutex):
-            if not self._recording:
-                print("CameraThread: Stop called but not recording.")
-                if self.video_writer: # Dọn dẹp nếu còn sót
-                    try: self.video_writer.release()
-                    except: pass
-                    self.video_writer = None
-                if self.temp_filename and os.path.exists(self.temp_filename):
-                    try: os.remove(self.temp_filename)
-                    except: pass
-                    self.temp_filename = None
-                self.recordingStoppedSignal.emit("") # Vẫn báo dừng
-                return
-
-            print(f"CameraThread: Stopping recording. Event: '{error_string}'")
-            self._recording = False
-            writer_instance = self.video_writer
-            temp_file_to_rename = self.temp_filename
-            self.video_writer = None
-            self.temp_filename = None
-        # ---- Hết vùng khóa Mutex ----
-
-        try:
-            if writer_instance:
-                print("CameraThread: Releasing VideoWriter...")
-                writer_instance.release()
-                print("CameraThread: VideoWriter released.")
-            else:
-                temp_file_to_rename = None # Không có writer thì không có file tạm
-
-            if temp_file_to_rename and os.path.exists(temp_file_to_rename):
-                file_size = os.path.getsize(temp_file_to_rename)
-                print(f"CameraThread: Temp file size: {file_size} bytes")
-                if file_size > 500: # Lưu nếu kích thước lớn hơn 500 bytes (ngưỡng nhỏ)
-                    safe_error_string = re.sub(r'[\\/*?:"<>|]', "_", error_string)
-                    safe_error_string = "_".join(safe_error_string.split()).strip('_')
-                    if not safe_error_string: safe_error_string = "Event"
-
-                    date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-                    base_fn = f"{date_str}_{safe_error_string}.mp4"
-                    final_fn = base_fn
-                    # Đảm bảo self.save_dir là hợp lệ
-                    current_save_dir = self.save_dir if os.path.isdir(self.save_dir) else DEFAULT_SAVE_DIR
-                    final_filepath = os.path.join(current_save_dir, final_fn)
-
-                    counter = 1
-                    while os.path.exists(final_filepath):
-                          name, ext = os.path.splitext(base_fn)
-                          final_fn = f"{name}_{counter}{ext}"
-                          final_filepath = os.path.join(current_save_dir, final_fn)
-                          counter += 1
-                          if counter > 100: final_filepath = ""; break # Tránh lặp vô hạn
-
-                    if final_filepath:
-                        print(f"CameraThread: Renaming '{temp_file_to_rename}' to '{final_filepath}'")
-                        os.rename(temp_file_to_rename, final_filepath)
-                        print(f"CameraThread: Saved: {final_filepath}")
-                    else:
-                        print(f"CameraThread: Could not generate unique filename. Deleting temp: {temp_file_to_rename}")
-                        os.remove(temp_file_to_rename)
-                else:
-                    print(f"CameraThread: Temp file '{temp_file_to_rename}' too small or empty. Deleting.")
-                    os.remove(temp_file_to_rename)
-                    final_filepath = ""
-            else:
-                print("CameraThread: No valid temp file found to save.")
-                final_filepath = ""
-
-        except Exception as e:
-            print(f"CameraThread: Error saving/renaming: {e}")
-            final_filepath = ""
-            if temp_file_to_rename and os.path.exists(temp_file_to_rename):
-                 try: os.remove(temp_file_to_rename); print("Cleaned up temp file on error.")
-                 except: pass
-        finally:
-             self.recordingStoppedSignal.emit(final_filepath)
-             print(f"CameraThread: Stopped signal emitted. Path='{final_filepath}'")
-
-
-# ---- Thread cho CAN ----
-# (Giữ nguyên CanThread như phiên bản trước - không cần thay đổi)
-class CanThread(QThread):
-    logMessage = pyqtSignal(str)
-    startRecordingSignal = pyqtSignal()
-    stopRecordingAndSaveSignal = pyqtSignal(str) # Gửi chuỗi lỗi/sự kiện từ payload
-    canErrorSignal = pyqtSignal(str)
-    connectionStatusSignal = pyqtSignal(bool) # True khi kết nối, False khi ngắt
-
-    def __init__(self, interface, channel, bitrate, start_id_hex, stop_id_hex, emergency_id_hex=None, parent=None):
-        super().__init__(parent)
-        self.interface = interface
-        self.channel = channel
-        self.bitrate = bitrate
-        self.start_id = None
-        self.stop_id = None
-        self.emergency_id = None
-        self._running = False
-        self.bus = None
-        self.notifier = None
-        self.listener = None
-
-        print(f"CanThread: Initializing with config: IF='{interface}', CH='{channel}', BR={bitrate}, Start='{start_id_hex}', Stop='{stop_id_hex}'")
-
-        missing_ids = []
-        try:
-            if not start_id_hex: missing_ids.append("Bắt Đầu Ghi")
-            else: self.start_id = int(start_id_hex, 16)
-
-            if not stop_id_hex: missing_ids.append("Dừng & Lưu")
-            else: self.stop_id = int(stop_id_hex, 16)
-
-            if emergency_id_hex: self.emergency_id = int(emergency_id_hex, 16)
-
-            if missing_ids: raise ValueError(f"CAN ID bắt buộc bị thiếu: {', '.join(missing_ids)}")
-            if not isinstance(self.bitrate, int) or self.bitrate <= 0: raise ValueError("Bitrate không hợp lệ.")
-
-            print(f"CanThread: CAN IDs parsed - Start: {hex(self.start_id)}, Stop: {hex(self.stop_id)}, Emergency: {hex(self.emergency_id) if self.emergency_id else 'None'}")
-
-        except ValueError as e:
-            raise ValueError(f"Lỗi cấu hình CAN: {e}")
-
+# ---- Thread quét Webcam ----
+class CameraScanThread(QThread):
+    """Quét webcam ở nền: liệt kê thiết bị, thử mở song song có timeout, cập nhật cache."""
+    camerasFound = pyqtSignal(list) # Danh sách CameraInfo
 
     def run(self):
-        self._running = True
         try:
-            print("CanThread: Attempting to connect to CAN bus...")
-            kwargs = {'interface': self.interface, 'channel': self.channel, 'receive_own_messages': False}
-            # Các interface thường dùng với CANable/SLCAN cần bitrate
-            if self.interface.lower() in ['slcan', 'serial', 'pcan', 'kvaser', 'vector', 'ixxat', 'usb2can']:
-                 kwargs['bitrate'] = self.bitrate
-            elif self.interface.lower() == 'socketcan': # Trên Linux
-                 print(f"CanThread: Note for socketcan - Bitrate ({self.bitrate}) should be set externally (e.g., using 'ip link').")
-
-            print(f"CanThread: Initializing can.interface.Bus with: {kwargs}")
-            self.bus = can.interface.Bus(**kwargs)
-            print(f"CanThread: CAN bus connected! Type: {self.bus.__class__.__name__}")
-            self.connectionStatusSignal.emit(True)
-
-            class MyListener(can.Listener):
-                def __init__(self, parent_thread):
-                    self.parent = parent_thread
-
-                def on_message_received(self, msg: can.Message):
-                    if not self.parent._running: return
-
-                    log_str = f"ID: {msg.arbitration_id:<5X} DLC: {msg.dlc} Data: {msg.data.hex().upper():<18}"
-                    self.parent.logMessage.emit(log_str)
-
-                    try:
-                        if self.parent.start_id is not None and msg.arbitration_id == self.parent.start_id:
-                            print(f"CanThread: Rx Start Rec. (ID: {msg.arbitration_id:#X})")
-                            self.parent.startRecordingSignal.emit()
-                        elif self.parent.stop_id is not None and msg.arbitration_id == self.parent.stop_id:
-                            print(f"CanThread: Rx Stop Rec. (ID: {msg.arbitration_id:#X})")
-                            payload_str = "PayloadError"
-                            try:
-                                payload_bytes = msg.data
-                                null_index = payload_bytes.find(b'\x00')
-                                if null_index != -1: payload_bytes = payload_bytes[:null_index]
-                                payload_str = payload_bytes.decode('utf-8', errors='replace').strip()
-                                if not payload_str: payload_str = "EventDataEmpty"
-                            except Exception as decode_err:
-                                print(f"CanThread: Payload decode error: {decode_err}")
-                            print(f"CanThread: Extracted event: '{payload_str}'")
-                            self.parent.stopRecordingAndSaveSignal.emit(payload_str)
-                    except Exception as handler_err:
-                         print(f"CanThread: Error handling msg: {handler_err}")
-
-                def on_error(self, exc):
-                     print(f"CanThread Listener Error: {exc}")
-                     if self.parent._running:
-                        self.parent.canErrorSignal.emit(f"Lỗi Bus/Listener: {exc}")
-
-            self.listener = MyListener(self)
-            self.notifier = can.Notifier(self.bus, [self.listener], timeout=1.0)
-            print("CanThread: CAN Notifier started.")
-
-            while self._running:
-                time.sleep(0.2) # Giữ thread chạy, giảm CPU
-
-        except can.CanError as e:
-            err_msg = f"Lỗi kết nối/giao tiếp CAN: {e}"
-            print(f"CanThread: {err_msg}")
-            if self._running: self.canErrorSignal.emit(err_msg)
-        except ValueError as e: # Lỗi cấu hình (bitrate/ID)
-            err_msg = f"Lỗi cấu hình CAN: {e}"
-            print(f"CanThread: {err_msg}")
-            if self._running: self.canErrorSignal.emit(err_msg)
+            cameras = discover_cameras(CAMERA_SCAN_LIMIT, timeout=DEFAULT_PROBE_TIMEOUT)
         except Exception as e:
-            err_msg = f"Lỗi CAN không xác định: {type(e).__name__}: {e}"
-            print(f"CanThread: {err_msg}")
-            if self._running: self.canErrorSignal.emit(err_msg)
-        finally:
-            print("CanThread: Finishing...")
-            self._running = False
-            if self.notifier:
-                try: self.notifier.stop(timeout=1.0) # Timeout ngắn hơn
-                except Exception as e: print(f"CanThread: Error stop notifier: {e}")
-            if self.bus:
-                try: self.bus.shutdown()
-                except Exception as e: print(f"CanThread: Error shutdown bus: {e}")
-            self.connectionStatusSignal.emit(False)
-            print("CanThread: Thread finished.")
-
-    def stop(self):
-        print("CanThread: Stop request received.")
-        self._running = False
+            print(f"CameraScanThread: Scan error: {e}")
+            cameras = []
+        self.camerasFound.emit(cameras)
+
+
+# ---- Cấu hình engine (lõi ghi hình dùng chung với cancam_daemon.py) ----
+ENGINE_CONFIG = EngineConfig(
+    save_dir=DEFAULT_SAVE_DIR, preroll_seconds=PREROLL_SECONDS, preroll_max_bytes=PREROLL_MAX_BYTES,
+    writer_queue_size=WRITER_QUEUE_SIZE, writer_overflow_policy=WRITER_OVERFLOW_POLICY,
+    capture_pacing=CAPTURE_PACING, preview_fps=PREVIEW_FPS, capture_mode=CAPTURE_MODE,
+    recording_mode=RECORDING_MODE, segment_seconds=SEGMENT_SECONDS, segment_quota_bytes=SEGMENT_QUOTA_BYTES,
+    encoder=VIDEO_ENCODER, encoder_preset=VIDEO_ENCODER_PRESET,
+    clip_index=CLIP_INDEX_ENABLED, catalog=CATALOG_ENABLED, can_record_format=CAN_RECORD_FORMAT,
+    trigger_debounce_seconds=TRIGGER_DEBOUNCE_SECONDS, min_clip_seconds=MIN_CLIP_SECONDS,
+    trigger_holdoff_seconds=TRIGGER_HOLDOFF_SECONDS, can_fd=CAN_FD_ENABLED, isotp=ISOTP_STOP_PAYLOAD,
+    isotp_fc_id=ISOTP_FC_ID, dbc_file=DBC_FILE, dbc_signals=DBC_SIGNALS,
+    trigger_rules_file=TRIGGER_RULES_FILE, metrics_export=METRICS_EXPORT_ENABLED,
+    metrics_interval=METRICS_EXPORT_SECONDS, metrics_port=METRICS_HTTP_PORT,
+    can_record_rotate_bytes=CAN_RECORD_ROTATE_BYTES, can_record_rotate_seconds=CAN_RECORD_ROTATE_SECONDS,
+    can_record_quota_bytes=CAN_RECORD_QUOTA_BYTES)
+# CameraThread / CanThread: adapter Qt trong qt_engine.py quanh CameraWorker / CanWorker của engine
 
 
 # ---- Giao diện chính (Đã đơn giản hóa) ----
 class MainWindow(QMainWindow):
+    eventSavedSignal = pyqtSignal(list) # Clip của một sự kiện đã hoàn tất ở luồng nền (ClipFinalizer)
+
     def __init__(self):
         super().__init__()
         # Giảm tiêu đề và kích thước mặc định
@@ -458,11 +120,22 @@ class MainWindow(QMainWindow):
         self.setGeometry(150, 150, 950, 700)
 
         # Thuộc tính
-        self.camera_thread = None
+        self.camera_thread = None # Camera chính của nhóm (preview + trạng thái ghi)
+        self.camera_group = None
+        self.scan_thread = None # CameraScanThread đang chạy (nếu có)
         self.can_thread = None
         self.current_save_dir = DEFAULT_SAVE_DIR
         self.is_recording_flag = False
         self.can_log_enabled = True
+        self.clip_tap = ClipCanTap() if CLIP_INDEX_ENABLED else None # CAN -> chỉ mục clip
+        self.eventSavedSignal.connect(self.on_event_saved)
+        self.metrics = shared_metrics() # Độ trễ trigger theo chặng, jitter, hàng đợi ghi, CPU (engine ghi vào)
+        self.metrics_exporter = None
+        if METRICS_EXPORT_ENABLED or METRICS_HTTP_PORT:
+            self.metrics_exporter = MetricsExporter(self.metrics,
+                                                    self.current_save_dir if METRICS_EXPORT_ENABLED else None,
+                                                    METRICS_EXPORT_SECONDS, METRICS_HTTP_PORT)
+            self.metrics_exporter.start()
 
         # Layout chính
         main_widget = QWidget(self)
@@ -473,11 +146,12 @@ class MainWindow(QMainWindow):
         video_layout = QVBoxLayout()
         video_groupbox = QGroupBox("Camera View")
         video_gb_layout = QVBoxLayout()
-        self.video_label = QLabel("Camera Tắt")
-        self.video_label.setAlignment(Qt.AlignCenter)
-        self.video_label.setMinimumSize(600, 450) # Giảm kích thước min
-        self.video_label.setStyleSheet("border: 1px solid gray; background-color: #ddd; color: black;")
-        video_gb_layout.addWidget(self.video_label)
+        self.video_view = VideoWidget("Camera Tắt")
+        self.video_view.setMinimumSize(600, 450) # Giảm kích thước min
+        self.video_view.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.video_view.installEventFilter(self) # Theo dõi kích thước để co giãn preview trong CameraThread
+        self.video_view.setStyleSheet("border: 1px solid gray; background-color: #ddd; color: black;")
+        video_gb_layout.addWidget(self.video_view)
         video_groupbox.setLayout(video_gb_layout)
         video_layout.addWidget(video_groupbox)
         main_layout.addLayout(video_layout, 3) # Video chiếm nhiều không gian hơn
@@ -498,6 +172,13 @@ class MainWindow(QMainWindow):
         cam_sel_layout.addWidget(self.cam_combo, 1)
         cam_sel_layout.addWidget(self.scan_cam_btn)
         cam_v_layout.addLayout(cam_sel_layout)
+        extra_cam_layout = QHBoxLayout()
+        self.extra_cams_input = QLineEdit()
+        self.extra_cams_input.setPlaceholderText("vd: 1, 2")
+        self.extra_cams_input.setToolTip("Index các webcam phụ ghi cùng lệnh CAN (cách nhau dấu phẩy)")
+        extra_cam_layout.addWidget(QLabel("Cam phụ:"))
+        extra_cam_layout.addWidget(self.extra_cams_input, 1)
+        cam_v_layout.addLayout(extra_cam_layout)
         # --- Bỏ phần thêm IP Cam ---
         cam_btn_layout = QHBoxLayout()
         self.start_cam_btn = QPushButton("Bật Camera")
@@ -528,11 +209,15 @@ class MainWindow(QMainWindow):
         dir_layout.addWidget(self.select_dir_btn)
         sys_v_layout.addLayout(dir_layout)
         # Log CAN
-        self.can_log_display = QTextEdit() # Tạo log display trước
+        self.can_log_display = QPlainTextEdit() # Tạo log display trước
         self.can_log_display.setReadOnly(True)
-        self.can_log_display.setFontFamily("Consolas")
-        self.can_log_display.setLineWrapMode(QTextEdit.NoWrap) # Không xuống dòng tự động
+        self.can_log_display.setFont(QFont("Consolas"))
+        self.can_log_display.setLineWrapMode(QPlainTextEdit.NoWrap) # Không xuống dòng tự động
+        self.can_log_display.setMaximumBlockCount(MAX_LOG_LINES) # Giới hạn cứng, Qt tự bỏ dòng cũ
         self.can_log_display.setFixedHeight(100) # Giới hạn chiều cao log
+        self.can_log_skipped = 0
+        self.can_log_skipped_label = QLabel("Bỏ qua: 0")
+        self.can_log_skipped_label.setToolTip("Số frame CAN không hiển thị do giao diện không theo kịp")
         log_ctrl_layout = QHBoxLayout()
         self.can_log_checkbox = QCheckBox("Hiện Log CAN")
         self.can_log_checkbox.setChecked(self.can_log_enabled)
@@ -541,11 +226,16 @@ class MainWindow(QMainWindow):
         clear_log_btn.clicked.connect(self.can_log_display.clear)
         log_ctrl_layout.addWidget(self.can_log_checkbox)
         log_ctrl_layout.addStretch()
+        log_ctrl_layout.addWidget(self.can_log_skipped_label)
         log_ctrl_layout.addWidget(clear_log_btn)
         sys_v_layout.addLayout(log_ctrl_layout)
         sys_v_layout.addWidget(self.can_log_display) # Thêm log display vào layout
         sys_gb.setLayout(sys_v_layout)
         control_layout.addWidget(sys_gb)
+        # Timer rút log CAN theo lô
+        self.can_log_timer = QTimer(self)
+        self.can_log_timer.setInterval(CAN_LOG_REFRESH_MS)
+        self.can_log_timer.timeout.connect(self.flush_can_log)
 
         # -- 3. CAN Control --
         can_gb = QGroupBox("3. Điều Khiển Qua CAN")
@@ -567,9 +257,9 @@ class MainWindow(QMainWindow):
         can_v_layout.addLayout(can_hw_layout)
         can_id_layout = QHBoxLayout()
         self.start_id_input = QLineEdit("100")
-        self.start_id_input.setPlaceholderText("Start Rec ID (Hex)")
+        self.start_id_input.setPlaceholderText("Start Rec ID (Hex, ID/MASK)")
         self.stop_id_input = QLineEdit("101")
-        self.stop_id_input.setPlaceholderText("Stop Rec ID (Hex)")
+        self.stop_id_input.setPlaceholderText("Stop Rec ID (Hex, ID/MASK)")
         can_id_layout.addWidget(QLabel("Start:"))
         can_id_layout.addWidget(self.start_id_input)
         can_id_layout.addWidget(QLabel("Stop:"))
@@ -583,6 +273,23 @@ class MainWindow(QMainWindow):
         can_gb.setLayout(can_v_layout)
         control_layout.addWidget(can_gb)
 
+        # -- 4. Hiệu năng --
+        stats_gb = QGroupBox("4. Hiệu Năng")
+        stats_v_layout = QVBoxLayout()
+        self.stats_display = QPlainTextEdit()
+        self.stats_display.setReadOnly(True)
+        self.stats_display.setFont(QFont("Consolas"))
+        self.stats_display.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.stats_display.setFixedHeight(150)
+        self.stats_display.setToolTip("Độ trễ từ frame CAN Start tới từng chặng ghi (ms), jitter camera, hàng đợi ghi, CPU")
+        stats_v_layout.addWidget(self.stats_display)
+        stats_gb.setLayout(stats_v_layout)
+        control_layout.addWidget(stats_gb)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setInterval(METRICS_REFRESH_MS)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start()
+
         control_layout.addStretch() # Đẩy các group box lên trên
         main_layout.addLayout(control_layout, 1) # Control chiếm ít không gian hơn
 
@@ -590,62 +297,55 @@ class MainWindow(QMainWindow):
         self.statusBar = QStatusBar()
         self.setStatusBar(self.statusBar)
 
-        # Khởi tạo
-        self.scan_cameras() # Quét camera khi bắt đầu
-        # Cập nhật status ban đầu dựa trên kết quả quét
-        if self.cam_combo.count() > 0 and self.cam_combo.itemText(0) != "Không tìm thấy camera":
-            self.statusBar.showMessage("Sẵn sàng. Chọn Webcam và nhấn Bật Camera.")
-        else:
-            self.statusBar.showMessage("Không tìm thấy webcam. Kiểm tra kết nối và nhấn Quét Lại.")
+        # Khởi tạo: hiện ngay danh sách từ cache, quét lại ở nền
+        cached = load_cached_cameras()
+        if cached:
+            self.populate_camera_combo(cached)
+            self.statusBar.showMessage("Sẵn sàng (danh sách webcam từ lần trước, đang kiểm tra lại...).")
+        self.scan_cameras()
 
 
     # --- Các Phương Thức ---
 
     def scan_cameras(self):
-        """Chỉ quét webcam."""
-        self.statusBar.showMessage("Đang quét webcam...")
-        self.setEnabled_CameraControls(False) # Khóa control khi quét
-        QApplication.processEvents()
-        time.sleep(0.1) # Chờ chút trước khi quét
-
-        # --- Chỉ quét hardware camera ---
-        self.cam_combo.clear() # Xóa hết item cũ
-        found_cameras = []
-        print("Scanning for webcams...")
-        for i in range(CAMERA_SCAN_LIMIT):
-            print(f"  Trying index {i}...")
-            cap_test = None
-            try:
-                cap_test = cv2.VideoCapture(i) # Thử cách đơn giản nhất
-                if cap_test and cap_test.isOpened():
-                     cam_name = f"Webcam {i}"
-                     found_cameras.append((cam_name, i)) # Lưu cả tên và index (int)
-                     print(f"    -> Found: {cam_name}")
-                # Không cần thử backend khác nếu cách đơn giản hoạt động
-            except Exception as e:
-                 print(f"    -> Error opening index {i}: {e}")
-            finally:
-                if cap_test:
-                    cap_test.release()
-                    # print(f"    -> Released index {i}")
-                # Thêm độ trễ nhỏ giữa các lần thử để tránh tranh chấp tài nguyên
-                time.sleep(0.1) # Delay 100ms
-
-        self.setEnabled_CameraControls(True) # Mở khóa control
-
-        if not found_cameras:
-            self.cam_combo.addItem("Không tìm thấy webcam")
-            self.cam_combo.setEnabled(False)
-            self.start_cam_btn.setEnabled(False)
+        """Quét webcam ở luồng nền (không chặn giao diện)."""
+        if self.scan_thread and self.scan_thread.isRunning(): return
+        print("MainWindow: Scanning for webcams in background...")
+        self.scan_cam_btn.setEnabled(False)
+        if self.cam_combo.count() == 0:
+            self.statusBar.showMessage("Đang quét webcam...")
+        self.scan_thread = CameraScanThread(self)
+        self.scan_thread.camerasFound.connect(self.on_cameras_found)
+        self.scan_thread.start()
+
+    def on_cameras_found(self, cameras):
+        self.populate_camera_combo(cameras)
+        camera_running = self.camera_group is not None and self.camera_group.is_running()
+        if camera_running:
+            self.scan_cam_btn.setEnabled(True)
+        else:
+            self.setEnabled_CameraControls(True)
+        if not cameras:
             self.statusBar.showMessage("Không tìm thấy webcam. Kiểm tra và Quét Lại.")
             print("Webcam scan finished: None found.")
         else:
-             self.cam_combo.setEnabled(True)
-             for name, index in found_cameras: # userData là index (int)
-                 self.cam_combo.addItem(name, userData=index)
-             self.start_cam_btn.setEnabled(True)
-             self.statusBar.showMessage("Sẵn sàng. Chọn Webcam và nhấn Bật Camera.")
-             print(f"Webcam scan finished: Found {len(found_cameras)} webcam(s).")
+            if not camera_running:
+                self.statusBar.showMessage("Sẵn sàng. Chọn Webcam và nhấn Bật Camera.")
+            print(f"Webcam scan finished: Found {len(cameras)} webcam(s).")
+
+    def populate_camera_combo(self, cameras):
+        """Điền combo từ danh sách CameraInfo (userData là index int), giữ lựa chọn hiện tại nếu còn."""
+        current = self.cam_combo.currentData()
+        self.cam_combo.clear()
+        if not cameras:
+            self.cam_combo.addItem("Không tìm thấy webcam")
+            self.cam_combo.setEnabled(False)
+            return
+        for info in cameras:
+            self.cam_combo.addItem(camera_label(info), userData=info.index)
+        position = self.cam_combo.findData(current)
+        if position >= 0:
+            self.cam_combo.setCurrentIndex(position)
 
 
     def setEnabled_CameraControls(self, enabled):
@@ -654,8 +354,9 @@ class MainWindow(QMainWindow):
         has_cam = self.cam_combo.count() > 0 and self.cam_combo.itemText(0) != "Không tìm thấy webcam"
         self.cam_combo.setEnabled(enabled and has_cam)
         self.scan_cam_btn.setEnabled(enabled)
+        self.extra_cams_input.setEnabled(enabled)
 
-        is_cam_running = self.camera_thread is not None and self.camera_thread.isRunning()
+        is_cam_running = self.camera_group is not None and self.camera_group.is_running()
         # Nút Start chỉ bật khi enabled=True, có cam, và cam chưa chạy
         self.start_cam_btn.setEnabled(enabled and has_cam and not is_cam_running)
         # Nút Stop chỉ bật khi cam đang chạy
@@ -663,9 +364,18 @@ class MainWindow(QMainWindow):
 
     # --- Bỏ hàm add_ip_camera ---
 
+    def extra_camera_indices(self):
+        """Index webcam phụ từ ô nhập; bỏ qua giá trị không phải số và trùng camera chính."""
+        indices = []
+        for part in self.extra_cams_input.text().split(","):
+            part = part.strip()
+            if part.isdigit() and int(part) not in indices:
+                indices.append(int(part))
+        return indices
+
     def start_camera(self):
-        """Kết nối và bắt đầu hiển thị webcam đã chọn."""
-        if self.camera_thread and self.camera_thread.isRunning(): return
+        """Kết nối và bắt đầu hiển thị webcam đã chọn (cùng các webcam phụ nếu có)."""
+        if self.camera_group and self.camera_group.is_running(): return
 
         selected_index = self.cam_combo.currentIndex()
         camera_index = self.cam_combo.itemData(selected_index) # Lấy index (int) từ userData
@@ -680,30 +390,40 @@ class MainWindow(QMainWindow):
         self.stop_cam_btn.setEnabled(True)  # Bật nút stop ngay
         QApplication.processEvents()
 
-        if self.camera_thread: # Dọn thread cũ nếu có
-            self.camera_thread.stop() # Đảm bảo thread cũ dừng hẳn
-
-        self.camera_thread = CameraThread(camera_index, self.current_save_dir) # Truyền index
-        self.camera_thread.changePixmap.connect(self.set_image)
+        if self.camera_group: # Dọn thread cũ nếu có
+            self.camera_group.stop() # Đảm bảo thread cũ dừng hẳn
+
+        # Nhóm camera: mọi camera nhận chung lệnh ghi/dừng từ CAN, camera đầu tiên dùng cho preview
+        self.camera_group = CameraGroup(self.current_save_dir, use_catalog=CATALOG_ENABLED)
+        self.camera_group.on_event_stopped = self.eventSavedSignal.emit # Gọi từ luồng nền -> về luồng GUI
+        indices = [camera_index] + [i for i in self.extra_camera_indices() if i != camera_index]
+        for index in indices:
+            camera = self.camera_group.add(CameraThread(index, self.current_save_dir, ENGINE_CONFIG, NEEDS_RB_SWAP)) # Truyền index
+            camera.clip_tap = self.clip_tap
+            camera.cameraErrorSignal.connect(self.on_camera_error)
+        for camera in self.camera_group.cameras[1:]:
+            camera.set_preview_enabled(False)
+        self.camera_thread = self.camera_group.primary
+        self.camera_thread.frameReady.connect(self.set_image)
         self.camera_thread.recordingStartedSignal.connect(self.on_recording_started)
         self.camera_thread.recordingStoppedSignal.connect(self.on_recording_stopped)
-        self.camera_thread.cameraErrorSignal.connect(self.on_camera_error)
         self.camera_thread.finished.connect(self.on_camera_thread_finished)
+        self.update_preview_target()
 
-        print(f"MainWindow: Starting camera thread for index: {camera_index}")
-        self.camera_thread.start()
-        self.video_label.setText(f"Đang kết nối {current_cam_text}...")
-        self.video_label.setStyleSheet("border: 2px solid orange;") # Viền cam đậm hơn
+        print(f"MainWindow: Starting camera threads for indices: {indices}")
+        self.camera_group.start()
+        self.video_view.setText(f"Đang kết nối {current_cam_text}...")
+        self.video_view.setStyleSheet("border: 2px solid orange;") # Viền cam đậm hơn
 
 
     def stop_camera(self):
         """Dừng webcam."""
-        if self.camera_thread and self.camera_thread.isRunning():
+        if self.camera_group and self.camera_group.is_running():
             self.statusBar.showMessage("Đang dừng camera...")
             self.setEnabled_CameraControls(False) # Khóa nút khi đang dừng
             QApplication.processEvents()
-            print("MainWindow: Requesting camera thread stop.")
-            self.camera_thread.stop()
+            print("MainWindow: Requesting camera threads stop.")
+            self.camera_group.stop()
             # UI reset trong on_camera_thread_finished
         else:
             print("Stop camera called but thread not running.")
@@ -713,12 +433,17 @@ class MainWindow(QMainWindow):
         """Xử lý khi thread camera kết thúc."""
         print("MainWindow: Camera thread finished.")
         was_recording = self.is_recording_flag
+        if self.camera_group:
+            self.camera_group.stop() # Camera chính dừng -> dừng cả camera phụ
+            self.camera_group = None
         self.camera_thread = None
         self.is_recording_flag = False
+        if self.can_thread:
+            self.can_thread.reset_triggers() # Không còn clip mở: lệnh Ghi kế tiếp phải tới được đây
 
-        self.video_label.setText("Camera Tắt")
-        self.video_label.setPixmap(QPixmap()) # Xóa ảnh
-        self.video_label.setStyleSheet("border: 1px solid gray; background-color: #ddd; color: black;")
+        self.video_view.setText("Camera Tắt")
+        self.video_view.clear() # Xóa ảnh, trả bộ đệm về pool
+        self.video_view.setStyleSheet("border: 1px solid gray; background-color: #ddd; color: black;")
         self.setEnabled_CameraControls(True) # Mở khóa control
 
         current_status = self.statusBar.currentMessage()
@@ -726,27 +451,51 @@ class MainWindow(QMainWindow):
             self.statusBar.showMessage("Camera đã tắt.")
 
 
-    @pyqtSlot(QPixmap)
-    def set_image(self, pixmap):
+    @pyqtSlot(object)
+    def set_image(self, frame):
         """Hiển thị frame ảnh."""
-        # Chỉ cập nhật nếu thread và label còn tồn tại
-        if self.video_label and self.camera_thread and self.camera_thread.isRunning():
-            current_style = self.video_label.styleSheet()
-            # Đổi viền khi frame đầu tiên về (không ghi hình)
-            if "orange" in current_style and not self.is_recording_flag:
-                 self.video_label.setStyleSheet("border: 1px solid green;") # Viền xanh
-                 if "Đang kết nối" in self.statusBar.currentMessage():
-                     self.statusBar.showMessage(f"Đang hiển thị: {self.cam_combo.currentText()}")
-            elif "green" in current_style and self.is_recording_flag:
-                 # Trường hợp bắt đầu ghi khi đang hiển thị -> đổi sang đỏ
-                 self.video_label.setStyleSheet("border: 3px solid red;")
-
-            # Scale và hiển thị ảnh
-            try:
-                 scaled_pixmap = pixmap.scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                 self.video_label.setPixmap(scaled_pixmap)
-            except Exception as e:
-                 print(f"Error scaling/setting pixmap: {e}")
+        # Chỉ cập nhật nếu thread camera còn chạy
+        if not (self.camera_thread and self.camera_thread.isRunning()):
+            frame.release() # Frame đến muộn sau khi tắt camera
+            return
+        current_style = self.video_view.styleSheet()
+        # Đổi viền khi frame đầu tiên về (không ghi hình)
+        if "orange" in current_style and not self.is_recording_flag:
+             self.video_view.setStyleSheet("border: 1px solid green;") # Viền xanh
+             if "Đang kết nối" in self.statusBar.currentMessage():
+                 self.statusBar.showMessage(f"Đang hiển thị: {self.cam_combo.currentText()}")
+        elif "green" in current_style and self.is_recording_flag:
+             # Trường hợp bắt đầu ghi khi đang hiển thị -> đổi sang đỏ
+             self.video_view.setStyleSheet("border: 3px solid red;")
+
+        # Ảnh đã được co giãn đúng kích thước khung trong CameraThread
+        self.video_view.show_frame(frame)
+
+    def update_preview_target(self):
+        """Gửi kích thước khung video và trạng thái hiển thị cho CameraThread."""
+        if self.camera_thread:
+            size = self.video_view.contentsRect().size()
+            self.camera_thread.set_preview_size(size.width(), size.height())
+            # Cửa sổ bị ẩn/thu nhỏ -> dừng hẳn xử lý preview
+            self.camera_thread.set_preview_enabled(self.isVisible() and not self.isMinimized())
+
+    def eventFilter(self, obj, event):
+        if obj is self.video_view and event.type() == QEvent.Resize:
+            self.update_preview_target()
+        return super().eventFilter(obj, event)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.update_preview_target()
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_preview_target()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.update_preview_target()
 
 
     def select_directory(self):
@@ -755,8 +504,10 @@ class MainWindow(QMainWindow):
         if new_dir and os.path.isdir(new_dir) and new_dir != self.current_save_dir:
             self.current_save_dir = new_dir
             self.dir_label.setText(new_dir)
-            if self.camera_thread and self.camera_thread.isRunning():
-                self.camera_thread.set_save_dir(new_dir)
+            if self.camera_group:
+                self.camera_group.set_save_dir(new_dir)
+            if self.metrics_exporter and METRICS_EXPORT_ENABLED:
+                self.metrics_exporter.set_directory(new_dir)
             print(f"Save directory set to: {new_dir}")
         elif new_dir:
              QMessageBox.warning(self, "Lỗi", f"Đường dẫn không hợp lệ: '{new_dir}'")
@@ -783,9 +534,13 @@ class MainWindow(QMainWindow):
             self.set_can_config_enabled(False) # Khóa input
             QApplication.processEvents()
             try:
-                self.can_thread = CanThread(interface, channel, bitrate, start_id_hex, stop_id_hex)
+                self.can_thread = CanThread(interface, channel, start_id_hex, stop_id_hex,
+                                          bitrate=bitrate, config=ENGINE_CONFIG)
                 # Signals/Slots
-                self.can_thread.logMessage.connect(self.append_can_log)
+                self.can_thread.log_enabled = self.can_log_enabled
+                if CAN_RECORD_ENABLED:
+                    self.can_thread.record_dir = os.path.join(self.current_save_dir, CAN_RECORD_SUBDIR)
+                self.can_thread.clip_tap = self.clip_tap
                 self.can_thread.startRecordingSignal.connect(self.handle_start_recording_can)
                 self.can_thread.stopRecordingAndSaveSignal.connect(self.handle_stop_recording_can)
                 self.can_thread.canErrorSignal.connect(self.on_can_error)
@@ -793,6 +548,7 @@ class MainWindow(QMainWindow):
                 self.can_thread.finished.connect(self.on_can_thread_finished)
                 print("MainWindow: Starting CAN thread.")
                 self.can_thread.start()
+                self.can_log_timer.start()
             except Exception as e:
                  self.on_can_error(f"Lỗi khởi tạo CAN: {e}")
         else: # Muốn ngắt kết nối
@@ -815,12 +571,12 @@ class MainWindow(QMainWindow):
              except: errors.append("Bitrate (Số > 0)")
          if not start_id_hex: errors.append("Start ID")
          else:
-             try: int(start_id_hex, 16)
-             except: errors.append("Start ID (Hex)")
+             try: parse_trigger_id(start_id_hex)
+             except: errors.append("Start ID (Hex hoặc ID/MASK)")
          if not stop_id_hex: errors.append("Stop ID")
          else:
-             try: int(stop_id_hex, 16)
-             except: errors.append("Stop ID (Hex)")
+             try: parse_trigger_id(stop_id_hex)
+             except: errors.append("Stop ID (Hex hoặc ID/MASK)")
          return errors, bitrate
 
     def set_can_config_enabled(self, enabled):
@@ -834,6 +590,8 @@ class MainWindow(QMainWindow):
 
     def on_can_thread_finished(self):
         print("MainWindow: CAN thread finished.")
+        self.flush_can_log() # Hiển thị nốt frame còn lại
+        self.can_log_timer.stop()
         self.can_thread = None
         if self.connect_can_btn.isChecked(): # Nếu dừng khi đang check -> lỗi
             self.connect_can_btn.setChecked(False)
@@ -862,31 +620,38 @@ class MainWindow(QMainWindow):
     def toggle_can_logging(self, checked):
         """Bật/tắt log dựa trên checkbox state."""
         self.can_log_enabled = checked
+        if self.can_thread:
+            self.can_thread.set_log_enabled(checked)
         print(f"CAN logging {'enabled' if checked else 'disabled'}")
 
-    def append_can_log(self, message):
-        if self.can_log_enabled:
-            timestamp = datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]
-            log_line = f"[{timestamp}] {message}"
-            # Giữ giới hạn số dòng
-            MAX_LOG_LINES = 500 # Giảm số dòng để nhẹ hơn
-            doc = self.can_log_display.document()
-            if doc.blockCount() > MAX_LOG_LINES:
-                cursor = QTextCursor(doc)
-                cursor.movePosition(QTextCursor.Start, QTextCursor.MoveAnchor)
-                cursor.movePosition(QTextCursor.Down, QTextCursor.KeepAnchor, doc.blockCount() - MAX_LOG_LINES)
-                cursor.removeSelectedText()
-            # Thêm dòng mới và cuộn xuống
-            self.can_log_display.append(log_line)
+    def flush_can_log(self):
+        """Rút frame từ vòng đệm của CanThread, chỉ định dạng các dòng sẽ hiện và thêm một lần."""
+        if not self.can_thread:
+            return
+        frames, skipped = self.can_thread.log_ring.drain(CAN_LOG_BATCH_ROWS)
+        if skipped:
+            self.can_log_skipped += skipped
+            self.can_log_skipped_label.setText(f"Bỏ qua: {self.can_log_skipped}")
+        if frames and self.can_log_enabled:
+            # Một lần append cho cả lô; setMaximumBlockCount tự cắt dòng cũ
+            self.can_log_display.appendPlainText("\n".join(format_can_row(msg) for msg in frames))
+
+
+    def refresh_metrics(self):
+        if self.isVisible() and not self.isMinimized():
+            self.stats_display.setPlainText(format_panel(self.metrics.snapshot()))
 
 
     def handle_start_recording_can(self):
+        self.metrics.mark_trigger(HOP_DISPATCH) # Signal Qt đã tới luồng GUI
         print("MainWindow: Rx Signal Start Recording")
         if self.camera_thread and self.camera_thread.isRunning() and not self.is_recording_flag:
             print(" -> Requesting camera start recording")
-            self.camera_thread.start_recording()
+            self.camera_group.start_recording(self.can_thread.last_start_id if self.can_thread else None) # Cùng mốc sự kiện cho mọi camera
         elif not self.camera_thread or not self.camera_thread.isRunning():
             self.statusBar.showMessage("CAN: Lệnh Ghi bị bỏ qua (Cam chưa bật)", 2500)
+            if self.can_thread:
+                self.can_thread.reset_triggers()
         # else: Đã đang ghi rồi, không cần làm gì
 
     def handle_stop_recording_can(self, event_string):
@@ -895,7 +660,9 @@ class MainWindow(QMainWindow):
             print(" -> Requesting camera stop recording")
             # Reset cờ ngay, gọi hàm stop trong thread
             self.is_recording_flag = False
-            self.camera_thread.stop_recording_and_save(event_string)
+            self.camera_group.stop_recording_and_save(event_string, self.can_thread.last_stop_id if self.can_thread else None)
+            if len(self.camera_group) > 1:
+                print(f"MainWindow: Per-camera stats:\n{self.camera_group.format_stats()}")
         elif not self.camera_thread or not self.camera_thread.isRunning():
             self.statusBar.showMessage("CAN: Lệnh Dừng bị bỏ qua (Cam chưa bật)", 2500)
         # else: Không đang ghi, không cần làm gì
@@ -905,14 +672,24 @@ class MainWindow(QMainWindow):
          if self.camera_thread and self.camera_thread.isRunning():
              self.is_recording_flag = True
              self.statusBar.showMessage("ĐANG GHI HÌNH...", 0)
-             self.video_label.setStyleSheet("border: 3px solid red;")
+             self.video_view.setStyleSheet("border: 3px solid red;")
          else: print("Warning: Rec started signal but cam stopped.")
 
-    def on_recording_stopped(self, saved_filepath):
-         print(f"MainWindow: Confirmed Recording Stopped. Path: '{saved_filepath}'")
-         # Cờ đã tắt ở handle_stop_recording_can
+    def on_recording_stopped(self, temp_filepath):
+         print(f"MainWindow: Confirmed Recording Stopped. Finalizing: '{temp_filepath}'")
+         # Cờ đã tắt ở handle_stop_recording_can; clip được hoàn tất ở luồng nền
          if self.camera_thread and self.camera_thread.isRunning() and "LỖI" not in self.statusBar.currentMessage():
-             self.video_label.setStyleSheet("border: 1px solid green;")
+             self.video_view.setStyleSheet("border: 1px solid green;")
+             self.statusBar.showMessage("Đang lưu clip...")
+
+    def on_event_saved(self, paths):
+         if len(paths) > 1:
+              saved = sum(1 for path in paths if path)
+              slowest = self.camera_group.bottleneck() if self.camera_group else None
+              self.statusBar.showMessage(f"Đã lưu {saved}/{len(paths)} camera"
+                                         + (f" (chậm nhất: {slowest['tag']})" if slowest else ""), 4000)
+              return
+         saved_filepath = paths[0] if paths else ""
          if saved_filepath:
               self.statusBar.showMessage(f"Đã lưu: {os.path.basename(saved_filepath)}", 4000)
          elif "LỖI" not in self.statusBar.currentMessage():
@@ -942,13 +719,21 @@ class MainWindow(QMainWindow):
         if reply == QMessageBox.Yes:
             self.statusBar.showMessage("Đang đóng...")
             QApplication.processEvents()
-            threads = [t for t in (self.can_thread, self.camera_thread) if t and t.isRunning()]
+            cameras = self.camera_group.cameras if self.camera_group else []
+            threads = [t for t in [self.can_thread] + cameras if t and t.isRunning()]
+            if self.scan_thread and self.scan_thread.isRunning():
+                self.scan_thread.wait(int(DEFAULT_PROBE_TIMEOUT * 1000) + 500) # Lượt quét tự dừng sau timeout
             if threads:
                 print(f"  Stopping {len(threads)} thread(s)...")
                 for t in threads: t.stop()
                 # Đợi tất cả kết thúc
                 all_stopped = all(t.wait(1500) for t in threads) # Đợi tối đa 1.5s mỗi thread
                 if not all_stopped: print("Warning: Some threads did not stop cleanly.")
+            if not shared_finalizer().drain(): # Đợi các clip đang lưu ở luồng nền
+                print("Warning: Some clips were still being finalized.")
+            self.metrics_timer.stop()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop() # Ghi file metrics lần cuối
             print("Closing application.")
             event.accept()
         else:
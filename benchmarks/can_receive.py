@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Đo thông lượng nhận CAN của CanWorker: Notifier + vòng sleep (cũ) so với vòng recv theo lô.
+
+Bus 'virtual' của python-can được nạp sẵn N frame trước khi đo, nên con số là khả năng xử lý của đường nhận
+(frame/s), không phụ thuộc tốc độ bên gửi. Đo thêm độ trễ từ request_stop() đến khi vòng nhận thoát.
+
+    python benchmarks/can_receive.py --frames 200000
+    python benchmarks/can_receive.py --modes batched --no-log --trigger-every 100
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import can # noqa: E402
+
+from can_pipeline import RECEIVE_MODES # noqa: E402
+from engine import CanWorker, EngineConfig, _TriggerListener # noqa: E402
+
+START_ID = 0x100
+STOP_ID = 0x101
+TRAFFIC_ID = 0x3A0
+
+
+def _frames(count, trigger_every):
+    """Traffic giả lập: phần lớn là frame thường, cứ trigger_every frame có một frame Start (bị debounce)."""
+    payload = bytes(range(8))
+    for i in range(count):
+        arbitration_id = START_ID if trigger_every and i % trigger_every == 0 else TRAFFIC_ID + (i & 0x3F)
+        yield can.Message(arbitration_id=arbitration_id, data=payload, is_extended_id=False)
+
+
+def measure(mode, frames, log_enabled, trigger_every, channel):
+    config = EngineConfig(can_receive_mode=mode, can_record=False)
+    worker = CanWorker("virtual", channel, f"{START_ID:X}", f"{STOP_ID:X}", config=config)
+    worker.log_enabled = log_enabled
+    worker.bus = worker._open_bus()
+    sender = can.Bus(interface="virtual", channel=channel)
+    try:
+        for msg in _frames(frames, trigger_every): # Nạp sẵn hàng đợi của bus nhận
+            sender.send(msg)
+        worker.listener = _TriggerListener(worker)
+        worker._running = True
+        loop = threading.Thread(target=worker._receive_loop, name=f"Receive-{mode}", daemon=True)
+        started = time.perf_counter()
+        loop.start()
+        while worker.frames_received < frames:
+            time.sleep(0.001)
+            if worker.log_enabled:
+                worker.log_ring.drain(None) # Như GUI rút log định kỳ
+        elapsed = time.perf_counter() - started
+        stop_requested = time.perf_counter()
+        worker.request_stop()
+        loop.join()
+        stop_latency = time.perf_counter() - stop_requested
+        if worker.notifier:
+            worker.notifier.stop(timeout=1.0)
+    finally:
+        sender.shutdown()
+        worker.bus.shutdown()
+    return {"mode": mode, "frames": frames, "seconds": elapsed, "frames_per_second": frames / elapsed,
+            "stop_latency_ms": stop_latency * 1000.0, "triggers": worker.trigger_state.stats()["accepted"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo thông lượng đường nhận CAN (bus virtual).")
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--modes", nargs="+", choices=RECEIVE_MODES, default=list(RECEIVE_MODES))
+    parser.add_argument("--no-log", action="store_true", help="Tắt vòng đệm log (như daemon)")
+    parser.add_argument("--trigger-every", type=int, default=1000, help="Tỉ lệ frame trigger (0 = không có)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    print(f"{'Mode':<10}{'Frames':>10}{'Seconds':>10}{'Frames/s':>12}{'Stop (ms)':>11}")
+    for mode in args.modes:
+        best = None
+        for run in range(args.repeat):
+            result = measure(mode, args.frames, not args.no_log, args.trigger_every, f"bench-{mode}-{run}")
+            if best is None or result["frames_per_second"] > best["frames_per_second"]:
+                best = result
+        print(f"{best['mode']:<10}{best['frames']:>10}{best['seconds']:>10.3f}{best['frames_per_second']:>12.0f}"
+              f"{best['stop_latency_ms']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
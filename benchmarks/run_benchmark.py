@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Benchmark ghi hình không cần phần cứng: camera tổng hợp + bus CAN 'virtual' của python-can.
+
+Chạy đúng các worker của sản phẩm (CaptureEngine như daemon, hoặc CameraThread/CanThread qua Qt với --qt,
+QT_QPA_PLATFORM=offscreen). Một luồng phát tải đẩy traffic CAN ở tốc độ cho trước và chu kỳ Start/Stop;
+kết quả (FPS chụp/mã hóa/mất, độ trễ trigger theo chặng, CPU, RSS) in ra dạng JSON để so sánh giữa các lần chạy.
+
+    python benchmarks/run_benchmark.py --duration 20 --resolution 1280x720 --fps 30 --can-load 2000
+    python benchmarks/run_benchmark.py --qt --cameras 2 --encoder mjpg --output before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen") # Trước khi nạp Qt: không cần màn hình
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import can # noqa: E402
+import cv2 # noqa: E402
+
+from catalog import VIDEO_EXTS # noqa: E402
+from encoders import ENCODER_AUTO # noqa: E402
+from engine import CaptureEngine, EngineConfig # noqa: E402
+from frame_sources import SYNTHETIC_SCHEME # noqa: E402
+from metrics import HOP_DISPATCH, TRIGGER_HOPS, shared_metrics, trigger_histogram # noqa: E402
+from shm_capture import CAPTURE_INPROCESS, CAPTURE_MODES # noqa: E402
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+START_ID = 0x100
+STOP_ID = 0x101
+LOAD_ID_BASE = 0x200 # Traffic nền: 0x200-0x2FF, không trùng ID trigger
+LOAD_TICK = 0.01 # Chu kỳ phát tải (s)
+BENCH_EVENT = "Bench"
+
+
+class BusLoad(threading.Thread):
+    """Phát traffic nền rate frame/s và chu kỳ Start -> (clip_seconds) -> Stop trên bus virtual."""
+
+    def __init__(self, channel, rate, trigger_period, clip_seconds, warmup):
+        super().__init__(name="BusLoad", daemon=True)
+        self.bus = can.Bus(interface="virtual", channel=channel)
+        self.rate = float(rate)
+        self.trigger_period = float(trigger_period)
+        self.clip_seconds = float(clip_seconds)
+        self.warmup = float(warmup)
+        self.sent = 0
+        self.starts = 0
+        self.stops = 0
+        self.cpu_seconds = 0.0 # CPU của luồng phát tải, trừ khỏi CPU tiến trình
+        self._stop_event = threading.Event()
+
+    def run(self):
+        payload = bytes(range(8))
+        stop_payload = BENCH_EVENT.encode("utf-8")
+        started = time.monotonic()
+        next_start = started + self.warmup # Đợi camera mở và pre-roll đầy
+        next_stop = None
+        cpu = time.thread_time()
+        while not self._stop_event.wait(LOAD_TICK):
+            now = time.monotonic()
+            due = int(self.rate * (now - started)) - self.sent
+            for i in range(max(0, due)):
+                self.bus.send(can.Message(arbitration_id=LOAD_ID_BASE + (self.sent + i) % 0x100, data=payload,
+                                          is_extended_id=False))
+            self.sent += max(0, due)
+            if self.trigger_period > 0 and now >= next_start:
+                self.bus.send(can.Message(arbitration_id=START_ID, data=b"\x01", is_extended_id=False))
+                self.starts += 1
+                next_start = now + self.trigger_period
+                next_stop = now + self.clip_seconds
+            if next_stop is not None and now >= next_stop:
+                self.bus.send(can.Message(arbitration_id=STOP_ID, data=stop_payload, is_extended_id=False))
+                self.stops += 1
+                next_stop = None
+        if next_stop is not None: # Đóng clip đang mở để nó được tính
+            self.bus.send(can.Message(arbitration_id=STOP_ID, data=stop_payload, is_extended_id=False))
+            self.stops += 1
+        self.cpu_seconds = time.thread_time() - cpu
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.bus.shutdown()
+
+
+def build_config(args, save_dir, channel):
+    return EngineConfig(
+        save_dir=save_dir, camera_sources=[f"{SYNTHETIC_SCHEME}{args.resolution}@{args.fps:g}"] * args.cameras,
+        capture_mode=args.capture_mode, encoder=args.encoder, preroll_seconds=args.preroll,
+        can_interface="virtual", can_channel=channel, start_id=f"{START_ID:X}", stop_id=f"{STOP_ID:X}",
+        can_record=args.can_record, trigger_holdoff_seconds=0.0, metrics_export=False, catalog=True).validate()
+
+
+def run_engine(args, config, load):
+    """Đường daemon: CaptureEngine (không preview, lệnh ghi qua luồng điều khiển)."""
+    engine = CaptureEngine(config)
+    engine.start()
+    time.sleep(0.2) # Bus virtual của CanWorker phải mở trước khi phát tải
+    load.start()
+    time.sleep(args.duration)
+    load.stop()
+    time.sleep(0.3) # Lệnh Stop cuối đi hết listener -> luồng điều khiển
+    engine.stop()
+    return list(engine.cameras.cameras), engine.can
+
+
+def run_qt(args, config, load):
+    """Đường GUI: CameraThread/CanThread, signal Qt tới slot ở luồng chính như MainWindow."""
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    from camera_group import CameraGroup
+    from clip_finalizer import shared_finalizer
+    from qt_engine import CameraThread, CanThread
+
+    app = QApplication.instance() or QApplication([])
+    metrics = shared_metrics()
+    group = CameraGroup(config.save_dir, use_catalog=config.catalog)
+    for source in config.camera_sources:
+        camera = group.add(CameraThread(source, config.save_dir, config))
+        camera.set_preview_size(640, 360)
+        camera.frameReady.connect(lambda frame: frame.release()) # Như VideoWidget sau khi vẽ
+    for camera in group.cameras[1:]:
+        camera.set_preview_enabled(False)
+    can_thread = CanThread("virtual", config.can_channel, config.start_id, config.stop_id, config=config)
+    state = {"recording": False}
+
+    def on_start():
+        metrics.mark_trigger(HOP_DISPATCH)
+        if not state["recording"]:
+            state["recording"] = True
+            group.start_recording(can_thread.last_start_id)
+
+    def on_stop(event):
+        if state["recording"]:
+            state["recording"] = False
+            group.stop_recording_and_save(event, can_thread.last_stop_id)
+
+    def drain_log():
+        can_thread.log_ring.drain(200) # Như timer log của GUI
+
+    can_thread.startRecordingSignal.connect(on_start)
+    can_thread.stopRecordingAndSaveSignal.connect(on_stop)
+    log_timer = QTimer()
+    log_timer.timeout.connect(drain_log)
+    log_timer.start(100)
+    group.start()
+    can_thread.start()
+    time.sleep(0.2) # Bus virtual của CanWorker phải mở trước khi phát tải
+    load.start()
+    QTimer.singleShot(int(args.duration * 1000), app.quit)
+    app.exec_()
+    load.stop()
+    deadline = time.monotonic() + 0.5 # Xử lý nốt Stop cuối
+    while time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    log_timer.stop()
+    can_thread.stop()
+    can_thread.wait(3000)
+    group.stop()
+    shared_finalizer().drain()
+    return [camera.worker for camera in group.cameras], can_thread.worker
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux báo KB
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _count_clips(save_dir):
+    return sum(1 for name in os.listdir(save_dir) if os.path.splitext(name)[1].lower() in VIDEO_EXTS)
+
+
+def collect(args, cameras, can_worker, load, elapsed, cpu_seconds, save_dir):
+    snapshot = shared_metrics().snapshot()
+    counters, histograms = snapshot["counters"], snapshot["histograms"]
+    captured = sum(camera.frame_clock.frame_count for camera in cameras)
+    late = sum(getattr(camera.cap, "late_frames", 0) for camera in cameras)
+    trigger_stats = can_worker.trigger_state.stats() if can_worker else {}
+    latency = {}
+    for hop in TRIGGER_HOPS:
+        summary = histograms.get(trigger_histogram(hop), {})
+        if summary.get("window"):
+            latency[hop] = {key: round(summary[key], 3) for key in ("count", "p50", "p95", "max")}
+    process_cpu = cpu_seconds - load.cpu_seconds
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "captured_fps": round(captured / elapsed / len(cameras), 2),
+        "capture_late_fps": round(late / elapsed / len(cameras), 2),
+        "encoded_fps": round(counters.get("frames_written", 0) / elapsed / len(cameras), 2),
+        "dropped_fps": round(counters.get("frames_dropped", 0) / elapsed / len(cameras), 2),
+        "frames_captured": captured,
+        "frames_written": counters.get("frames_written", 0),
+        "frames_dropped": counters.get("frames_dropped", 0),
+        "clips_saved": _count_clips(save_dir),
+        "triggers_sent": load.starts + load.stops, # Start + Stop, cùng cách đếm với "accepted"
+        "triggers_accepted": trigger_stats.get("accepted"),
+        "trigger_latency_ms": latency,
+        "capture_jitter_ms": {key: round(histograms.get("capture_jitter_ms", {}).get(key, 0.0), 3)
+                              for key in ("p50", "p95", "max")},
+        "can_frames_sent": load.sent + load.starts + load.stops,
+        "can_frames_received": can_worker.frames_received if can_worker else 0,
+        "cpu_percent": round(100.0 * process_cpu / elapsed, 1), # Không tính luồng phát tải
+        "cpu_stage_seconds": {stage: round(cpu["seconds"], 3) for stage, cpu in snapshot["cpu"].items()},
+        "rss_bytes": _rss_bytes(),
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ghi hình với camera tổng hợp và bus CAN virtual.")
+    parser.add_argument("--duration", type=float, default=20.0, help="Thời gian chạy (s)")
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--cameras", type=int, default=1)
+    parser.add_argument("--capture-mode", choices=CAPTURE_MODES, default=CAPTURE_INPROCESS)
+    parser.add_argument("--encoder", default=ENCODER_AUTO)
+    parser.add_argument("--preroll", type=float, default=2.0, help="Pre-roll (s)")
+    parser.add_argument("--can-load", type=float, default=1000.0, help="Traffic CAN nền (frame/s)")
+    parser.add_argument("--trigger-period", type=float, default=5.0, help="Chu kỳ Start (s), 0 = không ghi")
+    parser.add_argument("--clip-seconds", type=float, default=2.0, help="Start -> Stop (s)")
+    parser.add_argument("--no-can-record", dest="can_record", action="store_false")
+    parser.add_argument("--qt", action="store_true", help="Chạy qua CameraThread/CanThread (PyQt5, offscreen)")
+    parser.add_argument("--output", help="Ghi JSON vào file (mặc định in ra stdout)")
+    parser.add_argument("--keep", action="store_true", help="Giữ thư mục clip tạm")
+    args = parser.parse_args(argv)
+
+    save_dir = tempfile.mkdtemp(prefix="cancam_bench_")
+    channel = f"bench-{os.getpid()}"
+    config = build_config(args, save_dir, channel)
+    load = BusLoad(channel, args.can_load, args.trigger_period, args.clip_seconds, warmup=max(1.0, args.preroll))
+    print(f"Benchmark: {args.cameras} x {args.resolution}@{args.fps:g}, CAN {args.can_load:g} frame/s, "
+          f"{args.duration:g}s, {'Qt' if args.qt else 'engine'} -> {save_dir}", file=sys.stderr)
+    cpu_start, started = time.process_time(), time.monotonic()
+    try:
+        cameras, can_worker = (run_qt if args.qt else run_engine)(args, config, load)
+        elapsed = time.monotonic() - started
+        results = collect(args, cameras, can_worker, load, elapsed, time.process_time() - cpu_start, save_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(save_dir, ignore_errors=True)
+    report = {
+        "benchmark": "capture",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": _git_revision(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Tìm camera: liệt kê thiết bị, thử mở song song có timeout, lưu cache kết quả (không phụ thuộc Qt)."""
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+import cv2
+
+DEFAULT_SCAN_LIMIT = 5 # Số index thử trên hệ điều hành không liệt kê được thiết bị
+DEFAULT_PROBE_TIMEOUT = 3.0 # Giây chờ tối đa cho toàn bộ lượt thử
+DEFAULT_PROBE_WORKERS = 4
+CACHE_VERSION = 1
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "can_camdetect", "cameras.json")
+_SYSFS_V4L = "/sys/class/video4linux"
+
+CameraInfo = collections.namedtuple("CameraInfo", "index path name serial width height fps")
+
+
+def camera_key(path, serial):
+    """Khóa cache: đường dẫn thiết bị + số serial (cùng cổng USB nhưng camera khác sẽ không trùng)."""
+    return f"{path}|{serial or ''}"
+
+
+def camera_label(info):
+    label = info.name or f"Camera {info.index}"
+    if info.width and info.height:
+        label += f" ({info.width}x{info.height}"
+        label += f" @{info.fps:.0f}fps)" if info.fps else ")"
+    return label
+
+
+def _read_text(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _sysfs_serial(node):
+    """Serial USB của thiết bị video: đi ngược cây sysfs tới thiết bị USB có file 'serial'."""
+    device = os.path.realpath(os.path.join(_SYSFS_V4L, node, "device"))
+    for _ in range(3):
+        serial = _read_text(os.path.join(device, "serial"))
+        if serial:
+            return serial
+        device = os.path.dirname(device)
+    return ""
+
+
+def enumerate_candidates(limit=DEFAULT_SCAN_LIMIT):
+    """Danh sách (index, path, name, serial) cần thử. Linux: liệt kê /dev/video*, các OS khác: 0..limit-1."""
+    if not sys.platform.startswith("linux"):
+        return [(i, f"index:{i}", f"Camera {i}", "") for i in range(limit)]
+    candidates = []
+    for path in glob.glob("/dev/video*"):
+        match = re.fullmatch(r"/dev/video(\d+)", path)
+        if not match:
+            continue
+        node = f"video{match.group(1)}"
+        # UVC tạo thêm node metadata (index != 0) không phát hình -> bỏ qua không cần mở
+        if _read_text(os.path.join(_SYSFS_V4L, node, "index")) not in ("", "0"):
+            continue
+        name = _read_text(os.path.join(_SYSFS_V4L, node, "name")) or f"Camera {match.group(1)}"
+        candidates.append((int(match.group(1)), path, name, _sysfs_serial(node)))
+    return sorted(candidates)
+
+
+def probe_camera(candidate, api_preference=None):
+    """Mở thử một camera và đọc thông số. Trả về CameraInfo hoặc None."""
+    index, path, name, serial = candidate
+    cap = cv2.VideoCapture(index, api_preference) if api_preference is not None else cv2.VideoCapture(index)
+    try:
+        if not cap or not cap.isOpened():
+            return None
+        return CameraInfo(index, path, name, serial, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), float(cap.get(cv2.CAP_PROP_FPS) or 0.0))
+    finally:
+        if cap:
+            cap.release()
+
+
+def probe_all(candidates, api_preference=None, timeout=DEFAULT_PROBE_TIMEOUT, max_workers=DEFAULT_PROBE_WORKERS):
+    """Thử mở các camera song song; camera không trả lời trong timeout bị bỏ qua (luồng thử chạy nốt ở nền)."""
+    if not candidates:
+        return []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(candidates))),
+                                                     thread_name_prefix="CameraProbe")
+    futures = {executor.submit(probe_camera, candidate, api_preference): candidate for candidate in candidates}
+    done, pending = concurrent.futures.wait(futures, timeout=timeout)
+    executor.shutdown(wait=False) # Không đợi driver bị treo
+    found = []
+    for future in done:
+        try:
+            info = future.result()
+        except Exception as e:
+            print(f"CameraDiscovery: Probe {futures[future][1]} failed: {e}")
+            continue
+        if info:
+            found.append(info)
+    for future in pending:
+        print(f"CameraDiscovery: Probe {futures[future][1]} timed out after {timeout}s")
+    return sorted(found, key=lambda info: info.index)
+
+
+# ---- Cache ----
+def load_cached_cameras(cache_path=DEFAULT_CACHE_PATH):
+    """Camera từ lần quét trước còn thiết bị tương ứng (để hiện ngay khi khởi động, chưa mở camera)."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if data.get("version") != CACHE_VERSION:
+        return []
+    present = {camera_key(path, serial): index for index, path, _, serial in enumerate_candidates()}
+    cameras = []
+    for entry in data.get("devices", {}).values():
+        try:
+            info = CameraInfo(**entry)
+        except TypeError:
+            continue
+        key = camera_key(info.path, info.serial)
+        if key in present:
+            cameras.append(info._replace(index=present[key])) # Index có thể đổi sau khi cắm lại
+    return sorted(cameras, key=lambda info: info.index)
+
+
+def save_cached_cameras(cameras, cache_path=DEFAULT_CACHE_PATH):
+    data = {"version": CACHE_VERSION, "scanned_at": time.time(),
+            "devices": {camera_key(info.path, info.serial): info._asdict() for info in cameras}}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"CameraDiscovery: Could not write cache {cache_path}: {e}")
+
+
+def discover_cameras(limit=DEFAULT_SCAN_LIMIT, api_preference=None, timeout=DEFAULT_PROBE_TIMEOUT,
+                     cache_path=DEFAULT_CACHE_PATH):
+    """Liệt kê + thử mở song song, cập nhật cache. Chạy ở luồng nền (có thể mất tới timeout giây)."""
+    cameras = probe_all(enumerate_candidates(limit), api_preference, timeout)
+    if cache_path:
+        save_cached_cameras(cameras, cache_path)
+    return cameras
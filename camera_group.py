@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Nhóm nhiều camera chạy song song, điều khiển chung bởi một trigger CAN (không phụ thuộc Qt)."""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from catalog import open_catalog, sanitize_event_name
+from clip_finalizer import shared_finalizer
+
+MAX_NAME_COUNTER = 1000
+
+
+def camera_tag(position):
+    return f"cam{position}"
+
+
+def event_base_name(save_dir, error_string, tags, when=None, exts=(".mp4",)):
+    """Tên gốc chung cho một sự kiện: '{ngày}_{sự kiện}[_n]' sao cho mọi '{gốc}_{tag}{đuôi}' đều chưa tồn tại."""
+    when = when or datetime.datetime.now()
+    base = f"{when.strftime('%Y-%m-%d')}_{sanitize_event_name(error_string)}"
+    candidate = base
+    for counter in range(1, MAX_NAME_COUNTER + 1):
+        if not any(os.path.exists(os.path.join(save_dir, f"{candidate}_{tag}{ext}")) for tag in tags for ext in exts):
+            return candidate
+        candidate = f"{base}_{counter}"
+    raise FileExistsError(f"Không tạo được tên file duy nhất cho sự kiện '{error_string}'.")
+
+
+class CameraGroup:
+    """Quản lý N camera: bật/tắt chung, phát lệnh ghi/dừng tới mọi camera với cùng mốc thời gian sự kiện.
+
+    Camera đầu tiên là camera chính (dùng cho preview). Mỗi camera nhận một file_tag ('cam0', 'cam1', ...)
+    để file của cùng một sự kiện có tên thống nhất: '{ngày}_{sự kiện}_cam{i}.mp4'.
+    Camera là CameraWorker của engine hoặc adapter Qt có cùng giao diện (is_running, start_recording, ...).
+    """
+
+    def __init__(self, save_dir, finalizer=None, use_catalog=False):
+        self.save_dir = save_dir
+        self.finalizer = finalizer or shared_finalizer() # Hàng đợi hoàn tất clip chạy nền
+        self.use_catalog = use_catalog
+        self.catalog = open_catalog(save_dir) if use_catalog else None # Danh mục SQLite + cấp tên O(1)
+        self.start_trigger_id = None # CAN ID đã kích hoạt sự kiện hiện tại (ghi vào danh mục)
+        self.cameras = []
+        self.event_time = None      # datetime của sự kiện ghi hiện tại / gần nhất
+        self.event_monotonic = None # Cùng mốc, theo đồng hồ monotonic (khớp timestamp frame)
+        self.last_paths = []
+        self.on_event_stopped = None # Callback(list đường dẫn đã lưu, chuỗi rỗng nếu lỗi), gọi từ luồng nền
+
+    def __len__(self):
+        return len(self.cameras)
+
+    @property
+    def primary(self):
+        return self.cameras[0] if self.cameras else None
+
+    @property
+    def tags(self):
+        return [camera.file_tag for camera in self.cameras]
+
+    def add(self, camera):
+        """Thêm camera vào nhóm; chỉ gắn tag khi có nhiều hơn một camera để giữ tên file cũ cho 1 camera."""
+        self.cameras.append(camera)
+        camera.catalog = self.catalog
+        if len(self.cameras) > 1:
+            for position, cam in enumerate(self.cameras):
+                cam.file_tag = camera_tag(position)
+        return camera
+
+    def set_save_dir(self, directory):
+        self.save_dir = directory
+        if self.use_catalog:
+            self.catalog = open_catalog(directory)
+        for camera in self.cameras:
+            camera.set_save_dir(directory)
+            camera.catalog = self.catalog
+
+    def start(self):
+        for camera in self.cameras:
+            camera.start()
+
+    def stop(self):
+        # stop() của camera đợi thread kết thúc; gửi cờ dừng cho tất cả trước để chúng dừng song song
+        for camera in self.cameras:
+            camera.request_stop()
+        for camera in self.cameras:
+            if camera.is_running():
+                camera.stop()
+
+    def is_running(self):
+        return any(camera.is_running() for camera in self.cameras)
+
+    def start_recording(self, trigger_id=None):
+        self.event_time = datetime.datetime.now()
+        self.event_monotonic = time.monotonic()
+        self.start_trigger_id = trigger_id
+        for camera in self.cameras:
+            if camera.is_running():
+                camera.start_recording()
+
+    def stop_recording_and_save(self, error_string="UnknownEvent", trigger_id=None):
+        """Tách clip khỏi mọi camera ngay (có thể ghi sự kiện mới), phần hoàn tất xếp vào ClipFinalizer.
+
+        Khi mọi camera đã lưu xong, last_paths được cập nhật và on_event_stopped(paths) được gọi từ luồng nền.
+        """
+        when = self.event_time or datetime.datetime.now()
+        detached = [(position, camera, camera.detach_recording())
+                    for position, camera in enumerate(self.cameras) if camera.is_running()]
+        self.event_time = None
+        trigger_ids = (self.start_trigger_id, trigger_id)
+        self.start_trigger_id = None
+        self.finalizer.submit(self._finalize_event, error_string, when, detached, trigger_ids)
+
+    def _finalize_event(self, error_string, when, detached, trigger_ids=(None, None)):
+        # Chạy trong ClipFinalizer: các sự kiện trước đã đổi tên xong nên tên gốc không thể trùng
+        base_name = None
+        # Đuôi file theo encoder từng camera đã dùng (có thể khác nhau khi encoder phải lùi)
+        exts = {camera.video_ext for camera in self.cameras}
+        try:
+            if self.catalog is not None:
+                base_name = self.catalog.allocate_base_name(error_string, self.tags, when, exts)
+            elif len(self.cameras) > 1:
+                base_name = event_base_name(self.save_dir, error_string, self.tags, when, exts)
+        except (FileExistsError, sqlite3.Error) as e:
+            print(f"CameraGroup: {e}")
+        paths = [""] * len(self.cameras)
+
+        def finalize_one(position, camera, pending):
+            try:
+                paths[position] = camera.finalize_clip(pending, error_string, base_name, trigger_ids) or ""
+            except Exception as e:
+                print(f"CameraGroup: Error finalizing {camera.file_tag}: {e}")
+
+        # Mỗi camera release VideoWriter riêng: chạy song song
+        workers = [threading.Thread(target=finalize_one, args=item, name=f"Finalize-{item[0]}") for item in detached]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.last_paths = paths
+        if self.on_event_stopped is not None:
+            self.on_event_stopped(paths)
+
+    # --- Thống kê ---
+    def stats(self):
+        """Thông lượng từng camera: FPS đo được và bộ đếm của luồng mã hóa (đang ghi hoặc lần ghi gần nhất)."""
+        rows = []
+        for position, camera in enumerate(self.cameras):
+            writer = camera.writer_thread or camera.segment_writer # Chế độ đoạn: writer ghi liên tục
+            counters = writer.stats() if writer else (camera.last_writer_stats or {})
+            submitted = counters.get("submitted", 0)
+            dropped = counters.get("dropped_oldest", 0) + counters.get("dropped_newest", 0)
+            rows.append({
+                "tag": camera.file_tag or camera_tag(position),
+                "running": camera.is_running(),
+                "recording": writer is not None,
+                "measured_fps": round(camera.measured_fps, 2),
+                "submitted": submitted,
+                "written": counters.get("written", 0),
+                "dropped": dropped,
+                "drop_ratio": round(dropped / submitted, 4) if submitted else 0.0,
+                "queue_depth": counters.get("queue_depth", 0),
+                "write_errors": counters.get("write_errors", 0),
+            })
+        return rows
+
+    def bottleneck(self):
+        """Camera tệ nhất theo tỉ lệ mất frame, rồi độ sâu hàng đợi, rồi FPS thấp nhất. None nếu chưa có số liệu."""
+        rows = [row for row in self.stats() if row["running"] or row["submitted"]]
+        if not rows:
+            return None
+        return max(rows, key=lambda row: (row["drop_ratio"], row["queue_depth"], -row["measured_fps"]))
+
+    def format_stats(self):
+        lines = [f"{'Cam':<6}{'FPS':>8}{'Submit':>9}{'Write':>9}{'Drop':>7}{'Queue':>7}"]
+        for row in self.stats():
+            lines.append(f"{row['tag']:<6}{row['measured_fps']:>8.2f}{row['submitted']:>9}"
+                         f"{row['written']:>9}{row['dropped']:>7}{row['queue_depth']:>7}")
+        return "\n".join(lines)
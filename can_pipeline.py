@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""Các thành phần xử lý frame CAN dùng chung cho CanThread (không phụ thuộc Qt)."""
+import collections
+import threading
+import time
+
+# ---- Cấu hình mặc định ----
+DEFAULT_LOG_RING_SIZE = 16384 # Số frame thô tối đa chờ GUI rút
+DEFAULT_LOG_BATCH_ROWS = 200  # Số dòng tối đa được định dạng mỗi lần rút
+DEFAULT_TRIGGER_DEBOUNCE = 0.5 # Frame trigger cùng loại cách nhau ít hơn khoảng này là lặp lại của một lần bấm
+DEFAULT_MIN_CLIP_SECONDS = 0.0 # Lệnh dừng đến sớm hơn được hoãn đến đủ độ dài (0 = tắt)
+DEFAULT_TRIGGER_HOLDOFF = 1.0  # Bỏ qua lệnh bắt đầu trong khoảng này sau khi dừng
+DEFAULT_ISOTP_TIMEOUT = 1.0    # N_Cr: thời gian chờ tối đa giữa hai frame của một bản tin ISO-TP
+DEFAULT_ISOTP_STREAMS = 8      # Số bản tin ISO-TP ghép đồng thời (mỗi ID một bộ đệm cấp phát sẵn)
+RECEIVE_BATCHED = "batched"   # Một luồng đọc bus bằng recv() và xử lý theo lô
+RECEIVE_NOTIFIER = "notifier" # can.Notifier (luồng riêng, một callback mỗi frame) + luồng chờ (cũ)
+RECEIVE_MODES = (RECEIVE_BATCHED, RECEIVE_NOTIFIER)
+DEFAULT_RECV_TIMEOUT = 0.05 # Thời gian chờ recv() tối đa: cũng là độ trễ tối đa khi dừng
+DEFAULT_RECV_BATCH = 512    # Số frame tối đa rút không chờ trong một lô
+
+
+# ---- Vòng đệm log CAN ----
+class CanFrameRing:
+    """Vòng đệm frame CAN thô: listener chỉ append (nguyên tử dưới GIL, không khóa), GUI rút theo lô."""
+
+    def __init__(self, capacity=DEFAULT_LOG_RING_SIZE):
+        self._ring = collections.deque(maxlen=max(1, int(capacity)))
+        self.pushed = 0    # Chỉ listener tăng
+        self._consumed = 0 # Chỉ luồng rút tăng
+
+    def __len__(self):
+        return len(self._ring)
+
+    def push(self, msg):
+        """Gọi từ listener: lưu tham chiếu frame, không định dạng."""
+        self._ring.append(msg)
+        self.pushed += 1
+
+    def push_batch(self, msgs):
+        """Như push() cho cả lô: một lần extend."""
+        self._ring.extend(msgs)
+        self.pushed += len(msgs)
+
+    def drain(self, max_rows=DEFAULT_LOG_BATCH_ROWS):
+        """Rút toàn bộ frame hiện có. Trả về (frame mới nhất tối đa max_rows, số frame bị bỏ qua).
+
+        Frame bị bỏ qua gồm frame bị ghi đè khi vòng đệm đầy và frame cũ hơn max_rows trong lô này.
+        max_rows=None: trả về toàn bộ lô.
+        """
+        ring = self._ring
+        pushed = self.pushed
+        available = len(ring)
+        batch = [ring.popleft() for _ in range(available)]
+        # Xấp xỉ: listener có thể push thêm trong lúc rút, chỉ dùng cho bộ đếm hiển thị
+        overwritten = max(0, pushed - self._consumed - available)
+        self._consumed += available + overwritten
+        skipped = overwritten
+        if max_rows is not None and len(batch) > max_rows:
+            skipped += len(batch) - max_rows
+            batch = batch[-max_rows:]
+        return batch, skipped
+
+    def clear(self):
+        self._ring.clear()
+        self._consumed = self.pushed
+
+
+def format_can_row(msg):
+    """Định dạng một frame để hiển thị (chỉ gọi cho dòng sẽ được hiện)."""
+    ts = msg.timestamp or time.time()
+    stamp = time.strftime("%H:%M:%S", time.localtime(ts)) + f".{int((ts % 1) * 1000):03d}"
+    return f"[{stamp}] ID: {msg.arbitration_id:<5X} DLC: {msg.dlc} Data: {bytes(msg.data).hex().upper()}"
+
+
+# ---- Bảng điều phối trigger ----
+ACTION_START = "start"
+ACTION_STOP = "stop"
+ACTION_EMERGENCY = "emergency"
+
+STD_ID_MASK = 0x7FF
+EXT_ID_MASK = 0x1FFFFFFF
+_EXT_KEY_FLAG = 1 << 31 # Bit đánh dấu ID mở rộng trong khóa tra cứu
+MAX_EXPANDED_IDS = 4096 # Dải mask nhỏ hơn ngưỡng này được trải thẳng vào dict
+
+TriggerId = collections.namedtuple("TriggerId", "can_id mask extended")
+
+
+def parse_trigger_id(text):
+    """Phân tích ID trigger dạng hex: '100', '18FF50E5', 'ID/MASK' (vd '100/7F0'), tiền tố 'x:' ép ID mở rộng."""
+    text = text.strip()
+    extended = False
+    if text.lower().startswith("x:"):
+        extended = True
+        text = text[2:]
+    id_str, _, mask_str = text.partition("/")
+    can_id = int(id_str, 16)
+    if can_id < 0 or can_id > EXT_ID_MASK:
+        raise ValueError(f"CAN ID ngoài phạm vi: {id_str}")
+    if can_id > STD_ID_MASK:
+        extended = True
+    full_mask = EXT_ID_MASK if extended else STD_ID_MASK
+    mask = int(mask_str, 16) & full_mask if mask_str else full_mask
+    return TriggerId(can_id & mask, mask, extended)
+
+
+def format_trigger_id(trigger):
+    text = f"{trigger.can_id:X}"
+    full_mask = EXT_ID_MASK if trigger.extended else STD_ID_MASK
+    if trigger.mask != full_mask:
+        text += f"/{trigger.mask:X}"
+    return text
+
+
+def _lookup_key(arbitration_id, is_extended):
+    return arbitration_id | _EXT_KEY_FLAG if is_extended else arbitration_id
+
+
+class TriggerDispatchTable:
+    """Ánh xạ arbitration ID (kể cả dải mask, ID mở rộng) sang hành động, tra cứu O(1) bằng dict."""
+
+    def __init__(self):
+        self._exact = {}   # khóa -> hành động
+        self._masked = []  # (can_id, mask, extended, hành động) cho mask quá rộng để trải ra
+        self._entries = [] # (TriggerId, hành động) theo thứ tự khai báo, dùng cho bộ lọc bus
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, trigger, action):
+        """Đăng ký trigger; khi trùng, trigger khai báo trước được ưu tiên."""
+        self._entries.append((trigger, action))
+        full_mask = EXT_ID_MASK if trigger.extended else STD_ID_MASK
+        free = full_mask & ~trigger.mask
+        if (1 << bin(free).count("1")) > MAX_EXPANDED_IDS:
+            self._masked.append((trigger.can_id, trigger.mask, trigger.extended, action))
+            return
+        # Duyệt mọi tổ hợp bit tự do (submask) của dải
+        sub = free
+        while True:
+            self._exact.setdefault(_lookup_key(trigger.can_id | sub, trigger.extended), action)
+            if sub == 0:
+                break
+            sub = (sub - 1) & free
+
+    def lookup(self, arbitration_id, is_extended=False):
+        """Trả về hành động cho frame, None nếu không phải trigger."""
+        action = self._exact.get(_lookup_key(arbitration_id, is_extended))
+        if action is None and self._masked:
+            for can_id, mask, extended, masked_action in self._masked:
+                if extended == is_extended and (arbitration_id & mask) == can_id:
+                    return masked_action
+        return action
+
+    def can_filters(self):
+        """Bộ lọc cho bus.set_filters() để chỉ frame trigger đi tới Python."""
+        return [{"can_id": trigger.can_id, "can_mask": trigger.mask, "extended": trigger.extended}
+                for trigger, _ in self._entries]
+
+
+# ---- Máy trạng thái trigger ----
+TRIGGER_IDLE = "idle"
+TRIGGER_RECORDING = "recording"
+
+
+class TriggerStateMachine:
+    """Lọc trigger ngay trong listener để frame lặp lại không bao giờ sang luồng GUI.
+
+    ECU thường phát lặp ID trigger 10-100 Hz: chỉ frame đầu của một loạt (cách frame cùng loại trước đó
+    ít nhất debounce_seconds) được xét. Start khi đang ghi / trong hold-off sau khi dừng và Stop khi không ghi
+    bị bỏ. Stop đến trước min_clip_seconds được hoãn: CanWorker lấy ra bằng pop_due(). Emergency dừng ngay.
+    feed() chạy trong luồng Notifier, pop_due() trong luồng CanWorker.
+    """
+
+    def __init__(self, debounce_seconds=DEFAULT_TRIGGER_DEBOUNCE, min_clip_seconds=DEFAULT_MIN_CLIP_SECONDS,
+                 holdoff_seconds=DEFAULT_TRIGGER_HOLDOFF):
+        self.debounce_seconds = max(0.0, float(debounce_seconds))
+        self.min_clip_seconds = max(0.0, float(min_clip_seconds))
+        self.holdoff_seconds = max(0.0, float(holdoff_seconds))
+        self.state = TRIGGER_IDLE
+        self.started_at = None
+        self.holdoff_until = 0.0
+        self._last_seen = {} # hành động -> monotonic của frame gần nhất (kể cả frame bị bỏ)
+        self._pending = None # (hạn, hành động, msg, payload) của lệnh dừng đang hoãn
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.deferred = 0
+        self.dropped = collections.Counter() # lý do -> số frame
+        self.clock = time.monotonic # Đồng hồ khi không truyền now (phát lại log: thời gian trong log)
+
+    def _stop(self, now):
+        self.state = TRIGGER_IDLE
+        self.started_at = None
+        self.holdoff_until = now + self.holdoff_seconds
+
+    def _drop(self, reason):
+        self.dropped[reason] += 1
+        return False
+
+    def feed(self, action, msg, payload=None, now=None):
+        """True nếu frame trigger cần được xử lý ngay; False nếu bị bỏ hoặc được hoãn."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            last = self._last_seen.get(action)
+            self._last_seen[action] = now
+            if last is not None and now - last < self.debounce_seconds:
+                return self._drop("debounce")
+            if action == ACTION_START:
+                if self.state == TRIGGER_RECORDING:
+                    return self._drop("recording")
+                if now < self.holdoff_until:
+                    return self._drop("holdoff")
+                self.state = TRIGGER_RECORDING
+                self.started_at = now
+            else:
+                if self.state != TRIGGER_RECORDING:
+                    return self._drop("idle")
+                if action == ACTION_STOP:
+                    if self._pending is not None:
+                        return self._drop("pending")
+                    due = self.started_at + self.min_clip_seconds
+                    if now < due:
+                        self._pending = (due, action, msg, payload)
+                        self.deferred += 1
+                        return False
+                self._pending = None # Emergency thay cho lệnh dừng đang hoãn
+                self._stop(now)
+            self.accepted += 1
+            return True
+
+    def pop_due(self, now=None):
+        """(hành động, msg, payload) của lệnh dừng đã hoãn đủ lâu, None nếu chưa có."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            if self._pending is None or now < self._pending[0]:
+                return None
+            _, action, msg, payload = self._pending
+            self._pending = None
+            self._stop(now)
+            self.accepted += 1
+            return action, msg, payload
+
+    def time_to_due(self, now=None):
+        """Giây đến hạn lệnh dừng đang hoãn, None nếu không có."""
+        pending = self._pending
+        if pending is None:
+            return None
+        return max(0.0, pending[0] - (self.clock() if now is None else now))
+
+    def reset(self):
+        """Về trạng thái chờ (vd: camera đã tắt nên phía ghi không còn clip nào mở)."""
+        with self._lock:
+            self.state = TRIGGER_IDLE
+            self.started_at = None
+            self.holdoff_until = 0.0
+            self._pending = None
+
+    def stats(self):
+        with self._lock:
+            return {"accepted": self.accepted, "deferred": self.deferred, "dropped": dict(self.dropped),
+                    "state": self.state}
+
+
+# ---- Ghép bản tin ISO-TP (ISO 15765-2) ----
+ISOTP_SINGLE = 0x0
+ISOTP_FIRST = 0x1
+ISOTP_CONSECUTIVE = 0x2
+ISOTP_FLOW_CONTROL = 0x3
+ISOTP_MAX_LENGTH = 4095 # Độ dài tối đa của First Frame 12-bit
+ISOTP_FLOW_CONTINUE = bytes((0x30, 0x00, 0x00)) # FC: Continue To Send, block size 0, STmin 0
+
+
+class _IsoTpStream:
+    __slots__ = ("buffer", "length", "filled", "next_seq", "deadline")
+
+    def __init__(self, max_length):
+        self.buffer = bytearray(max_length) # Cấp phát một lần, dùng lại cho mọi bản tin
+        self.length = 0
+        self.filled = 0
+        self.next_seq = 0
+        self.deadline = 0.0
+
+
+class IsoTpReassembler:
+    """Ghép payload nhiều frame ISO-TP (CAN cổ điển và CAN FD 64 byte) cho frame trigger, chế độ nghe thụ động.
+
+    Mỗi arbitration ID dùng một bộ đệm lấy từ pool cấp phát sẵn (tối đa max_streams bản tin đồng thời);
+    frame tiếp nối chỉ chép vào bộ đệm đó. Bản tin quá timeout giữa hai frame bị bỏ, bộ đệm trả về pool.
+    feed() trả về payload hoàn chỉnh (bytes) hoặc None khi bản tin chưa đủ. Frame không đúng định dạng ISO-TP
+    được trả nguyên dữ liệu để ECU gửi chuỗi thô vẫn dừng ghi được.
+    """
+
+    def __init__(self, max_length=ISOTP_MAX_LENGTH, timeout=DEFAULT_ISOTP_TIMEOUT, max_streams=DEFAULT_ISOTP_STREAMS):
+        self.max_length = int(max_length)
+        self.timeout = float(timeout)
+        self._streams = {} # khóa ID -> _IsoTpStream đang ghép
+        self._pool = [_IsoTpStream(self.max_length) for _ in range(max(1, int(max_streams)))]
+        self.on_first_frame = None # Callback(msg) khi nhận First Frame (vd: gửi Flow Control)
+        self.completed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0 # Bản tin dài quá max_length hoặc hết bộ đệm
+        self.raw = 0 # Frame không phải SF/FF hợp lệ, không có bản tin đang ghép: trả nguyên dữ liệu
+        self.clock = time.monotonic
+
+    def _release(self, key):
+        stream = self._streams.pop(key, None)
+        if stream is not None:
+            self._pool.append(stream)
+
+    def _acquire(self, key, now):
+        self._release(key) # First Frame mới thay bản tin dang dở của cùng ID
+        if not self._pool:
+            for other in [k for k, stream in self._streams.items() if stream.deadline < now]:
+                self.timeouts += 1
+                self._release(other)
+        if not self._pool:
+            return None
+        stream = self._streams[key] = self._pool.pop()
+        return stream
+
+    def _raw(self, key, data):
+        # Chuỗi thô (vd: b'1234', b' Stop', b'\x00\x00'): chỉ khi ID này không có bản tin ISO-TP đang ghép
+        if key in self._streams:
+            self.errors += 1
+            return None
+        self.raw += 1
+        return bytes(data)
+
+    def feed(self, msg, now=None):
+        data = msg.data
+        size = len(data)
+        key = _lookup_key(msg.arbitration_id, msg.is_extended_id)
+        if not size:
+            return self._raw(key, data) # Payload rỗng vẫn là lệnh dừng (tên sự kiện mặc định)
+        pci = data[0] >> 4
+        if pci == ISOTP_SINGLE:
+            length, offset = data[0] & 0x0F, 1
+            if length == 0 and size > 8: # CAN FD: độ dài ở byte thứ hai
+                length, offset = data[1], 2
+            if not 0 < length <= size - offset:
+                return self._raw(key, data)
+            self.completed += 1
+            return bytes(data[offset:offset + length])
+        now = self.clock() if now is None else now
+        if pci == ISOTP_FIRST:
+            if size < 8:
+                return self._raw(key, data)
+            length, offset = ((data[0] & 0x0F) << 8) | data[1], 2
+            if length == 0: # Độ dài 32-bit (ISO 15765-2:2016)
+                length, offset = int.from_bytes(data[2:6], "big"), 6
+            if length > self.max_length:
+                self.rejected += 1
+                self._release(key)
+                return None
+            stream = self._acquire(key, now)
+            if stream is None:
+                self.rejected += 1
+                return None
+            chunk = min(size - offset, length)
+            stream.buffer[:chunk] = data[offset:offset + chunk]
+            stream.length, stream.filled, stream.next_seq = length, chunk, 1
+            stream.deadline = now + self.timeout
+            if self.on_first_frame is not None:
+                self.on_first_frame(msg)
+            return None
+        if pci == ISOTP_CONSECUTIVE:
+            stream = self._streams.get(key)
+            if stream is None:
+                return self._raw(key, data) # Không có First Frame trước đó: không phải ISO-TP
+            if now > stream.deadline:
+                self.timeouts += 1
+                self._release(key)
+                return None
+            if (data[0] & 0x0F) != stream.next_seq: # Mất frame: không ghép được nữa
+                self.errors += 1
+                self._release(key)
+                return None
+            chunk = min(size - 1, stream.length - stream.filled)
+            stream.buffer[stream.filled:stream.filled + chunk] = data[1:1 + chunk]
+            stream.filled += chunk
+            stream.next_seq = (stream.next_seq + 1) & 0x0F
+            stream.deadline = now + self.timeout
+            if stream.filled < stream.length:
+                return None
+            payload = bytes(stream.buffer[:stream.length]) # Bộ đệm được dùng lại ngay sau đây
+            self._release(key)
+            self.completed += 1
+            return payload
+        if pci == ISOTP_FLOW_CONTROL:
+            return self._raw(key, data)
+        return bytes(data) # Không phải ISO-TP: dữ liệu thô
+
+    def stats(self):
+        return {"completed": self.completed, "timeouts": self.timeouts, "errors": self.errors,
+                "rejected": self.rejected, "raw": self.raw, "active": len(self._streams)}
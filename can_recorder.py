@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Ghi liên tục toàn bộ frame CAN ra file (định dạng nhị phân cố định hoặc BLF/ASC), có xoay vòng file."""
+import datetime
+import os
+import struct
+import threading
+import time
+
+import can
+
+from can_pipeline import CanFrameRing
+
+# ---- Định dạng nhị phân .ccl ----
+CCL_MAGIC = b"CCLG"
+CCL_VERSION = 1
+CCL_EXTENSION = ".ccl"
+# Header file: magic, version, kích thước bản ghi, thời điểm mở file (epoch)
+FILE_HEADER = struct.Struct("<4sHHd")
+# Bản ghi: timestamp (s), arbitration ID, flags, độ dài dữ liệu, 8 byte dữ liệu
+RECORD = struct.Struct("<dIBB8s")
+FD_EXTRA_BYTES = 56 # Frame CAN FD dài hơn 8 byte: thêm 56 byte ngay sau bản ghi
+
+FLAG_EXTENDED = 0x01
+FLAG_REMOTE = 0x02
+FLAG_ERROR = 0x04
+FLAG_FD = 0x08
+FLAG_BRS = 0x10
+FLAG_ESI = 0x20
+FLAG_RX = 0x40
+
+FORMAT_BINARY = "ccl"
+FORMAT_BLF = "blf"
+FORMAT_ASC = "asc"
+RECORD_FORMATS = (FORMAT_BINARY, FORMAT_BLF, FORMAT_ASC)
+
+# ---- Cấu hình mặc định ----
+DEFAULT_QUEUE_SIZE = 1 << 20 # ~2 phút ở 1 Mbit/s tải đầy trước khi mất frame
+DEFAULT_BLOCK_SIZE = 1 << 20 # Bộ đệm ghi 1 MB
+DEFAULT_FLUSH_INTERVAL = 0.25 # Giây giữa các lần rút hàng đợi
+DEFAULT_ROTATE_BYTES = 256 * 1024 * 1024
+DEFAULT_ROTATE_SECONDS = 3600
+DEFAULT_QUOTA_BYTES = 4 * 1024 * 1024 * 1024 # Tổng dung lượng log CAN; 0 = không giới hạn
+
+
+def message_flags(msg):
+    flags = 0
+    if msg.is_extended_id: flags |= FLAG_EXTENDED
+    if msg.is_remote_frame: flags |= FLAG_REMOTE
+    if msg.is_error_frame: flags |= FLAG_ERROR
+    if msg.is_fd: flags |= FLAG_FD
+    if msg.bitrate_switch: flags |= FLAG_BRS
+    if msg.error_state_indicator: flags |= FLAG_ESI
+    if msg.is_rx: flags |= FLAG_RX
+    return flags
+
+
+def read_ccl(path):
+    """Đọc file .ccl, sinh ra (timestamp, arbitration_id, flags, dlc, data bytes) theo thứ tự ghi."""
+    with open(path, "rb") as f:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            return
+        magic, version, record_size, _ = FILE_HEADER.unpack(header)
+        if magic != CCL_MAGIC or record_size != RECORD.size:
+            raise ValueError(f"File không phải định dạng CCL hợp lệ: {path}")
+        while True:
+            raw = f.read(RECORD.size)
+            if len(raw) < RECORD.size:
+                break # Bản ghi cuối bị cắt (vd: mất điện) -> dừng
+            timestamp, arbitration_id, flags, dlc, data = RECORD.unpack(raw)
+            if flags & FLAG_FD and dlc > 8:
+                extra = f.read(FD_EXTRA_BYTES)
+                if len(extra) < FD_EXTRA_BYTES:
+                    break
+                data += extra
+            yield timestamp, arbitration_id, flags, dlc, data[:dlc]
+
+
+def record_to_message(record):
+    """Chuyển một bản ghi read_ccl() thành can.Message."""
+    timestamp, arbitration_id, flags, dlc, data = record
+    return can.Message(timestamp=timestamp, arbitration_id=arbitration_id,
+                       is_extended_id=bool(flags & FLAG_EXTENDED), is_remote_frame=bool(flags & FLAG_REMOTE),
+                       is_error_frame=bool(flags & FLAG_ERROR), is_fd=bool(flags & FLAG_FD),
+                       bitrate_switch=bool(flags & FLAG_BRS), error_state_indicator=bool(flags & FLAG_ESI),
+                       is_rx=bool(flags & FLAG_RX), dlc=dlc, data=data)
+
+
+class CanRecorder(threading.Thread):
+    """Luồng ghi nền: listener chỉ push() tham chiếu frame, luồng này đóng gói và ghi theo khối lớn.
+    File log cũ nhất (kể cả từ lần chạy trước) bị xóa khi tổng dung lượng vượt quota_bytes.
+    """
+
+    def __init__(self, directory, fmt=FORMAT_BINARY, rotate_bytes=DEFAULT_ROTATE_BYTES,
+                 rotate_seconds=DEFAULT_ROTATE_SECONDS, quota_bytes=DEFAULT_QUOTA_BYTES, queue_size=DEFAULT_QUEUE_SIZE,
+                 block_size=DEFAULT_BLOCK_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, prefix="can"):
+        super().__init__(name="CanRecorder", daemon=True)
+        if fmt not in RECORD_FORMATS:
+            raise ValueError(f"Định dạng ghi CAN không hỗ trợ: {fmt}")
+        self.directory = directory
+        self.fmt = fmt
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.quota_bytes = int(quota_bytes)
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.prefix = prefix
+        self._queue = CanFrameRing(queue_size)
+        self._stop_event = threading.Event()
+        self._file = None     # File nhị phân (.ccl)
+        self._logger = None   # Writer python-can (.blf/.asc)
+        self._opened_at = 0.0
+        self._file_bytes = 0
+        self._buffer = bytearray(block_size + RECORD.size + FD_EXTRA_BYTES)
+        self.current_path = None
+        self.files_written = []
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.files_evicted = 0
+        self.on_error = None # callback(exception) khi luồng ghi dừng vì lỗi
+
+    def push(self, msg):
+        """Gọi từ listener: O(1), không cấp phát thêm ngoài phần tử deque."""
+        self._queue.push(msg)
+
+    def push_batch(self, msgs):
+        self._queue.push_batch(msgs)
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    # --- Quản lý file ---
+    def _open_next(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        ext = CCL_EXTENSION if self.fmt == FORMAT_BINARY else f".{self.fmt}"
+        self.current_path = os.path.join(self.directory, f"{self.prefix}_{stamp}{ext}")
+        if self.fmt == FORMAT_BINARY:
+            self._file = open(self.current_path, "wb", buffering=self.block_size)
+            self._file.write(FILE_HEADER.pack(CCL_MAGIC, CCL_VERSION, RECORD.size, time.time()))
+            self._file_bytes = FILE_HEADER.size
+        else:
+            self._logger = can.Logger(self.current_path) # BLFWriter / ASCWriter
+            self._file_bytes = 0
+        self._opened_at = time.monotonic()
+        self.files_written.append(self.current_path)
+        print(f"CanRecorder: Recording CAN to {self.current_path}")
+        self._evict()
+
+    def _evict(self):
+        """Xóa file log cũ nhất (tên chứa thời điểm mở nên sắp xếp theo tên = theo thời gian) cho đến khi dưới quota."""
+        if self.quota_bytes <= 0:
+            return
+        extensions = (CCL_EXTENSION, f".{FORMAT_BLF}", f".{FORMAT_ASC}")
+        logs = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.startswith(f"{self.prefix}_") or not name.endswith(extensions) or path == self.current_path:
+                continue
+            try:
+                logs.append((path, os.path.getsize(path)))
+            except OSError:
+                continue
+        total = sum(size for _, size in logs)
+        for path, size in logs:
+            if total <= self.quota_bytes:
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"CanRecorder: Could not delete {path}: {e}")
+                continue
+            total -= size
+            self.files_evicted += 1
+
+    def _close_current(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._logger:
+            self._logger.stop()
+            self._logger = None
+
+    def _should_rotate(self):
+        if self.rotate_seconds and time.monotonic() - self._opened_at >= self.rotate_seconds:
+            return True
+        if self.rotate_bytes:
+            size = self._file_bytes if self._file else os.path.getsize(self.current_path)
+            return size >= self.rotate_bytes
+        return False
+
+    # --- Ghi ---
+    def _write_binary(self, frames):
+        buf = self._buffer
+        pack_into = RECORD.pack_into
+        offset = 0
+        for msg in frames:
+            data = bytes(msg.data)
+            pack_into(buf, offset, msg.timestamp, msg.arbitration_id, message_flags(msg), len(data), data[:8])
+            offset += RECORD.size
+            if len(data) > 8:
+                buf[offset:offset + FD_EXTRA_BYTES] = data[8:].ljust(FD_EXTRA_BYTES, b"\x00")
+                offset += FD_EXTRA_BYTES
+            if offset >= self.block_size:
+                self._file.write(memoryview(buf)[:offset])
+                self._file_bytes += offset
+                offset = 0
+        if offset:
+            self._file.write(memoryview(buf)[:offset])
+            self._file_bytes += offset
+
+    def _write_batch(self, frames):
+        if self.fmt == FORMAT_BINARY:
+            self._write_binary(frames)
+        else:
+            for msg in frames:
+                self._logger.on_message_received(msg)
+        self.frames_written += len(frames)
+
+    def run(self):
+        try:
+            self._open_next()
+            while True:
+                stopping = self._stop_event.wait(self.flush_interval)
+                frames, dropped = self._queue.drain(None)
+                self.frames_dropped += dropped
+                if frames:
+                    self._write_batch(frames)
+                if self._should_rotate():
+                    self._close_current()
+                    self._open_next()
+                if stopping:
+                    break
+        except Exception as e:
+            print(f"CanRecorder: Error writing CAN log: {e}")
+            if self.on_error:
+                self.on_error(e)
+        finally:
+            self._close_current()
+            print(f"CanRecorder: Stopped. Frames written: {self.frames_written}, dropped: {self.frames_dropped}")
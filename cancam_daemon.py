@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Chạy ghi hình theo trigger CAN không cần giao diện (máy không màn hình, chạy như service).
+
+Dùng chung engine với GUI, không nạp PyQt5. Cấu hình đọc từ file INI (xem cancam.example.ini),
+tham số dòng lệnh ghi đè giá trị trong file.
+
+    python cancam_daemon.py --config cancam.ini
+    python cancam_daemon.py --camera 0 --camera 1 --interface socketcan --channel can0 --start-id 100 --stop-id 101
+"""
+import argparse
+import signal
+import sys
+
+from engine import CaptureEngine, EngineConfig
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Ghi hình camera theo trigger CAN (không giao diện).")
+    parser.add_argument("--config", help="File cấu hình INI")
+    parser.add_argument("--save-dir", dest="save_dir", help="Thư mục lưu clip")
+    parser.add_argument("--camera", dest="camera_sources", action="append",
+                        help="Nguồn camera (index hoặc URL), lặp lại cho nhiều camera")
+    parser.add_argument("--capture-mode", dest="capture_mode", help="inprocess | process")
+    parser.add_argument("--recording-mode", dest="recording_mode", help="event | segments (ghi liên tục theo đoạn)")
+    parser.add_argument("--segment-seconds", dest="segment_seconds", type=float)
+    parser.add_argument("--segment-quota-bytes", dest="segment_quota_bytes", type=int)
+    parser.add_argument("--encoder", help="auto | mjpg | mp4v | xvid | raw | x264 | ffv1")
+    parser.add_argument("--encoder-preset", dest="encoder_preset", help="fast | balanced | quality")
+    parser.add_argument("--interface", dest="can_interface", help="Interface python-can (vd: socketcan, pcan)")
+    parser.add_argument("--channel", dest="can_channel", help="Kênh CAN (vd: can0, PCAN_USBBUS1)")
+    parser.add_argument("--bitrate", dest="can_bitrate", type=int)
+    parser.add_argument("--start-id", dest="start_id", help="ID bắt đầu ghi (hex, hỗ trợ ID/MASK)")
+    parser.add_argument("--stop-id", dest="stop_id", help="ID dừng & lưu (hex)")
+    parser.add_argument("--emergency-id", dest="emergency_id", help="ID dừng khẩn cấp (hex)")
+    parser.add_argument("--no-can-record", dest="can_record", action="store_false", default=None,
+                        help="Tắt ghi liên tục traffic CAN")
+    parser.add_argument("--can-record-quota-bytes", dest="can_record_quota_bytes", type=int,
+                        help="Tổng dung lượng log CAN, xóa file cũ nhất trước (0 = không giới hạn)")
+    parser.add_argument("--metrics-export", dest="metrics_export", action="store_true", default=None,
+                        help="Ghi metrics.json + metrics.prom vào <thư mục lưu>/metrics")
+    parser.add_argument("--metrics-port", dest="metrics_port", type=int,
+                        help="Phục vụ /metrics, /metrics.json trên 127.0.0.1:<port>")
+    parser.add_argument("--print-config", action="store_true", help="In cấu hình đã gộp rồi thoát")
+    parser.add_argument("--list-cameras", action="store_true", help="Quét camera rồi thoát")
+    return parser
+
+
+def load_config(args):
+    overrides = {name: value for name, value in vars(args).items()
+                 if value is not None and name not in ("config", "print_config", "list_cameras")}
+    if args.config:
+        return EngineConfig.from_file(args.config, **overrides)
+    return EngineConfig(**overrides)
+
+
+def list_cameras():
+    from camera_discovery import camera_label, discover_cameras
+    from shm_capture import default_api_preference
+    for info in discover_cameras(api_preference=default_api_preference()):
+        print(f"{info.index}\t{info.path}\t{camera_label(info)}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.list_cameras:
+        list_cameras()
+        return 0
+    try:
+        config = load_config(args).validate()
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Daemon: Configuration error: {e}")
+        return 2
+    if args.print_config:
+        config.to_parser().write(sys.stdout)
+        return 0
+    if not config.can_enabled:
+        print("Daemon: Warning: CAN not configured (interface/channel/start_id/stop_id), cameras will only buffer.")
+
+    try:
+        engine = CaptureEngine(config)
+    except ValueError as e:
+        print(f"Daemon: {e}")
+        return 2
+
+    def on_signal(signum, _frame):
+        print(f"Daemon: Signal {signum} received, stopping...")
+        engine.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    engine.start()
+    # Chờ theo từng khoảng ngắn để luồng chính vẫn nhận được tín hiệu
+    while not engine.wait(0.5):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
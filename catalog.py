@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Danh mục bản ghi trong SQLite (không phụ thuộc Qt): tra cứu clip theo sự kiện, thời gian, camera.
+
+Mỗi thư mục lưu có một file '<thư mục>/catalog.sqlite3', được cập nhật trong lúc hoàn tất clip (ClipFinalizer).
+Bảng name_counters giữ số thứ tự tiếp theo cho mỗi '{ngày}_{sự kiện}' nên việc cấp tên file duy nhất chỉ cần
+một lần tra khóa và một lần kiểm tra file, thay vì thử lần lượt '_1', '_2', ... trên đĩa.
+Thư mục có sẵn từ trước (chưa có danh mục) được nạp bằng rebuild(): một lượt scandir, không đọc nội dung file.
+"""
+import argparse
+import collections
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from segment_recorder import CONCAT_LIST_NAME, SEGMENT_SUBDIR
+
+CATALOG_FILENAME = "catalog.sqlite3"
+KIND_CLIP = "clip"         # Một file video (chế độ sự kiện)
+KIND_SEGMENTS = "segments" # Thư mục sự kiện chứa các đoạn đã link (chế độ đoạn)
+VIDEO_EXTS = (".mp4", ".avi", ".mkv")
+MAX_NAME_PROBES = 1000 # Số tên tối đa thử thêm khi bộ đếm lệch với đĩa (file được chép vào bằng tay)
+# '{YYYY-MM-DD}_{sự kiện}[_n][_camK]': đọc từ phải sang trái như lúc đặt tên
+_NAME_RE = re.compile(r"^(?P<day>\d{4}-\d{2}-\d{2})_(?P<event>.+?)(?:_(?P<index>\d+))?(?:_(?P<camera>cam\d+))?$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    base_name TEXT NOT NULL,
+    event TEXT NOT NULL,
+    camera TEXT,
+    kind TEXT NOT NULL,
+    start_monotonic REAL,
+    stop_monotonic REAL,
+    start_wall REAL,
+    stop_wall REAL,
+    duration REAL,
+    size INTEGER,
+    codec TEXT,
+    start_trigger_id INTEGER,
+    stop_trigger_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS recordings_event ON recordings (event, start_wall);
+CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start_wall);
+CREATE INDEX IF NOT EXISTS recordings_camera ON recordings (camera, start_wall);
+CREATE TABLE IF NOT EXISTS name_counters (
+    base TEXT PRIMARY KEY,
+    next_index INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+CatalogEntry = collections.namedtuple(
+    "CatalogEntry", "path base_name event camera kind start_monotonic stop_monotonic start_wall stop_wall "
+                    "duration size codec start_trigger_id stop_trigger_id")
+_COLUMNS = ", ".join(CatalogEntry._fields)
+
+
+def sanitize_event_name(error_string):
+    """Làm sạch chuỗi sự kiện từ CAN để dùng trong tên file."""
+    safe = re.sub(r'[\\/*?:"<>|]', "_", error_string or "")
+    safe = "_".join(safe.split()).strip("_")
+    return safe or "UnknownEvent"
+
+
+def directory_size(path):
+    """Tổng kích thước file trong thư mục sự kiện (một cấp)."""
+    with os.scandir(path) as files:
+        return sum(f.stat().st_size for f in files if f.is_file())
+
+
+def wall_time(monotonic_ts):
+    """Timestamp monotonic (của frame) -> epoch, theo độ lệch đồng hồ hiện tại."""
+    return time.time() - (time.monotonic() - monotonic_ts)
+
+
+def _indexed_name(base, index):
+    return base if index == 0 else f"{base}_{index}"
+
+
+def parse_recording_name(name):
+    """'2024-01-01_Overheat_2_cam1.mp4' -> (gốc '2024-01-01_Overheat', sự kiện, n, camera); None nếu không khớp.
+
+    Tên sự kiện kết thúc bằng '_<số>' không phân biệt được với hậu tố trùng tên, được hiểu là hậu tố.
+    """
+    match = _NAME_RE.match(os.path.splitext(name)[0])
+    if not match:
+        return None
+    return (f"{match['day']}_{match['event']}", match["event"], int(match["index"] or 0), match["camera"])
+
+
+class RecordingCatalog:
+    """Danh mục của một thư mục lưu. An toàn khi gọi từ nhiều luồng (một kết nối, khóa nội bộ)."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, CATALOG_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL") # Đọc (GUI/CLI) không chặn ghi (ClipFinalizer)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        empty = self._conn.execute("SELECT NOT EXISTS (SELECT 1 FROM name_counters)").fetchone()[0]
+        if empty:
+            self.rebuild() # Thư mục cũ chưa có danh mục: nạp một lần để bộ đếm tên khớp với đĩa
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Cấp tên ---
+    def _taken(self, directory, candidate, tags, exts):
+        return any(os.path.exists(os.path.join(directory, f"{candidate}_{tag}{ext}" if tag else f"{candidate}{ext}"))
+                   for tag in tags for ext in exts)
+
+    def allocate_base_name(self, error_string, tags=(None,), when=None, exts=(".mp4",)):
+        """Tên gốc '{ngày}_{sự kiện}[_n]' chưa dùng cho mọi tag/đuôi; bộ đếm tăng ngay nên không cấp trùng lần hai.
+
+        Bình thường chỉ kiểm tra một tên trên đĩa; nếu bộ đếm lệch (file chép vào bằng tay) thì thử tiếp.
+        """
+        when = when or datetime.datetime.now()
+        base = f"{when.strftime('%Y-%m-%d')}_{sanitize_event_name(error_string)}"
+        tags = list(tags) or [None]
+        with self._lock:
+            row = self._conn.execute("SELECT next_index FROM name_counters WHERE base = ?", (base,)).fetchone()
+            first = row[0] if row else 0
+            for index in range(first, first + MAX_NAME_PROBES):
+                candidate = _indexed_name(base, index)
+                if not self._taken(self.directory, candidate, tags, exts):
+                    self._conn.execute("INSERT INTO name_counters (base, next_index) VALUES (?, ?) "
+                                       "ON CONFLICT (base) DO UPDATE SET next_index = excluded.next_index",
+                                       (base, index + 1))
+                    return candidate
+        raise FileExistsError(f"Không tạo được tên file duy nhất cho sự kiện '{error_string}'.")
+
+    # --- Ghi ---
+    def record(self, path, event, camera=None, kind=KIND_CLIP, start_monotonic=None, stop_monotonic=None,
+               size=None, codec=None, start_trigger_id=None, stop_trigger_id=None):
+        """Thêm/cập nhật một bản ghi vừa lưu. Thời gian monotonic được đổi sang epoch tại thời điểm gọi."""
+        path = os.path.abspath(path)
+        parsed = parse_recording_name(os.path.basename(path))
+        # Tên gốc chung của sự kiện (kể cả hậu tố '_n'): các camera cùng sự kiện có cùng base_name
+        base_name = _indexed_name(parsed[0], parsed[2]) if parsed else os.path.splitext(os.path.basename(path))[0]
+        start_wall = wall_time(start_monotonic) if start_monotonic is not None else None
+        stop_wall = wall_time(stop_monotonic) if stop_monotonic is not None else None
+        duration = (stop_monotonic - start_monotonic
+                    if start_monotonic is not None and stop_monotonic is not None else None)
+        if size is None and os.path.isfile(path):
+            size = os.path.getsize(path)
+        entry = CatalogEntry(path, base_name, sanitize_event_name(event), camera, kind, start_monotonic,
+                             stop_monotonic, start_wall, stop_wall, duration, size, codec, start_trigger_id,
+                             stop_trigger_id)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO recordings ({_COLUMNS}) "
+                               f"VALUES ({', '.join('?' * len(entry))})", entry)
+        return entry
+
+    def update_size(self, path, size):
+        with self._lock:
+            self._conn.execute("UPDATE recordings SET size = ? WHERE path = ?", (size, os.path.abspath(path)))
+
+    def remove(self, path):
+        with self._lock:
+            self._conn.execute("DELETE FROM recordings WHERE path = ?", (os.path.abspath(path),))
+
+    # --- Truy vấn ---
+    def find(self, event=None, since=None, until=None, camera=None, limit=None):
+        """Bản ghi theo sự kiện, khoảng thời gian (epoch, giao với [since, until]) và camera; mới nhất trước."""
+        clauses, params = [], []
+        if event is not None:
+            clauses.append("event = ?")
+            params.append(sanitize_event_name(event))
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(camera)
+        if until is not None:
+            clauses.append("start_wall <= ?")
+            params.append(until)
+        if since is not None:
+            clauses.append("stop_wall >= ?")
+            params.append(since)
+        sql = f"SELECT {_COLUMNS} FROM recordings"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY start_wall DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [CatalogEntry(*row) for row in rows]
+
+    def get(self, path):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM recordings WHERE path = ?",
+                                     (os.path.abspath(path),)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def events(self):
+        """Danh sách (sự kiện, số bản ghi), nhiều nhất trước."""
+        with self._lock:
+            return self._conn.execute("SELECT event, COUNT(*) FROM recordings GROUP BY event "
+                                      "ORDER BY COUNT(*) DESC").fetchall()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+
+    # --- Nạp lại từ đĩa ---
+    def _scan(self):
+        """Một lượt scandir thư mục lưu: (CatalogEntry, n) cho file clip và thư mục sự kiện theo mẫu tên."""
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                parsed = parse_recording_name(entry.name)
+                if parsed is None or entry.name == SEGMENT_SUBDIR:
+                    continue
+                base, event, index, camera = parsed
+                try:
+                    if entry.is_dir():
+                        if not os.path.exists(os.path.join(entry.path, CONCAT_LIST_NAME)):
+                            continue
+                        kind = KIND_SEGMENTS
+                        size = directory_size(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in VIDEO_EXTS:
+                        kind = KIND_CLIP
+                        size = entry.stat().st_size
+                    else:
+                        continue
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                # Chỉ có thời điểm sửa file (dùng cho cả đầu/cuối); thời lượng/codec không đọc để giữ lượt quét nhanh
+                found.append((CatalogEntry(os.path.abspath(entry.path), _indexed_name(base, index), event, camera,
+                                           kind, None, None, mtime, mtime, None, size, None, None, None), base, index))
+        return found
+
+    def rebuild(self):
+        """Đồng bộ danh mục với đĩa: thêm file chưa có, xóa bản ghi mà file đã mất, đặt lại bộ đếm tên.
+
+        Bản ghi đã có được giữ nguyên (thông tin đầy đủ từ lúc ghi hơn hẳn thông tin suy ra từ tên file).
+        """
+        started = time.monotonic()
+        found = self._scan()
+        counters = {}
+        for _, base, index in found:
+            counters[base] = max(counters.get(base, 0), index + 1)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS scanned (path TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM scanned")
+                self._conn.executemany("INSERT OR IGNORE INTO scanned (path) VALUES (?)",
+                                       [(item.path,) for item, _, _ in found])
+                removed = self._conn.execute("DELETE FROM recordings WHERE path NOT IN (SELECT path FROM scanned)"
+                                             ).rowcount
+                before = self._conn.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+                self._conn.executemany(f"INSERT OR IGNORE INTO recordings ({_COLUMNS}) "
+                                       f"VALUES ({', '.join('?' * len(CatalogEntry._fields))})",
+                                       [item for item, _, _ in found])
+                added = self._conn.execute("SELECT COUNT(*) FROM recordings").fetchone()[0] - before
+                # Không hạ bộ đếm: tên đã cấp cho clip đang hoàn tất dở không được cấp lại
+                self._conn.executemany("INSERT INTO name_counters (base, next_index) VALUES (?, ?) "
+                                       "ON CONFLICT (base) DO UPDATE SET "
+                                       "next_index = MAX(next_index, excluded.next_index)",
+                                       list(counters.items()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        print(f"RecordingCatalog: Rebuilt {self.directory}: {len(found)} on disk, +{added} / -{removed} "
+              f"in {time.monotonic() - started:.2f}s")
+        return added, removed
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def open_catalog(directory):
+    """Danh mục dùng chung trong tiến trình cho một thư mục lưu; None nếu không mở được (vd: thư mục chỉ đọc)."""
+    if not directory or not os.path.isdir(directory):
+        return None
+    key = os.path.abspath(directory)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            try:
+                catalog = _catalogs[key] = RecordingCatalog(key)
+            except (sqlite3.Error, OSError) as e:
+                print(f"RecordingCatalog: Could not open catalog in {key}: {e}")
+                return None
+        return catalog
+
+
+def _format_time(epoch):
+    return datetime.datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S") if epoch else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tra cứu danh mục bản ghi của một thư mục lưu.")
+    parser.add_argument("directory", help="Thư mục lưu clip")
+    parser.add_argument("--rebuild", action="store_true", help="Quét lại thư mục và đồng bộ danh mục")
+    parser.add_argument("--event", help="Lọc theo chuỗi sự kiện")
+    parser.add_argument("--camera", help="Lọc theo camera (vd: cam1)")
+    parser.add_argument("--since", help="Từ thời điểm 'YYYY-MM-DD[ HH:MM[:SS]]'")
+    parser.add_argument("--until", help="Đến thời điểm 'YYYY-MM-DD[ HH:MM[:SS]]'")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+    catalog = open_catalog(args.directory)
+    if catalog is None:
+        print(f"Catalog: Cannot open '{args.directory}'.")
+        return 1
+    if args.rebuild:
+        catalog.rebuild()
+    since = datetime.datetime.fromisoformat(args.since).timestamp() if args.since else None
+    until = datetime.datetime.fromisoformat(args.until).timestamp() if args.until else None
+    for entry in catalog.find(args.event, since, until, args.camera, args.limit):
+        duration = f"{entry.duration:.1f}s" if entry.duration is not None else "-"
+        print(f"{_format_time(entry.start_wall or entry.stop_wall)}  {entry.event:<24} {entry.camera or '-':<6} "
+              f"{duration:>8} {entry.size or 0:>12} {entry.codec or '-':<6} {os.path.basename(entry.path)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Hàng đợi hoàn tất clip chạy nền (không phụ thuộc Qt).
+
+Release VideoWriter (ghi index MP4), kiểm tra kích thước, đặt tên, đổi tên và ghi chỉ mục đều chạy ở đây
+thay vì ở luồng gọi lệnh dừng. Công việc được xử lý tuần tự: sự kiện sau chỉ được đặt tên khi file của
+sự kiện trước đã đổi tên xong, nên hai sự kiện không thể chọn trùng một tên file.
+"""
+import queue
+import threading
+
+DEFAULT_DRAIN_TIMEOUT = 30.0 # Giây chờ các clip còn trong hàng đợi khi thoát
+
+
+class ClipFinalizer(threading.Thread):
+    """Luồng nền thực thi tuần tự các công việc hoàn tất clip: submit(hàm, *tham số)."""
+
+    def __init__(self, name="ClipFinalizer"):
+        super().__init__(name=name, daemon=True)
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self.pending = 0 # Công việc đã nhận nhưng chưa xong (kể cả đang chạy)
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, job, *args):
+        with self._cond:
+            self.pending += 1
+        self._queue.put((job, args))
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job, args = item
+            try:
+                job(*args)
+            except Exception as e:
+                self.failed += 1
+                print(f"ClipFinalizer: Job failed: {type(e).__name__}: {e}")
+            finally:
+                with self._cond:
+                    self.pending -= 1
+                    self.completed += 1
+                    self._cond.notify_all()
+
+    def drain(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """Đợi hàng đợi trống. Trả về True nếu mọi clip đã hoàn tất trong thời gian chờ."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.pending == 0, timeout)
+
+    def stop(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        self._queue.put(None) # Sau các công việc đã nhận
+        if self.is_alive():
+            self.join(timeout)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_finalizer():
+    """Finalizer dùng chung trong tiến trình (mọi nhóm camera xếp chung một hàng đợi)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None or not _shared.is_alive():
+            _shared = ClipFinalizer()
+            _shared.start()
+        return _shared
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Chỉ mục sidecar cho từng clip: timestamp từng frame video và các frame CAN trong cửa sổ clip."""
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx.npz"
+DEFAULT_TAP_HISTORY = 1 << 16 # Frame CAN giữ lại khi chưa ghi (phủ cửa sổ pre-roll)
+DEFAULT_TAP_MAX_FRAMES = 1 << 20 # Trần frame CAN gom cho một clip (~vài phút ở tải bus đầy), quá thì bỏ frame mới
+_US = 1e6
+
+CAN_FLAG_EXTENDED = 0x01
+CAN_FLAG_REMOTE = 0x02
+CAN_FLAG_ERROR = 0x04
+CAN_FLAG_FD = 0x08
+
+
+def index_path_for(video_path):
+    """'.../2024-01-01_Event.mp4' -> '.../2024-01-01_Event.idx.npz'."""
+    return os.path.splitext(video_path)[0] + INDEX_SUFFIX
+
+
+def _can_dtype(data_width):
+    # Bảng cột: delta thời gian (µs), ID, cờ, độ dài, dữ liệu, timestamp phần cứng gốc
+    return np.dtype([("dt_us", "<u4"), ("arbitration_id", "<u4"), ("flags", "u1"),
+                     ("dlc", "u1"), ("data", "u1", (data_width,)), ("hw_ts", "<f8")])
+
+
+def _delta_encode_us(offsets):
+    """Offset tuyệt đối (s, tăng dần) -> delta µs uint32; phần tử đầu là offset so với gốc clip."""
+    ticks = np.round(np.asarray(offsets, dtype=np.float64) * _US).astype(np.int64)
+    deltas = np.diff(ticks, prepend=0)
+    return np.clip(deltas, 0, np.iinfo(np.uint32).max).astype(np.uint32)
+
+
+def _delta_decode_s(deltas):
+    return np.cumsum(deltas, dtype=np.int64) / _US
+
+
+class ClipCanTap:
+    """Nhánh frame CAN cho chỉ mục clip: giữ lịch sử ngắn khi chưa ghi, gom toàn bộ khi đang ghi.
+
+    push() chạy trong listener: một lần đọc đồng hồ và một lần append (nguyên tử dưới GIL).
+    Nhiều camera có thể dùng chung: việc gom kéo dài đến khi camera cuối cùng gọi end().
+    Clip dài (chế độ đoạn, Stop không đến) chỉ giữ max_frames frame đầu; phần sau được đếm ở dropped.
+    """
+
+    def __init__(self, history=DEFAULT_TAP_HISTORY, max_frames=DEFAULT_TAP_MAX_FRAMES):
+        self._history = collections.deque(maxlen=max(1, int(history)))
+        self.max_frames = max(1, int(max_frames))
+        self.dropped = 0 # Frame bỏ vì vượt max_frames trong clip hiện tại / gần nhất
+        self._clip = None
+        self._users = 0
+        self._lock = threading.Lock() # Chỉ bảo vệ begin()/end(), không dùng trong push()
+        self.clock = time.monotonic # Phát lại log: thời gian trong log, cùng trục với timestamp frame
+
+    def push(self, msg):
+        item = (self.clock(), msg)
+        clip = self._clip
+        if clip is not None:
+            if len(clip) < self.max_frames:
+                clip.append(item)
+            else:
+                self.dropped += 1
+        else:
+            self._history.append(item)
+
+    def begin(self):
+        """Bắt đầu gom cho clip mới, kèm lịch sử gần nhất (để phủ pre-roll)."""
+        with self._lock:
+            self._users += 1
+            if self._clip is None:
+                self._clip = list(self._history)[-self.max_frames:]
+                self._history.clear()
+                self.dropped = 0
+
+    def end(self):
+        """Kết thúc clip của một camera, trả về bản sao danh sách (monotonic, msg) đã gom đến lúc này."""
+        with self._lock:
+            clip = self._clip
+            if clip is None:
+                return []
+            snapshot = list(clip)
+            self._users = max(0, self._users - 1)
+            if self._users == 0:
+                self._clip = None
+                if self.dropped:
+                    print(f"ClipCanTap: Clip index capped at {self.max_frames} CAN frames, dropped {self.dropped}")
+                self._history.extend(clip[-self._history.maxlen:]) # Giữ frame cuối làm lịch sử
+        return snapshot
+
+
+def monotonic_to_wall(timestamp):
+    """Timestamp time.monotonic() -> thời điểm epoch tương ứng."""
+    return time.time() - (time.monotonic() - timestamp)
+
+
+class ClipIndex:
+    """Chỉ mục đã nạp: thời gian tính bằng giây kể từ frame đầu tiên của clip."""
+
+    def __init__(self, frame_times, can, t0_monotonic=0.0, wall_start=0.0, video=""):
+        self.frame_times = np.asarray(frame_times, dtype=np.float64)
+        self.can = can
+        self.can_times = _delta_decode_s(can["dt_us"]) if len(can) else np.zeros(0)
+        self.t0_monotonic = t0_monotonic
+        self.wall_start = wall_start
+        self.video = video
+
+    @property
+    def frame_count(self):
+        return len(self.frame_times)
+
+    @classmethod
+    def build(cls, frame_timestamps, can_items=(), video="", wall_clock=None):
+        """Tạo chỉ mục từ timestamp monotonic của frame đã ghi và các cặp (monotonic, can.Message).
+
+        wall_clock: timestamp frame -> thời điểm epoch (mặc định quy đổi từ time.monotonic(); phát lại log
+        truyền đồng hồ của trục log vì timestamp frame khi đó không phải monotonic).
+        """
+        frame_ts = np.asarray(frame_timestamps, dtype=np.float64)
+        if not len(frame_ts):
+            raise ValueError("Clip không có frame nào để lập chỉ mục.")
+        t0, t_end = float(frame_ts[0]), float(frame_ts[-1])
+        frame_times = _delta_decode_s(_delta_encode_us(frame_ts - t0))
+
+        items = [(ts, msg) for ts, msg in can_items if t0 <= ts <= t_end]
+        items.sort(key=lambda item: item[0])
+        width = 64 if any(len(msg.data) > 8 for _, msg in items) else 8
+        can = np.zeros(len(items), dtype=_can_dtype(width))
+        if items:
+            can["dt_us"] = _delta_encode_us([ts - t0 for ts, _ in items])
+            can["arbitration_id"] = [msg.arbitration_id for _, msg in items]
+            can["flags"] = [(CAN_FLAG_EXTENDED if msg.is_extended_id else 0)
+                            | (CAN_FLAG_REMOTE if msg.is_remote_frame else 0)
+                            | (CAN_FLAG_ERROR if msg.is_error_frame else 0)
+                            | (CAN_FLAG_FD if getattr(msg, "is_fd", False) else 0) for _, msg in items]
+            can["dlc"] = [len(msg.data) for _, msg in items]
+            can["hw_ts"] = [msg.timestamp or 0.0 for _, msg in items]
+            data = can["data"]
+            for row, (_, msg) in enumerate(items):
+                payload = bytes(msg.data)
+                data[row, :len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        wall_start = (wall_clock or monotonic_to_wall)(t0)
+        return cls(frame_times, can, t0, wall_start, os.path.basename(video))
+
+    def save(self, path):
+        with open(path, "wb") as f: # Truyền file object để numpy không tự thêm đuôi .npz
+            np.savez_compressed(f, version=np.array(INDEX_VERSION),
+                                frame_dt_us=_delta_encode_us(self.frame_times), can=self.can,
+                                t0_monotonic=np.array(self.t0_monotonic), wall_start=np.array(self.wall_start),
+                                video=np.array(self.video))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["version"])
+            if version != INDEX_VERSION:
+                raise ValueError(f"Phiên bản chỉ mục không hỗ trợ: {version}")
+            return cls(_delta_decode_s(data["frame_dt_us"]), data["can"], float(data["t0_monotonic"]),
+                       float(data["wall_start"]), str(data["video"]))
+
+    # --- Truy vấn O(log n) ---
+    def frame_at(self, t):
+        """Chỉ số frame video đang hiển thị tại thời điểm t (giây kể từ đầu clip)."""
+        idx = int(np.searchsorted(self.frame_times, t, side="right")) - 1
+        return min(max(idx, 0), len(self.frame_times) - 1)
+
+    def frame_for_can(self, row):
+        """Chỉ số frame video tương ứng với frame CAN ở dòng row."""
+        return self.frame_at(self.can_times[row])
+
+    def can_between(self, t_start, t_end):
+        """Các frame CAN trong [t_start, t_end) (giây kể từ đầu clip)."""
+        lo = np.searchsorted(self.can_times, t_start, side="left")
+        hi = np.searchsorted(self.can_times, t_end, side="left")
+        return self.can[lo:hi]
+
+    def can_for_frame(self, frame_idx):
+        """Các frame CAN nhận được trong khoảng hiển thị của frame video frame_idx."""
+        t_start = self.frame_times[frame_idx]
+        t_end = self.frame_times[frame_idx + 1] if frame_idx + 1 < len(self.frame_times) else np.inf
+        return self.can_between(t_start, t_end)
+
+
+def write_clip_index(video_path, frame_timestamps, can_items=(), wall_clock=None):
+    """Ghi chỉ mục sidecar cạnh file video; trả về đường dẫn."""
+    index = ClipIndex.build(frame_timestamps, can_items, video=video_path, wall_clock=wall_clock)
+    return index.save(index_path_for(video_path))
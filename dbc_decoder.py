@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Giải mã tín hiệu CAN theo file DBC bằng bảng trích bit biên dịch sẵn (không phụ thuộc Qt).
+
+Mỗi tín hiệu được biên dịch một lần thành (byte bắt đầu cửa sổ 8 byte, thứ tự byte, shift, mask, hệ số, offset,
+có dấu). Listener chỉ chép byte frame vào mảng numpy cấp phát sẵn; luồng CAN giải mã cả lô bằng vài phép
+toán vector cho mỗi message (không xử lý bit từng frame bằng Python), rồi giữ giá trị mới nhất của từng tín hiệu.
+"""
+import collections
+import re
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_DECODE_BATCH = 4096   # Số frame tối đa trong một lô (đầy thì bị bỏ frame cũ nhất chưa giải mã)
+DEFAULT_DECODE_INTERVAL = 0.05 # Chu kỳ giải mã lô (s) trong luồng CanWorker
+CLASSIC_WIDTH = 8
+FD_WIDTH = 64
+DBC_EXTENDED_FLAG = 0x80000000 # Bit 31 của ID trong DBC đánh dấu ID 29-bit
+
+Signal = collections.namedtuple(
+    "Signal", "name message_id extended start length little_endian signed factor offset minimum maximum unit message",
+    defaults=("",))
+
+
+def qualified_name(signal):
+    """'<message>.<tín hiệu>': tên tín hiệu chỉ duy nhất trong một message, khác message có thể trùng tên."""
+    return f"{signal.message}.{signal.name}" if signal.message else signal.name
+
+_MESSAGE_RE = re.compile(r"^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)")
+_SIGNAL_RE = re.compile(
+    r"^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*\(([^,]+),([^)]+)\)\s*"
+    r"\[([^|]*)\|([^\]]*)\]\s*\"([^\"]*)\"")
+
+
+def _float(text, default=0.0):
+    try:
+        return float(text)
+    except ValueError:
+        return default
+
+
+def load_dbc(path):
+    """Đọc BO_/SG_ của file DBC. Trả về (dict ID -> tên message, list Signal, số tín hiệu multiplex bị bỏ qua).
+
+    Tín hiệu multiplex (m<n>) chưa được hỗ trợ và bị bỏ qua; tín hiệu bộ chọn (M) được giải mã như thường.
+    """
+    messages, signals, skipped = {}, [], 0
+    current = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("BO_ "):
+                match = _MESSAGE_RE.match(line)
+                if match:
+                    raw_id = int(match.group(1))
+                    current = (raw_id & ~DBC_EXTENDED_FLAG, bool(raw_id & DBC_EXTENDED_FLAG))
+                    messages[current] = match.group(2)
+                else:
+                    current = None
+            elif line.startswith("SG_ ") and current is not None:
+                match = _SIGNAL_RE.match(line)
+                if not match:
+                    continue
+                name, mux, start, length, order, sign, factor, offset, minimum, maximum, unit = match.groups()
+                if mux and mux.startswith("m"):
+                    skipped += 1
+                    continue
+                signals.append(Signal(name, current[0], current[1], int(start), int(length), order == "1",
+                                      sign == "-", _float(factor, 1.0), _float(offset), _float(minimum),
+                                      _float(maximum), unit, messages[current]))
+    return messages, signals, skipped
+
+
+def _msb_linear(start):
+    """Bit bắt đầu Motorola (đánh số răng cưa trong DBC) -> vị trí bit tính từ MSB của byte 0."""
+    return (start // 8) * 8 + (7 - start % 8)
+
+
+def compile_signal(signal, width=CLASSIC_WIDTH):
+    """(byte đầu cửa sổ, big_endian, shift, mask) để: raw = (uint64 của data[byte:byte+8] >> shift) & mask."""
+    if not 0 < signal.length <= 64:
+        raise ValueError(f"Độ dài tín hiệu không hợp lệ: {signal.name} ({signal.length} bit)")
+    if signal.little_endian:
+        first_bit = signal.start
+        window = min(first_bit // 8, width - 8)
+        shift = first_bit - window * 8
+        end_bit = first_bit + signal.length
+    else:
+        first_bit = _msb_linear(signal.start)
+        window = min(first_bit // 8, width - 8)
+        end_bit = first_bit + signal.length
+        shift = 64 - (end_bit - window * 8)
+    if end_bit > width * 8 or shift < 0 or shift + signal.length > 64:
+        raise ValueError(f"Tín hiệu {signal.name} nằm ngoài frame {width} byte hoặc vượt cửa sổ 64 bit.")
+    mask = (1 << signal.length) - 1
+    return window, not signal.little_endian, shift, mask
+
+
+class CompiledMessage:
+    """Bảng trích của một message: tín hiệu được gom theo cửa sổ 8 byte để một lần nạp dùng cho nhiều tín hiệu."""
+
+    def __init__(self, key, signals, columns, width):
+        self.key = key
+        self.columns = np.asarray(columns, dtype=np.intp) # Vị trí trong mảng giá trị mới nhất
+        self.factors = np.array([s.factor for s in signals], dtype=np.float64)
+        self.offsets = np.array([s.offset for s in signals], dtype=np.float64)
+        signed = np.array([s.signed for s in signals], dtype=bool)
+        lengths = np.array([s.length for s in signals], dtype=np.float64)
+        # Bù hai: giá trị >= 2^(n-1) trừ đi 2^n (tính trên float để không tràn với tín hiệu 64 bit)
+        self.sign_threshold = np.where(signed, np.exp2(lengths - 1), np.inf)
+        self.sign_range = np.exp2(lengths)
+        groups = collections.defaultdict(list)
+        for position, signal in enumerate(signals):
+            window, big_endian, shift, mask = compile_signal(signal, width)
+            groups[(window, big_endian)].append((position, shift, mask))
+        # (byte đầu, dtype cửa sổ, vị trí tín hiệu, shift, mask) cho từng cửa sổ
+        self.windows = []
+        for (window, big_endian), items in sorted(groups.items()):
+            self.windows.append((window, np.dtype(">u8" if big_endian else "<u8"),
+                                 np.array([p for p, _, _ in items], dtype=np.intp),
+                                 np.array([s for _, s, _ in items], dtype=np.uint64),
+                                 np.array([m for _, _, m in items], dtype=np.uint64)))
+
+    def decode(self, data):
+        """data: mảng (n, width) uint8 các frame của message này -> giá trị vật lý (n, số tín hiệu)."""
+        raw = np.empty((len(data), len(self.factors)), dtype=np.float64)
+        for window, dtype, positions, shifts, masks in self.windows:
+            words = np.ascontiguousarray(data[:, window:window + 8]).view(dtype)[:, 0].astype(np.uint64)
+            raw[:, positions] = (words[:, None] >> shifts) & masks
+        raw -= np.where(raw >= self.sign_threshold, self.sign_range, 0.0)
+        return raw * self.factors + self.offsets
+
+
+class SignalDecoder:
+    """Giải mã lô frame CAN thành giá trị mới nhất của các tín hiệu đã chọn.
+
+    push(msg) gọi trong listener: bỏ qua nhanh ID không có trong DBC, chỉ chép byte vào lô cấp phát sẵn.
+    decode_pending() gọi định kỳ từ luồng khác: đổi lô (double buffer) rồi giải mã theo từng message.
+    Tín hiệu được gọi bằng '<message>.<tín hiệu>'; tên trần chỉ dùng được khi không trùng giữa các message.
+    """
+
+    def __init__(self, signals, names=None, width=CLASSIC_WIDTH, capacity=DEFAULT_DECODE_BATCH):
+        if names:
+            # Chọn theo tên đầy đủ hoặc tên trần (tên trần trùng nhau chọn tất cả các message có tín hiệu đó)
+            wanted = set(names)
+            signals = [s for s in signals if s.name in wanted or qualified_name(s) in wanted]
+            missing = wanted - {s.name for s in signals} - {qualified_name(s) for s in signals}
+            if missing:
+                raise ValueError(f"Tín hiệu không có trong DBC: {', '.join(sorted(missing))}")
+        self.width = int(width)
+        self.signals = []
+        by_message = collections.defaultdict(list)
+        for signal in signals:
+            try:
+                compile_signal(signal, self.width)
+            except ValueError as e:
+                print(f"SignalDecoder: Skipping signal: {e}")
+                continue
+            by_message[(signal.message_id, signal.extended)].append((len(self.signals), signal))
+            self.signals.append(signal)
+        self.names = [qualified_name(s) for s in self.signals]
+        self.index = {name: position for position, name in enumerate(self.names)} # tên đầy đủ/tên trần -> cột
+        bare = collections.defaultdict(list)
+        for name, signal in zip(self.names, self.signals):
+            bare[signal.name].append(name)
+        self.ambiguous = {} # Tên trần có ở nhiều message -> các tên đầy đủ
+        for name, qualified in bare.items():
+            if len(qualified) > 1:
+                self.ambiguous[name] = qualified
+            elif name not in self.index:
+                self.index[name] = self.index[qualified[0]]
+        self.messages = {key: CompiledMessage(key, [s for _, s in items], [c for c, _ in items], self.width)
+                         for key, items in by_message.items()}
+        self.latest = np.full(len(self.signals), np.nan) # Giá trị vật lý mới nhất
+        self.updated = np.zeros(len(self.signals))       # monotonic lúc giải mã giá trị mới nhất
+        self.capacity = max(1, int(capacity))
+        self._buffers = [self._new_buffer(), self._new_buffer()]
+        self._count = 0
+        self._lock = threading.Lock()
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.batches = 0
+
+    @classmethod
+    def from_dbc(cls, path, names=None, width=CLASSIC_WIDTH, capacity=DEFAULT_DECODE_BATCH):
+        messages, signals, skipped = load_dbc(path)
+        decoder = cls(signals, names, width, capacity)
+        print(f"SignalDecoder: Loaded {path}: {len(messages)} message(s), {len(decoder.signals)} signal(s)"
+              + (f", {skipped} multiplexed skipped" if skipped else ""))
+        return decoder
+
+    def _new_buffer(self):
+        return (np.zeros(self.capacity, dtype=np.int64), np.zeros(self.capacity),
+                np.zeros((self.capacity, self.width), dtype=np.uint8))
+
+    def wants(self, arbitration_id, is_extended=False):
+        return (arbitration_id, is_extended) in self.messages
+
+    def push(self, msg):
+        key = (msg.arbitration_id, msg.is_extended_id)
+        if key not in self.messages:
+            return
+        data = msg.data
+        size = min(len(data), self.width)
+        with self._lock:
+            keys, times, rows = self._buffers[0]
+            n = self._count
+            if n == self.capacity: # Lô đầy (luồng giải mã chậm): ghi đè frame cuối, giữ giá trị mới nhất
+                n -= 1
+                self.frames_dropped += 1
+            keys[n] = msg.arbitration_id | (1 << 32 if msg.is_extended_id else 0)
+            times[n] = time.monotonic()
+            row = rows[n]
+            row[:size] = data[:size]
+            if size < self.width:
+                row[size:] = 0
+            self._count = n + 1
+
+    def decode_pending(self):
+        """Giải mã lô hiện có. Trả về list (CompiledMessage, timestamps, giá trị (n, số tín hiệu)) theo message."""
+        with self._lock:
+            count = self._count
+            if not count:
+                return []
+            batch = self._buffers[0]
+            self._buffers.reverse() # Listener ghi tiếp vào bộ đệm còn lại
+            self._count = 0
+        keys, times, rows = (array[:count] for array in batch)
+        results = []
+        for key in np.unique(keys):
+            compiled = self.messages[(int(key) & 0xFFFFFFFF, bool(key >> 32))]
+            selected = np.flatnonzero(keys == key)
+            values = compiled.decode(rows[selected])
+            self.latest[compiled.columns] = values[-1]
+            self.updated[compiled.columns] = times[selected[-1]]
+            results.append((compiled, times[selected], values))
+        self.frames_decoded += count
+        self.batches += 1
+        return results
+
+    def column(self, name):
+        """Cột của tín hiệu theo tên đầy đủ hoặc tên trần; ValueError nếu tên trần trùng giữa các message."""
+        if name in self.ambiguous:
+            raise ValueError(f"Tín hiệu '{name}' có trong nhiều message, dùng tên đầy đủ: "
+                             f"{', '.join(self.ambiguous[name])}")
+        try:
+            return self.index[name]
+        except KeyError:
+            raise ValueError(f"Tín hiệu không có trong DBC: {name}") from None
+
+    def value(self, name, default=None):
+        """Giá trị vật lý mới nhất của tín hiệu, default nếu chưa nhận được frame nào."""
+        value = self.latest[self.column(name)]
+        return default if np.isnan(value) else float(value)
+
+    def snapshot(self):
+        """Giá trị mới nhất theo tên đầy đủ '<message>.<tín hiệu>'."""
+        return {name: float(value) for name, value in zip(self.names, self.latest) if not np.isnan(value)}
+
+    def stats(self):
+        return {"signals": len(self.signals), "messages": len(self.messages), "decoded": self.frames_decoded,
+                "dropped": self.frames_dropped, "batches": self.batches}
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""Backend mã hóa video có thể thay thế và hiệu chuẩn trên chính máy ghi (không phụ thuộc Qt).
+
+Mọi writer có cùng giao diện với cv2.VideoWriter (isOpened/write/release) để FrameWriterThread dùng chung.
+Hiệu chuẩn: mã hóa thử từng backend ở đúng độ phân giải/FPS, đo FPS mã hóa và MB/phút, rồi chọn
+backend tốn dung lượng ít nhất trong số các backend theo kịp thời gian thực. Kết quả được cache theo máy.
+
+    python encoders.py --calibrate --width 1280 --height 720 --fps 30
+"""
+import argparse
+import collections
+import functools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# ---- Backend ----
+BACKEND_OPENCV = "opencv" # cv2.VideoWriter với FOURCC
+BACKEND_FFMPEG = "ffmpeg" # Tiến trình ffmpeg nhận frame BGR thô qua stdin
+ENCODER_AUTO = "auto"     # Dùng kết quả hiệu chuẩn đã cache, nếu chưa có thì DEFAULT_ENCODER
+
+# ---- Preset chất lượng ----
+PRESET_FAST = "fast"
+PRESET_BALANCED = "balanced"
+PRESET_QUALITY = "quality"
+PRESETS = (PRESET_FAST, PRESET_BALANCED, PRESET_QUALITY)
+
+# name: tên dùng trong cấu hình; codec: FOURCC (OpenCV, None = không nén) hoặc encoder ffmpeg
+EncoderSpec = collections.namedtuple("EncoderSpec", "name backend codec ext lossless")
+ENCODERS = collections.OrderedDict((spec.name, spec) for spec in (
+    EncoderSpec("mjpg", BACKEND_OPENCV, "MJPG", ".avi", False),
+    EncoderSpec("mp4v", BACKEND_OPENCV, "mp4v", ".mp4", False),
+    EncoderSpec("xvid", BACKEND_OPENCV, "XVID", ".avi", False),
+    EncoderSpec("raw", BACKEND_OPENCV, None, ".avi", True),
+    EncoderSpec("x264", BACKEND_FFMPEG, "libx264", ".mp4", False),
+    EncoderSpec("ffv1", BACKEND_FFMPEG, "ffv1", ".mkv", True),
+))
+ENCODER_NAMES = tuple(ENCODERS) + (ENCODER_AUTO,)
+DEFAULT_ENCODER = "mp4v"
+FALLBACK_ENCODERS = ("mp4v", "xvid", "mjpg") # Thử lần lượt khi encoder yêu cầu không mở được
+
+# Tham số theo preset: chất lượng JPEG cho MJPG, (preset, crf) cho x264
+_MJPG_QUALITY = {PRESET_FAST: 70, PRESET_BALANCED: 85, PRESET_QUALITY: 95}
+_X264_PARAMS = {PRESET_FAST: ("ultrafast", 28), PRESET_BALANCED: ("veryfast", 23), PRESET_QUALITY: ("medium", 18)}
+
+# ---- Hiệu chuẩn ----
+DEFAULT_CALIBRATION_SECONDS = 3.0 # Thời gian mã hóa thử mỗi backend
+DEFAULT_REALTIME_HEADROOM = 1.25 # Backend phải mã hóa nhanh hơn FPS ghi ít nhất chừng này lần
+DEFAULT_FPS_TOLERANCE = 0.1 # FPS đo được lệch FPS đã hiệu chuẩn tới 10% vẫn dùng kết quả đó (vd: 29.4 -> @30)
+CALIBRATION_VERSION = 1
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.expanduser("~"), ".cache", "can_camdetect", "encoders.json")
+_SYNTHETIC_FRAMES = 12
+
+CalibrationResult = collections.namedtuple("CalibrationResult", "encoder preset encode_fps mb_per_min realtime")
+
+
+def ffmpeg_path():
+    return shutil.which("ffmpeg")
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_encoders(binary):
+    """Tên các encoder mà bản ffmpeg này được build kèm ('ffmpeg -encoders'), đọc một lần mỗi tiến trình."""
+    try:
+        output = subprocess.run([binary, "-hide_banner", "-encoders"], capture_output=True, text=True,
+                                timeout=10.0).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Encoder: Could not list ffmpeg encoders: {e}")
+        return frozenset()
+    # Sau dòng '------': ' V....D libx264   libx264 H.264 ...'
+    _, _, listing = output.partition("------")
+    return frozenset(line.split()[1] for line in listing.splitlines() if len(line.split()) >= 2)
+
+
+def ffmpeg_has_encoder(codec):
+    binary = ffmpeg_path()
+    return binary is not None and codec in ffmpeg_encoders(binary)
+
+
+def available_encoders():
+    """Encoder dùng được trên máy này (ffmpeg cần có trong PATH và được build kèm encoder đó)."""
+    return [spec for spec in ENCODERS.values() if spec.backend != BACKEND_FFMPEG or ffmpeg_has_encoder(spec.codec)]
+
+
+class FfmpegPipeWriter:
+    """Writer qua tiến trình ffmpeg: frame BGR thô ghi vào stdin, mã hóa ở tiến trình riêng.
+
+    Encoder được kiểm tra trong 'ffmpeg -encoders' trước khi chạy: ffmpeg chỉ khởi tạo encoder khi nhận frame
+    đầu tiên, nên nếu không kiểm tra, isOpened() vẫn True và open_writer() không lùi được về encoder khác.
+    """
+
+    def __init__(self, path, codec, fps, frame_size, preset=PRESET_BALANCED):
+        self.path = path
+        self.frame_size = tuple(frame_size)
+        self._proc = None
+        binary = ffmpeg_path()
+        if not binary:
+            return
+        if codec not in ffmpeg_encoders(binary):
+            print(f"Encoder: ffmpeg has no encoder '{codec}'.")
+            return
+        width, height = self.frame_size
+        args = [binary, "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps:.3f}", "-i", "-"]
+        if codec == "libx264":
+            x264_preset, crf = _X264_PARAMS.get(preset, _X264_PARAMS[PRESET_BALANCED])
+            args += ["-c:v", "libx264", "-preset", x264_preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+        else:
+            args += ["-c:v", codec]
+        args.append(path)
+        try:
+            self._proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.PIPE)
+        except OSError as e:
+            print(f"Encoder: Could not start ffmpeg: {e}")
+
+    def isOpened(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, OSError, AttributeError) as e:
+            raise IOError(f"ffmpeg đã dừng: {self._stderr() or e}")
+
+    def _stderr(self):
+        return self._read_stderr(self._proc)
+
+    @staticmethod
+    def _read_stderr(proc):
+        try:
+            return proc.stderr.read().decode("utf-8", errors="replace").strip()
+        except Exception:
+            return ""
+
+    def release(self, timeout=30.0):
+        """Đóng stdin và chờ ffmpeg ghi xong; IOError nếu ffmpeg thoát lỗi (file có thể hỏng)."""
+        if self._proc is None:
+            return
+        proc = self._proc
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        self._proc = None
+        if proc.returncode != 0:
+            stderr = self._read_stderr(proc)
+            raise IOError(f"ffmpeg thoát với mã {proc.returncode}" + (f": {stderr}" if stderr else ""))
+
+
+def create_writer(spec, path, fps, frame_size, preset=PRESET_BALANCED):
+    """Tạo writer cho spec; có thể chưa mở được (kiểm tra isOpened())."""
+    if spec.backend == BACKEND_FFMPEG:
+        return FfmpegPipeWriter(path, spec.codec, fps, frame_size, preset)
+    fourcc = cv2.VideoWriter_fourcc(*spec.codec) if spec.codec else 0
+    writer = cv2.VideoWriter(path, fourcc, fps, tuple(frame_size))
+    if writer.isOpened() and spec.codec == "MJPG":
+        writer.set(cv2.VIDEOWRITER_PROP_QUALITY, _MJPG_QUALITY.get(preset, _MJPG_QUALITY[PRESET_BALANCED]))
+    return writer
+
+
+def open_writer(base_path, fps, frame_size, encoder=DEFAULT_ENCODER, preset=PRESET_BALANCED):
+    """Mở writer theo encoder yêu cầu, lùi dần về FALLBACK_ENCODERS.
+
+    base_path không có đuôi: đuôi file theo encoder thực sự được dùng. Trả về (writer, spec, path).
+    """
+    names = [encoder] + [name for name in FALLBACK_ENCODERS if name != encoder]
+    for name in names:
+        spec = ENCODERS.get(name)
+        if spec is None:
+            continue
+        path = base_path + spec.ext
+        writer = create_writer(spec, path, fps, frame_size, preset)
+        if writer.isOpened():
+            if name != encoder:
+                print(f"Encoder: '{encoder}' unavailable, using '{name}'.")
+            return writer, spec, path
+        try:
+            writer.release()
+        except IOError:
+            pass # ffmpeg đã thoát lỗi trước khi nhận frame: thử encoder kế tiếp
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"Encoder: Warning: Failed to open '{name}'.")
+    raise IOError(f"Không thể mở VideoWriter ({', '.join(names)}).")
+
+
+# ---- Hiệu chuẩn ----
+def synthetic_frames(frame_size, count=_SYNTHETIC_FRAMES, seed=0):
+    """Frame thử: nền gradient (dễ nén) + khối nhiễu di chuyển (giống chuyển động thật, khó nén)."""
+    width, height = frame_size
+    rng = np.random.default_rng(seed)
+    gradient = np.zeros((height, width, 3), dtype=np.uint8)
+    gradient[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    gradient[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    block_w, block_h = max(1, width // 4), max(1, height // 4)
+    frames = []
+    for i in range(count):
+        frame = gradient.copy()
+        x = (i * block_w // 3) % max(1, width - block_w)
+        y = (i * block_h // 5) % max(1, height - block_h)
+        frame[y:y + block_h, x:x + block_w] = rng.integers(0, 256, (block_h, block_w, 3), dtype=np.uint8)
+        frame += rng.integers(0, 8, frame.shape, dtype=np.uint8) # Nhiễu cảm biến nhẹ
+        frames.append(frame)
+    return frames
+
+
+def benchmark_encoder(spec, frame_size, fps, preset=PRESET_BALANCED, seconds=DEFAULT_CALIBRATION_SECONDS,
+                      frames=None, directory=None):
+    """Mã hóa thử trong khoảng seconds giây. Trả về CalibrationResult hoặc None nếu không mở được."""
+    frames = frames or synthetic_frames(frame_size)
+    fd, path = tempfile.mkstemp(prefix=f"calib_{spec.name}_", suffix=spec.ext, dir=directory)
+    os.close(fd)
+    try:
+        writer = create_writer(spec, path, fps, frame_size, preset)
+        if not writer.isOpened():
+            writer.release()
+            return None
+        count = 0
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < seconds:
+                writer.write(frames[count % len(frames)])
+                count += 1
+        finally:
+            writer.release() # Tính cả thời gian ghi nốt (ffmpeg, bộ đệm container)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        encode_fps = count / elapsed
+        video_minutes = count / fps / 60.0
+        mb_per_min = os.path.getsize(path) / 1e6 / video_minutes if count else float("inf")
+        return CalibrationResult(spec.name, preset, round(encode_fps, 1), round(mb_per_min, 2),
+                                 round(encode_fps / fps, 2))
+    except Exception as e:
+        print(f"Encoder: Benchmark '{spec.name}' failed: {e}")
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def choose_encoder(results, headroom=DEFAULT_REALTIME_HEADROOM):
+    """Encoder tốn ít MB/phút nhất trong số encoder theo kịp thời gian thực (có dự phòng headroom).
+
+    Không encoder nào đủ nhanh -> chọn encoder nhanh nhất.
+    """
+    results = [result for result in results if result]
+    if not results:
+        return None
+    fast_enough = [result for result in results if result.realtime >= headroom]
+    if fast_enough:
+        return min(fast_enough, key=lambda result: (result.mb_per_min, -result.encode_fps))
+    return max(results, key=lambda result: result.encode_fps)
+
+
+def calibration_key(frame_size, fps, preset):
+    width, height = frame_size
+    return f"{width}x{height}@{round(fps)}|{preset}"
+
+
+def find_calibration(entries, frame_size, fps, preset, tolerance=DEFAULT_FPS_TOLERANCE):
+    """Mục hiệu chuẩn cùng độ phân giải/preset có FPS gần fps nhất (lệch tối đa tolerance); None nếu không có.
+
+    FPS lúc ghi là FPS đo được (vd: 29.4) nên không so khớp chính xác với FPS danh định đã hiệu chuẩn (@30).
+    """
+    width, height = frame_size
+    best, best_error = None, None
+    for key, entry in entries.items():
+        size, _, rest = key.partition("@")
+        calibrated_fps, _, entry_preset = rest.partition("|")
+        if size != f"{width}x{height}" or entry_preset != preset:
+            continue
+        try:
+            error = abs(float(calibrated_fps) - fps)
+        except ValueError:
+            continue
+        if error <= tolerance * max(fps, 1.0) and (best_error is None or error < best_error):
+            best, best_error = entry, error
+    return best
+
+
+def load_calibration(cache_path=DEFAULT_CALIBRATION_PATH):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Kết quả phụ thuộc CPU của máy: bỏ qua cache chép từ máy khác
+    if data.get("version") != CALIBRATION_VERSION or data.get("host") != platform.node():
+        return {}
+    return data.get("entries", {})
+
+
+def save_calibration(entries, cache_path=DEFAULT_CALIBRATION_PATH):
+    data = {"version": CALIBRATION_VERSION, "host": platform.node(), "entries": entries}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Encoder: Could not write calibration cache {cache_path}: {e}")
+
+
+def calibrate(frame_size, fps, preset=PRESET_BALANCED, seconds=DEFAULT_CALIBRATION_SECONDS,
+              encoders=None, frames=None, headroom=DEFAULT_REALTIME_HEADROOM, cache_path=DEFAULT_CALIBRATION_PATH):
+    """Đo mọi encoder khả dụng, chọn encoder phù hợp và lưu cache. Trả về (tên encoder, danh sách kết quả)."""
+    specs = [ENCODERS[name] for name in encoders] if encoders else available_encoders()
+    frames = frames or synthetic_frames(frame_size)
+    results = []
+    for spec in specs:
+        result = benchmark_encoder(spec, frame_size, fps, preset, seconds, frames)
+        if result:
+            print(f"Encoder: {result.encoder:<6} {result.encode_fps:>8.1f} fps  {result.mb_per_min:>8.2f} MB/min  "
+                  f"x{result.realtime:.2f} realtime")
+        results.append(result)
+    best = choose_encoder(results, headroom)
+    if best and cache_path:
+        entries = load_calibration(cache_path)
+        entries[calibration_key(frame_size, fps, preset)] = {
+            "encoder": best.encoder, "calibrated_at": time.time(),
+            "results": [result._asdict() for result in results if result]}
+        save_calibration(entries, cache_path)
+    return (best.encoder if best else None), [result for result in results if result]
+
+
+def resolve_encoder(encoder, frame_size, fps, preset=PRESET_BALANCED, cache_path=DEFAULT_CALIBRATION_PATH):
+    """'auto' -> encoder đã hiệu chuẩn cho độ phân giải/FPS/preset này (không hiệu chuẩn lúc ghi)."""
+    if encoder != ENCODER_AUTO:
+        return encoder
+    entry = find_calibration(load_calibration(cache_path), frame_size, fps, preset)
+    if entry and entry.get("encoder") in ENCODERS:
+        return entry["encoder"]
+    return DEFAULT_ENCODER
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hiệu chuẩn encoder video trên máy này.")
+    parser.add_argument("--calibrate", action="store_true", help="Đo và lưu encoder phù hợp")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--preset", choices=PRESETS, default=PRESET_BALANCED)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_CALIBRATION_SECONDS)
+    parser.add_argument("--encoder", dest="encoders", action="append", choices=list(ENCODERS),
+                        help="Chỉ đo các encoder này (lặp lại)")
+    args = parser.parse_args(argv)
+    frame_size = (args.width, args.height)
+    if not args.calibrate:
+        print(f"Encoders: {', '.join(spec.name for spec in available_encoders())}")
+        print(f"Auto -> {resolve_encoder(ENCODER_AUTO, frame_size, args.fps, args.preset)}")
+        return 0
+    best, _ = calibrate(frame_size, args.fps, args.preset, args.seconds, args.encoders)
+    if not best:
+        print("Encoder: No encoder could be opened.")
+        return 1
+    print(f"Encoder: Selected '{best}' for {calibration_key(frame_size, args.fps, args.preset)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1166 @@
+# -*- coding: utf-8 -*-
+"""Lõi ghi hình không phụ thuộc Qt: đọc camera, trigger CAN, ghi clip.
+
+GUI (qua qt_engine) và daemon không màn hình (cancam_daemon.py) dùng chung các lớp ở đây.
+Sự kiện được báo qua callback (on_*), gọi từ luồng của worker.
+"""
+import collections
+import configparser
+import datetime
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import can
+import cv2
+
+from video_pipeline import (PreRollBuffer, FrameWriterThread, FrameClock, PreviewThrottle, FrameBufferPool,
+                            DEFAULT_PREROLL_SECONDS, DEFAULT_PREROLL_MAX_BYTES, DEFAULT_WRITER_QUEUE_SIZE,
+                            DEFAULT_PREVIEW_FPS, OVERFLOW_DROP_OLDEST, OVERFLOW_POLICIES, PACING_CAMERA,
+                            PACING_FIXED, read_frame, resolve_recording_fps)
+from can_pipeline import (CanFrameRing, IsoTpReassembler, TriggerDispatchTable, TriggerStateMachine,
+                          format_trigger_id, parse_trigger_id, EXT_ID_MASK, ISOTP_FLOW_CONTINUE, STD_ID_MASK,
+                          ACTION_START, ACTION_STOP, ACTION_EMERGENCY, DEFAULT_MIN_CLIP_SECONDS,
+                          DEFAULT_TRIGGER_DEBOUNCE, DEFAULT_TRIGGER_HOLDOFF, DEFAULT_RECV_BATCH,
+                          DEFAULT_RECV_TIMEOUT, RECEIVE_BATCHED, RECEIVE_MODES, RECEIVE_NOTIFIER)
+from can_recorder import (CanRecorder, FORMAT_BINARY, RECORD_FORMATS, DEFAULT_ROTATE_BYTES,
+                          DEFAULT_ROTATE_SECONDS, DEFAULT_QUOTA_BYTES)
+from catalog import KIND_CLIP, KIND_SEGMENTS, directory_size
+from clip_index import ClipCanTap, monotonic_to_wall, write_clip_index
+from dbc_decoder import CLASSIC_WIDTH, DEFAULT_DECODE_INTERVAL, FD_WIDTH, SignalDecoder
+from metrics import (DEFAULT_EXPORT_INTERVAL, HOP_DISPATCH, HOP_START, JITTER, QUEUE_EDGES, STAGE_BUFFER,
+                     STAGE_CAN, STAGE_CAPTURE, STAGE_DECODE, STAGE_PREVIEW, WRITER_QUEUE, MetricsExporter,
+                     shared_metrics)
+from trigger_rules import TriggerRuleEngine, load_rules
+from encoders import (DEFAULT_ENCODER, ENCODERS, ENCODER_AUTO, ENCODER_NAMES, PRESET_BALANCED, PRESETS,
+                      open_writer, resolve_encoder)
+from segment_recorder import (RECORDING_EVENT, RECORDING_MODES, RECORDING_SEGMENTS, SEGMENT_SUBDIR,
+                              DEFAULT_SEGMENT_QUOTA_BYTES, DEFAULT_SEGMENT_SECONDS, SegmentWriterThread)
+from camera_group import CameraGroup, sanitize_event_name
+from shm_capture import CAPTURE_INPROCESS, CAPTURE_MODES, default_api_preference, open_capture
+
+DEFAULT_SAVE_DIR = os.path.join(os.path.expanduser("~"), "CameraCAN_Recordings")
+DEFAULT_BITRATE = 500000
+CAN_RECORD_SUBDIR = "can_logs"
+MIN_CLIP_BYTES = 500 # File tạm nhỏ hơn ngưỡng này coi như rỗng và bị xóa
+# Interface cần truyền bitrate khi mở bus (socketcan đặt bitrate bằng 'ip link')
+BITRATE_INTERFACES = ('slcan', 'serial', 'pcan', 'kvaser', 'vector', 'ixxat', 'usb2can')
+
+
+# ---- Cấu hình ----
+# thuộc tính: (section INI, kiểu, giá trị mặc định); tên khóa INI trùng tên thuộc tính
+_CONFIG_SCHEMA = {
+    "save_dir": ("storage", str, DEFAULT_SAVE_DIR),
+    "clip_index": ("storage", bool, True),
+    "catalog": ("storage", bool, True),
+    "camera_sources": ("camera", list, ["0"]),
+    "capture_mode": ("camera", str, CAPTURE_INPROCESS),
+    "capture_pacing": ("camera", str, PACING_CAMERA),
+    "preroll_seconds": ("camera", float, DEFAULT_PREROLL_SECONDS),
+    "preroll_max_bytes": ("camera", int, DEFAULT_PREROLL_MAX_BYTES),
+    "writer_queue_size": ("camera", int, DEFAULT_WRITER_QUEUE_SIZE),
+    "writer_overflow_policy": ("camera", str, OVERFLOW_DROP_OLDEST),
+    "preview_fps": ("camera", float, DEFAULT_PREVIEW_FPS),
+    "recording_mode": ("camera", str, RECORDING_EVENT),
+    "segment_seconds": ("camera", float, DEFAULT_SEGMENT_SECONDS),
+    "segment_quota_bytes": ("camera", int, DEFAULT_SEGMENT_QUOTA_BYTES),
+    "encoder": ("camera", str, ENCODER_AUTO),
+    "encoder_preset": ("camera", str, PRESET_BALANCED),
+    "can_interface": ("can", str, ""),
+    "can_channel": ("can", str, ""),
+    "can_bitrate": ("can", int, DEFAULT_BITRATE),
+    "can_fd": ("can", bool, False),
+    "can_receive_mode": ("can", str, RECEIVE_BATCHED),
+    "start_id": ("can", str, ""),
+    "stop_id": ("can", str, ""),
+    "emergency_id": ("can", str, ""),
+    "trigger_debounce_seconds": ("can", float, DEFAULT_TRIGGER_DEBOUNCE),
+    "min_clip_seconds": ("can", float, DEFAULT_MIN_CLIP_SECONDS),
+    "trigger_holdoff_seconds": ("can", float, DEFAULT_TRIGGER_HOLDOFF),
+    "isotp": ("can", bool, False),
+    "isotp_fc_id": ("can", str, ""),
+    "dbc_file": ("can", str, ""),
+    "dbc_signals": ("can", list, []),
+    "trigger_rules_file": ("can", str, ""),
+    "can_record": ("can", bool, True),
+    "can_record_format": ("can", str, FORMAT_BINARY),
+    "can_record_rotate_bytes": ("can", int, DEFAULT_ROTATE_BYTES),
+    "can_record_rotate_seconds": ("can", int, DEFAULT_ROTATE_SECONDS),
+    "can_record_quota_bytes": ("can", int, DEFAULT_QUOTA_BYTES),
+    "metrics_export": ("metrics", bool, False),
+    "metrics_interval": ("metrics", float, DEFAULT_EXPORT_INTERVAL),
+    "metrics_port": ("metrics", int, 0),
+}
+
+
+class EngineConfig:
+    """Cấu hình của lõi ghi hình: mặc định trong _CONFIG_SCHEMA, có thể đọc từ file INI và ghi đè bằng tham số."""
+
+    def __init__(self, **overrides):
+        for name, (_, kind, default) in _CONFIG_SCHEMA.items():
+            setattr(self, name, list(default) if kind is list else default)
+        for name, value in overrides.items():
+            if name not in _CONFIG_SCHEMA:
+                raise TypeError(f"Tham số cấu hình không hợp lệ: {name}")
+            setattr(self, name, value)
+
+    @classmethod
+    def from_file(cls, path, **overrides):
+        parser = configparser.ConfigParser()
+        if not parser.read(path, encoding="utf-8"):
+            raise FileNotFoundError(f"Không đọc được file cấu hình: {path}")
+        values = {}
+        for name, (section, kind, _) in _CONFIG_SCHEMA.items():
+            if not parser.has_option(section, name):
+                continue
+            if kind is bool:
+                values[name] = parser.getboolean(section, name)
+            elif kind is int:
+                values[name] = parser.getint(section, name)
+            elif kind is float:
+                values[name] = parser.getfloat(section, name)
+            elif kind is list:
+                values[name] = [item.strip() for item in parser.get(section, name).split(",") if item.strip()]
+            else:
+                values[name] = parser.get(section, name)
+        values.update(overrides)
+        return cls(**values)
+
+    def to_parser(self):
+        parser = configparser.ConfigParser()
+        for name, (section, kind, _) in _CONFIG_SCHEMA.items():
+            if not parser.has_section(section):
+                parser.add_section(section)
+            value = getattr(self, name)
+            parser.set(section, name, ", ".join(value) if kind is list else str(value))
+        return parser
+
+    def validate(self):
+        if self.capture_mode not in CAPTURE_MODES:
+            raise ValueError(f"capture_mode không hợp lệ: {self.capture_mode}")
+        if self.capture_pacing not in (PACING_CAMERA, PACING_FIXED):
+            raise ValueError(f"capture_pacing không hợp lệ: {self.capture_pacing}")
+        if self.writer_overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"writer_overflow_policy không hợp lệ: {self.writer_overflow_policy}")
+        if self.recording_mode not in RECORDING_MODES:
+            raise ValueError(f"recording_mode không hợp lệ: {self.recording_mode}")
+        if self.encoder not in ENCODER_NAMES:
+            raise ValueError(f"encoder không hợp lệ: {self.encoder}")
+        if self.encoder_preset not in PRESETS:
+            raise ValueError(f"encoder_preset không hợp lệ: {self.encoder_preset}")
+        if self.can_record_format not in RECORD_FORMATS:
+            raise ValueError(f"can_record_format không hợp lệ: {self.can_record_format}")
+        if self.can_receive_mode not in RECEIVE_MODES:
+            raise ValueError(f"can_receive_mode không hợp lệ: {self.can_receive_mode}")
+        return self
+
+    @property
+    def can_enabled(self):
+        return bool(self.can_interface and self.can_channel and self.start_id and self.stop_id)
+
+    @property
+    def record_dir(self):
+        return os.path.join(self.save_dir, CAN_RECORD_SUBDIR)
+
+
+def _notify(callback, *args):
+    if callback is not None:
+        callback(*args)
+
+
+# ---- Camera ----
+# Clip đã tách khỏi camera, chờ hoàn tất ở luồng nền
+PendingClip = collections.namedtuple(
+    "PendingClip", "recording writer_thread temp_filename can_items event_start event_end segment_writer save_dir "
+                   "codec")
+
+
+class CameraWorker(threading.Thread):
+    """Đọc một camera, giữ pre-roll, ghi clip khi được yêu cầu.
+
+    Callback: on_frame(PooledFrame), on_recording_started(), on_recording_stopped(temp_path) ngay khi dừng ghi,
+    on_clip_saved(path) khi clip đã hoàn tất, on_error(message), on_finished().
+    """
+
+    def __init__(self, source, save_dir, config=None):
+        super().__init__(name=f"CameraWorker-{source}", daemon=True)
+        self.config = config or EngineConfig()
+        self.source = source
+        self.save_dir = save_dir
+        self._running = False
+        self._recording = False
+        self.writer_thread = None # Luồng mã hóa riêng, sở hữu VideoWriter khi đang ghi
+        self.last_writer_stats = None
+        self.cap = None
+        self.temp_filename = None
+        self.segments_mode = self.config.recording_mode == RECORDING_SEGMENTS
+        # Đuôi file của encoder đang/vừa dùng; chế độ đoạn lưu sự kiện thành thư mục (không đuôi)
+        self.video_ext = "" if self.segments_mode else ENCODERS[DEFAULT_ENCODER].ext
+        self.segment_writer = None # Writer ghi liên tục (chế độ đoạn), chỉ luồng camera tạo/đóng
+        self.event_start = None # Mốc monotonic bắt đầu sự kiện đang mở (chế độ đoạn)
+        self.lock = threading.Lock() # Bảo vệ _recording, writer_thread, temp_filename, save_dir
+        # Bộ đệm pre-roll (JPEG, giới hạn byte) được ghi vào đầu clip khi bắt đầu ghi
+        self.preroll = PreRollBuffer(self.config.preroll_seconds, self.config.preroll_max_bytes)
+        self.frame_clock = FrameClock() # Timestamp monotonic từng frame + FPS thực tế
+        self.preview = PreviewThrottle(self.config.preview_fps) # Co giãn preview trong luồng camera
+        self.preview_pool = FrameBufferPool() # Bộ đệm preview cấp phát sẵn
+        self.preview_swap_rb = False # Đổi kênh R/B khi render preview (theo định dạng QImage của GUI)
+        self.clip_tap = None # ClipCanTap dùng chung với CanWorker (chỉ mục clip)
+        self.wall_clock = monotonic_to_wall # Timestamp frame -> epoch cho chỉ mục clip (phát lại: trục log)
+        self.file_tag = None # 'cam0', 'cam1'... khi chạy trong CameraGroup nhiều camera
+        self.catalog = None # RecordingCatalog của thư mục lưu (CameraGroup gán), None = không ghi danh mục
+        self.video_codec = None # Encoder thực sự dùng cho clip/đoạn hiện tại (ghi vào danh mục)
+        self.zero_copy_capture = False # Frame là view shared memory (ProcessCapture)
+        self.metrics = shared_metrics() # Jitter, hàng đợi ghi, CPU từng chặng, độ trễ trigger
+        # Callback
+        self.on_frame = None
+        self.on_recording_started = None
+        self.on_recording_stopped = None
+        self.on_clip_saved = None
+        self.on_error = None
+        self.on_finished = None
+
+    @property
+    def measured_fps(self):
+        return self.frame_clock.fps
+
+    def is_running(self):
+        return self.is_alive()
+
+    def set_preview_size(self, width, height):
+        self.preview.set_target_size(width, height)
+
+    def set_preview_enabled(self, enabled):
+        self.preview.set_enabled(enabled)
+
+    def set_save_dir(self, directory):
+        if directory and os.path.isdir(directory):
+            with self.lock:
+                self.save_dir = directory
+        else:
+            print(f"CameraWorker: Cảnh báo: Thư mục lưu '{directory}' không hợp lệ.")
+
+    def _open(self):
+        api_preference = default_api_preference()
+        cap = open_capture(self.source, self.config.capture_mode, api_preference)
+        if (not cap or not cap.isOpened()) and api_preference is not None:
+            print(f"CameraWorker: Failed with preferred backend, retrying default for {self.source}...")
+            cap = open_capture(self.source, self.config.capture_mode)
+        if not cap or not cap.isOpened():
+            raise ConnectionError(f"Không thể mở camera: {self.source}")
+        return cap
+
+    def run(self):
+        self._running = True
+        print(f"CameraWorker: Attempting to open camera: {self.source}")
+        try:
+            self.cap = self._open()
+            frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            if not (0 < fps <= 120):
+                print(f"CameraWorker: Invalid FPS ({fps}) from camera {self.source}, using default 25.")
+                fps = 25
+            if frame_width <= 0 or frame_height <= 0:
+                time.sleep(0.5) # Một số camera cần thời gian trước khi báo kích thước
+                frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                if frame_width <= 0 or frame_height <= 0:
+                    raise ValueError(f"Không lấy được kích thước frame hợp lệ từ camera {self.source}.")
+            print(f"CameraWorker: Camera {self.source} opened: {frame_width}x{frame_height}, FPS: {fps:.2f}")
+
+            self.zero_copy_capture = getattr(self.cap, "zero_copy", False)
+            self.frame_clock.reset()
+            pacing_fixed = self.config.capture_pacing == PACING_FIXED
+            metrics, thread_time = self.metrics, time.thread_time
+            last_ts = None
+            while self._running:
+                # Chỉ chờ trên camera (grab/retrieve), timestamp lấy ngay sau grab
+                cpu = thread_time() # CPU của luồng: thời gian chờ camera không bị tính
+                ret, frame, frame_ts = read_frame(self.cap, self.frame_clock)
+                metrics.add_cpu(STAGE_CAPTURE, thread_time() - cpu)
+                if not ret:
+                    if not self.cap.isOpened():
+                        raise ConnectionError(f"Mất kết nối camera {self.source}.")
+                    time.sleep(0.05)
+                    continue
+                if self.zero_copy_capture:
+                    # View shared memory có thể bị ghi đè bất kỳ lúc nào: sao chép + kiểm tra lại trước khi dùng
+                    frame = self.cap.stable_copy(frame)
+                    if frame is None:
+                        metrics.increment("frames_torn")
+                        continue
+                # Jitter: độ lệch khoảng cách hai frame so với chu kỳ trung bình đo được
+                measured_fps = self.frame_clock.fps # 0.0 khi chưa đủ mẫu; fps của camera giữ cho pacing cố định
+                if last_ts is not None and measured_fps > 0:
+                    metrics.observe(JITTER, abs(frame_ts - last_ts - 1.0 / measured_fps) * 1000.0)
+                last_ts = frame_ts
+
+                # Preview: chỉ frame đến lượt mới được co giãn thẳng vào bộ đệm của pool
+                if self.on_frame is not None and self.preview.due(frame_ts):
+                    cpu = thread_time()
+                    try:
+                        pooled = self.preview.render_into(frame, self.preview_pool, self.preview_swap_rb, frame_ts)
+                        if pooled is not None:
+                            self.on_frame(pooled)
+                    except Exception as display_e:
+                        print(f"CameraWorker: Display error: {display_e}")
+                    metrics.add_cpu(STAGE_PREVIEW, thread_time() - cpu)
+
+                # Chế độ đoạn: bật writer liên tục khi đã đo được FPS (frame trước đó nằm trong pre-roll)
+                if self.segments_mode and self.segment_writer is None and self.frame_clock.ready:
+                    self._start_segment_writer()
+
+                # Ghi: chỉ đưa frame vào hàng đợi, mã hóa do writer_thread đảm nhận
+                with self.lock:
+                    writer_thread = (self.writer_thread if self._recording else None) or self.segment_writer
+                cpu = thread_time()
+                if writer_thread:
+                    writer_thread.submit(frame, frame_ts)
+                    metrics.observe(WRITER_QUEUE, writer_thread.queue_depth, QUEUE_EDGES)
+                else:
+                    self.preroll.push(frame, frame_ts)
+                metrics.add_cpu(STAGE_BUFFER, thread_time() - cpu)
+
+                if pacing_fixed:
+                    time.sleep(max(0.01, 0.9 / fps)) # Chế độ cũ: sleep cố định mỗi frame
+
+        except (ConnectionError, ValueError) as e:
+            print(f"CameraWorker: {e}")
+            _notify(self.on_error, str(e))
+        except Exception as e:
+            print(f"CameraWorker: Unexpected error: {type(e).__name__}: {e}")
+            _notify(self.on_error, f"Lỗi camera: {e}")
+        finally:
+            print(f"CameraWorker: Finishing camera {self.source}...")
+            if self.cap:
+                self.cap.release()
+            with self.lock:
+                was_recording = self._recording
+                writer_thread = self.writer_thread
+                self.writer_thread = None
+                segment_writer = self.segment_writer
+                self.segment_writer = None
+            if writer_thread:
+                print("CameraWorker: Releasing VideoWriter...")
+                self.last_writer_stats = writer_thread.close(timeout=3.0)
+            if segment_writer:
+                print("CameraWorker: Closing segment writer...")
+                self.last_writer_stats = segment_writer.close(timeout=3.0)
+            if self.clip_tap and was_recording: # Chỉ trả lượt begin() của chính camera này (tap dùng chung)
+                self.clip_tap.end() # Clip dang dở: bỏ dữ liệu chỉ mục
+            self._recording = False
+            self._running = False
+            self.preroll.clear()
+            print(f"CameraWorker: Camera {self.source} finished.")
+            _notify(self.on_finished)
+
+    def request_stop(self):
+        """Chỉ đặt cờ dừng, không đợi (CameraGroup dừng nhiều camera song song)."""
+        self._running = False
+
+    def stop(self, timeout=3.0):
+        self.request_stop()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+            if self.is_alive():
+                print(f"CameraWorker: Warning: camera {self.source} did not stop within {timeout}s.")
+
+    def _start_segment_writer(self):
+        frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = resolve_recording_fps(self.frame_clock, self.cap.get(cv2.CAP_PROP_FPS))
+        encoder = resolve_encoder(self.config.encoder, (frame_width, frame_height), fps, self.config.encoder_preset)
+        directory = os.path.join(self.save_dir, SEGMENT_SUBDIR, self.file_tag or "cam")
+        writer = SegmentWriterThread(
+            directory, (frame_width, frame_height), fps, encoder, self.config.encoder_preset,
+            self.config.segment_seconds, self.config.segment_quota_bytes, tag=self.file_tag,
+            on_event_complete=self._on_segment_event_complete,
+            max_queue=self.config.writer_queue_size, overflow=self.config.writer_overflow_policy,
+            preroll=self.preroll.drain(), on_error=self._on_writer_error, name=f"SegmentWriter-{self.source}",
+            metrics=self.metrics)
+        writer.start()
+        with self.lock:
+            self.segment_writer = writer
+            self.video_codec = encoder
+        print(f"CameraWorker: Segment recording -> {directory} ({self.config.segment_seconds:.0f}s segments, "
+              f"{frame_width}x{frame_height} @ {fps:.2f}fps, {encoder})")
+
+    def _start_segment_event(self):
+        with self.lock:
+            if self._recording:
+                print("CameraWorker: Start recording called, but already recording.")
+                return False
+            if self.segment_writer is None:
+                print("CameraWorker: Cannot start event, segment writer not ready.")
+                return False
+            # Sự kiện phủ cả khoảng pre-roll trước lệnh Start, giống clip của chế độ sự kiện
+            self.event_start = time.monotonic() - self.config.preroll_seconds
+            self.segment_writer.mark_event_start(self.event_start)
+            if self.clip_tap:
+                self.clip_tap.begin()
+            self._recording = True
+        self.metrics.mark_trigger(HOP_START)
+        _notify(self.on_recording_started)
+        print("CameraWorker: Event started (segment mode).")
+        return True
+
+    def _on_segment_event_complete(self, event):
+        # Gọi từ luồng ghi đoạn khi đoạn cuối của sự kiện đã đóng và được link
+        if self.config.clip_index and event.segments:
+            self._save_clip_index(event.directory, event.frame_timestamps, event.can_items)
+        catalog = self.catalog
+        if catalog is not None:
+            try:
+                catalog.update_size(event.directory, sum(segment.size for segment in event.segments))
+            except sqlite3.Error as e:
+                print(f"CameraWorker: Catalog update error: {e}")
+
+    def start_recording(self):
+        if self.segments_mode:
+            return self._start_segment_event()
+        with self.lock:
+            if self._recording:
+                print("CameraWorker: Start recording called, but already recording.")
+                return False
+            if not self.cap or not self.cap.isOpened():
+                print("CameraWorker: Cannot start recording, camera not ready.")
+                return False
+            if not self.save_dir or not os.path.isdir(self.save_dir):
+                _notify(self.on_error, f"Lỗi: Thư mục lưu '{self.save_dir}' không hợp lệ.")
+                return False
+
+            frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            # FPS đo được để thời lượng clip khớp thời gian thực
+            fps = resolve_recording_fps(self.frame_clock, self.cap.get(cv2.CAP_PROP_FPS))
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+            tag = f"_{self.file_tag}" if self.file_tag else ""
+            temp_base = os.path.join(self.save_dir, f"rec_{timestamp}{tag}_temp")
+            encoder = resolve_encoder(self.config.encoder, (frame_width, frame_height), fps, self.config.encoder_preset)
+
+            video_writer = None
+            try:
+                # Đuôi file theo encoder thực sự mở được (có lùi về mp4v/XVID/MJPG)
+                video_writer, spec, self.temp_filename = open_writer(
+                    temp_base, fps, (frame_width, frame_height), encoder, self.config.encoder_preset)
+                self.video_ext = spec.ext
+                self.video_codec = spec.name
+                print(f"CameraWorker: Starting recording -> {self.temp_filename} "
+                      f"({frame_width}x{frame_height} @ {fps:.2f}fps, {spec.name}/{self.config.encoder_preset})")
+                # Luồng mã hóa ghi pre-roll trước rồi đến các frame trực tiếp
+                self.writer_thread = FrameWriterThread(
+                    video_writer, (frame_width, frame_height),
+                    max_queue=self.config.writer_queue_size, overflow=self.config.writer_overflow_policy,
+                    preroll=self.preroll.drain(), on_error=self._on_writer_error,
+                    name=f"FrameWriter-{self.source}", metrics=self.metrics)
+                self.writer_thread.start()
+                if self.clip_tap:
+                    self.clip_tap.begin()
+                self._recording = True
+            except Exception as e:
+                print(f"CameraWorker: VideoWriter error: {e}")
+                if video_writer:
+                    try:
+                        video_writer.release()
+                    except IOError as release_e:
+                        print(f"CameraWorker: Error releasing VideoWriter: {release_e}")
+                self.writer_thread = None
+                if self.temp_filename and os.path.exists(self.temp_filename):
+                    os.remove(self.temp_filename)
+                self.temp_filename = None
+                _notify(self.on_error, f"Lỗi VideoWriter: {e}")
+                return False
+        self.metrics.mark_trigger(HOP_START) # Chỉ camera đầu tiên của nhóm được tính
+        _notify(self.on_recording_started)
+        print("CameraWorker: Recording started.")
+        return True
+
+    def _on_writer_error(self, exc):
+        # Gọi từ luồng mã hóa khi ghi frame lỗi: dừng nhận frame và báo lỗi
+        with self.lock:
+            if threading.current_thread() is self.segment_writer:
+                self.segment_writer = None # Luồng camera mở writer đoạn mới ở frame kế tiếp
+            else:
+                self._recording = False
+        _notify(self.on_error, f"Lỗi ghi frame video: {exc}")
+
+    def _save_clip_index(self, video_path, frame_timestamps, can_items):
+        # Lỗi chỉ mục không được làm hỏng file video đã lưu
+        try:
+            print(f"CameraWorker: Clip index saved: {write_clip_index(video_path, frame_timestamps, can_items, self.wall_clock)}")
+        except Exception as e:
+            print(f"CameraWorker: Error writing clip index: {e}")
+
+    def _final_path(self, save_dir, error_string, base_name, ext):
+        """Tên file cuối cùng chưa tồn tại trong thư mục lưu; '' nếu không tạo được."""
+        save_dir = save_dir if os.path.isdir(save_dir) else self.config.save_dir
+        if base_name:
+            base_fn = f"{base_name}_{self.file_tag}{ext}" if self.file_tag else f"{base_name}{ext}"
+        else:
+            base_fn = f"{datetime.datetime.now().strftime('%Y-%m-%d')}_{sanitize_event_name(error_string)}{ext}"
+        name, ext = os.path.splitext(base_fn)
+        final_filepath = os.path.join(save_dir, base_fn)
+        counter = 1
+        while os.path.exists(final_filepath):
+            if counter > 100:
+                return ""
+            final_filepath = os.path.join(save_dir, f"{name}_{counter}{ext}")
+            counter += 1
+        return final_filepath
+
+    def detach_recording(self):
+        """Tách clip đang ghi khỏi camera ngay lập tức để có thể ghi clip mới; trả về PendingClip.
+
+        Không chạm tới VideoWriter hay hệ thống file: phần đó do finalize_clip() làm ở luồng nền.
+        """
+        now = time.monotonic()
+        with self.lock:
+            pending = PendingClip(self._recording, self.writer_thread, self.temp_filename, [],
+                                  self.event_start, now, self.segment_writer, self.save_dir, self.video_codec)
+            self._recording = False
+            self.writer_thread = None
+            self.temp_filename = None
+            self.event_start = None
+        clip_started = pending.recording or pending.writer_thread is not None
+        if not clip_started:
+            print("CameraWorker: Stop called but not recording.")
+        if self.clip_tap and clip_started:
+            pending = pending._replace(can_items=self.clip_tap.end())
+        _notify(self.on_recording_stopped, pending.temp_filename or "")
+        return pending
+
+    def finalize_clip(self, pending, error_string="UnknownEvent", base_name=None, trigger_ids=(None, None)):
+        """Phần chậm của việc dừng ghi, chạy ở ClipFinalizer. Trả về đường dẫn đã lưu ('' nếu không lưu).
+
+        base_name do CameraGroup cấp (chuỗi hoặc hàm trả về chuỗi) để các camera cùng sự kiện có tên thống nhất.
+        Chế độ đoạn: đường dẫn là thư mục sự kiện chứa hard link các đoạn và danh sách concat.
+        trigger_ids: (ID CAN bắt đầu, ID CAN dừng) ghi vào danh mục cùng clip.
+        """
+        if callable(base_name):
+            base_name = base_name()
+        if self.segments_mode:
+            final_path = self._pin_segment_event(pending, error_string, base_name)
+        else:
+            final_path = self._save_clip(pending, error_string, base_name)
+        if final_path and self.catalog is not None:
+            self._catalog_clip(pending, final_path, error_string, trigger_ids)
+        _notify(self.on_clip_saved, final_path)
+        return final_path
+
+    def stop_recording_and_save(self, error_string="UnknownEvent", base_name=None, trigger_ids=(None, None)):
+        """Dừng ghi và hoàn tất clip ngay trong luồng gọi (CameraGroup dùng detach + finalize ở luồng nền)."""
+        return self.finalize_clip(self.detach_recording(), error_string, base_name, trigger_ids)
+
+    def _catalog_clip(self, pending, final_path, error_string, trigger_ids):
+        if self.segments_mode:
+            # Đoạn đang ghi dở được link sau: kích thước cập nhật lại ở _on_segment_event_complete
+            kind, start, stop, size = KIND_SEGMENTS, pending.event_start, pending.event_end, directory_size(final_path)
+        else:
+            stamps = pending.writer_thread.frame_timestamps if pending.writer_thread else ()
+            kind, size = KIND_CLIP, None
+            start, stop = (stamps[0], stamps[-1]) if len(stamps) else (None, None)
+        try:
+            self.catalog.record(final_path, error_string, self.file_tag or str(self.source), kind, start, stop,
+                                size, pending.codec, trigger_ids[0], trigger_ids[1])
+        except (sqlite3.Error, OSError) as e:
+            print(f"CameraWorker: Catalog error: {e}") # Clip đã lưu, chỉ thiếu dòng danh mục
+
+    def _pin_segment_event(self, pending, error_string, base_name):
+        """Ghim và link các đoạn của sự kiện vào thư mục sự kiện; không đợi writer (O(1))."""
+        if not pending.recording or pending.segment_writer is None:
+            return ""
+        try:
+            event_dir = self._final_path(pending.save_dir, error_string, base_name, "")
+            if not event_dir:
+                raise FileExistsError("Không tạo được tên thư mục sự kiện duy nhất.")
+            pending.segment_writer.pin_event(pending.event_start, pending.event_end, event_dir, pending.can_items)
+            print(f"CameraWorker: Event pinned -> {event_dir}")
+            return event_dir
+        except Exception as e:
+            print(f"CameraWorker: Error pinning event: {e}")
+            return ""
+
+    def _save_clip(self, pending, error_string, base_name):
+        writer_thread, temp_filename = pending.writer_thread, pending.temp_filename
+        if pending.recording:
+            print(f"CameraWorker: Finalizing recording. Event: '{error_string}'")
+        final_filepath = ""
+        try:
+            if writer_thread:
+                # Ghi nốt hàng đợi và giải phóng VideoWriter (ghi index MP4)
+                self.last_writer_stats = writer_thread.close()
+                print(f"CameraWorker: VideoWriter released. Stats: {self.last_writer_stats}")
+                if writer_thread.release_error is not None:
+                    _notify(self.on_error, f"Lỗi hoàn tất video (clip có thể hỏng): {writer_thread.release_error}")
+            if not (pending.recording and temp_filename and os.path.exists(temp_filename)):
+                if temp_filename and os.path.exists(temp_filename):
+                    os.remove(temp_filename) # Dọn file dang dở (vd: sau lỗi ghi frame)
+                return ""
+            if os.path.getsize(temp_filename) <= MIN_CLIP_BYTES:
+                print(f"CameraWorker: Temp file '{temp_filename}' too small or empty. Deleting.")
+                os.remove(temp_filename)
+                return ""
+            final_filepath = self._final_path(pending.save_dir, error_string, base_name,
+                                              os.path.splitext(temp_filename)[1])
+            if not final_filepath:
+                print(f"CameraWorker: Could not generate unique filename. Deleting temp: {temp_filename}")
+                os.remove(temp_filename)
+                return ""
+            os.rename(temp_filename, final_filepath)
+            print(f"CameraWorker: Saved: {final_filepath}")
+            if self.config.clip_index:
+                self._save_clip_index(final_filepath, writer_thread.frame_timestamps, pending.can_items)
+        except Exception as e:
+            print(f"CameraWorker: Error saving/renaming: {e}")
+            final_filepath = ""
+            if temp_filename and os.path.exists(temp_filename):
+                try:
+                    os.remove(temp_filename)
+                except OSError:
+                    pass
+        return final_filepath
+
+
+# ---- CAN ----
+def _trigger_source(msg):
+    return f"ID: {msg.arbitration_id:#X}" if msg is not None else "rule"
+
+
+class _TriggerListener(can.Listener):
+    """Xử lý frame nhận được: đẩy tham chiếu frame cho recorder/chỉ mục/log/giải mã rồi tra bảng trigger.
+
+    on_message_received() cho can.Notifier (mỗi frame một lần gọi), on_batch() cho vòng recv theo lô.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.lookup = worker.dispatch_table.lookup
+        self.feed = worker.trigger_state.feed
+        self.reassembler = worker.reassembler
+        self.decoder = worker.signal_decoder
+        self.rules = worker.rule_engine
+        self.handlers = worker.trigger_handlers
+        self.recorder = worker.recorder
+        self.clip_tap = worker.clip_tap
+        self.log_ring = worker.log_ring
+        self.received = 0
+
+    def on_message_received(self, msg):
+        self.received += 1
+        if self.recorder is not None:
+            self.recorder.push(msg) # Luồng ghi riêng đóng gói và ghi theo khối
+        if self.clip_tap is not None:
+            self.clip_tap.push(msg)
+        if self.worker.log_enabled:
+            self.log_ring.push(msg) # Định dạng để sau, chỉ cho dòng được hiển thị
+        if self.decoder is not None:
+            self.decoder.push(msg) # Chỉ chép byte; giải mã theo lô ở luồng CanWorker
+        if self.rules is not None:
+            for rule in self.rules.on_frame(msg): # Chỉ luật của ID này được đánh giá
+                self.worker.fire_rule(rule, msg)
+        action = self.lookup(msg.arbitration_id, msg.is_extended_id)
+        if action is not None:
+            self._dispatch(action, msg)
+
+    def on_batch(self, batch):
+        """Một lượt cho cả lô: recorder/log nhận cả lô một lần, phần còn lại duyệt frame với tham chiếu cục bộ."""
+        self.received += len(batch)
+        if self.recorder is not None:
+            self.recorder.push_batch(batch)
+        if self.worker.log_enabled:
+            self.log_ring.push_batch(batch)
+        clip_push = self.clip_tap.push if self.clip_tap is not None else None
+        decoder_push = self.decoder.push if self.decoder is not None else None
+        rules, lookup, dispatch = self.rules, self.lookup, self._dispatch
+        for msg in batch:
+            if clip_push is not None:
+                clip_push(msg)
+            if decoder_push is not None:
+                decoder_push(msg)
+            if rules is not None:
+                for rule in rules.on_frame(msg):
+                    self.worker.fire_rule(rule, msg)
+            action = lookup(msg.arbitration_id, msg.is_extended_id)
+            if action is not None:
+                dispatch(action, msg)
+
+    def _dispatch(self, action, msg):
+        payload = None
+        if action == ACTION_STOP and self.reassembler is not None:
+            payload = self.reassembler.feed(msg)
+            if payload is None:
+                return # Bản tin ISO-TP chưa đủ frame
+        if self.feed(action, msg, payload): # Frame lặp/thừa dừng ở đây, không sang GUI
+            try:
+                self.handlers[action](msg, payload)
+            except Exception as handler_err:
+                print(f"CanWorker: Error handling msg: {handler_err}")
+
+    def on_error(self, exc):
+        print(f"CanWorker: Listener error: {exc}")
+        if self.worker._running:
+            _notify(self.worker.on_error, f"Lỗi Bus/Listener: {exc}")
+
+
+class CanWorker(threading.Thread):
+    """Kết nối bus CAN, ghi log/recorder, phát trigger ghi/dừng.
+
+    Callback: on_start_trigger(), on_stop_trigger(event_string), on_error(message),
+    on_connection(connected), on_finished().
+    """
+
+    def __init__(self, interface, channel, start_id_hex, stop_id_hex, emergency_id_hex=None,
+                 bitrate=DEFAULT_BITRATE, config=None):
+        super().__init__(name="CanWorker", daemon=True)
+        self.config = config or EngineConfig()
+        self.interface = interface
+        self.channel = channel
+        self.bitrate = bitrate
+        self._running = False
+        self.bus = None
+        self.notifier = None
+        self.log_ring = CanFrameRing() # Listener chỉ đẩy frame thô, GUI rút theo lô
+        self.log_enabled = True
+        self.record_dir = None # Thư mục ghi CAN liên tục (None = tắt)
+        self.recorder = None
+        self.clip_tap = None # ClipCanTap cho chỉ mục clip
+        self.listener = None
+        self.last_start_id = None # arbitration ID của frame trigger gần nhất (ghi vào danh mục clip)
+        self.last_stop_id = None
+        self.metrics = shared_metrics()
+        self.on_start_trigger = None
+        self.on_stop_trigger = None
+        self.on_error = None
+        self.on_connection = None
+        self.on_finished = None
+
+        # ID dạng hex, hỗ trợ 'ID/MASK' và ID mở rộng 29-bit
+        missing_ids = [label for label, value in (("Bắt Đầu Ghi", start_id_hex), ("Dừng & Lưu", stop_id_hex))
+                       if not value]
+        if missing_ids:
+            raise ValueError(f"CAN ID bắt buộc bị thiếu: {', '.join(missing_ids)}")
+        if not isinstance(bitrate, int) or bitrate <= 0:
+            raise ValueError("Bitrate không hợp lệ.")
+        try:
+            self.start_id = parse_trigger_id(start_id_hex)
+            self.stop_id = parse_trigger_id(stop_id_hex)
+            self.emergency_id = parse_trigger_id(emergency_id_hex) if emergency_id_hex else None
+        except ValueError as e:
+            raise ValueError(f"Định dạng CAN ID không hợp lệ: {e}")
+        print(f"CanWorker: CAN IDs - Start: {format_trigger_id(self.start_id)}, Stop: {format_trigger_id(self.stop_id)}, "
+              f"Emergency: {format_trigger_id(self.emergency_id) if self.emergency_id else 'None'}")
+
+        # Bảng điều phối: arbitration ID -> hàm xử lý, tra cứu O(1) cho mỗi frame
+        self.dispatch_table = TriggerDispatchTable()
+        self.dispatch_table.add(self.start_id, ACTION_START)
+        self.dispatch_table.add(self.stop_id, ACTION_STOP)
+        if self.emergency_id is not None:
+            self.dispatch_table.add(self.emergency_id, ACTION_EMERGENCY)
+        self.trigger_handlers = {
+            ACTION_START: self.handle_start_frame,
+            ACTION_STOP: self.handle_stop_frame,
+            ACTION_EMERGENCY: self.handle_emergency_frame,
+        }
+        # Chuỗi sự kiện dài hơn một frame: ghép ISO-TP, tùy chọn gửi Flow Control khi không có ECU nào trả lời
+        self.reassembler = IsoTpReassembler() if self.config.isotp else None
+        self.flow_control_id = None
+        if self.reassembler is not None and self.config.isotp_fc_id:
+            try:
+                self.flow_control_id = parse_trigger_id(self.config.isotp_fc_id)
+            except ValueError as e:
+                raise ValueError(f"Định dạng CAN ID Flow Control không hợp lệ: {e}")
+            self.reassembler.on_first_frame = self._send_flow_control
+        # Giải mã tín hiệu theo DBC (giá trị mới nhất ở signal_decoder.latest / snapshot())
+        self.signal_decoder = None
+        self.on_signals = None # Callback(list (CompiledMessage, timestamps, giá trị)) sau mỗi lô, từ luồng CanWorker
+        if self.config.dbc_file:
+            try:
+                self.signal_decoder = SignalDecoder.from_dbc(self.config.dbc_file, self.config.dbc_signals or None,
+                                                             FD_WIDTH if self.config.can_fd else CLASSIC_WIDTH)
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Lỗi file DBC: {e}")
+        # Luật trigger trên ID/payload/tín hiệu, bổ sung cho các ID Start/Stop/Emergency ở trên
+        self.rule_engine = None
+        if self.config.trigger_rules_file:
+            try:
+                self.rule_engine = TriggerRuleEngine(load_rules(self.config.trigger_rules_file), self.signal_decoder)
+            except (OSError, ValueError, KeyError) as e:
+                raise ValueError(f"Lỗi luật trigger: {e}")
+            print(f"CanWorker: Loaded {len(self.rule_engine)} trigger rule(s) from {self.config.trigger_rules_file}")
+        # Chống dội / gộp trigger lặp, độ dài clip tối thiểu, hold-off sau khi dừng
+        self.trigger_state = TriggerStateMachine(self.config.trigger_debounce_seconds, self.config.min_clip_seconds,
+                                                 self.config.trigger_holdoff_seconds)
+
+    def is_running(self):
+        return self.is_alive()
+
+    @property
+    def frames_received(self):
+        return self.listener.received if self.listener is not None else 0
+
+    def set_log_enabled(self, enabled):
+        self.log_enabled = enabled
+        self.update_bus_filters()
+
+    def reset_triggers(self):
+        """Gọi khi phía ghi không còn clip mở (vd: camera tắt) để lệnh Start kế tiếp không bị coi là lặp."""
+        self.trigger_state.reset()
+
+    def _fire_due_trigger(self):
+        due = self.trigger_state.pop_due()
+        if due is not None:
+            action, msg, payload = due
+            try:
+                self.trigger_handlers[action](msg, payload)
+            except Exception as handler_err:
+                print(f"CanWorker: Error handling deferred trigger: {handler_err}")
+
+    def update_bus_filters(self):
+        """Không cần toàn bộ traffic (log, ghi file, chỉ mục clip) -> chỉ frame trigger qua bộ lọc driver/kernel.
+
+        Ghi log CAN liên tục (can_record) và chỉ mục clip (clip_index) cần mọi frame nên khi bật một trong hai,
+        bộ lọc driver không được dùng và mọi frame vẫn đi tới Python; chỉ tắt hiển thị log là chưa đủ.
+        """
+        if not self.bus:
+            return
+        full_traffic = [name for name, enabled in (("can_record", self.recorder is not None),
+                                                   ("clip_index", self.clip_tap is not None)) if enabled]
+        want_all = self.log_enabled or bool(full_traffic)
+        if self.rule_engine is not None and self.rule_engine.frame_ids() is None:
+            want_all = True # Có luật phải xem mọi frame
+        filters = None if want_all else self.dispatch_table.can_filters()
+        if filters is not None and self.rule_engine is not None:
+            filters += [{"can_id": can_id, "can_mask": EXT_ID_MASK if extended else STD_ID_MASK, "extended": extended}
+                        for can_id, extended in self.rule_engine.frame_ids()]
+        if filters is not None and self.signal_decoder is not None: # Thêm các message cần giải mã
+            filters += [{"can_id": can_id, "can_mask": EXT_ID_MASK if extended else STD_ID_MASK, "extended": extended}
+                        for can_id, extended in self.signal_decoder.messages]
+        try:
+            self.bus.set_filters(filters)
+            print(f"CanWorker: Bus filters -> {filters if filters else 'none (full logging)'}")
+            if full_traffic:
+                print(f"CanWorker: Driver filters off because {', '.join(full_traffic)} needs every frame "
+                      f"(disable to filter trigger IDs in the driver).")
+        except Exception as e:
+            print(f"CanWorker: Could not set bus filters: {e}")
+
+    def _decode_signals(self):
+        results = self.signal_decoder.decode_pending()
+        if results:
+            if self.rule_engine is not None:
+                for rule in self.rule_engine.on_signals([compiled.key for compiled, _, _ in results]):
+                    self.fire_rule(rule)
+            _notify(self.on_signals, results)
+        if self.rule_engine is not None:
+            for rule in self.rule_engine.tick():
+                self.fire_rule(rule)
+
+    def fire_rule(self, rule, msg=None):
+        """Luật đã kích hoạt đi qua cùng máy trạng thái trigger như frame Start/Stop thường."""
+        payload = rule.event.encode("utf-8") if rule.action == ACTION_STOP else None
+        if self.trigger_state.feed(rule.action, msg, payload):
+            print(f"CanWorker: Rule fired: {rule.text}")
+            try:
+                self.trigger_handlers[rule.action](msg, payload)
+            except Exception as handler_err:
+                print(f"CanWorker: Error handling rule: {handler_err}")
+
+    def _send_flow_control(self, first_frame):
+        # Gọi trong listener khi nhận First Frame: cho phép bên gửi phát tiếp các Consecutive Frame
+        fc = self.flow_control_id
+        data = ISOTP_FLOW_CONTINUE + bytes(8 - len(ISOTP_FLOW_CONTINUE)) # Đệm đủ 8 byte
+        try:
+            self.bus.send(can.Message(arbitration_id=fc.can_id, is_extended_id=fc.extended, data=data,
+                                      is_fd=first_frame.is_fd), timeout=0.05)
+        except (can.CanError, AttributeError) as e:
+            print(f"CanWorker: Could not send ISO-TP flow control: {e}")
+
+    def handle_start_frame(self, msg, payload=None):
+        # msg là None khi trigger đến từ luật trên tín hiệu DBC
+        print(f"CanWorker: Rx Start Rec. ({_trigger_source(msg)})")
+        self.last_start_id = msg.arbitration_id if msg is not None else None
+        self.metrics.begin_trigger(msg) # Mốc gốc cho độ trễ các chặng phía sau
+        _notify(self.on_start_trigger)
+
+    def handle_stop_frame(self, msg, payload=None):
+        print(f"CanWorker: Rx Stop Rec. ({_trigger_source(msg)})")
+        self.last_stop_id = msg.arbitration_id if msg is not None else None
+        payload_str = "PayloadError"
+        try:
+            # Payload là chuỗi UTF-8 (một frame CAN/CAN FD hoặc bản tin ISO-TP đã ghép), cắt tại ký tự null đầu tiên
+            payload_bytes = bytes(msg.data if payload is None else payload).split(b'\x00', 1)[0]
+            payload_str = payload_bytes.decode('utf-8', errors='replace').strip() or "EventDataEmpty"
+        except Exception as decode_err:
+            print(f"CanWorker: Payload decode error: {decode_err}")
+        print(f"CanWorker: Extracted event: '{payload_str}'")
+        _notify(self.on_stop_trigger, payload_str)
+
+    def handle_emergency_frame(self, msg, payload=None):
+        print(f"CanWorker: Rx Emergency Stop ({_trigger_source(msg)})")
+        self.last_stop_id = msg.arbitration_id if msg is not None else None
+        _notify(self.on_stop_trigger, "EmergencyStop")
+
+    def _open_bus(self):
+        kwargs = {'interface': self.interface, 'channel': self.channel, 'receive_own_messages': False}
+        if self.interface.lower() in BITRATE_INTERFACES:
+            kwargs['bitrate'] = self.bitrate
+        elif self.interface.lower() == 'socketcan':
+            print(f"CanWorker: Note for socketcan - Bitrate ({self.bitrate}) should be set externally (ip link).")
+        if self.config.can_fd:
+            kwargs['fd'] = True # Nhận frame CAN FD đến 64 byte
+        print(f"CanWorker: Initializing can.interface.Bus with: {kwargs}")
+        return can.interface.Bus(**kwargs)
+
+    def run(self):
+        self._running = True
+        try:
+            self.bus = self._open_bus()
+            print(f"CanWorker: CAN bus connected! Type: {self.bus.__class__.__name__}")
+            if self.record_dir:
+                self.recorder = CanRecorder(self.record_dir, fmt=self.config.can_record_format,
+                                            rotate_bytes=self.config.can_record_rotate_bytes,
+                                            rotate_seconds=self.config.can_record_rotate_seconds,
+                                            quota_bytes=self.config.can_record_quota_bytes)
+                self.recorder.on_error = lambda e: _notify(self.on_error, f"Lỗi ghi log CAN: {e}")
+                self.recorder.start()
+            self.update_bus_filters()
+            _notify(self.on_connection, True)
+
+            self.listener = _TriggerListener(self)
+            self._receive_loop()
+
+        except can.CanError as e:
+            print(f"CanWorker: CAN error: {e}")
+            _notify(self.on_error, f"Lỗi kết nối/giao tiếp CAN: {e}")
+        except ValueError as e:
+            print(f"CanWorker: Configuration error: {e}")
+            _notify(self.on_error, f"Lỗi cấu hình CAN: {e}")
+        except Exception as e:
+            print(f"CanWorker: Unexpected error: {type(e).__name__}: {e}")
+            _notify(self.on_error, f"Lỗi CAN không xác định: {e}")
+        finally:
+            self._running = False
+            if self.notifier:
+                try:
+                    self.notifier.stop(timeout=1.0)
+                except Exception as e:
+                    print(f"CanWorker: Error stopping notifier: {e}")
+            if self.recorder:
+                self.recorder.stop() # Ghi nốt hàng đợi và đóng file
+                self.recorder = None
+            if self.bus:
+                try:
+                    self.bus.shutdown()
+                except Exception as e:
+                    print(f"CanWorker: Error shutting down bus: {e}")
+            _notify(self.on_connection, False)
+            print(f"CanWorker: Trigger stats: {self.trigger_state.stats()}")
+            if self.reassembler is not None:
+                print(f"CanWorker: ISO-TP stats: {self.reassembler.stats()}")
+            if self.signal_decoder is not None:
+                print(f"CanWorker: Signal decoder stats: {self.signal_decoder.stats()}")
+            if self.rule_engine is not None:
+                print(f"CanWorker: Rule stats: {self.rule_engine.stats()}")
+            print("CanWorker: Finished.")
+            _notify(self.on_finished)
+
+    def _receive_loop(self):
+        if self.config.can_receive_mode == RECEIVE_NOTIFIER:
+            self._run_notifier()
+        else:
+            self._run_batched()
+
+    def _run_batched(self):
+        """Một luồng: chờ frame đầu bằng recv(timeout), rút tiếp không chờ đến DEFAULT_RECV_BATCH frame, xử lý cả lô.
+
+        Không có luồng Notifier và vòng sleep riêng; cờ dừng được kiểm tra sau mỗi recv (tối đa DEFAULT_RECV_TIMEOUT).
+        """
+        print("CanWorker: Batched receive loop started.")
+        recv = self.bus.recv
+        listener = self.listener
+        metrics, thread_time = self.metrics, time.thread_time
+        next_decode = 0.0
+        while self._running:
+            wait = self.trigger_state.time_to_due()
+            msg = recv(DEFAULT_RECV_TIMEOUT if wait is None else min(DEFAULT_RECV_TIMEOUT, wait))
+            if msg is not None:
+                batch = [msg]
+                while len(batch) < DEFAULT_RECV_BATCH:
+                    msg = recv(0)
+                    if msg is None:
+                        break
+                    batch.append(msg)
+                cpu = thread_time()
+                try:
+                    listener.on_batch(batch)
+                except Exception as e:
+                    listener.on_error(e)
+                metrics.add_cpu(STAGE_CAN, thread_time() - cpu)
+                metrics.set_gauge("can_frames_received", listener.received)
+            if self.signal_decoder is not None:
+                now = time.monotonic()
+                if now >= next_decode:
+                    cpu = thread_time()
+                    self._decode_signals()
+                    metrics.add_cpu(STAGE_DECODE, thread_time() - cpu)
+                    next_decode = now + DEFAULT_DECODE_INTERVAL
+            self._fire_due_trigger()
+
+    def _run_notifier(self):
+        self.notifier = can.Notifier(self.bus, [self.listener], timeout=1.0)
+        print("CanWorker: CAN Notifier started.")
+        while self._running:
+            # Notifier chạy ở luồng riêng; luồng này phát lệnh dừng đã hoãn và giải mã lô tín hiệu DBC
+            period = DEFAULT_DECODE_INTERVAL if self.signal_decoder is not None else 0.2
+            wait = self.trigger_state.time_to_due()
+            time.sleep(period if wait is None else min(period, wait))
+            if self.signal_decoder is not None:
+                cpu = time.thread_time()
+                self._decode_signals()
+                self.metrics.add_cpu(STAGE_DECODE, time.thread_time() - cpu)
+            # CPU của luồng Notifier không được tách riêng, chỉ đếm frame
+            self.metrics.set_gauge("can_frames_received", self.listener.received)
+            self._fire_due_trigger()
+
+    def request_stop(self):
+        self._running = False
+
+    def stop(self, timeout=None):
+        """Đặt cờ dừng; timeout khác None thì đợi luồng kết thúc."""
+        self.request_stop()
+        if timeout is not None and self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+
+# ---- Ghép camera + CAN (không GUI) ----
+class CaptureEngine:
+    """Ghép nhóm camera với trigger CAN không qua GUI.
+
+    Callback CAN chỉ đưa lệnh vào hàng đợi; một luồng điều khiển thực hiện ghi/dừng tuần tự
+    để luồng Notifier không bị chặn khi các writer ghi nốt hàng đợi.
+    """
+
+    CAMERA_WORKER = CameraWorker # Lớp con thay nguồn frame/bus (vd: replay.py phát lại log)
+    CAN_WORKER = CanWorker
+
+    def __init__(self, config):
+        self.config = config.validate()
+        self.clip_tap = ClipCanTap() if config.clip_index else None
+        self.cameras = CameraGroup(config.save_dir, use_catalog=config.catalog)
+        self.cameras.on_event_stopped = self._on_event_saved
+        for source in config.camera_sources:
+            camera = self.cameras.add(self.CAMERA_WORKER(source, config.save_dir, config))
+            camera.clip_tap = self.clip_tap
+            camera.set_preview_enabled(False) # Không có màn hình
+            camera.on_error = self._on_camera_error
+        self.can = None
+        if config.can_enabled:
+            self.can = self.CAN_WORKER(config.can_interface, config.can_channel, config.start_id, config.stop_id,
+                                       config.emergency_id or None, config.can_bitrate, config)
+            self.can.log_enabled = False
+            self.can.record_dir = config.record_dir if config.can_record else None
+            self.can.clip_tap = self.clip_tap
+            self.can.on_start_trigger = self._on_can_start
+            self.can.on_stop_trigger = self._on_can_stop
+            self.can.on_error = self._on_can_error
+        self.metrics = shared_metrics()
+        self.exporter = None
+        if config.metrics_export or config.metrics_port:
+            self.exporter = MetricsExporter(self.metrics, config.save_dir if config.metrics_export else None,
+                                            config.metrics_interval, config.metrics_port)
+        self.recording = False
+        self._commands = queue.Queue()
+        self._control = threading.Thread(target=self._control_loop, name="EngineControl", daemon=True)
+        self._stopped = threading.Event()
+
+    def start(self):
+        os.makedirs(self.config.save_dir, exist_ok=True)
+        self._control.start()
+        if self.exporter:
+            self.exporter.start()
+        self.cameras.start()
+        if self.can:
+            self.can.start()
+        print(f"CaptureEngine: Started with {len(self.cameras)} camera(s), CAN: "
+              f"{'%s/%s' % (self.config.can_interface, self.config.can_channel) if self.can else 'off'}")
+
+    def request_start_recording(self, trigger_id=None):
+        self._commands.put((ACTION_START, trigger_id))
+
+    def request_stop_recording(self, event_string="UnknownEvent", trigger_id=None):
+        self._commands.put((ACTION_STOP, (event_string, trigger_id)))
+
+    def _on_can_start(self):
+        # Gọi trong listener ngay sau khi CanWorker ghi nhận ID: đọc ở đây để lệnh mang đúng ID của frame
+        self.request_start_recording(self.can.last_start_id)
+
+    def _on_can_stop(self, event_string):
+        self.request_stop_recording(event_string, self.can.last_stop_id)
+
+    def _control_loop(self):
+        while True:
+            action, argument = self._commands.get()
+            if action is None:
+                break
+            try:
+                if action == ACTION_START:
+                    self._start_recording(argument)
+                elif action == ACTION_STOP:
+                    self._stop_recording(*argument)
+            except Exception as e:
+                print(f"CaptureEngine: Error handling '{action}': {e}")
+
+    def _start_recording(self, trigger_id=None):
+        self.metrics.mark_trigger(HOP_DISPATCH) # Lệnh đã tới luồng điều khiển (tương ứng signal Qt của GUI)
+        if self.recording:
+            print("CaptureEngine: Start trigger ignored, already recording.")
+            return
+        if not self.cameras.is_running():
+            print("CaptureEngine: Start trigger ignored, no camera running.")
+            if self.can:
+                self.can.reset_triggers()
+            return
+        self.cameras.start_recording(trigger_id)
+        self.recording = True
+
+    def _stop_recording(self, event_string, trigger_id=None):
+        if not self.recording:
+            print("CaptureEngine: Stop trigger ignored, not recording.")
+            return
+        self.recording = False
+        self.cameras.stop_recording_and_save(event_string, trigger_id) # Hoàn tất ở ClipFinalizer -> _on_event_saved
+
+    def _on_event_saved(self, paths):
+        print(f"CaptureEngine: Saved {sum(1 for p in paths if p)}/{len(paths)} clip(s): {[p for p in paths if p]}")
+        print(self.cameras.format_stats())
+
+    def _on_camera_error(self, message):
+        print(f"CaptureEngine: Camera error: {message}")
+
+    def _on_can_error(self, message):
+        print(f"CaptureEngine: CAN error: {message}")
+
+    def stop(self):
+        """Lưu clip đang ghi (nếu có), rồi dừng CAN và camera."""
+        if self._stopped.is_set():
+            return
+        if self.recording:
+            self.request_stop_recording("Shutdown")
+        self._commands.put((None, None))
+        if self._control.is_alive():
+            self._control.join()
+        if not self.cameras.finalizer.drain():
+            print("CaptureEngine: Warning: some clips were still finalizing at shutdown.")
+        if self.can:
+            self.can.stop(timeout=3.0)
+        self.cameras.stop()
+        if self.exporter:
+            self.exporter.stop() # Ghi lần cuối
+        self._stopped.set()
+        print("CaptureEngine: Stopped.")
+
+    def wait(self, timeout=None):
+        return self._stopped.wait(timeout)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Nguồn frame không cần camera thật: ảnh tổng hợp hoặc file video phát theo nhịp (không phụ thuộc Qt).
+
+Cùng giao diện với cv2.VideoCapture (isOpened/grab/retrieve/read/get/release) nên CameraWorker, ProcessCapture
+và benchmark dùng như một camera. Nguồn được chọn bằng chuỗi source:
+
+    synthetic:1280x720@30     frame tổng hợp 1280x720, 30 fps
+    file:clip.mp4             phát file theo FPS gốc, lặp lại khi hết
+    file:clip.mp4@4x          nhanh gấp 4 lần
+    file:clip.mp4@max         nhanh nhất có thể (không sleep)
+"""
+import re
+import time
+
+import cv2
+import numpy as np
+
+SYNTHETIC_SCHEME = "synthetic:"
+FILE_SCHEME = "file:"
+DEFAULT_SYNTHETIC_SIZE = (1280, 720)
+DEFAULT_SYNTHETIC_FPS = 30.0
+DEFAULT_FILE_FPS = 25.0 # Khi file không báo FPS
+SPEED_MAX = 0.0 # Không điều tốc
+
+_SYNTHETIC_RE = re.compile(r"^(?:(\d+)x(\d+))?(?:@([\d.]+))?$")
+_SPEED_RE = re.compile(r"^(.*)@(max|[\d.]+x)$")
+
+
+def is_virtual_source(source):
+    return isinstance(source, str) and source.startswith((SYNTHETIC_SCHEME, FILE_SCHEME))
+
+
+def parse_synthetic(spec):
+    """'1280x720@30' -> ((1280, 720), 30.0); phần nào thiếu dùng mặc định."""
+    match = _SYNTHETIC_RE.match(spec.strip())
+    if not match:
+        raise ValueError(f"Nguồn tổng hợp không hợp lệ: '{spec}' (vd: synthetic:1280x720@30)")
+    width, height, fps = match.groups()
+    size = (int(width), int(height)) if width else DEFAULT_SYNTHETIC_SIZE
+    fps = float(fps) if fps else DEFAULT_SYNTHETIC_FPS
+    if size[0] <= 0 or size[1] <= 0 or fps <= 0:
+        raise ValueError(f"Kích thước/FPS nguồn tổng hợp không hợp lệ: '{spec}'")
+    return size, fps
+
+
+def parse_file_source(spec):
+    """'clip.mp4@4x' -> ('clip.mp4', 4.0); '@max' -> SPEED_MAX; không có hậu tố -> 1.0."""
+    match = _SPEED_RE.match(spec)
+    if not match:
+        return spec, 1.0
+    path, speed = match.groups()
+    return path, SPEED_MAX if speed == "max" else float(speed[:-1])
+
+
+class _PacedCapture:
+    """Phần chung: phát frame theo nhịp thời gian thực (sleep tới mốc frame kế tiếp), đếm frame bị trễ nhịp."""
+
+    def __init__(self, fps, speed=1.0):
+        self.fps = float(fps)
+        self.speed = float(speed)
+        self.interval = 1.0 / (self.fps * self.speed) if self.speed > 0 else 0.0
+        self.frames = 0
+        self.late_frames = 0 # Người đọc chậm hơn nhịp nguồn (camera thật sẽ bỏ các frame này)
+        self.opened = True
+        self._next_due = None
+
+    def _pace(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next_due is None:
+            self._next_due = now
+        delay = self._next_due - now
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -self.interval: # Trễ hơn một chu kỳ: tính các frame đã lỡ, đặt lại mốc
+            self.late_frames += int(-delay / self.interval)
+            self._next_due = now
+        self._next_due += self.interval
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        self.opened = False
+
+
+class SyntheticCapture(_PacedCapture):
+    """Frame BGR tổng hợp: nền gradient + dải sáng chạy ngang + số thứ tự, để encoder có chuyển động thật."""
+
+    def __init__(self, size=DEFAULT_SYNTHETIC_SIZE, fps=DEFAULT_SYNTHETIC_FPS, speed=1.0):
+        super().__init__(fps, speed)
+        self.width, self.height = size
+        x = np.linspace(0, 255, self.width, dtype=np.float32)
+        y = np.linspace(0, 255, self.height, dtype=np.float32)
+        self._base = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._base[..., 0] = x[None, :]
+        self._base[..., 1] = y[:, None]
+        self._base[..., 2] = ((x[None, :] + y[:, None]) / 2).astype(np.uint8)
+        self._bar = max(4, self.width // 40)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frames)
+        return 0.0
+
+    def grab(self):
+        if not self.opened:
+            return False
+        self._pace()
+        self.frames += 1
+        return True
+
+    def retrieve(self, image=None):
+        if not self.opened or not self.frames:
+            return False, None
+        # Mảng mới mỗi frame như cv2.VideoCapture: frame có thể nằm trong hàng đợi ghi
+        frame = self._base.copy() if image is None or image.shape != self._base.shape else image
+        if frame is image:
+            np.copyto(frame, self._base)
+        x = (self.frames * self._bar // 2) % self.width
+        frame[:, x:x + self._bar] = 255
+        cv2.putText(frame, str(self.frames), (16, max(32, self.height // 10)), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(1.0, self.height / 360), (255, 255, 255), 2)
+        return True, frame
+
+
+class FileCapture(_PacedCapture):
+    """Phát file video theo FPS gốc nhân speed (SPEED_MAX = không điều tốc); loop: quay lại đầu khi hết file."""
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0
+        super().__init__(fps if 0 < fps <= 240 else DEFAULT_FILE_FPS, speed)
+        self.loop = loop
+        self.opened = self.cap.isOpened()
+        self.loops = 0
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return self.cap.get(prop)
+
+    def grab(self):
+        if not self.opened:
+            return False
+        self._pace()
+        if not self.cap.grab():
+            if not self.loop or not self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0) or not self.cap.grab():
+                self.opened = False # Hết file: CameraWorker coi như mất camera và dừng
+                return False
+            self.loops += 1
+        self.frames += 1
+        return True
+
+    def retrieve(self, image=None):
+        return self.cap.retrieve(image)
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+def open_virtual_source(source):
+    """Mở nguồn 'synthetic:...' hoặc 'file:...'."""
+    if source.startswith(SYNTHETIC_SCHEME):
+        return SyntheticCapture(*parse_synthetic(source[len(SYNTHETIC_SCHEME):]))
+    path, speed = parse_file_source(source[len(FILE_SCHEME):])
+    return FileCapture(path, speed)
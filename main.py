@@ -1,333 +1,125 @@
 import sys
 import os
-import datetime
-import re
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QComboBox, QLabel, QLineEdit, QFileDialog,
-                             QTextEdit, QStatusBar, QMessageBox, QCheckBox)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer, QMutex, QMutexLocker
-from PyQt5.QtGui import QImage, QPixmap
-import cv2
-import can
-import numpy as np
-import time
+                             QPlainTextEdit, QStatusBar, QMessageBox, QCheckBox, QSizePolicy)
+from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer, QEvent
+from PyQt5.QtGui import QFontDatabase
+
+from video_pipeline import OVERFLOW_DROP_OLDEST, PACING_CAMERA
+from video_widget import VideoWidget, NEEDS_RB_SWAP
+from can_pipeline import format_can_row
+from can_recorder import FORMAT_BINARY
+from encoders import ENCODER_AUTO, PRESET_BALANCED
+from segment_recorder import RECORDING_EVENT
+from clip_index import ClipCanTap
+from camera_group import CameraGroup
+from clip_finalizer import shared_finalizer
+from shm_capture import CAPTURE_INPROCESS, default_api_preference
+from camera_discovery import (DEFAULT_PROBE_TIMEOUT, camera_label, discover_cameras,
+                              load_cached_cameras)
+from engine import EngineConfig
+from metrics import HOP_DISPATCH, MetricsExporter, format_panel, shared_metrics
+from qt_engine import CameraThread, CanThread
 
 # ---- Global Settings ----
 DEFAULT_SAVE_DIR = os.path.expanduser("~") # Thư mục Home làm mặc định
 CAMERA_SCAN_LIMIT = 5 # Số lượng index camera tối đa để quét
-
-# ---- Thread cho Camera ----
-class CameraThread(QThread):
-    changePixmap = pyqtSignal(QPixmap)
-    recordingStartedSignal = pyqtSignal()
-    recordingStoppedSignal = pyqtSignal(str) # Gửi đường dẫn file đã lưu
-    cameraErrorSignal = pyqtSignal(str)
-
-    def __init__(self, camera_source, save_dir, parent=None):
-        super().__init__(parent)
-        self.camera_source = camera_source
-        self.save_dir = save_dir
-        self._running = False
-        self._recording = False
-        self.video_writer = None
-        self.cap = None
-        self.error_string_from_can = "UnknownEvent" # Mặc định
-        self.mutex = QMutex() # Bảo vệ truy cập vào _recording và video_writer
-
-    def set_save_dir(self, directory):
-        self.save_dir = directory
-
-    def run(self):
-        self._running = True
-        print(f"Attempting to open camera: {self.camera_source}")
-        try:
-            # Cố gắng chuyển đổi sang int nếu là số (index), không thì giữ nguyên (URL)
-            try:
-                cam_idx = int(self.camera_source)
-                self.cap = cv2.VideoCapture(cam_idx, cv2.CAP_DSHOW if os.name == 'nt' else None) # Thêm backend cho Windows
-            except ValueError:
-                self.cap = cv2.VideoCapture(self.camera_source)
-
-            if not self.cap or not self.cap.isOpened():
-                raise ConnectionError(f"Không thể mở camera: {self.camera_source}")
-
-            print(f"Camera {self.camera_source} opened successfully.")
-            frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = self.cap.get(cv2.CAP_PROP_FPS)
-            # Đảm bảo FPS hợp lệ, nếu không lấy được thì đặt mặc định
-            if fps <= 0:
-                print("Warning: Could not get camera FPS, defaulting to 25.")
-                fps = 25 # Giá trị mặc định
-
-            print(f"Resolution: {frame_width}x{frame_height}, FPS: {fps}")
-
-            while self._running:
-                ret, frame = self.cap.read()
-                if not ret:
-                    print("Error: Failed to grab frame.")
-                    time.sleep(0.1) # Đợi một chút trước khi thử lại
-                    continue
-
-                # --- Xử lý hiển thị ---
-                rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = rgb_image.shape
-                bytes_per_line = ch * w
-                convert_to_qt_format = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-                p = QPixmap.fromImage(convert_to_qt_format)
-                self.changePixmap.emit(p)
-
-                # --- Xử lý ghi video (thread-safe) ---
-                with QMutexLocker(self.mutex):
-                    if self._recording and self.video_writer:
-                        try:
-                            self.video_writer.write(frame)
-                        except Exception as e:
-                            print(f"Error writing frame: {e}")
-                            # Có thể dừng ghi ở đây hoặc chỉ log lỗi
-                # time.sleep(1 / (fps * 1.1)) # Thêm độ trễ nhỏ nếu cần để giảm CPU, *1.1 để an toàn
-                time.sleep(0.01) # Giới hạn tốc độ vòng lặp một chút
-
-        except ConnectionError as e:
-             print(f"Camera connection error: {e}")
-             self.cameraErrorSignal.emit(str(e))
-        except Exception as e:
-             print(f"Error in camera thread: {e}")
-             self.cameraErrorSignal.emit(f"Lỗi camera: {e}")
-        finally:
-            print("Camera thread finishing...")
-            if self.cap:
-                self.cap.release()
-                print("Camera released.")
-            with QMutexLocker(self.mutex):
-                if self.video_writer:
-                    print("Releasing video writer...")
-                    self.video_writer.release()
-                    self.video_writer = None
-            self._recording = False # Đảm bảo trạng thái recording là false khi thread kết thúc
-            print("Camera thread finished.")
-
-
-    def stop(self):
-        self._running = False
-        self.wait() # Đợi thread kết thúc hoàn toàn
-
-    def start_recording(self):
-        with QMutexLocker(self.mutex):
-            if not self._recording and self.cap and self.cap.isOpened():
-                if not self.save_dir or not os.path.isdir(self.save_dir):
-                    print("Error: Invalid save directory.")
-                    self.cameraErrorSignal.emit("Lỗi: Thư mục lưu không hợp lệ.")
-                    return
-
-                frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = self.cap.get(cv2.CAP_PROP_FPS)
-                if fps <= 0: fps = 25 # Default FPS
-
-                # Sử dụng tên tạm thời trước khi có tên lỗi từ CAN
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                self.temp_filename = os.path.join(self.save_dir, f"recording_{timestamp}.mp4")
-
-                # --- Chọn Codec ---
-                # Thử 'mp4v', nếu không được có thể thử 'XVID' hoặc khác
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                # fourcc = cv2.VideoWriter_fourcc(*'XVID')
-
-                try:
-                    print(f"Starting recording to {self.temp_filename} at {fps} FPS, {frame_width}x{frame_height}")
-                    self.video_writer = cv2.VideoWriter(self.temp_filename, fourcc, fps, (frame_width, frame_height))
-                    if not self.video_writer.isOpened():
-                         raise IOError("Could not open VideoWriter")
-                    self._recording = True
-                    self.recordingStartedSignal.emit()
-                    print("Recording started.")
-                except Exception as e:
-                    print(f"Error starting VideoWriter: {e}")
-                    self.cameraErrorSignal.emit(f"Lỗi bắt đầu ghi: {e}")
-                    self.video_writer = None
-                    self._recording = False
-
-
-    def stop_recording_and_save(self, error_string="UnknownEvent"):
-         final_filepath = ""
-         with QMutexLocker(self.mutex):
-            if self._recording and self.video_writer:
-                print("Stopping recording...")
-                self._recording = False
-                temp_file_to_rename = self.temp_filename # Lưu lại tên tạm thời
-                try:
-                    self.video_writer.release()
-                    self.video_writer = None
-                    print("Video writer released.")
-
-                    # --- Tạo tên file cuối cùng ---
-                    # Làm sạch tên lỗi/sự kiện từ CAN
-                    safe_error_string = re.sub(r'[\\/*?:"<>|]', "_", error_string) # Thay thế ký tự không hợp lệ
-                    if not safe_error_string: safe_error_string = "UnknownEvent" # Đảm bảo không rỗng
-
-                    date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-                    final_filename = f"{date_str}_{safe_error_string}.mp4"
-                    final_filepath = os.path.join(self.save_dir, final_filename)
-
-                    # Đổi tên file tạm thành file cuối cùng
-                    if os.path.exists(temp_file_to_rename):
-                         # Xử lý trường hợp file đích đã tồn tại (ví dụ thêm số thứ tự)
-                         counter = 1
-                         base_name, ext = os.path.splitext(final_filename)
-                         while os.path.exists(final_filepath):
-                              final_filename = f"{base_name}_{counter}{ext}"
-                              final_filepath = os.path.join(self.save_dir, final_filename)
-                              counter += 1
-
-                         os.rename(temp_file_to_rename, final_filepath)
-                         print(f"Video saved as: {final_filepath}")
-                    else:
-                         print(f"Warning: Temporary file {temp_file_to_rename} not found for renaming.")
-                         final_filepath = "" # Đặt lại nếu không đổi tên được
-
-
-                except Exception as e:
-                    print(f"Error stopping recording or renaming file: {e}")
-                    # Không emit lỗi ở đây vì có thể luồng chính đã xử lý
-                    final_filepath = "" # Đặt lại nếu có lỗi
-                finally:
-                     # Dù thành công hay không, báo hiệu đã dừng (có thể kèm đường dẫn hoặc chuỗi rỗng)
-                     self.recordingStoppedSignal.emit(final_filepath)
-                     print("Recording stopped signal emitted.")
-
-# ---- Thread cho CAN ----
-class CanThread(QThread):
-    logMessage = pyqtSignal(str)
-    startRecordingSignal = pyqtSignal()
-    stopRecordingAndSaveSignal = pyqtSignal(str) # Gửi chuỗi lỗi/sự kiện từ payload
-    canErrorSignal = pyqtSignal(str)
-    connectionStatusSignal = pyqtSignal(bool) # True khi kết nối, False khi ngắt
-
-    def __init__(self, interface, channel, start_id_hex, stop_id_hex, emergency_id_hex=None, parent=None):
-        super().__init__(parent)
-        self.interface = interface
-        self.channel = channel
-        self.start_id = None
-        self.stop_id = None
-        self.emergency_id = None
-        self._running = False
-        self.bus = None
-        self.notifier = None
-
-        # Chuyển đổi ID hex sang int, xử lý lỗi
-        try:
-            self.start_id = int(start_id_hex, 16) if start_id_hex else None
-            self.stop_id = int(stop_id_hex, 16) if stop_id_hex else None
-            self.emergency_id = int(emergency_id_hex, 16) if emergency_id_hex else None
-            print(f"CAN IDs configured - Start: {hex(self.start_id) if self.start_id is not None else 'None'}, Stop: {hex(self.stop_id) if self.stop_id is not None else 'None'}")
-        except ValueError as e:
-            raise ValueError(f"Định dạng CAN ID không hợp lệ: {e}")
-
-        if not self.start_id or not self.stop_id:
-             raise ValueError("Start Recording ID và Stop Recording ID không được để trống.")
-
+PREROLL_SECONDS = 5 # Số giây giữ lại trước khi nhận lệnh ghi từ CAN (0 = tắt)
+PREROLL_MAX_BYTES = 64 * 1024 * 1024 # Giới hạn bộ nhớ cho bộ đệm pre-roll (JPEG)
+WRITER_QUEUE_SIZE = 64 # Số frame tối đa chờ luồng mã hóa
+WRITER_OVERFLOW_POLICY = OVERFLOW_DROP_OLDEST # block | drop_oldest | drop_newest
+CAPTURE_PACING = PACING_CAMERA # camera: chỉ chờ camera | fixed: sleep 10 ms mỗi frame (cũ)
+PREVIEW_FPS = 15 # Tần số cập nhật preview (Hz), 0 = mọi frame
+CAN_LOG_REFRESH_MS = 100 # Chu kỳ rút log CAN lên giao diện
+CAN_LOG_BATCH_ROWS = 200 # Số dòng tối đa được định dạng mỗi lần rút
+MAX_LOG_LINES = 1000 # Giới hạn cứng số dòng trong khung log
+CAN_RECORD_ENABLED = True # Ghi liên tục mọi frame CAN ra file trong <thư mục lưu>/can_logs
+CAN_RECORD_FORMAT = FORMAT_BINARY # ccl (nhị phân gọn) | blf | asc
+CAN_RECORD_ROTATE_BYTES = 256 * 1024 * 1024 # Xoay file khi đạt kích thước này (0 = không giới hạn)
+CAN_RECORD_ROTATE_SECONDS = 3600 # Xoay file sau khoảng thời gian này (0 = không giới hạn)
+CAN_RECORD_QUOTA_BYTES = 4 * 1024 * 1024 * 1024 # Tổng dung lượng log CAN; file cũ nhất bị xóa trước (0 = không giới hạn)
+CAN_RECORD_SUBDIR = "can_logs"
+CLIP_INDEX_ENABLED = True # Ghi file chỉ mục <clip>.idx.npz (timestamp frame + CAN trong clip)
+TRIGGER_DEBOUNCE_SECONDS = 0.5 # Frame trigger lặp lại (ECU phát 10-100 Hz) trong khoảng này bị gộp ngay ở listener
+MIN_CLIP_SECONDS = 0 # Lệnh dừng đến sớm hơn được hoãn đến đủ độ dài clip (0 = tắt)
+TRIGGER_HOLDOFF_SECONDS = 1.0 # Bỏ qua lệnh bắt đầu trong khoảng này sau khi dừng
+CAN_FD_ENABLED = False # Mở bus ở chế độ CAN FD (payload đến 64 byte)
+ISOTP_STOP_PAYLOAD = False # Chuỗi sự kiện của frame Dừng gửi bằng ISO-TP (nhiều frame), được ghép trước khi xử lý
+ISOTP_FC_ID = "" # ID (hex) để gửi Flow Control khi không có ECU nào khác trả lời ("" = chỉ nghe)
+DBC_FILE = "" # File DBC để giải mã tín hiệu xe ("" = tắt)
+DBC_SIGNALS = [] # Chỉ giải mã các tín hiệu này, 'Message.Signal' hoặc tên trần ([] = mọi tín hiệu trong DBC)
+TRIGGER_RULES_FILE = "" # File luật trigger, vd 'stop(Overspeed): speed > 80 for 2s' ("" = chỉ dùng ID ở trên)
+CATALOG_ENABLED = True # Danh mục SQLite <thư mục lưu>/catalog.sqlite3: tra cứu clip, cấp tên file O(1)
+CAPTURE_MODE = CAPTURE_INPROCESS # inprocess | process: mỗi camera một tiến trình, frame qua shared memory
+RECORDING_MODE = RECORDING_EVENT # event: ghi từ Start đến Stop | segments: ghi liên tục theo đoạn, sự kiện link đoạn
+SEGMENT_SECONDS = 10 # Độ dài mỗi đoạn ở chế độ segments
+SEGMENT_QUOTA_BYTES = 8 * 1024 * 1024 * 1024 # Hạn mức đoạn mỗi camera trong <thư mục lưu>/segments, xóa cũ nhất trước
+VIDEO_ENCODER = ENCODER_AUTO # auto (theo hiệu chuẩn 'python encoders.py --calibrate') | mjpg | mp4v | xvid | raw | x264 | ffv1
+VIDEO_ENCODER_PRESET = PRESET_BALANCED # fast | balanced | quality
+METRICS_EXPORT_ENABLED = False # Ghi metrics.json + metrics.prom (độ trễ trigger, jitter, hàng đợi ghi, CPU) vào <thư mục lưu>/metrics
+METRICS_EXPORT_SECONDS = 5 # Chu kỳ ghi file metrics
+METRICS_HTTP_PORT = 0 # Cổng 127.0.0.1 phục vụ /metrics và /metrics.json (0 = tắt)
+METRICS_REFRESH_MS = 1000 # Chu kỳ cập nhật khung hiệu năng
+
+# ---- Thread quét camera ----
+class CameraScanThread(QThread):
+    camerasFound = pyqtSignal(list) # Danh sách CameraInfo
 
     def run(self):
-        self._running = True
+        # Liệt kê thiết bị và thử mở song song có timeout, kết quả được lưu cache cho lần khởi động sau
         try:
-            print(f"Attempting to connect to CAN: interface='{self.interface}', channel='{self.channel}'")
-            # --- Khởi tạo CAN Bus ---
-            # Cần cấu hình chính xác 'interface' và 'channel' cho phần cứng của bạn
-            # Ví dụ cho SocketCAN trên Linux: interface='socketcan', channel='can0'
-            # Ví dụ cho PCAN trên Windows: interface='pcan', channel='PCAN_USBBUS1'
-            # Ví dụ cho Vector trên Windows: interface='vector', channel=0, app_name='MyCameraApp'
-            # **CHỈNH SỬA DÒNG DƯỚI ĐÂY CHO PHÙ HỢP VỚI HỆ THỐNG CỦA BẠN**
-            self.bus = can.interface.Bus(interface=self.interface, channel=self.channel, bustype=self.interface)
-            # self.bus = can.interface.Bus(bustype='socketcan', channel='can0', bitrate=500000) # Example for SocketCAN
-            # self.bus = can.interface.Bus(bustype='pcan', channel='PCAN_USBBUS1', bitrate=500000) # Example for PCAN
-            print("CAN bus connected successfully.")
-            self.connectionStatusSignal.emit(True)
-
-            # Tạo listener tùy chỉnh
-            class MyListener(can.Listener):
-                def __init__(self, can_thread_ref):
-                    self.can_thread_ref = can_thread_ref
-
-                def on_message_received(self, msg: can.Message):
-                    # Log tất cả message (nếu được bật)
-                    log_str = f"ID: {msg.arbitration_id:#X} DLC: {msg.dlc} Data: {msg.data.hex().upper()}"
-                    self.can_thread_ref.logMessage.emit(log_str)
-
-                    # Xử lý lệnh điều khiển
-                    if self.can_thread_ref.start_id is not None and msg.arbitration_id == self.can_thread_ref.start_id:
-                        print("Received Start Recording CAN message.")
-                        self.can_thread_ref.startRecordingSignal.emit()
-                    elif self.can_thread_ref.stop_id is not None and msg.arbitration_id == self.can_thread_ref.stop_id:
-                        print("Received Stop Recording CAN message.")
-                        try:
-                            # Giả định payload là chuỗi UTF-8
-                            error_string = msg.data.decode('utf-8', errors='ignore').strip()
-                            # Xóa các ký tự null nếu có
-                            error_string = error_string.replace('\x00', '')
-                            if not error_string: error_string = "ReceivedStopEvent" # Nếu payload rỗng
-                            print(f"Extracted error/event string: '{error_string}'")
-                        except Exception as e:
-                            print(f"Could not decode CAN payload as UTF-8: {e}")
-                            error_string = "PayloadDecodeError"
-                        self.can_thread_ref.stopRecordingAndSaveSignal.emit(error_string)
-                    # Thêm xử lý Emergency Stop nếu cần
-                    # elif self.can_thread_ref.emergency_id is not None and msg.arbitration_id == self.can_thread_ref.emergency_id:
-                    #     print("Received Emergency Stop CAN message.")
-                    #     # Gửi tín hiệu dừng camera khẩn cấp (cần định nghĩa thêm)
-                    #     pass
-
-            # Sử dụng Notifier để chạy listener trong nền
-            self.notifier = can.Notifier(self.bus, [MyListener(self)])
-            print("CAN Notifier started.")
-
-            # Giữ thread chạy cho đến khi bị dừng từ bên ngoài
-            while self._running:
-                time.sleep(0.5) # Ngủ để giảm tải CPU, notifier vẫn chạy
-
-        except can.CanError as e:
-            print(f"CAN Error: {e}")
-            self.canErrorSignal.emit(f"Lỗi CAN: {e}")
-            self.connectionStatusSignal.emit(False)
-        except ValueError as e: # Bắt lỗi từ việc chuyển đổi ID
-            print(f"Configuration Error: {e}")
-            self.canErrorSignal.emit(str(e))
-            self.connectionStatusSignal.emit(False)
+            cameras = discover_cameras(CAMERA_SCAN_LIMIT, default_api_preference(), DEFAULT_PROBE_TIMEOUT)
         except Exception as e:
-            print(f"Unexpected error in CAN thread: {e}")
-            self.canErrorSignal.emit(f"Lỗi không xác định: {e}")
-            self.connectionStatusSignal.emit(False)
-        finally:
-            print("CAN thread finishing...")
-            if self.notifier:
-                self.notifier.stop()
-                print("CAN Notifier stopped.")
-            if self.bus:
-                self.bus.shutdown()
-                print("CAN bus shutdown.")
-            self._running = False
-            self.connectionStatusSignal.emit(False) # Báo đã ngắt kết nối
-            print("CAN thread finished.")
-
-    def stop(self):
-        self._running = False
-        # Không cần wait() ở đây vì vòng lặp chính sẽ tự kết thúc khi _running=False
-        # và notifier.stop(), bus.shutdown() sẽ được gọi trong finally
+            print(f"Camera scan error: {e}")
+            cameras = []
+        self.camerasFound.emit(cameras)
+
+
+# ---- Cấu hình engine (lõi ghi hình dùng chung với cancam_daemon.py) ----
+ENGINE_CONFIG = EngineConfig(
+    save_dir=DEFAULT_SAVE_DIR, preroll_seconds=PREROLL_SECONDS, preroll_max_bytes=PREROLL_MAX_BYTES,
+    writer_queue_size=WRITER_QUEUE_SIZE, writer_overflow_policy=WRITER_OVERFLOW_POLICY,
+    capture_pacing=CAPTURE_PACING, preview_fps=PREVIEW_FPS, capture_mode=CAPTURE_MODE,
+    recording_mode=RECORDING_MODE, segment_seconds=SEGMENT_SECONDS, segment_quota_bytes=SEGMENT_QUOTA_BYTES,
+    encoder=VIDEO_ENCODER, encoder_preset=VIDEO_ENCODER_PRESET,
+    clip_index=CLIP_INDEX_ENABLED, catalog=CATALOG_ENABLED, can_record_format=CAN_RECORD_FORMAT,
+    trigger_debounce_seconds=TRIGGER_DEBOUNCE_SECONDS, min_clip_seconds=MIN_CLIP_SECONDS,
+    trigger_holdoff_seconds=TRIGGER_HOLDOFF_SECONDS, can_fd=CAN_FD_ENABLED, isotp=ISOTP_STOP_PAYLOAD,
+    isotp_fc_id=ISOTP_FC_ID, dbc_file=DBC_FILE, dbc_signals=DBC_SIGNALS,
+    trigger_rules_file=TRIGGER_RULES_FILE, metrics_export=METRICS_EXPORT_ENABLED,
+    metrics_interval=METRICS_EXPORT_SECONDS, metrics_port=METRICS_HTTP_PORT,
+    can_record_rotate_bytes=CAN_RECORD_ROTATE_BYTES, can_record_rotate_seconds=CAN_RECORD_ROTATE_SECONDS,
+    can_record_quota_bytes=CAN_RECORD_QUOTA_BYTES)
+# CameraThread / CanThread: adapter Qt trong qt_engine.py quanh CameraWorker / CanWorker của engine
 
 
 # ---- Giao diện chính ----
 class MainWindow(QMainWindow):
+    eventSavedSignal = pyqtSignal(list) # Clip của một sự kiện đã hoàn tất ở luồng nền (ClipFinalizer)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Giám Sát Camera & Điều Khiển CAN")
         self.setGeometry(100, 100, 900, 700) # Tăng kích thước cửa sổ
 
         # --- Thuộc tính ---
-        self.camera_thread = None
+        self.camera_thread = None # Camera chính của camera_group (preview + trạng thái ghi)
+        self.camera_group = None
+        self.scan_thread = None
         self.can_thread = None
         self.current_save_dir = DEFAULT_SAVE_DIR
         self.is_recording_flag = False # Cờ trạng thái ghi hình
         self.can_log_enabled = True
+        self.clip_tap = ClipCanTap() if CLIP_INDEX_ENABLED else None # Nối CAN với chỉ mục clip
+        self.eventSavedSignal.connect(self.on_event_saved)
+        self.metrics = shared_metrics() # Độ trễ trigger theo chặng, jitter, hàng đợi ghi, CPU (engine ghi vào)
+        self.metrics_exporter = None
+        if METRICS_EXPORT_ENABLED or METRICS_HTTP_PORT:
+            self.metrics_exporter = MetricsExporter(self.metrics,
+                                                    self.current_save_dir if METRICS_EXPORT_ENABLED else None,
+                                                    METRICS_EXPORT_SECONDS, METRICS_HTTP_PORT)
+            self.metrics_exporter.start()
 
         # --- Giao diện ---
         main_widget = QWidget(self)
@@ -336,11 +128,12 @@ class MainWindow(QMainWindow):
 
         # -- Khu vực Video (Trái) --
         video_layout = QVBoxLayout()
-        self.video_label = QLabel("Chưa kết nối Camera")
-        self.video_label.setAlignment(Qt.AlignCenter)
-        self.video_label.setMinimumSize(640, 480) # Kích thước tối thiểu cho video
-        self.video_label.setStyleSheet("border: 1px solid black; background-color: lightgray;")
-        video_layout.addWidget(self.video_label)
+        self.video_view = VideoWidget("Chưa kết nối Camera")
+        self.video_view.setMinimumSize(640, 480) # Kích thước tối thiểu cho video
+        self.video_view.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.video_view.installEventFilter(self)
+        self.video_view.setStyleSheet("border: 1px solid black; background-color: lightgray;")
+        video_layout.addWidget(self.video_view)
         main_layout.addLayout(video_layout, 3) # Chiếm 3 phần không gian
 
         # -- Khu vực Điều khiển (Phải) --
@@ -350,7 +143,8 @@ class MainWindow(QMainWindow):
         cam_group = QVBoxLayout()
         cam_group.addWidget(QLabel("1. Quản Lý Camera:"))
         self.cam_combo = QComboBox()
-        self.scan_cameras() # Quét khi khởi động
+        self.populate_camera_combo(load_cached_cameras()) # Hiện ngay kết quả lần trước
+        self.scan_cameras() # Kiểm tra lại ở nền
         cam_group.addWidget(self.cam_combo)
 
         ip_cam_layout = QHBoxLayout()
@@ -361,6 +155,9 @@ class MainWindow(QMainWindow):
         add_ip_btn.clicked.connect(self.add_ip_camera)
         ip_cam_layout.addWidget(add_ip_btn)
         cam_group.addLayout(ip_cam_layout)
+        self.extra_cams_input = QLineEdit()
+        self.extra_cams_input.setPlaceholderText("Camera phụ ghi cùng trigger (vd: 1, 2, rtsp://...)")
+        cam_group.addWidget(self.extra_cams_input)
 
         cam_buttons_layout = QHBoxLayout()
         self.start_cam_btn = QPushButton("Bật Camera")
@@ -404,9 +201,9 @@ class MainWindow(QMainWindow):
 
         can_id_layout = QHBoxLayout()
         self.start_id_input = QLineEdit("100") # ID mặc định ví dụ
-        self.start_id_input.setPlaceholderText("ID Bắt Đầu Ghi (Hex)")
+        self.start_id_input.setPlaceholderText("ID Bắt Đầu Ghi (Hex, ID/MASK)")
         self.stop_id_input = QLineEdit("101") # ID mặc định ví dụ
-        self.stop_id_input.setPlaceholderText("ID Dừng & Lưu (Hex)")
+        self.stop_id_input.setPlaceholderText("ID Dừng & Lưu (Hex, ID/MASK)")
         # self.emergency_id_input = QLineEdit() # Tùy chọn
         # self.emergency_id_input.setPlaceholderText("ID Dừng Khẩn Cấp (Hex)")
         can_id_layout.addWidget(self.start_id_input)
@@ -431,10 +228,33 @@ class MainWindow(QMainWindow):
         log_header_layout.addWidget(self.can_log_checkbox)
         log_group.addLayout(log_header_layout)
 
-        self.can_log_display = QTextEdit()
+        self.can_log_display = QPlainTextEdit()
         self.can_log_display.setReadOnly(True)
+        self.can_log_display.setMaximumBlockCount(MAX_LOG_LINES) # Qt tự bỏ dòng cũ nhất
         log_group.addWidget(self.can_log_display)
+        self.can_log_skipped_label = QLabel("Bỏ qua: 0 frame")
+        log_group.addWidget(self.can_log_skipped_label)
         control_layout.addLayout(log_group)
+        self.can_log_skipped = 0
+
+        # 5. Hiệu năng
+        stats_group = QVBoxLayout()
+        stats_group.addWidget(QLabel("5. Hiệu Năng (độ trễ trigger, camera, CPU):"))
+        self.stats_display = QPlainTextEdit()
+        self.stats_display.setReadOnly(True)
+        self.stats_display.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.stats_display.setMaximumHeight(170)
+        stats_group.addWidget(self.stats_display)
+        control_layout.addLayout(stats_group)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setInterval(METRICS_REFRESH_MS)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start()
+
+        # Timer rút log CAN theo lô
+        self.can_log_timer = QTimer(self)
+        self.can_log_timer.setInterval(CAN_LOG_REFRESH_MS)
+        self.can_log_timer.timeout.connect(self.flush_can_log)
 
         control_layout.addStretch() # Đẩy mọi thứ lên trên
         main_layout.addLayout(control_layout, 1) # Chiếm 1 phần không gian
@@ -447,39 +267,37 @@ class MainWindow(QMainWindow):
     # --- Các phương thức xử lý ---
 
     def scan_cameras(self):
-        self.cam_combo.clear()
-        available_cameras = []
+        """Quét camera ở luồng nền, combo được cập nhật khi có kết quả."""
+        if self.scan_thread and self.scan_thread.isRunning():
+            return
         print("Scanning for cameras...")
-        for i in range(CAMERA_SCAN_LIMIT):
-            cap = cv2.VideoCapture(i, cv2.CAP_DSHOW if os.name == 'nt' else None)
-            if cap is not None and cap.isOpened():
-                cam_name = f"Camera {i}"
-                # Cố gắng lấy tên mô tả hơn (có thể không hoạt động trên mọi OS/backend)
-                # try:
-                #     backend_name = cap.getBackendName()
-                #     # Tên cụ thể hơn có thể cần API hệ điều hành
-                #     cam_name = f"Camera {i} ({backend_name})"
-                # except Exception:
-                #     pass
-                available_cameras.append((cam_name, str(i))) # Lưu cả tên và index
-                print(f"Found: {cam_name}")
-                cap.release()
-            else:
-                # print(f"Index {i} not available or failed to open.")
-                if cap: cap.release()
-                # Dừng quét sớm nếu không tìm thấy liên tiếp
-                # if i > 0 and not available_cameras: # Nếu index 0 không có thì cũng dừng
-                 #    break
+        self.scan_thread = CameraScanThread(self)
+        self.scan_thread.camerasFound.connect(self.on_cameras_found)
+        self.scan_thread.start()
+
+    def on_cameras_found(self, cameras):
+        self.populate_camera_combo(cameras)
+        print(f"Camera scan finished: {len(cameras)} camera(s) found.")
+
+    def populate_camera_combo(self, cameras):
+        """Điền combo từ danh sách CameraInfo, giữ lại camera IP đã thêm và lựa chọn hiện tại."""
+        current = self.cam_combo.currentData()
+        ip_items = [(self.cam_combo.itemText(i), self.cam_combo.itemData(i)) for i in range(self.cam_combo.count())
+                    if self.cam_combo.itemData(i) and not str(self.cam_combo.itemData(i)).isdigit()]
+        self.cam_combo.clear()
+        for info in cameras:
+            self.cam_combo.addItem(camera_label(info), userData=str(info.index)) # Lưu index vào userData
+        for name, source in ip_items:
+            self.cam_combo.addItem(name, userData=source)
 
-        if not available_cameras:
+        if self.cam_combo.count() == 0:
             self.cam_combo.addItem("Không tìm thấy camera nào")
             self.cam_combo.setEnabled(False)
-        else:
-             self.cam_combo.setEnabled(True)
-             for name, source in available_cameras:
-                 self.cam_combo.addItem(name, userData=source) # Lưu source vào userData
-
-        print("Camera scan finished.")
+            return
+        self.cam_combo.setEnabled(not (self.camera_group and self.camera_group.is_running()))
+        position = self.cam_combo.findData(current)
+        if position >= 0:
+            self.cam_combo.setCurrentIndex(position)
 
 
     def add_ip_camera(self):
@@ -502,8 +320,12 @@ class MainWindow(QMainWindow):
              QMessageBox.warning(self, "Lỗi", "Vui lòng nhập URL Camera IP.")
 
 
+    def extra_camera_sources(self):
+        """Danh sách nguồn camera phụ (index hoặc URL), cách nhau bởi dấu phẩy."""
+        return [source.strip() for source in self.extra_cams_input.text().split(",") if source.strip()]
+
     def start_camera(self):
-        if self.camera_thread and self.camera_thread.isRunning():
+        if self.camera_group and self.camera_group.is_running():
             QMessageBox.warning(self, "Lỗi", "Camera đang chạy!")
             return
 
@@ -520,25 +342,36 @@ class MainWindow(QMainWindow):
         self.statusBar.showMessage(f"Đang kết nối tới {self.cam_combo.currentText()}...")
         QApplication.processEvents() # Cập nhật giao diện
 
-        self.camera_thread = CameraThread(camera_source, self.current_save_dir)
-        self.camera_thread.changePixmap.connect(self.set_image)
+        # Mọi camera chạy song song và nhận chung lệnh ghi/dừng từ CAN
+        self.camera_group = CameraGroup(self.current_save_dir, use_catalog=CATALOG_ENABLED)
+        self.camera_group.on_event_stopped = self.eventSavedSignal.emit # Gọi từ luồng nền -> về luồng GUI
+        for source in [camera_source] + self.extra_camera_sources():
+            camera = self.camera_group.add(CameraThread(source, self.current_save_dir, ENGINE_CONFIG, NEEDS_RB_SWAP))
+            camera.clip_tap = self.clip_tap
+            camera.cameraErrorSignal.connect(self.on_camera_error)
+        for camera in self.camera_group.cameras[1:]:
+            camera.set_preview_enabled(False) # Chỉ camera chính được hiển thị
+
+        self.camera_thread = self.camera_group.primary
+        self.camera_thread.frameReady.connect(self.set_image)
         self.camera_thread.recordingStartedSignal.connect(self.on_recording_started)
         self.camera_thread.recordingStoppedSignal.connect(self.on_recording_stopped)
-        self.camera_thread.cameraErrorSignal.connect(self.on_camera_error)
         self.camera_thread.finished.connect(self.on_camera_thread_finished) # Xử lý khi thread kết thúc
+        self.update_preview_target()
 
-        self.camera_thread.start()
+        self.camera_group.start()
 
         self.start_cam_btn.setEnabled(False)
         self.stop_cam_btn.setEnabled(True)
         self.cam_combo.setEnabled(False) # Không cho đổi camera khi đang chạy
         self.ip_cam_input.setEnabled(False) # Tương tự cho IP Cam
+        self.extra_cams_input.setEnabled(False)
 
 
     def stop_camera(self):
-        if self.camera_thread and self.camera_thread.isRunning():
+        if self.camera_group and self.camera_group.is_running():
             self.statusBar.showMessage("Đang dừng camera...")
-            self.camera_thread.stop() # Gửi tín hiệu dừng và đợi
+            self.camera_group.stop() # Gửi tín hiệu dừng cho mọi camera và đợi
             # Việc cập nhật UI sẽ được xử lý trong on_camera_thread_finished
         else:
              # Nếu thread không chạy nhưng nút vẫn bật (trường hợp lỗi nào đó)
@@ -547,19 +380,56 @@ class MainWindow(QMainWindow):
 
     def on_camera_thread_finished(self):
         print("Camera thread finished signal received by main window.")
+        if self.camera_group:
+            self.camera_group.stop() # Camera chính đã dừng (vd: lỗi) -> dừng luôn các camera phụ
+            self.camera_group = None
         self.camera_thread = None # Xóa tham chiếu đến thread
-        self.video_label.setText("Camera đã tắt")
-        self.video_label.setPixmap(QPixmap()) # Xóa hình ảnh cuối cùng
+        if self.can_thread:
+            self.can_thread.reset_triggers() # Không còn clip mở: lệnh Start kế tiếp phải tới được đây
+        self.video_view.setText("Camera đã tắt")
+        self.video_view.clear() # Xóa hình ảnh cuối cùng
         self.start_cam_btn.setEnabled(True)
         self.stop_cam_btn.setEnabled(False)
         self.cam_combo.setEnabled(True) # Cho phép chọn lại camera
         self.ip_cam_input.setEnabled(True)
+        self.extra_cams_input.setEnabled(True)
         self.is_recording_flag = False # Đảm bảo cờ ghi hình tắt
         self.statusBar.showMessage("Camera đã tắt.")
 
 
-    def set_image(self, pixmap):
-        self.video_label.setPixmap(pixmap.scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+    def set_image(self, frame):
+        # Frame đã được co giãn đúng kích thước trong CameraThread
+        if self.camera_thread and self.camera_thread.isRunning():
+            self.video_view.show_frame(frame)
+        else:
+            frame.release() # Frame đến muộn sau khi tắt camera
+
+    def update_preview_target(self):
+        """Gửi kích thước khung video và trạng thái hiển thị cho CameraThread."""
+        if self.camera_thread:
+            size = self.video_view.contentsRect().size()
+            self.camera_thread.set_preview_size(size.width(), size.height())
+            self.camera_thread.set_preview_enabled(self.isVisible() and not self.isMinimized())
+
+    def eventFilter(self, obj, event):
+        # Theo dõi kích thước khung video để CameraThread co giãn frame đúng cỡ
+        if obj is self.video_view and event.type() == QEvent.Resize:
+            self.update_preview_target()
+        return super().eventFilter(obj, event)
+
+    def changeEvent(self, event):
+        # Dừng xử lý preview khi cửa sổ bị thu nhỏ
+        if event.type() == QEvent.WindowStateChange:
+            self.update_preview_target()
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_preview_target()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.update_preview_target()
 
 
     def select_directory(self):
@@ -568,8 +438,10 @@ class MainWindow(QMainWindow):
             self.current_save_dir = directory
             self.dir_label.setText(directory)
             # Cập nhật thư mục lưu cho camera thread nếu đang chạy
-            if self.camera_thread and self.camera_thread.isRunning():
-                self.camera_thread.set_save_dir(directory)
+            if self.camera_group:
+                self.camera_group.set_save_dir(directory)
+            if self.metrics_exporter and METRICS_EXPORT_ENABLED:
+                self.metrics_exporter.set_directory(directory)
             print(f"Thư mục lưu được đặt thành: {directory}")
 
 
@@ -592,14 +464,18 @@ class MainWindow(QMainWindow):
 
             self.statusBar.showMessage("Đang kết nối CAN...")
             try:
-                self.can_thread = CanThread(interface, channel, start_id_hex, stop_id_hex) # , emergency_id_hex)
-                self.can_thread.logMessage.connect(self.append_can_log)
+                self.can_thread = CanThread(interface, channel, start_id_hex, stop_id_hex, config=ENGINE_CONFIG) # , emergency_id_hex)
+                self.can_thread.log_enabled = self.can_log_enabled
+                if CAN_RECORD_ENABLED:
+                    self.can_thread.record_dir = os.path.join(self.current_save_dir, CAN_RECORD_SUBDIR)
+                self.can_thread.clip_tap = self.clip_tap
                 self.can_thread.startRecordingSignal.connect(self.handle_start_recording_can)
                 self.can_thread.stopRecordingAndSaveSignal.connect(self.handle_stop_recording_can)
                 self.can_thread.canErrorSignal.connect(self.on_can_error)
                 self.can_thread.connectionStatusSignal.connect(self.on_can_connection_status)
                 self.can_thread.finished.connect(self.on_can_thread_finished) # Khi thread kết thúc
                 self.can_thread.start()
+                self.can_log_timer.start()
 
                 # Vô hiệu hóa các input cấu hình khi đang kết nối
                 self.can_interface_input.setEnabled(False)
@@ -636,6 +512,8 @@ class MainWindow(QMainWindow):
 
     def on_can_thread_finished(self):
          print("CAN thread finished signal received by main window.")
+         self.flush_can_log() # Hiển thị nốt các frame còn lại
+         self.can_log_timer.stop()
          self.can_thread = None
          # self.connect_can_btn.setChecked(False) # Đảm bảo nút ở trạng thái chưa kết nối
          # self.connect_can_btn.setText("Kết Nối CAN")
@@ -668,26 +546,43 @@ class MainWindow(QMainWindow):
 
     def toggle_can_logging(self, state):
         self.can_log_enabled = (state == Qt.Checked)
+        if self.can_thread:
+            self.can_thread.set_log_enabled(self.can_log_enabled)
         print(f"CAN logging {'enabled' if self.can_log_enabled else 'disabled'}")
 
-    def append_can_log(self, message):
-        if self.can_log_enabled:
-            self.can_log_display.append(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}: {message}")
+    def flush_can_log(self):
+        """Rút frame CAN từ vòng đệm, chỉ định dạng các dòng sẽ hiển thị và thêm một lần."""
+        if not self.can_thread:
+            return
+        frames, skipped = self.can_thread.log_ring.drain(CAN_LOG_BATCH_ROWS)
+        if skipped:
+            self.can_log_skipped += skipped
+            self.can_log_skipped_label.setText(f"Bỏ qua: {self.can_log_skipped} frame")
+        if frames and self.can_log_enabled:
+            self.can_log_display.appendPlainText("\n".join(format_can_row(msg) for msg in frames))
             # Tự động cuộn xuống dưới
             self.can_log_display.verticalScrollBar().setValue(self.can_log_display.verticalScrollBar().maximum())
 
 
+    def refresh_metrics(self):
+        if self.isVisible() and not self.isMinimized():
+            self.stats_display.setPlainText(format_panel(self.metrics.snapshot()))
+
+
     def handle_start_recording_can(self):
+        self.metrics.mark_trigger(HOP_DISPATCH) # Signal Qt đã tới luồng GUI
         if self.camera_thread and self.camera_thread.isRunning():
              if not self.is_recording_flag: # Chỉ bắt đầu nếu chưa ghi
                  print("Main: Received start recording signal from CAN")
                  self.is_recording_flag = True # Đặt cờ trước khi gọi thread
-                 self.camera_thread.start_recording()
+                 self.camera_group.start_recording(self.can_thread.last_start_id if self.can_thread else None) # Cùng mốc sự kiện cho mọi camera
                  # Status sẽ được cập nhật bởi signal từ camera_thread
              else:
                  print("Main: Received start recording signal, but already recording.")
         else:
             print("Main: Received start recording signal, but camera is not running.")
+            if self.can_thread:
+                self.can_thread.reset_triggers()
             # Có thể thêm thông báo lỗi ở đây nếu muốn
 
 
@@ -696,8 +591,10 @@ class MainWindow(QMainWindow):
              if self.is_recording_flag: # Chỉ dừng nếu đang ghi
                  print(f"Main: Received stop recording signal from CAN with payload: '{error_string}'")
                  self.is_recording_flag = False # Đặt cờ trước khi gọi thread
-                 self.camera_thread.stop_recording_and_save(error_string)
+                 self.camera_group.stop_recording_and_save(error_string, self.can_thread.last_stop_id if self.can_thread else None)
                  # Status sẽ được cập nhật bởi signal từ camera_thread
+                 if len(self.camera_group) > 1:
+                      print(f"Main: Per-camera stats:\n{self.camera_group.format_stats()}")
              else:
                   print("Main: Received stop recording signal, but not currently recording.")
         else:
@@ -709,8 +606,19 @@ class MainWindow(QMainWindow):
          self.statusBar.showMessage("Đang ghi hình...")
          print("Main: Recording started confirmation received.")
 
-    def on_recording_stopped(self, saved_filepath):
+    def on_recording_stopped(self, temp_filepath):
+         # Clip được hoàn tất ở luồng nền, có thể ghi sự kiện mới ngay
          self.is_recording_flag = False # Đảm bảo cờ đúng trạng thái
+         self.statusBar.showMessage("Đã dừng ghi hình. Đang lưu clip...")
+
+    def on_event_saved(self, paths):
+         if len(paths) > 1:
+              saved = sum(1 for path in paths if path)
+              slowest = self.camera_group.bottleneck() if self.camera_group else None
+              self.statusBar.showMessage(f"Đã lưu {saved}/{len(paths)} camera"
+                                         + (f", chậm nhất: {slowest['tag']}" if slowest else ""))
+              return
+         saved_filepath = paths[0] if paths else ""
          if saved_filepath:
               self.statusBar.showMessage(f"Đã dừng ghi hình. Lưu tại: {saved_filepath}")
               print(f"Main: Recording stopped confirmation received. Saved to {saved_filepath}")
@@ -724,8 +632,8 @@ class MainWindow(QMainWindow):
         QMessageBox.critical(self, "Lỗi Camera", error_message)
         self.statusBar.showMessage(f"Lỗi Camera: {error_message}")
         # Dừng thread camera nếu nó vẫn đang chạy (ví dụ lỗi khi đang ghi)
-        if self.camera_thread and self.camera_thread.isRunning():
-             self.camera_thread.stop() # Sẽ gọi on_camera_thread_finished để reset UI
+        if self.camera_group and self.camera_group.is_running():
+             self.camera_group.stop() # Sẽ gọi on_camera_thread_finished để reset UI
         else:
              # Nếu lỗi xảy ra trước khi thread chạy hoặc sau khi đã dừng
              self.on_camera_thread_finished() # Reset UI
@@ -743,12 +651,19 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         print("Close event triggered.")
         # Dừng các thread trước khi thoát
-        if self.camera_thread and self.camera_thread.isRunning():
-            print("Stopping camera thread before closing...")
-            self.camera_thread.stop()
+        if self.camera_group and self.camera_group.is_running():
+            print("Stopping camera threads before closing...")
+            self.camera_group.stop()
         if self.can_thread and self.can_thread.isRunning():
             print("Stopping CAN thread before closing...")
             self.can_thread.stop()
+        if self.scan_thread and self.scan_thread.isRunning():
+            self.scan_thread.wait(int(DEFAULT_PROBE_TIMEOUT * 1000) + 500) # Lượt quét tự kết thúc sau timeout
+        if not shared_finalizer().drain(): # Đợi các clip đang lưu ở luồng nền
+            print("Warning: Some clips were still being finalized.")
+        self.metrics_timer.stop()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop() # Ghi file metrics lần cuối
         print("Proceeding with closing.")
         event.accept()
 
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""Đo độ trễ trigger đầu-cuối và các chỉ số hiệu năng, xuất ra file/HTTP cục bộ (không phụ thuộc Qt).
+
+Trigger Start được đóng dấu thời gian ở từng chặng: timestamp của bus (phần cứng/driver) -> listener ->
+nơi nhận lệnh (signal Qt trong GUI, luồng điều khiển trong daemon) -> start_recording -> lần ghi frame đầu
+tiên (pre-roll) -> frame trực tiếp đầu tiên. Mỗi chặng đưa vào một histogram trượt tính từ mốc listener.
+Cùng registry giữ jitter camera, độ sâu hàng đợi ghi và thời gian CPU từng chặng xử lý (time.thread_time()).
+
+    python metrics.py <thư mục lưu>   # in <thư mục lưu>/metrics/metrics.json mới nhất dưới dạng bảng
+"""
+import bisect
+import collections
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_WINDOW = 1024 # Số mẫu gần nhất của mỗi histogram
+DEFAULT_EXPORT_INTERVAL = 5.0 # Chu kỳ ghi file metrics (s)
+METRICS_JSON = "metrics.json"
+METRICS_TEXT = "metrics.prom" # Định dạng text kiểu Prometheus
+METRICS_PREFIX = "cancam_"
+METRICS_SUBDIR = "metrics" # File metrics nằm trong thư mục con riêng của thư mục lưu, không lẫn với clip
+LATENCY_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+QUEUE_EDGES = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+BUS_CLOCK_TOLERANCE = 60.0 # Timestamp bus lệch quá mức này so với time.time(): đồng hồ thiết bị, không so được
+CPU_RATE_MARKS = 10 # % CPU tính trên ~10 mốc cách nhau >= 1 s
+
+# Các chặng của trigger Start (tên histogram: trigger_<chặng>_ms)
+HOP_BUS = "bus"                          # Timestamp bus -> listener
+HOP_DISPATCH = "dispatch"                # Listener -> handle_start_recording_can (GUI) / luồng điều khiển (daemon)
+HOP_START = "start_recording"            # Listener -> start_recording() xong (writer đã mở)
+HOP_FIRST_WRITE = "first_write"          # Listener -> video_writer.write đầu tiên (frame pre-roll)
+HOP_FIRST_LIVE_WRITE = "first_live_write" # Listener -> frame chụp sau trigger đầu tiên được ghi
+TRIGGER_HOPS = (HOP_BUS, HOP_DISPATCH, HOP_START, HOP_FIRST_WRITE, HOP_FIRST_LIVE_WRITE)
+
+# Chặng tính CPU
+STAGE_CAPTURE = "capture"   # grab/retrieve
+STAGE_PREVIEW = "preview"   # Co giãn preview
+STAGE_BUFFER = "buffer"     # Nén pre-roll JPEG / đưa frame vào hàng đợi ghi
+STAGE_ENCODE = "encode"     # Luồng mã hóa (kể cả giải nén pre-roll)
+STAGE_CAN = "can_receive"   # Xử lý lô frame CAN trong listener
+STAGE_DECODE = "can_decode" # Giải mã tín hiệu DBC + luật
+
+# Tên histogram/gauge dùng chung giữa engine và GUI
+JITTER = "capture_jitter_ms"
+WRITER_QUEUE = "writer_queue_depth"
+
+
+def trigger_histogram(hop):
+    return f"trigger_{hop}_ms"
+
+
+class RollingHistogram:
+    """N mẫu gần nhất + tổng tích lũy; phân vị và bucket chỉ tính khi đọc (định kỳ, không trên đường nóng)."""
+
+    def __init__(self, window=DEFAULT_WINDOW, edges=LATENCY_EDGES_MS):
+        self._samples = collections.deque(maxlen=max(1, int(window)))
+        self._lock = threading.Lock()
+        self.edges = tuple(edges)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        result = {"count": count, "sum": total, "window": len(samples)}
+        if not samples:
+            return result
+        n = len(samples)
+
+        def quantile(q):
+            return samples[min(n - 1, int(q * (n - 1) + 0.5))]
+
+        result.update(min=samples[0], mean=sum(samples) / n, p50=quantile(0.5), p95=quantile(0.95),
+                      p99=quantile(0.99), max=samples[-1],
+                      # Bucket tích lũy trên cửa sổ: số mẫu <= cạnh
+                      buckets={str(edge): bisect.bisect_right(samples, edge) for edge in self.edges})
+        return result
+
+
+class CpuMeter:
+    """CPU cộng dồn của một chặng (giây) và % CPU trên cửa sổ trượt (một lõi = 100%)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = 0.0
+        self._marks = collections.deque([(time.monotonic(), 0.0)], maxlen=CPU_RATE_MARKS)
+
+    def add(self, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self.seconds += seconds
+            if now - self._marks[-1][0] >= 1.0:
+                self._marks.append((now, self.seconds))
+
+    def percent(self):
+        now = time.monotonic()
+        with self._lock:
+            start, base = self._marks[0]
+            seconds = self.seconds
+        elapsed = now - start
+        return 100.0 * (seconds - base) / elapsed if elapsed >= 1.0 else 0.0 # Cửa sổ quá ngắn: chưa có số
+
+
+class TriggerTrace:
+    """Một trigger Start đang được đo: mốc listener (monotonic) và độ trễ đã ghi của từng chặng (ms)."""
+    __slots__ = ("origin", "wall", "source", "latencies")
+
+    def __init__(self, origin, wall, source):
+        self.origin = origin
+        self.wall = wall
+        self.source = source
+        self.latencies = {}
+
+
+class MetricsRegistry:
+    """Histogram, gauge, bộ đếm và CPU theo chặng, an toàn khi ghi từ nhiều luồng."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._cpu = {}
+        self._gauges = {}
+        self._counters = collections.Counter()
+        self._trace = None
+        self.started = time.time()
+
+    def histogram(self, name, edges=LATENCY_EDGES_MS):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, RollingHistogram(self.window, edges))
+        return histogram
+
+    def observe(self, name, value, edges=LATENCY_EDGES_MS):
+        self.histogram(name, edges).record(value)
+
+    def set_gauge(self, name, value):
+        self._gauges[name] = value
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def add_cpu(self, stage, seconds):
+        meter = self._cpu.get(stage)
+        if meter is None:
+            with self._lock:
+                meter = self._cpu.setdefault(stage, CpuMeter())
+        meter.add(seconds)
+
+    # ---- Trigger ----
+    def begin_trigger(self, msg=None):
+        """Gọi trong listener khi trigger Start được chấp nhận; msg None khi trigger đến từ luật tín hiệu."""
+        now, wall = time.monotonic(), time.time()
+        trace = TriggerTrace(now, wall, f"{msg.arbitration_id:#X}" if msg is not None else "rule")
+        bus_timestamp = getattr(msg, "timestamp", 0.0) if msg is not None else 0.0
+        if bus_timestamp:
+            delay = wall - bus_timestamp
+            if 0.0 <= delay < BUS_CLOCK_TOLERANCE:
+                trace.latencies[HOP_BUS] = delay * 1000.0
+                self.observe(trigger_histogram(HOP_BUS), delay * 1000.0)
+            else:
+                self.increment("trigger_bus_clock_mismatch")
+        self.increment("triggers")
+        self._trace = trace
+        return trace
+
+    def mark_trigger(self, hop):
+        """Ghi chặng hop của trigger đang đo (chỉ lần đầu). Trả về độ trễ từ listener (ms) hoặc None."""
+        now = time.monotonic()
+        trace = self._trace
+        if trace is None:
+            return None
+        with self._lock:
+            if hop in trace.latencies:
+                return None # Camera khác / frame sau của cùng trigger
+            latency = trace.latencies[hop] = (now - trace.origin) * 1000.0
+        self.observe(trigger_histogram(hop), latency)
+        return latency
+
+    @property
+    def last_trigger(self):
+        return self._trace
+
+    # ---- Đọc ----
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            cpu = dict(self._cpu)
+            counters = dict(self._counters)
+        trace = self._trace
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "process_cpu_s": time.process_time(),
+            "histograms": {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            "cpu": {stage: {"seconds": meter.seconds, "percent": meter.percent()}
+                    for stage, meter in sorted(cpu.items())},
+            "gauges": dict(self._gauges),
+            "counters": counters,
+            "last_trigger": None if trace is None else {
+                "time": trace.wall, "source": trace.source, "latencies_ms": dict(trace.latencies)},
+        }
+
+
+def format_text(snapshot):
+    """Snapshot -> text kiểu Prometheus (histogram xuất dạng summary trên cửa sổ trượt)."""
+    lines = []
+    for name, summary in snapshot["histograms"].items():
+        metric = METRICS_PREFIX + name
+        lines.append(f"# TYPE {metric} summary")
+        for label in ("p50", "p95", "p99"):
+            if label in summary:
+                lines.append(f'{metric}{{quantile="0.{label[1:]}"}} {summary[label]:.6g}')
+        lines.append(f"{metric}_sum {summary['sum']:.6g}")
+        lines.append(f"{metric}_count {summary['count']}")
+    if snapshot["cpu"]:
+        lines.append(f"# TYPE {METRICS_PREFIX}cpu_seconds_total counter")
+        lines.extend(f'{METRICS_PREFIX}cpu_seconds_total{{stage="{stage}"}} {cpu["seconds"]:.6g}'
+                     for stage, cpu in snapshot["cpu"].items())
+        lines.append(f"# TYPE {METRICS_PREFIX}cpu_percent gauge")
+        lines.extend(f'{METRICS_PREFIX}cpu_percent{{stage="{stage}"}} {cpu["percent"]:.4g}'
+                     for stage, cpu in snapshot["cpu"].items())
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {METRICS_PREFIX}{name} gauge")
+        lines.append(f"{METRICS_PREFIX}{name} {value:.6g}")
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {METRICS_PREFIX}{name}_total counter")
+        lines.append(f"{METRICS_PREFIX}{name}_total {value}")
+    lines.append(f"{METRICS_PREFIX}process_cpu_seconds_total {snapshot['process_cpu_s']:.6g}")
+    return "\n".join(lines) + "\n"
+
+
+_HOP_LABELS = {HOP_BUS: "bus->listener", HOP_DISPATCH: "-> lệnh ghi", HOP_START: "-> start_rec",
+               HOP_FIRST_WRITE: "-> ghi đầu", HOP_FIRST_LIVE_WRITE: "-> frame live"}
+
+
+def _summary_row(label, summary, unit_format="{:7.1f}"):
+    if not summary.get("window"):
+        return f"{label:<16}{0:>6}" + "      -" * 3
+    values = "".join(unit_format.format(summary[key]) for key in ("p50", "p95", "max"))
+    return f"{label:<16}{summary['count']:>6}{values}"
+
+
+def format_panel(snapshot):
+    """Bảng text ngắn cho khung thống kê của GUI."""
+    histograms = snapshot["histograms"]
+    lines = [f"{'Trigger (ms)':<16}{'n':>6}{'p50':>7}{'p95':>7}{'max':>7}"]
+    for hop in TRIGGER_HOPS:
+        lines.append(_summary_row(_HOP_LABELS[hop], histograms.get(trigger_histogram(hop), {})))
+    last = snapshot["last_trigger"]
+    if last:
+        lines.append("Gần nhất: " + " | ".join(f"{_HOP_LABELS[hop].lstrip('-> ')} {last['latencies_ms'][hop]:.1f}"
+                                                 for hop in TRIGGER_HOPS if hop in last["latencies_ms"]))
+    lines.append(_summary_row("Jitter cam (ms)", histograms.get(JITTER, {})))
+    lines.append(_summary_row("Hàng đợi ghi", histograms.get(WRITER_QUEUE, {}), "{:7.0f}"))
+    if snapshot["cpu"]:
+        lines.append("CPU: " + ", ".join(f"{stage} {cpu['percent']:.0f}%" for stage, cpu in snapshot["cpu"].items()))
+    return "\n".join(lines)
+
+
+def _write_atomic(path, text):
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp, path) # Người đọc không bao giờ thấy file ghi dở
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        snapshot = self.registry.snapshot()
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(snapshot).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = format_text(snapshot).encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Không in mỗi lần scrape
+
+
+class MetricsExporter(threading.Thread):
+    """Ghi định kỳ metrics.json + metrics.prom vào <thư mục lưu>/metrics; tùy chọn phục vụ /metrics, /metrics.json
+    trên 127.0.0.1.
+    """
+
+    def __init__(self, registry, directory, interval=DEFAULT_EXPORT_INTERVAL, port=0):
+        super().__init__(name="MetricsExporter", daemon=True)
+        self.registry = registry
+        self.directory = directory
+        self.interval = max(0.5, float(interval))
+        self.port = int(port or 0)
+        self.server = None
+        self._stop_event = threading.Event()
+
+    def set_directory(self, directory):
+        self.directory = directory
+
+    def run(self):
+        if self.port:
+            try:
+                handler = type("MetricsHandler", (_MetricsHandler,), {"registry": self.registry})
+                self.server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), handler)
+                threading.Thread(target=self.server.serve_forever, name="MetricsHTTP", daemon=True).start()
+                print(f"MetricsExporter: Serving http://127.0.0.1:{self.port}/metrics")
+            except OSError as e:
+                print(f"MetricsExporter: Could not bind port {self.port}: {e}")
+        while not self._stop_event.wait(self.interval):
+            self.export()
+        self.export()
+
+    def export(self):
+        directory = self.directory
+        if not directory or not os.path.isdir(directory):
+            return
+        directory = os.path.join(directory, METRICS_SUBDIR)
+        snapshot = self.registry.snapshot()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _write_atomic(os.path.join(directory, METRICS_JSON), json.dumps(snapshot, indent=1))
+            _write_atomic(os.path.join(directory, METRICS_TEXT), format_text(snapshot))
+        except OSError as e:
+            print(f"MetricsExporter: Write error: {e}")
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.is_alive():
+            self.join(timeout)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics():
+    """Registry dùng chung trong tiến trình (camera, CAN và GUI ghi vào cùng một chỗ)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MetricsRegistry()
+        return _shared
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Cách dùng: python metrics.py <thư mục lưu | metrics.json>")
+        return 2
+    path = argv[0]
+    if os.path.isdir(path):
+        subdir = os.path.join(path, METRICS_SUBDIR)
+        path = os.path.join(subdir if os.path.isdir(subdir) else path, METRICS_JSON)
+    with open(path, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    print(f"{path} ({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['time']))}, "
+          f"uptime {snapshot['uptime_s']:.0f}s)")
+    print(format_panel(snapshot))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Adapter Qt cho engine: bọc CameraWorker/CanWorker, phát lại callback dưới dạng signal cho GUI.
+
+Giữ nguyên giao diện CameraThread/CanThread cũ (signal, isRunning(), wait(), stop(), ...) để MainWindow
+không phải đổi; toàn bộ logic ghi hình nằm trong engine.py và được dùng chung với daemon.
+"""
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from engine import CameraWorker, CanWorker, DEFAULT_BITRATE
+
+
+class _WorkerAdapter(QObject):
+    """Phần chung: start/stop/wait theo kiểu QThread, chuyển thuộc tính còn lại sang worker."""
+    finished = pyqtSignal()
+
+    def _bind(self, worker):
+        self.worker = worker
+        worker.on_finished = self.finished.emit # Signal phát từ luồng worker -> slot chạy ở luồng GUI
+
+    def start(self):
+        self.worker.start()
+
+    def isRunning(self):
+        return self.worker.is_alive()
+
+    def is_running(self):
+        return self.worker.is_alive()
+
+    def wait(self, msecs=None):
+        """Như QThread.wait: True nếu luồng đã kết thúc trong thời gian chờ."""
+        if self.worker.ident is not None:
+            self.worker.join(None if msecs is None else msecs / 1000.0)
+        return not self.worker.is_alive()
+
+    def request_stop(self):
+        self.worker.request_stop()
+
+    def __getattr__(self, name):
+        # Chỉ gọi khi QObject không có thuộc tính này (vd: log_ring, measured_fps, writer_thread)
+        worker = self.__dict__.get("worker")
+        if worker is None:
+            raise AttributeError(name)
+        return getattr(worker, name)
+
+
+class CameraThread(_WorkerAdapter):
+    frameReady = pyqtSignal(object) # PooledFrame cho VideoWidget
+    recordingStartedSignal = pyqtSignal()
+    recordingStoppedSignal = pyqtSignal(str) # Phát ngay khi dừng ghi (đường dẫn file tạm)
+    clipSavedSignal = pyqtSignal(str) # Phát khi clip đã hoàn tất ở luồng nền (đường dẫn đã lưu)
+    cameraErrorSignal = pyqtSignal(str)
+
+    def __init__(self, camera_source, save_dir, config=None, swap_rb=False, parent=None):
+        super().__init__(parent)
+        worker = CameraWorker(camera_source, save_dir, config)
+        worker.preview_swap_rb = swap_rb
+        worker.on_frame = self.frameReady.emit
+        worker.on_recording_started = self.recordingStartedSignal.emit
+        worker.on_recording_stopped = self.recordingStoppedSignal.emit
+        worker.on_clip_saved = self.clipSavedSignal.emit
+        worker.on_error = self.cameraErrorSignal.emit
+        self._bind(worker)
+
+    # Thuộc tính được CameraGroup/MainWindow gán trực tiếp
+    @property
+    def clip_tap(self):
+        return self.worker.clip_tap
+
+    @clip_tap.setter
+    def clip_tap(self, tap):
+        self.worker.clip_tap = tap
+
+    @property
+    def file_tag(self):
+        return self.worker.file_tag
+
+    @file_tag.setter
+    def file_tag(self, tag):
+        self.worker.file_tag = tag
+
+    @property
+    def catalog(self):
+        return self.worker.catalog
+
+    @catalog.setter
+    def catalog(self, catalog):
+        self.worker.catalog = catalog
+
+    def stop(self):
+        self.worker.stop()
+
+
+class CanThread(_WorkerAdapter):
+    startRecordingSignal = pyqtSignal()
+    stopRecordingAndSaveSignal = pyqtSignal(str) # Chuỗi lỗi/sự kiện từ payload
+    canErrorSignal = pyqtSignal(str)
+    connectionStatusSignal = pyqtSignal(bool) # True khi kết nối, False khi ngắt
+
+    def __init__(self, interface, channel, start_id_hex, stop_id_hex, emergency_id_hex=None,
+                 bitrate=DEFAULT_BITRATE, config=None, parent=None):
+        super().__init__(parent)
+        # ValueError (ID/bitrate sai) được ném ra ngay cho GUI như trước
+        worker = CanWorker(interface, channel, start_id_hex, stop_id_hex, emergency_id_hex, bitrate, config)
+        worker.on_start_trigger = self.startRecordingSignal.emit
+        worker.on_stop_trigger = self.stopRecordingAndSaveSignal.emit
+        worker.on_error = self.canErrorSignal.emit
+        worker.on_connection = self.connectionStatusSignal.emit
+        self._bind(worker)
+
+    @property
+    def log_enabled(self):
+        return self.worker.log_enabled
+
+    @log_enabled.setter
+    def log_enabled(self, enabled):
+        self.worker.log_enabled = enabled
+
+    @property
+    def record_dir(self):
+        return self.worker.record_dir
+
+    @record_dir.setter
+    def record_dir(self, directory):
+        self.worker.record_dir = directory
+
+    @property
+    def clip_tap(self):
+        return self.worker.clip_tap
+
+    @clip_tap.setter
+    def clip_tap(self, tap):
+        self.worker.clip_tap = tap
+
+    def stop(self):
+        print("CanThread: Stop request received.")
+        self.worker.stop() # Không đợi: finished được phát khi bus đã đóng
@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+"""Phát lại log CAN qua đúng đường trigger của CanWorker, kèm file video làm nguồn camera (không cần phần cứng).
+
+Log đọc bằng can.LogReader (ASC, BLF, CSV, TRC...) hoặc file .ccl của CanRecorder; nhiều file (vd: các file đã
+xoay vòng của một ngày) được nối theo thứ tự. Frame giữ nguyên timestamp gốc và được đưa vào theo:
+
+    --speed 1      đúng nhịp thời gian như lúc ghi
+    --speed 8x     nhanh gấp 8 lần (video cũng phát nhanh gấp 8)
+    --speed max    nhanh nhất có thể: video và CAN đi lần lượt trên trục thời gian của log, lệnh ghi/dừng
+                   được thực hiện xong trước khi frame video kế tiếp được đọc -> kết quả lặp lại được
+
+Kết quả: bộ clip mà cấu hình hiện tại sẽ tạo ra (trong --output) cùng báo cáo thời gian replay_report.json/.txt
+(trigger theo thời gian log, clip, độ lệch giữa trigger và frame video lúc bắt đầu/dừng ghi).
+
+    python replay.py can_logs/*.ccl --video front.mp4 --config cancam.ini --speed max
+    python replay.py drive.blf --video front.mp4 --video rear.mp4 --video-offset -1.5 --speed 4x --output out
+"""
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import can
+
+from can_pipeline import ACTION_EMERGENCY, ACTION_START, ACTION_STOP
+from can_recorder import CCL_EXTENSION, read_ccl, record_to_message
+from engine import CameraWorker, CanWorker, CaptureEngine, EngineConfig
+from frame_sources import (SPEED_MAX, SYNTHETIC_SCHEME, FileCapture, SyntheticCapture, parse_file_source,
+                           parse_synthetic)
+from segment_recorder import RECORDING_EVENT
+from shm_capture import CAPTURE_INPROCESS
+from video_pipeline import OVERFLOW_BLOCK, PACING_CAMERA
+
+REPLAY_INTERFACE = "replay"
+DEFAULT_REPLAY_SOURCE = f"{SYNTHETIC_SCHEME}640x360@25" # Không có video: vẫn tạo clip để kiểm tra trigger
+DEFAULT_TAIL_SECONDS = 2.0 # Chạy thêm sau frame cuối của log (lệnh dừng đang hoãn, writer ghi nốt)
+EPOCH_MIN = 1e9 # Timestamp lớn hơn coi như epoch (BLF, .ccl); nhỏ hơn là thời gian tương đối (ASC)
+REPORT_JSON = "replay_report.json"
+REPORT_TEXT = "replay_report.txt"
+
+
+def parse_speed(text):
+    """'1', '8x' -> 1.0, 8.0; 'max' -> SPEED_MAX."""
+    text = str(text).strip().lower()
+    if text == "max":
+        return SPEED_MAX
+    speed = float(text[:-1] if text.endswith("x") else text)
+    if not speed > 0:
+        raise ValueError(f"Tốc độ phát lại không hợp lệ: '{text}' (vd: 1, 8x, max)")
+    return speed
+
+
+def iter_log(paths):
+    """can.Message của các file log theo thứ tự, đọc dần (log cả ngày không nằm hết trong RAM)."""
+    for path in paths:
+        if path.lower().endswith(CCL_EXTENSION):
+            for record in read_ccl(path):
+                yield record_to_message(record)
+        else:
+            with can.LogReader(path) as reader:
+                yield from reader
+
+
+def format_log_time(timestamp, origin):
+    if timestamp is None:
+        return "-"
+    if timestamp >= EPOCH_MIN:
+        return datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]
+    return f"+{timestamp - origin:.3f}s"
+
+
+class ReplayClock:
+    """Trục thời gian của log dùng chung cho bus, nguồn video, máy trạng thái trigger và chỉ mục clip.
+
+    speed > 0: chạy theo đồng hồ thật nhân speed. SPEED_MAX: chỉ tiến khi mọi nguồn video đã tới mốc đó
+    (không còn video thì bus tự đẩy tới frame kế tiếp); hold() giữ video đứng yên đến khi lệnh ghi/dừng xong.
+    """
+
+    def __init__(self, origin, speed=1.0):
+        self.origin = origin
+        self.speed = float(speed)
+        self.cond = threading.Condition()
+        self.closed = False
+        self._wall_origin = None
+        self._position = origin
+        self._sources = {} # nguồn video -> mốc đã tới (SPEED_MAX)
+        self._holds = 0
+
+    @property
+    def paced(self):
+        return self.speed > 0
+
+    @property
+    def has_sources(self):
+        return bool(self._sources)
+
+    @property
+    def held(self):
+        return self._holds > 0
+
+    def start(self):
+        with self.cond:
+            self._wall_origin = time.monotonic()
+            self.cond.notify_all()
+
+    @staticmethod
+    def wall(timestamp):
+        """Thời điểm trên trục log -> epoch: chính timestamp bus đã ghi trong log (BLF/CCL ghi theo epoch)."""
+        return timestamp
+
+    def now(self):
+        """Thời điểm hiện tại trên trục log; không khóa (gọi từ listener và máy trạng thái trigger)."""
+        if not self.paced:
+            return self._position
+        if self._wall_origin is None:
+            return self.origin
+        return self.origin + (time.monotonic() - self._wall_origin) * self.speed
+
+    def wall_delay(self, timestamp):
+        """Giây đồng hồ thật đến mốc timestamp (chỉ khi paced)."""
+        return (timestamp - self.now()) / self.speed
+
+    def add_source(self, key):
+        with self.cond:
+            self._sources[key] = self.origin
+
+    def remove_source(self, key):
+        with self.cond:
+            if self._sources.pop(key, None) is not None:
+                self._advance()
+                self.cond.notify_all()
+
+    def advance(self, key, timestamp):
+        """Nguồn video key đã tới timestamp; trục log tiến tới nguồn chậm nhất."""
+        with self.cond:
+            if key in self._sources and timestamp > self._sources[key]:
+                self._sources[key] = timestamp
+                self._advance()
+
+    def advance_to(self, timestamp):
+        """Không còn nguồn video: bus hoặc vòng điều khiển đẩy trục log (SPEED_MAX)."""
+        with self.cond:
+            if not self._sources and timestamp > self._position:
+                self._position = timestamp
+                self.cond.notify_all()
+
+    def _advance(self):
+        # Gọi khi đang giữ cond
+        if self._sources:
+            target = min(self._sources.values())
+            if target > self._position:
+                self._position = target
+                self.cond.notify_all()
+
+    def hold(self):
+        if not self.paced:
+            with self.cond:
+                self._holds += 1
+
+    def release(self):
+        if not self.paced:
+            with self.cond:
+                self._holds = max(0, self._holds - 1)
+                self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class ReplayBus(can.BusABC):
+    """Bus chỉ đọc: recv() trả frame của log khi trục thời gian đã tới timestamp gốc của nó (giữ nguyên timestamp).
+
+    waiting = CanWorker đang chờ trong recv() có timeout -> mọi frame đã trả trước đó đã được xử lý xong.
+    """
+
+    def __init__(self, paths, clock=None, channel=REPLAY_INTERFACE, **kwargs):
+        self.paths = list(paths)
+        self.clock = clock
+        self.channel_info = f"replay: {', '.join(os.path.basename(path) for path in self.paths)}"
+        self._messages = iter_log(self.paths)
+        self._next = None
+        self.first_time = None
+        self.last_time = None
+        self.delivered = 0
+        self.filtered = 0
+        self.waiting = False
+        self.exhausted = False
+        self.closed = False
+        self.trigger_due = None # Callback -> giây đến lệnh dừng đang hoãn (TriggerStateMachine.time_to_due)
+        self._load_next()
+        self.first_time = self._next.timestamp if self._next is not None else None
+        super().__init__(channel=channel, **kwargs)
+
+    def _load_next(self):
+        self._next = next(self._messages, None)
+        if self._next is None:
+            self.exhausted = True
+
+    @property
+    def next_time(self):
+        return self._next.timestamp if self._next is not None else math.inf
+
+    def _due_trigger(self):
+        return self.trigger_due is not None and self.trigger_due() == 0
+
+    def caught_up(self, timestamp):
+        """Mọi frame đến timestamp đã được CanWorker xử lý và không còn lệnh dừng hoãn nào đến hạn."""
+        return self.closed or (self.waiting and self.next_time > timestamp and not self._due_trigger())
+
+    def recv(self, timeout=None):
+        clock = self.clock
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with clock.cond:
+            while not self.closed:
+                msg = self._next
+                if msg is not None:
+                    if msg.timestamp <= clock.now(): # Timestamp lùi (log nhiều kênh) -> trả ngay
+                        self._load_next()
+                        self.last_time = msg.timestamp if self.last_time is None else max(self.last_time,
+                                                                                          msg.timestamp)
+                        self.waiting = False
+                        if not self._matches_filters(msg):
+                            self.filtered += 1
+                            continue
+                        self.delivered += 1
+                        return msg
+                    if not clock.paced and not clock.has_sources:
+                        clock.advance_to(msg.timestamp)
+                        continue
+                if self._due_trigger():
+                    self.waiting = False
+                    return None # Để CanWorker phát lệnh dừng đã đến hạn trước khi video đi tiếp
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None # recv(0) của vòng theo lô: lô chưa xử lý nên không đánh dấu waiting
+                self.waiting = True
+                clock.cond.notify_all()
+                if msg is not None and clock.paced:
+                    delay = clock.wall_delay(msg.timestamp)
+                    remaining = delay if remaining is None else min(remaining, delay)
+                clock.cond.wait(remaining)
+        return None
+
+    def send(self, msg, timeout=None):
+        pass # Phát lại thụ động: không gửi gì lên bus (vd: ISO-TP Flow Control)
+
+    def shutdown(self):
+        with self.clock.cond:
+            self.closed = True
+            self.clock.cond.notify_all()
+        super().shutdown()
+
+
+class ReplayCapture:
+    """Nguồn frame đi theo ReplayClock: frame thứ k mang capture_timestamp = start + k/fps trên trục log.
+
+    Hết log thì nguồn ngừng cấp frame sau frame cuối log + tail_seconds (nguồn tổng hợp không tự hết).
+    """
+
+    def __init__(self, inner, clock, bus, start, key, tail_seconds=DEFAULT_TAIL_SECONDS):
+        self.inner = inner
+        self.clock = clock
+        self.bus = bus
+        self.start = start
+        self.key = key
+        self.tail_seconds = tail_seconds
+        self.fps = inner.fps
+        self.frames = 0
+        self.late_frames = 0 # Chế độ paced: frame đọc trễ hơn một chu kỳ so với trục log
+        self.capture_timestamp = None
+        self.log_ended = False
+        self._released = False
+
+    def isOpened(self):
+        return self.inner.isOpened()
+
+    def get(self, prop):
+        return self.inner.get(prop)
+
+    def _wait(self, timestamp):
+        clock = self.clock
+        if clock.paced:
+            delay = clock.wall_delay(timestamp)
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay * self.fps > 1.0:
+                self.late_frames += 1
+            return
+        clock.advance(self.key, timestamp)
+        with clock.cond:
+            clock.cond.wait_for(lambda: clock.closed or (not clock.held and self.bus.caught_up(timestamp)))
+
+    def _past_log_end(self, timestamp):
+        with self.clock.cond: # exhausted/last_time đổi cùng lúc trong ReplayBus.recv()
+            if not self.bus.exhausted:
+                return False
+            last = self.bus.last_time if self.bus.last_time is not None else self.clock.origin
+        return timestamp > last + self.tail_seconds
+
+    def grab(self):
+        if self.log_ended:
+            return False
+        timestamp = self.start + self.frames / self.fps
+        self._wait(timestamp)
+        if self._past_log_end(timestamp):
+            # Nguồn vẫn mở (isOpened) để camera chỉ chờ engine dừng và clip đang ghi được lưu bình thường
+            self.log_ended = True
+            self.clock.remove_source(self.key)
+            return False
+        if not self.inner.grab():
+            self.release() # Hết video: trục log không còn chờ nguồn này
+            return False
+        self.frames += 1
+        self.capture_timestamp = timestamp
+        return True
+
+    def retrieve(self, image=None):
+        return self.inner.retrieve(image)
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.inner.release()
+            self.clock.remove_source(self.key)
+
+
+class ReplayCameraWorker(CameraWorker):
+    """CameraWorker đọc video (hoặc nguồn tổng hợp) không điều tốc, nhịp do ReplayCapture/ReplayClock quyết định."""
+
+    def __init__(self, source, save_dir, config=None):
+        super().__init__(source, save_dir, config)
+        self.replay_clock = None
+        self.replay_bus = None
+        self.video_start = 0.0
+        self.replay_tail = DEFAULT_TAIL_SECONDS
+        self.replay_capture = None
+
+    def _open(self):
+        if self.source.startswith(SYNTHETIC_SCHEME):
+            inner = SyntheticCapture(*parse_synthetic(self.source[len(SYNTHETIC_SCHEME):]), speed=SPEED_MAX)
+        else:
+            inner = FileCapture(parse_file_source(self.source)[0], SPEED_MAX, loop=False)
+        self.replay_capture = ReplayCapture(inner, self.replay_clock, self.replay_bus, self.video_start, self,
+                                            self.replay_tail)
+        if not inner.isOpened():
+            self.replay_capture.release()
+            raise ConnectionError(f"Không mở được video: {self.source}")
+        return self.replay_capture
+
+
+class ReplayCanWorker(CanWorker):
+    """CanWorker đọc từ ReplayBus; ghi lại thời điểm (trên trục log) của trigger vừa xử lý.
+
+    Lệnh dừng bị hoãn (min_clip_seconds) mang thời điểm nó được thực hiện, không phải thời điểm của frame.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replay_bus = None
+        self.last_trigger_time = None
+        self._firing_due = False
+
+    def _open_bus(self):
+        print(f"CanWorker: Replaying {self.replay_bus.channel_info}")
+        self.replay_bus.trigger_due = self.trigger_state.time_to_due
+        return self.replay_bus
+
+    def _fire_due_trigger(self):
+        self._firing_due = True
+        try:
+            super()._fire_due_trigger()
+        finally:
+            self._firing_due = False
+
+    def _stamp(self, msg):
+        deferred = msg is None or self._firing_due
+        self.last_trigger_time = self.replay_bus.clock.now() if deferred else msg.timestamp
+
+    def handle_start_frame(self, msg, payload=None):
+        self._stamp(msg)
+        super().handle_start_frame(msg, payload)
+
+    def handle_stop_frame(self, msg, payload=None):
+        self._stamp(msg)
+        super().handle_stop_frame(msg, payload)
+
+    def handle_emergency_frame(self, msg, payload=None):
+        self._stamp(msg)
+        super().handle_emergency_frame(msg, payload)
+
+
+class ReplayEngine(CaptureEngine):
+    """CaptureEngine với bus và camera phát lại; ghi nhận trigger/clip cho báo cáo thời gian."""
+
+    CAMERA_WORKER = ReplayCameraWorker
+    CAN_WORKER = ReplayCanWorker
+
+    def __init__(self, config, logs, speed=1.0, video_offset=0.0):
+        self.bus = ReplayBus(logs)
+        if self.bus.first_time is None:
+            raise ValueError(f"Log không có frame nào: {', '.join(logs)}")
+        self.clock = ReplayClock(self.bus.first_time, speed)
+        self.bus.clock = self.clock
+        super().__init__(config)
+        if self.can is None:
+            raise ValueError("Thiếu start_id/stop_id trong cấu hình.")
+        self.can.replay_bus = self.bus
+        # Debounce, độ dài clip tối thiểu, luật 'for', timeout ISO-TP và chỉ mục clip theo thời gian log
+        for component in (self.can.trigger_state, self.can.rule_engine, self.can.reassembler, self.clip_tap):
+            if component is not None:
+                component.clock = self.clock.now
+        self.tail_seconds = max(DEFAULT_TAIL_SECONDS, config.min_clip_seconds)
+        for camera in self.cameras.cameras:
+            camera.replay_clock = self.clock
+            camera.replay_bus = self.bus
+            camera.video_start = self.clock.origin + video_offset
+            camera.replay_tail = self.tail_seconds
+            camera.wall_clock = self.clock.wall
+            self.clock.add_source(camera)
+        self.triggers = [] # {"action", "log_time", "event"} theo thứ tự CanWorker phát
+        self.clips = []
+        self._command_times = collections.deque() # Thời điểm log của từng lệnh trong hàng đợi điều khiển
+        self._open_clip = None
+        self._open_writers = [] # FrameWriterThread của clip đang ghi: timestamp frame đã ghi cho báo cáo
+        self._saving = collections.deque() # (clip, writers) đã dừng, chờ ClipFinalizer báo đường dẫn
+        self.wall_seconds = 0.0
+        self.interrupted = False
+
+    # --- Trigger từ CanWorker (luồng CAN) ---
+    def _on_can_start(self):
+        self.clock.hold() # SPEED_MAX: video đứng yên đến khi lệnh ghi được thực hiện
+        self.triggers.append({"action": ACTION_START, "log_time": self.can.last_trigger_time})
+        self._command_times.append(self.can.last_trigger_time)
+        super()._on_can_start()
+
+    def _on_can_stop(self, event_string):
+        self.clock.hold()
+        action = ACTION_EMERGENCY if event_string == "EmergencyStop" else ACTION_STOP
+        self.triggers.append({"action": action, "log_time": self.can.last_trigger_time, "event": event_string})
+        self._command_times.append(self.can.last_trigger_time)
+        super()._on_can_stop(event_string)
+
+    # --- Luồng điều khiển ---
+    def _skews(self, timestamp):
+        """Frame video mới nhất của từng camera lúc lệnh được thực hiện trừ thời điểm trigger (giây trên trục log).
+
+        -1/fps ở SPEED_MAX: frame đúng thời điểm trigger là frame trực tiếp đầu tiên của clip.
+        """
+        return [round(camera.frame_clock.last_timestamp - timestamp, 4)
+                if camera.frame_clock.last_timestamp is not None else None for camera in self.cameras.cameras]
+
+    def _start_recording(self, trigger_id=None):
+        timestamp = self._command_times.popleft() if self._command_times else self.clock.now()
+        try:
+            was_recording = self.recording
+            super()._start_recording(trigger_id)
+            if self.recording and not was_recording:
+                if timestamp >= EPOCH_MIN: # Tên file theo ngày của log, không phải ngày phát lại
+                    self.cameras.event_time = datetime.datetime.fromtimestamp(timestamp)
+                self._open_clip = {"start_time": timestamp, "start_skew_s": self._skews(timestamp)}
+                self._open_writers = [camera.writer_thread for camera in self.cameras.cameras]
+        finally:
+            self.clock.release()
+
+    def _stop_recording(self, event_string, trigger_id=None):
+        timestamp = self._command_times.popleft() if self._command_times else self.clock.now()
+        try:
+            clip = self._open_clip if self.recording else None
+            if clip is not None:
+                clip.update(event=event_string, stop_time=timestamp, stop_skew_s=self._skews(timestamp))
+                self.clips.append(clip)
+                self._saving.append((clip, self._open_writers))
+                self._open_clip, self._open_writers = None, []
+            super()._stop_recording(event_string, trigger_id)
+        finally:
+            self.clock.release()
+
+    def _on_event_saved(self, paths):
+        if self._saving:
+            clip, writers = self._saving.popleft()
+            clip["paths"] = [path for path in paths if path]
+            # Độ dài thật theo frame đã ghi (pre-roll có thể ngắn hơn preroll_seconds, vd: trigger sát đầu video)
+            stamps = [writer.frame_timestamps for writer in writers if writer is not None]
+            clip["frames"] = [len(ts) for ts in stamps]
+            spans = [ts[-1] - ts[0] for ts in stamps if ts]
+            clip["first_frame_time"] = min((ts[0] for ts in stamps if ts), default=None)
+            clip["duration_s"] = round(max(spans), 3) if spans else 0.0
+        super()._on_event_saved(paths)
+
+    # --- Chạy ---
+    def _finished(self):
+        if self.bus.closed or not self.can.is_running():
+            return True # CanWorker đã dừng (lỗi cấu hình/bus)
+        if not (self.bus.exhausted and self.bus.waiting):
+            return False
+        end = (self.bus.last_time if self.bus.last_time is not None else self.clock.origin) + self.tail_seconds
+        if not self.clock.paced and not self.clock.has_sources:
+            self.clock.advance_to(end) # Hết video trước khi hết log: không còn gì đẩy trục thời gian
+        return (self.clock.now() >= end and self.can.trigger_state.time_to_due() is None
+                and self._commands.empty() and not self.clock.held)
+
+    def run(self):
+        """Phát lại đến hết log (cộng DEFAULT_TAIL_SECONDS), lưu clip đang ghi rồi dừng engine."""
+        self.start()
+        started = time.monotonic()
+        self.clock.start()
+        try:
+            while not self._finished():
+                time.sleep(0.02)
+        except KeyboardInterrupt:
+            self.interrupted = True
+            print("Replay: Interrupted, saving what has been recorded...")
+        finally:
+            self.wall_seconds = time.monotonic() - started
+            self.clock.close() # Nguồn video không còn chờ bus/lệnh
+            self.stop()
+
+    def report(self, logs, videos, video_offset):
+        origin = self.clock.origin
+        last = self.bus.last_time if self.bus.last_time is not None else origin
+        span = last - origin
+        for item in self.triggers:
+            item["offset_s"] = round(item["log_time"] - origin, 4) if item["log_time"] is not None else None
+        captures = [camera.replay_capture for camera in self.cameras.cameras]
+        return {
+            "logs": list(logs),
+            "videos": list(videos),
+            "speed": "max" if not self.clock.paced else self.clock.speed,
+            "video_offset_s": video_offset,
+            "log_start": origin,
+            "log_end": last,
+            "log_seconds": round(span, 3),
+            "frames": self.bus.delivered,
+            "frames_filtered": self.bus.filtered,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "speedup": round(span / self.wall_seconds, 2) if self.wall_seconds > 0 else None,
+            "interrupted": self.interrupted,
+            "video_frames": [capture.frames if capture else 0 for capture in captures],
+            "video_late_frames": [capture.late_frames if capture else 0 for capture in captures],
+            # Frame cuối của video trên trục log: trigger sau mốc này không có hình (clip bị bỏ)
+            "video_end": [capture.start + capture.frames / capture.fps if capture else None for capture in captures],
+            "trigger_stats": self.can.trigger_state.stats(),
+            "triggers": self.triggers,
+            "clips": self.clips,
+        }
+
+
+def _format_skew(skews):
+    """Độ lệch lớn nhất giữa các camera."""
+    skews = [skew for skew in skews if skew is not None]
+    return f"{max(skews):.3f}" if skews else "-"
+
+
+def format_report(report):
+    origin = report["log_start"]
+    speed = report["speed"] if report["speed"] == "max" else f"{report['speed']:g}x"
+    lines = [
+        f"Log: {len(report['logs'])} file, {report['frames']} frame, "
+        f"{format_log_time(origin, origin)} -> {format_log_time(report['log_end'], origin)} "
+        f"({report['log_seconds']:.1f}s), speed {speed}",
+        f"Wall: {report['wall_seconds']:.1f}s ({report['speedup'] or 0:.1f}x)"
+        f"{' - INTERRUPTED' if report['interrupted'] else ''}",
+        f"Video: {', '.join(report['videos']) or DEFAULT_REPLAY_SOURCE}, offset {report['video_offset_s']:+.3f}s, "
+        f"frames {report['video_frames']}, late {report['video_late_frames']}, "
+        f"ends {[format_log_time(end, origin) for end in report['video_end']]}",
+        f"Triggers: {report['trigger_stats']['accepted']} accepted, {report['trigger_stats']['deferred']} deferred, "
+        f"dropped {report['trigger_stats']['dropped']}",
+        "",
+        f"{'Action':<10}{'Log time':>16}{'Offset (s)':>13}  Event",
+    ]
+    for item in report["triggers"]:
+        offset = f"{item['offset_s']:.3f}" if item["offset_s"] is not None else "-"
+        lines.append(f"{item['action']:<10}{format_log_time(item['log_time'], origin):>16}{offset:>13}  "
+                     f"{item.get('event', '')}")
+    lines += ["", f"{'#':<4}{'Start':>14}{'Stop':>14}{'Dur (s)':>9}{'Skew start':>12}{'Skew stop':>11}  Event -> files"]
+    for number, clip in enumerate(report["clips"], 1):
+        files = ", ".join(os.path.basename(path) for path in clip.get("paths", [])) or "-"
+        lines.append(
+            f"{number:<4}{format_log_time(clip['start_time'], origin):>14}"
+            f"{format_log_time(clip.get('stop_time'), origin):>14}{clip.get('duration_s', 0):>9.2f}"
+            f"{_format_skew(clip['start_skew_s']):>12}{_format_skew(clip.get('stop_skew_s', ())):>11}"
+            f"  {clip.get('event', '')} -> {files}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Phát lại log CAN qua đường trigger, tạo lại bộ clip từ video.")
+    parser.add_argument("logs", nargs="+", help="File log (.asc, .blf, ... hoặc .ccl), theo thứ tự thời gian")
+    parser.add_argument("--video", dest="videos", action="append", default=[],
+                        help="File video làm nguồn camera, lặp lại cho nhiều camera")
+    parser.add_argument("--video-offset", type=float, default=0.0,
+                        help="Frame đầu của video nằm ở (giây sau frame đầu của log), có thể âm")
+    parser.add_argument("--speed", type=parse_speed, default=SPEED_MAX, help="1 | 8x | max (mặc định max)")
+    parser.add_argument("--config", help="File cấu hình INI (ID trigger, debounce, pre-roll, DBC, luật...)")
+    parser.add_argument("--output", help="Thư mục lưu clip và báo cáo (mặc định replay_<thời gian>)")
+    parser.add_argument("--start-id", dest="start_id", help="Ghi đè ID bắt đầu ghi (hex)")
+    parser.add_argument("--stop-id", dest="stop_id", help="Ghi đè ID dừng & lưu (hex)")
+    parser.add_argument("--emergency-id", dest="emergency_id", help="Ghi đè ID dừng khẩn cấp (hex)")
+    parser.add_argument("--encoder", help="auto | mjpg | mp4v | xvid | raw | x264 | ffv1")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output = args.output or os.path.abspath(f"replay_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    overrides = {name: getattr(args, name) for name in ("start_id", "stop_id", "emergency_id", "encoder")
+                 if getattr(args, name) is not None}
+    # Ghi theo sự kiện trong tiến trình (đồng hồ dùng chung), không ghi lại CAN, không xuất metrics
+    overrides.update(save_dir=output, camera_sources=args.videos or [DEFAULT_REPLAY_SOURCE],
+                     capture_mode=CAPTURE_INPROCESS, capture_pacing=PACING_CAMERA, recording_mode=RECORDING_EVENT,
+                     can_interface=REPLAY_INTERFACE, can_channel=os.path.basename(args.logs[0]), can_record=False,
+                     metrics_export=False, metrics_port=0)
+    if args.speed == SPEED_MAX:
+        overrides["writer_overflow_policy"] = OVERFLOW_BLOCK # Không có thời gian thực để đuổi kịp: encoder chặn video
+    try:
+        os.makedirs(output, exist_ok=True) # Trước engine: danh mục (tên clip theo ngày của log) mở ở đây
+        config = (EngineConfig.from_file(args.config, **overrides) if args.config
+                  else EngineConfig(**overrides)).validate()
+        engine = ReplayEngine(config, args.logs, args.speed, args.video_offset)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Replay: {e}")
+        return 2
+    engine.run()
+    report = engine.report(args.logs, args.videos, args.video_offset)
+    text = format_report(report)
+    with open(os.path.join(output, REPORT_JSON), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(output, REPORT_TEXT), "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    print(text)
+    print(f"Replay: Report -> {os.path.join(output, REPORT_JSON)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Ghi liên tục kiểu dashcam: video chia thành các đoạn ngắn, giữ trong hạn mức dung lượng (không phụ thuộc Qt).
+
+Sự kiện CAN không dừng writer: các đoạn phủ khoảng thời gian sự kiện được ghim rồi hard link vào thư mục
+sự kiện kèm danh sách concat cho ffmpeg. Khi chương trình bị sập chỉ mất đoạn đang ghi dở.
+"""
+import array
+import collections
+import datetime
+import os
+import shutil
+import threading
+
+from encoders import DEFAULT_ENCODER, PRESET_BALANCED, open_writer
+from video_pipeline import FrameWriterThread
+
+RECORDING_EVENT = "event"       # Chỉ ghi từ lệnh Start đến lệnh Stop (cũ)
+RECORDING_SEGMENTS = "segments" # Ghi liên tục theo đoạn, sự kiện chỉ ghim và link đoạn
+RECORDING_MODES = (RECORDING_EVENT, RECORDING_SEGMENTS)
+DEFAULT_SEGMENT_SECONDS = 10.0
+DEFAULT_SEGMENT_QUOTA_BYTES = 8 * 1024 * 1024 * 1024 # Mỗi camera; 0 = không giới hạn
+SEGMENT_SUBDIR = "segments"
+SEGMENT_PREFIX = "seg_"
+CONCAT_LIST_NAME = "segments.txt"
+
+
+class Segment:
+    """Một file đoạn: timestamp monotonic của frame đầu/cuối và của từng frame trong đoạn."""
+
+    def __init__(self, path, start, frame_timestamps=None):
+        self.path = path
+        self.start = start
+        self.end = start
+        self.frame_timestamps = frame_timestamps if frame_timestamps is not None else array.array("d")
+        self.size = 0
+
+    def overlaps(self, start, end):
+        return self.end >= start and self.start <= end
+
+
+class SegmentEvent:
+    """Sự kiện đã ghim: các đoạn phủ [start, end] được link vào directory khi đã đóng."""
+
+    def __init__(self, directory, start, end, can_items=None):
+        self.directory = directory
+        self.start = start
+        self.end = end
+        self.can_items = can_items or []
+        self.segments = [] # Đoạn đã link, theo thứ tự thời gian
+        self.complete = False
+
+    @property
+    def concat_list(self):
+        return os.path.join(self.directory, CONCAT_LIST_NAME)
+
+    @property
+    def frame_timestamps(self):
+        stamps = array.array("d")
+        for segment in self.segments:
+            stamps.extend(segment.frame_timestamps)
+        return stamps
+
+
+def link_or_copy(src, dst):
+    """Hard link (O(1), không tốn thêm dung lượng); hệ thống file không hỗ trợ thì sao chép."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def write_concat_list(path, names):
+    """Danh sách cho: ffmpeg -f concat -safe 0 -i segments.txt -c copy clip.mp4"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for name in names:
+            f.write(f"file '{name}'\n")
+    os.replace(tmp_path, path)
+
+
+class SegmentWriterThread(FrameWriterThread):
+    """FrameWriterThread ghi liên tục, đổi file sau mỗi segment_seconds (theo timestamp frame).
+
+    Đoạn cũ nhất bị xóa khi tổng dung lượng vượt quota_bytes, trừ các đoạn thuộc sự kiện đang mở.
+    mark_event_start()/pin_event() gọi từ luồng camera; việc mở/đóng file chỉ diễn ra trong luồng này.
+    """
+    TRACE_TRIGGER = False # Ghi liên tục từ lúc bật camera, không gắn với trigger nào
+
+    def __init__(self, directory, frame_size, fps, encoder=DEFAULT_ENCODER, preset=PRESET_BALANCED,
+                 segment_seconds=DEFAULT_SEGMENT_SECONDS, quota_bytes=DEFAULT_SEGMENT_QUOTA_BYTES,
+                 tag=None, on_event_complete=None, **kwargs):
+        super().__init__(None, frame_size, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fps = fps
+        self.encoder = encoder
+        self.preset = preset
+        self.segment_seconds = max(1.0, float(segment_seconds))
+        self.quota_bytes = int(quota_bytes)
+        self.tag = tag
+        self.on_event_complete = on_event_complete
+        self.video_ext = ""
+        self.current = None
+        self.closed_segments = collections.deque()
+        self.total_bytes = 0
+        self.segments_written = 0
+        self.segments_evicted = 0
+        self._sequence = 0 # Số thứ tự trong tên file: đoạn mở cùng mili giây không trùng tên
+        self._events = []      # SegmentEvent còn chờ đoạn đang ghi
+        self._open_starts = [] # Mốc bắt đầu của sự kiện đang mở: đoạn từ mốc này trở đi không bị xóa
+        self._released = False
+        self._seg_lock = threading.Lock()
+        self._scan_existing()
+
+    def _scan_existing(self):
+        """Đoạn còn lại từ lần chạy trước (vd: sau khi sập) vẫn tính vào quota và bị xóa trước tiên."""
+        tag = f"_{self.tag}" if self.tag else ""
+        for name in sorted(os.listdir(self.directory)):
+            root = os.path.splitext(name)[0]
+            if not name.startswith(SEGMENT_PREFIX) or not root.endswith(tag):
+                continue
+            path = os.path.join(self.directory, name)
+            segment = Segment(path, float("-inf"))
+            segment.size = os.path.getsize(path)
+            self.closed_segments.append(segment)
+            self.total_bytes += segment.size
+        self._evict()
+
+    # --- Luồng ghi ---
+    def _open_segment(self, timestamp):
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        tag = f"_{self.tag}" if self.tag else ""
+        self._sequence += 1
+        name = f"{SEGMENT_PREFIX}{stamp}_{self._sequence:06d}{tag}"
+        self.writer, spec, path = open_writer(os.path.join(self.directory, name),
+                                              self.fps, self.frame_size, self.encoder, self.preset)
+        self.video_ext = spec.ext
+        # run() ghi timestamp vào self.frame_timestamps: mỗi đoạn giữ mảng riêng
+        self.frame_timestamps = array.array("d")
+        self.current = Segment(path, timestamp, self.frame_timestamps)
+
+    def _close_segment(self):
+        segment, writer = self.current, self.writer
+        self.current = None
+        self.writer = None
+        try:
+            writer.release()
+        except Exception as release_e:
+            print(f"SegmentWriter: Error releasing segment writer: {release_e}")
+        segment.size = os.path.getsize(segment.path) if os.path.exists(segment.path) else 0
+        with self._seg_lock:
+            self.closed_segments.append(segment)
+            self.total_bytes += segment.size
+            self.segments_written += 1
+            completed = self._link_pending(segment)
+            self._evict()
+        for event in completed:
+            self._finish(event)
+
+    def _write(self, frame, timestamp):
+        if self.current is not None and timestamp - self.current.start >= self.segment_seconds:
+            self._close_segment()
+        if self.current is None:
+            self._open_segment(timestamp)
+        self.current.end = timestamp
+        super()._write(frame, timestamp)
+
+    def _release(self):
+        if self.current is not None:
+            self._close_segment()
+        with self._seg_lock:
+            pending, self._events = self._events, []
+            self._released = True
+        for event in pending: # Không còn đoạn mới: hoàn tất với các đoạn đã có
+            self._finish(event)
+
+    # --- Quota ---
+    def _pinned(self, segment):
+        return any(segment.end >= start for start in self._open_starts)
+
+    def _evict(self):
+        if self.quota_bytes <= 0:
+            return
+        for segment in list(self.closed_segments):
+            if self.total_bytes <= self.quota_bytes:
+                return
+            if self._pinned(segment):
+                continue
+            try:
+                os.remove(segment.path) # Bản hard link trong thư mục sự kiện vẫn còn
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"SegmentWriter: Could not delete {segment.path}: {e}")
+                continue
+            self.closed_segments.remove(segment)
+            self.total_bytes -= segment.size
+            self.segments_evicted += 1
+        if self.total_bytes > self.quota_bytes:
+            print(f"SegmentWriter: Warning: quota exceeded by pinned segments ({self.total_bytes} bytes).")
+
+    # --- Sự kiện ---
+    def _link(self, event, segment):
+        try:
+            link_or_copy(segment.path, os.path.join(event.directory, os.path.basename(segment.path)))
+        except OSError as e:
+            print(f"SegmentWriter: Could not link {segment.path}: {e}")
+            return
+        event.segments.append(segment)
+
+    def _link_pending(self, segment):
+        """Link đoạn vừa đóng vào các sự kiện chờ; trả về các sự kiện đã đủ đoạn."""
+        completed = []
+        for event in list(self._events):
+            if segment.overlaps(event.start, event.end):
+                self._link(event, segment)
+            if segment.end >= event.end:
+                self._events.remove(event)
+                completed.append(event)
+        return completed
+
+    def _finish(self, event):
+        try:
+            write_concat_list(event.concat_list, [os.path.basename(s.path) for s in event.segments])
+        except OSError as e:
+            print(f"SegmentWriter: Could not write concat list: {e}")
+        event.complete = True
+        print(f"SegmentWriter: Event complete: {event.directory} ({len(event.segments)} segment(s))")
+        if self.on_event_complete:
+            try:
+                self.on_event_complete(event)
+            except Exception as e:
+                print(f"SegmentWriter: Event callback error: {e}")
+
+    def mark_event_start(self, start):
+        """Từ mốc start (monotonic), đoạn không bị xóa cho đến khi sự kiện được ghim."""
+        with self._seg_lock:
+            self._open_starts.append(start)
+
+    def pin_event(self, start, end, directory, can_items=None):
+        """Link các đoạn phủ [start, end] vào directory; đoạn đang ghi được link khi đóng.
+
+        Không chờ writer: trả về SegmentEvent ngay, on_event_complete được gọi khi đủ đoạn.
+        """
+        os.makedirs(directory, exist_ok=True)
+        event = SegmentEvent(directory, start, end, can_items)
+        with self._seg_lock:
+            if start in self._open_starts:
+                self._open_starts.remove(start)
+            for segment in self.closed_segments:
+                if segment.overlaps(start, end):
+                    self._link(event, segment)
+            done = self._released or (bool(event.segments) and event.segments[-1].end >= end)
+            if not done:
+                self._events.append(event)
+        if done:
+            self._finish(event)
+        return event
+
+    def stats(self):
+        counters = super().stats()
+        counters.update(segments=len(self.closed_segments), segment_bytes=self.total_bytes,
+                        segments_evicted=self.segments_evicted)
+        return counters
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Đọc camera trong tiến trình riêng, trao frame qua vòng đệm shared memory (không phụ thuộc Qt).
+
+Mỗi nguồn camera chạy trong một tiến trình con với GIL riêng: grab/retrieve ghi thẳng vào một ô của
+SharedFrameRing. Tiến trình chính đọc frame dưới dạng view numpy trên shared memory (không sao chép).
+ProcessCapture có cùng giao diện với cv2.VideoCapture để CameraThread dùng như camera thường.
+"""
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from frame_sources import is_virtual_source, open_virtual_source
+
+# ---- Cấu hình mặc định ----
+CAPTURE_INPROCESS = "inprocess" # cv2.VideoCapture trong luồng camera (cũ)
+CAPTURE_PROCESS = "process"     # Mỗi camera một tiến trình + vòng đệm shared memory
+CAPTURE_MODES = (CAPTURE_INPROCESS, CAPTURE_PROCESS)
+DEFAULT_RING_SLOTS = 4 # Số ô frame; view chỉ hợp lệ đến khi có thêm chừng ấy frame mới
+DEFAULT_OPEN_TIMEOUT = 10.0 # Giây chờ tiến trình con mở camera
+DEFAULT_GRAB_TIMEOUT = 1.0
+_HEADER_BYTES = 64 # Vùng điều khiển: bộ đếm frame đã ghi (uint64)
+_ALIGN = 64
+
+
+def _align(value):
+    return (value + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class SharedFrameRing:
+    """Vòng đệm frame có kích thước cố định trên shared memory, đồng bộ bằng seqlock từng ô.
+
+    Frame thứ n (đếm từ 1) nằm ở ô (n - 1) % slots. seq của ô = 2n - 1 khi đang ghi, 2n khi đã ghi xong:
+    người đọc kiểm tra seq trước và sau khi dùng dữ liệu để phát hiện ô bị ghi đè. Chỉ một tiến trình ghi.
+    """
+
+    def __init__(self, shm, slots, shape, dtype, owner):
+        self.shm = shm
+        self.slots = int(slots)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        buf = shm.buf
+        self._control = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=0)
+        self._seq = np.ndarray((self.slots,), dtype=np.uint64, buffer=buf, offset=_HEADER_BYTES)
+        self._ts = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=_HEADER_BYTES + 8 * self.slots)
+        frames_offset = _align(_HEADER_BYTES + 16 * self.slots)
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=buf, offset=frames_offset)
+
+    @staticmethod
+    def required_bytes(slots, shape, dtype):
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return _align(_HEADER_BYTES + 16 * slots) + slots * frame_bytes
+
+    @classmethod
+    def create(cls, slots, shape, dtype=np.uint8):
+        shm = shared_memory.SharedMemory(create=True, size=cls.required_bytes(slots, shape, dtype))
+        ring = cls(shm, slots, shape, dtype, owner=True)
+        ring._control[0] = 0
+        ring._seq[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots, shape, dtype=np.uint8):
+        return cls(shared_memory.SharedMemory(name=name), slots, shape, dtype, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_count(self):
+        return int(self._control[0])
+
+    # --- Phía ghi (tiến trình camera) ---
+    def begin_write(self):
+        """Trả về (số thứ tự frame, view ô cần ghi). Ô được đánh dấu 'đang ghi' cho tới commit()."""
+        count = int(self._control[0]) + 1
+        slot = (count - 1) % self.slots
+        self._seq[slot] = 2 * count - 1
+        return count, self.frames[slot]
+
+    def commit(self, count, timestamp):
+        slot = (count - 1) % self.slots
+        self._ts[slot] = timestamp
+        self._seq[slot] = 2 * count
+        self._control[0] = count
+
+    # --- Phía đọc ---
+    def valid(self, count):
+        """Frame count còn nguyên trong ô của nó (chưa bị ghi đè/đang ghi)."""
+        return count > 0 and int(self._seq[(count - 1) % self.slots]) == 2 * count
+
+    def view(self, count):
+        """(timestamp, view không sao chép) của frame count; None nếu không còn hợp lệ."""
+        slot = (count - 1) % self.slots
+        if not self.valid(count):
+            return None
+        return float(self._ts[slot]), self.frames[slot]
+
+    def read_latest(self, out=None):
+        """Sao chép frame mới nhất (thử lại nếu bị ghi đè giữa chừng). Trả về (count, timestamp, frame)."""
+        while True:
+            count = self.write_count
+            if count == 0:
+                return 0, None, None
+            slot = (count - 1) % self.slots
+            if not self.valid(count):
+                continue
+            timestamp = float(self._ts[slot])
+            if out is None:
+                out = np.empty(self.shape, dtype=self.dtype)
+            np.copyto(out, self.frames[slot])
+            if self.valid(count):
+                return count, timestamp, out
+
+    def close(self):
+        # Bỏ tham chiếu view trước khi đóng, nếu không SharedMemory.close() báo BufferError
+        self._control = self._seq = self._ts = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError: # Còn view đang được giữ ở nơi khác: vùng nhớ được giải phóng khi view bị thu hồi
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _open_capture(source, api_preference):
+    if is_virtual_source(source):
+        return open_virtual_source(source) # Nguồn tổng hợp/file cho benchmark, replay
+    try:
+        index = int(source)
+    except (TypeError, ValueError):
+        return cv2.VideoCapture(source)
+    if api_preference is not None:
+        return cv2.VideoCapture(index, api_preference)
+    return cv2.VideoCapture(index)
+
+
+def _capture_worker(source, api_preference, slots, conn, frame_ready, stop_event):
+    """Tiến trình con: mở camera, báo kích thước frame, rồi ghi liên tục vào vòng đệm do cha tạo."""
+    cap = _open_capture(source, api_preference)
+    ring = None
+    try:
+        if not cap or not cap.isOpened():
+            conn.send(("error", f"Không thể mở camera: {source}"))
+            return
+        ok, first = cap.read()
+        if not ok or first is None:
+            conn.send(("error", f"Không đọc được frame đầu tiên từ camera: {source}"))
+            return
+        props = {prop: cap.get(prop) for prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS)}
+        conn.send(("opened", first.shape, first.dtype.str, props))
+        if not conn.poll(DEFAULT_OPEN_TIMEOUT):
+            return
+        ring = SharedFrameRing.attach(conn.recv(), slots, first.shape, first.dtype)
+
+        count, dst = ring.begin_write()
+        np.copyto(dst, first)
+        ring.commit(count, time.monotonic())
+        frame_ready.release()
+        while not stop_event.is_set():
+            if not cap.grab():
+                time.sleep(0.01)
+                continue
+            timestamp = time.monotonic() # CLOCK_MONOTONIC dùng chung giữa các tiến trình
+            count, dst = ring.begin_write()
+            ok, frame = cap.retrieve(dst) # Giải mã thẳng vào ô của vòng đệm khi cùng kích thước
+            if not ok or frame is None:
+                continue
+            if frame.ctypes.data != dst.ctypes.data: # OpenCV đã cấp phát mới (khác kích thước/kiểu)
+                if frame.shape != dst.shape:
+                    frame = cv2.resize(frame, (dst.shape[1], dst.shape[0]))
+                np.copyto(dst, frame.reshape(dst.shape), casting="unsafe")
+            ring.commit(count, timestamp)
+            frame_ready.release()
+    except (EOFError, BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        cap.release()
+        if ring:
+            ring.close()
+        conn.close()
+
+
+class ProcessCapture:
+    """Thay thế cv2.VideoCapture: camera chạy ở tiến trình con, frame đọc qua SharedFrameRing.
+
+    retrieve() trả về view trên shared memory (zero_copy = True): tiến trình con có thể ghi đè ô bất kỳ lúc nào
+    (sau ring.slots frame), người dùng cần giữ frame phải sao chép bằng stable_copy() (kiểm tra lại seqlock).
+    """
+    zero_copy = True
+
+    def __init__(self, source, api_preference=None, slots=DEFAULT_RING_SLOTS,
+                 open_timeout=DEFAULT_OPEN_TIMEOUT, grab_timeout=DEFAULT_GRAB_TIMEOUT):
+        self.source = source
+        self.grab_timeout = grab_timeout
+        self.ring = None
+        self.capture_timestamp = None # Timestamp monotonic do tiến trình con đóng ngay sau grab
+        self._count = 0
+        self._view = None # View shared memory vừa trả về từ retrieve()
+        self.frames_torn = 0 # Frame bị ghi đè trong lúc sao chép (bị bỏ)
+        self._props = {}
+        self.error = None
+        # spawn: không fork tiến trình đang chạy Qt
+        ctx = mp.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self._frame_ready = ctx.Semaphore(0)
+        self._stop_event = ctx.Event()
+        self._process = ctx.Process(target=_capture_worker, name=f"Capture-{source}", daemon=True,
+                                    args=(source, api_preference, slots, child_conn, self._frame_ready,
+                                          self._stop_event))
+        self._process.start()
+        child_conn.close()
+        try:
+            if not self._conn.poll(open_timeout):
+                raise TimeoutError(f"Tiến trình camera không phản hồi sau {open_timeout}s")
+            reply = self._conn.recv()
+            if reply[0] != "opened":
+                raise ConnectionError(reply[1])
+            _, shape, dtype, self._props = reply
+            self.ring = SharedFrameRing.create(slots, shape, dtype)
+            self._conn.send(self.ring.name)
+        except Exception as e:
+            self.error = str(e)
+            print(f"ProcessCapture: {e}")
+            self.release()
+
+    def isOpened(self):
+        return self.ring is not None and self._process.is_alive()
+
+    def get(self, prop):
+        return self._props.get(prop, 0.0)
+
+    def grab(self):
+        """Chờ frame mới từ tiến trình con; bỏ qua các frame đã lỡ để luôn lấy frame mới nhất."""
+        if self.ring is None or not self._frame_ready.acquire(timeout=self.grab_timeout):
+            return False
+        while self._frame_ready.acquire(False):
+            pass
+        self._count = self.ring.write_count
+        view = self.ring.view(self._count)
+        self.capture_timestamp = view[0] if view else time.monotonic()
+        return True
+
+    def retrieve(self, image=None):
+        if self.ring is None or self._count == 0:
+            return False, None
+        view = self.ring.view(self._count)
+        if view is None: # Đọc quá chậm, ô đã bị ghi đè -> sao chép frame mới nhất
+            self._count, self.capture_timestamp, frame = self.ring.read_latest(image)
+            return frame is not None, frame
+        if image is not None:
+            np.copyto(image, view[1])
+            return True, image
+        self._view = view[1]
+        return True, view[1]
+
+    def stable_copy(self, frame):
+        """Sao chép frame vừa retrieve() ra khỏi shared memory rồi kiểm tra lại seqlock của ô.
+
+        Trả về None nếu tiến trình con đã ghi vào ô trong lúc sao chép (frame rách); frame không phải view
+        (đã được sao chép bởi retrieve/read_latest) được trả lại nguyên vẹn.
+        """
+        if frame is not self._view:
+            return frame
+        self._view = None
+        copy = frame.copy()
+        if self.ring is None or not self.ring.valid(self._count):
+            self.frames_torn += 1
+            return None
+        return copy
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        self._stop_event.set()
+        if self._process.is_alive():
+            self._process.join(2.0)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(1.0)
+        self._conn.close()
+        if self.ring:
+            self.ring.close()
+            self.ring = None
+
+
+def open_capture(source, mode=CAPTURE_INPROCESS, api_preference=None):
+    """Mở nguồn camera theo chế độ: cv2.VideoCapture trong tiến trình hoặc ProcessCapture."""
+    if mode == CAPTURE_PROCESS:
+        return ProcessCapture(source, api_preference)
+    return _open_capture(source, api_preference)
+
+
+def default_api_preference():
+    return cv2.CAP_DSHOW if os.name == "nt" else None
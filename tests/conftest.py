@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Các module nằm ở thư mục gốc repo (chạy trực tiếp bằng python <file>.py): thêm vào sys.path cho pytest."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
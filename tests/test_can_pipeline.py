@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import can
+
+from can_pipeline import (ACTION_EMERGENCY, ACTION_START, ACTION_STOP, TRIGGER_IDLE, TRIGGER_RECORDING,
+                          IsoTpReassembler, TriggerStateMachine)
+
+
+def _machine(**kwargs):
+    params = dict(debounce_seconds=0.5, min_clip_seconds=2.0, holdoff_seconds=1.0)
+    params.update(kwargs)
+    return TriggerStateMachine(**params)
+
+
+def _frame(data, arbitration_id=0x7E8, extended=False):
+    return can.Message(arbitration_id=arbitration_id, is_extended_id=extended, data=bytes(data))
+
+
+class TestTriggerStateMachine:
+    def test_start_then_stop(self):
+        machine = _machine()
+        assert machine.feed(ACTION_START, None, now=10.0)
+        assert machine.state == TRIGGER_RECORDING
+        assert machine.feed(ACTION_STOP, None, now=13.0)
+        assert machine.state == TRIGGER_IDLE
+        assert machine.stats()["accepted"] == 2
+
+    def test_repeated_frames_are_debounced(self):
+        machine = _machine()
+        assert machine.feed(ACTION_START, None, now=10.0)
+        # ECU phát lặp 10 Hz: mọi frame cách frame trước < debounce đều bị bỏ, kể cả sau debounce tính từ frame đầu
+        for step in range(1, 20):
+            assert not machine.feed(ACTION_START, None, now=10.0 + step * 0.1)
+        assert machine.dropped["debounce"] == 19
+
+    def test_start_while_recording_is_dropped(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        assert not machine.feed(ACTION_START, None, now=12.0)
+        assert machine.dropped["recording"] == 1
+
+    def test_stop_when_idle_is_dropped(self):
+        machine = _machine()
+        assert not machine.feed(ACTION_STOP, None, now=1.0)
+        assert machine.dropped["idle"] == 1
+
+    def test_early_stop_is_deferred_until_min_clip(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        assert not machine.feed(ACTION_STOP, "msg", b"Evt", now=10.5)
+        assert machine.deferred == 1
+        assert machine.time_to_due(now=11.0) == 1.0
+        assert machine.pop_due(now=11.9) is None
+        assert machine.pop_due(now=12.0) == (ACTION_STOP, "msg", b"Evt")
+        assert machine.state == TRIGGER_IDLE
+        assert machine.time_to_due(now=12.0) is None
+
+    def test_second_stop_while_pending_is_dropped(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        machine.feed(ACTION_STOP, None, now=10.5)
+        assert not machine.feed(ACTION_STOP, None, now=11.5)
+        assert machine.dropped["pending"] == 1
+
+    def test_emergency_replaces_pending_stop(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        machine.feed(ACTION_STOP, None, now=10.5)
+        assert machine.feed(ACTION_EMERGENCY, None, now=10.6)
+        assert machine.state == TRIGGER_IDLE
+        assert machine.pop_due(now=20.0) is None
+
+    def test_holdoff_after_stop(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        machine.feed(ACTION_STOP, None, now=13.0)
+        assert not machine.feed(ACTION_START, None, now=13.5)
+        assert machine.dropped["holdoff"] == 1
+        assert machine.feed(ACTION_START, None, now=14.5)
+
+    def test_injected_clock(self):
+        now = [5.0]
+        machine = _machine()
+        machine.clock = lambda: now[0]
+        machine.feed(ACTION_START, None)
+        assert machine.started_at == 5.0
+        machine.feed(ACTION_STOP, None)
+        now[0] = 7.0
+        assert machine.pop_due() is not None
+
+    def test_reset(self):
+        machine = _machine()
+        machine.feed(ACTION_START, None, now=10.0)
+        machine.feed(ACTION_STOP, None, now=10.5)
+        machine.reset()
+        assert machine.state == TRIGGER_IDLE
+        assert machine.time_to_due() is None
+        assert machine.feed(ACTION_START, None, now=10.6)
+
+
+class TestIsoTpReassembler:
+    def test_single_frame(self):
+        reassembler = IsoTpReassembler()
+        assert reassembler.feed(_frame([0x04, ord("S"), ord("t"), ord("o"), ord("p"), 0, 0, 0])) == b"Stop"
+        assert reassembler.completed == 1
+
+    def test_single_frame_can_fd(self):
+        payload = bytes(range(20))
+        data = bytes([0x00, len(payload)]) + payload
+        data += bytes(64 - len(data))
+        assert IsoTpReassembler().feed(_frame(data)) == payload
+
+    def test_multi_frame(self):
+        payload = b"Overspeed_Event_01"
+        reassembler = IsoTpReassembler()
+        first_frames = []
+        reassembler.on_first_frame = first_frames.append
+        assert reassembler.feed(_frame(bytes([0x10, len(payload)]) + payload[:6]), now=0.0) is None
+        assert reassembler.feed(_frame(bytes([0x21]) + payload[6:13]), now=0.01) is None
+        assert reassembler.feed(_frame(bytes([0x22]) + payload[13:].ljust(7, b"\x00")), now=0.02) == payload
+        assert len(first_frames) == 1
+        assert reassembler.stats()["active"] == 0
+
+    def test_streams_are_per_id(self):
+        reassembler = IsoTpReassembler()
+        reassembler.feed(_frame(bytes([0x10, 10]) + b"AAAAAA", 0x100), now=0.0)
+        reassembler.feed(_frame(bytes([0x10, 10]) + b"BBBBBB", 0x100, extended=True), now=0.0)
+        assert reassembler.feed(_frame(bytes([0x21]) + b"bbbb\x00\x00\x00", 0x100, extended=True), now=0.01) \
+            == b"BBBBBBbbbb"
+        assert reassembler.feed(_frame(bytes([0x21]) + b"aaaa\x00\x00\x00", 0x100), now=0.01) == b"AAAAAAaaaa"
+
+    def test_wrong_sequence_drops_message(self):
+        reassembler = IsoTpReassembler()
+        reassembler.feed(_frame(bytes([0x10, 20]) + b"123456"), now=0.0)
+        assert reassembler.feed(_frame(bytes([0x22]) + b"7890123"), now=0.01) is None
+        assert reassembler.errors == 1
+        assert reassembler.stats()["active"] == 0
+
+    def test_timeout_between_frames(self):
+        reassembler = IsoTpReassembler(timeout=1.0)
+        reassembler.feed(_frame(bytes([0x10, 10]) + b"123456"), now=0.0)
+        assert reassembler.feed(_frame(bytes([0x21]) + b"7890\x00\x00\x00"), now=1.5) is None
+        assert reassembler.timeouts == 1
+
+    def test_too_long_is_rejected(self):
+        reassembler = IsoTpReassembler(max_length=16)
+        assert reassembler.feed(_frame(bytes([0x10, 100]) + b"123456"), now=0.0) is None
+        assert reassembler.rejected == 1
+
+    def test_raw_payloads_pass_through(self):
+        reassembler = IsoTpReassembler()
+        # ECU gửi chuỗi thô / payload rỗng thay vì ISO-TP: vẫn phải là lệnh dừng
+        assert reassembler.feed(_frame(b"1234")) == b"1234"
+        assert reassembler.feed(_frame(b"")) == b""
+        assert reassembler.feed(_frame(b" Stop")) == b" Stop"
+        assert reassembler.feed(_frame(b"\x00\x00")) == b"\x00\x00"
+        assert reassembler.raw == 4
+
+    def test_consecutive_without_first_frame_is_raw(self):
+        assert IsoTpReassembler().feed(_frame(b"\x21abc")) == b"\x21abc"
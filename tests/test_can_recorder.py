@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+
+import can
+import pytest
+
+from can_recorder import (CCL_EXTENSION, FLAG_EXTENDED, FLAG_FD, FORMAT_BINARY, CanRecorder, read_ccl,
+                          record_to_message)
+
+
+def _messages():
+    return [
+        can.Message(timestamp=1000.0, arbitration_id=0x100, is_extended_id=False, data=b"\x01\x02"),
+        can.Message(timestamp=1000.5, arbitration_id=0x18FF50E5, is_extended_id=True, data=bytes(range(8))),
+        can.Message(timestamp=1001.0, arbitration_id=0x7E8, is_extended_id=False, is_fd=True,
+                    bitrate_switch=True, data=bytes(range(64))),
+        can.Message(timestamp=1001.25, arbitration_id=0x200, is_extended_id=False, is_remote_frame=True, dlc=4),
+        can.Message(timestamp=1002.0, arbitration_id=0x300, is_extended_id=False, data=b""),
+    ]
+
+
+def _record(directory, messages, **kwargs):
+    recorder = CanRecorder(str(directory), fmt=FORMAT_BINARY, flush_interval=0.01, **kwargs)
+    recorder.start()
+    recorder.push_batch(messages)
+    recorder.stop()
+    return recorder
+
+
+def test_ccl_round_trip(tmp_path):
+    messages = _messages()
+    recorder = _record(tmp_path, messages)
+    assert recorder.frames_written == len(messages)
+    path, = recorder.files_written
+    assert path.endswith(CCL_EXTENSION)
+    records = list(read_ccl(path))
+    assert len(records) == len(messages)
+    for record, original in zip(records, messages):
+        restored = record_to_message(record)
+        assert restored.timestamp == original.timestamp
+        assert restored.arbitration_id == original.arbitration_id
+        assert restored.is_extended_id == original.is_extended_id
+        assert restored.is_fd == original.is_fd
+        assert restored.bitrate_switch == original.bitrate_switch
+        assert restored.is_remote_frame == original.is_remote_frame
+        assert bytes(restored.data) == bytes(original.data)
+    assert records[1][2] & FLAG_EXTENDED
+    assert records[2][2] & FLAG_FD and records[2][3] == 64
+
+
+def test_truncated_file_stops_at_last_full_record(tmp_path):
+    path, = _record(tmp_path, _messages()[:2]).files_written
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3) # Mất điện giữa bản ghi cuối
+    assert [record[1] for record in read_ccl(path)] == [0x100]
+
+
+def test_invalid_file_is_rejected(tmp_path):
+    path = tmp_path / "bad.ccl"
+    path.write_bytes(b"NOPE" + bytes(40))
+    with pytest.raises(ValueError):
+        list(read_ccl(str(path)))
+
+
+def test_quota_evicts_oldest_logs(tmp_path):
+    for day in range(1, 4):
+        (tmp_path / f"can_2020010{day}_000000_000{CCL_EXTENSION}").write_bytes(bytes(1000))
+    (tmp_path / "notes.txt").write_bytes(bytes(5000)) # Không phải log CAN: không bị xóa
+    recorder = _record(tmp_path, _messages(), quota_bytes=2500)
+    assert recorder.files_evicted == 1
+    remaining = sorted(os.listdir(tmp_path))
+    assert f"can_20200101_000000_000{CCL_EXTENSION}" not in remaining
+    assert "notes.txt" in remaining
+    assert os.path.basename(recorder.files_written[0]) in remaining
+
+
+def test_write_error_is_reported(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    errors = []
+    recorder = CanRecorder(str(blocker / "logs"))
+    recorder.on_error = errors.append
+    recorder.start()
+    recorder.join(5.0)
+    assert len(errors) == 1
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import random
+
+import can
+import numpy as np
+import pytest
+
+from dbc_decoder import FD_WIDTH, Signal, SignalDecoder, compile_signal, load_dbc
+
+DBC_TEXT = """VERSION ""
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.1,0) [0|6553.5] "km/h" Vector__XXX
+ SG_ Temp : 16|8@1- (1,-40) [-40|215] "degC" Vector__XXX
+ SG_ Rpm : 31|16@0+ (0.25,0) [0|16383.75] "rpm" Vector__XXX
+BO_ 2566868992 Wheel: 8 ECU
+ SG_ Mode M : 0|4@1+ (1,0) [0|15] "" Vector__XXX
+ SG_ SpeedA m0 : 8|16@1+ (1,0) [0|65535] "" Vector__XXX
+ SG_ Speed : 7|12@0+ (0.5,0) [0|2047.5] "km/h" Vector__XXX
+"""
+
+
+def _signal(start, length, little_endian, signed=False, factor=1.0, offset=0.0, name="S", message_id=0x100):
+    return Signal(name, message_id, False, start, length, little_endian, signed, factor, offset, 0.0, 0.0, "")
+
+
+def _reference_raw(signal, data):
+    """Trích bit từng bit theo định nghĩa DBC (Intel: LSB tại start; Motorola: MSB tại start, đánh số răng cưa)."""
+    bits = [(data[i // 8] >> (i % 8)) & 1 for i in range(len(data) * 8)]
+    value = 0
+    if signal.little_endian:
+        for k in range(signal.length):
+            value |= bits[signal.start + k] << k
+    else:
+        position = signal.start
+        for _ in range(signal.length):
+            value = (value << 1) | bits[position]
+            position = position - 1 if position % 8 else position + 15
+    if signal.signed and value >= 1 << (signal.length - 1):
+        value -= 1 << signal.length
+    return value
+
+
+def _decode_one(signal, data, width=8):
+    decoder = SignalDecoder([signal], width=width)
+    decoder.push(can.Message(arbitration_id=signal.message_id, is_extended_id=signal.extended, data=bytes(data)))
+    (compiled, _, values), = decoder.decode_pending()
+    return values[0, 0]
+
+
+def test_load_dbc(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC_TEXT)
+    messages, signals, skipped = load_dbc(str(path))
+    assert messages == {(0x100, False): "Engine", (0x18FF5000, True): "Wheel"}
+    assert skipped == 1 # Tín hiệu multiplex m0
+    by_name = {(s.message, s.name): s for s in signals}
+    assert set(by_name) == {("Engine", "Speed"), ("Engine", "Temp"), ("Engine", "Rpm"), ("Wheel", "Mode"),
+                            ("Wheel", "Speed")}
+    temp = by_name[("Engine", "Temp")]
+    assert temp.signed and temp.factor == 1.0 and temp.offset == -40.0
+    assert not by_name[("Engine", "Rpm")].little_endian
+
+
+def test_little_endian_values():
+    data = bytes([0xE8, 0x03, 0xF6, 0, 0, 0, 0, 0])
+    assert _decode_one(_signal(0, 16, True, factor=0.1), data) == pytest.approx(100.0)
+    assert _decode_one(_signal(16, 8, True, signed=True), data) == -10.0
+
+
+def test_big_endian_value():
+    # Motorola start bit 7, 16 bit: byte 0 là MSB
+    assert _decode_one(_signal(7, 16, False), bytes([0x12, 0x34, 0, 0, 0, 0, 0, 0])) == 0x1234
+    # Tín hiệu 12 bit bắt đầu giữa byte
+    assert _decode_one(_signal(3, 12, False), bytes([0x0A, 0xBC, 0, 0, 0, 0, 0, 0])) == 0xABC
+
+
+@pytest.mark.parametrize("little_endian", [True, False])
+def test_matches_bitwise_reference(little_endian):
+    rng = random.Random(1234)
+    for _ in range(300):
+        length = rng.randint(1, 32)
+        signed = rng.random() < 0.5
+        if little_endian:
+            start = rng.randint(0, 64 - length)
+        else:
+            msb = rng.randint(0, 64 - length) # Vị trí MSB tính từ bit cao của byte 0
+            start = (msb // 8) * 8 + (7 - msb % 8)
+        signal = _signal(start, length, little_endian, signed)
+        data = bytes(rng.randrange(256) for _ in range(8))
+        assert _decode_one(signal, data) == _reference_raw(signal, data), signal
+
+
+def test_can_fd_window_beyond_byte_8():
+    signal = _signal(60 * 8, 16, True)
+    data = bytearray(FD_WIDTH)
+    data[60:62] = (0xBEEF).to_bytes(2, "little")
+    assert _decode_one(signal, data, width=FD_WIDTH) == 0xBEEF
+
+
+def test_signal_outside_frame_is_rejected():
+    with pytest.raises(ValueError):
+        compile_signal(_signal(60, 16, True))
+
+
+def test_latest_value_and_snapshot(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC_TEXT)
+    decoder = SignalDecoder.from_dbc(str(path))
+    assert decoder.value("Rpm") is None
+    for speed in (100, 200, 300):
+        decoder.push(can.Message(arbitration_id=0x100, is_extended_id=False,
+                                 data=speed.to_bytes(2, "little") + bytes(6)))
+    decoder.decode_pending()
+    assert decoder.value("Engine.Speed") == pytest.approx(30.0)
+    assert decoder.snapshot()["Engine.Speed"] == pytest.approx(30.0)
+    assert "Wheel.Speed" not in decoder.snapshot()
+    with pytest.raises(ValueError, match="Engine.Speed, Wheel.Speed"):
+        decoder.value("Speed")
+
+
+def test_frames_of_other_ids_are_ignored():
+    decoder = SignalDecoder([_signal(0, 8, True)])
+    decoder.push(can.Message(arbitration_id=0x101, is_extended_id=False, data=b"\x01"))
+    decoder.push(can.Message(arbitration_id=0x100, is_extended_id=True, data=b"\x01"))
+    assert decoder.decode_pending() == []
+    assert np.isnan(decoder.latest[0])
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Hồi quy toàn đường trigger -> clip: phát lại log CAN dựng sẵn với nguồn video tổng hợp (--speed max)."""
+import json
+import os
+
+import can
+import pytest
+
+pytest.importorskip("cv2")
+
+import replay # noqa: E402 (cần cv2)
+from clip_index import ClipIndex, index_path_for # noqa: E402
+
+LOG_START = 1700000000.0 # Epoch: BLF ghi timestamp tuyệt đối
+BACKGROUND_ID = 0x123
+START_ID = 0x100
+STOP_ID = 0x200
+# (giây sau frame đầu, ID, payload)
+TRIGGERS = [(2.0, START_ID, b""), (2.05, START_ID, b""), (5.0, STOP_ID, b"Evt"),
+            (7.0, START_ID, b""), (7.5, STOP_ID, b"Late")]
+
+
+def _write_log(path, seconds=10.0, period=0.01):
+    writer = can.BLFWriter(str(path))
+    triggers = list(TRIGGERS)
+    for step in range(int(seconds / period)):
+        offset = step * period
+        writer.on_message_received(can.Message(timestamp=LOG_START + offset, arbitration_id=BACKGROUND_ID,
+                                               is_extended_id=False, data=bytes([step % 256])))
+        while triggers and triggers[0][0] <= offset + 1e-9:
+            at, arbitration_id, payload = triggers.pop(0)
+            writer.on_message_received(can.Message(timestamp=LOG_START + at + 0.001, arbitration_id=arbitration_id,
+                                                   is_extended_id=False, data=payload))
+    writer.stop()
+
+
+@pytest.fixture(scope="module")
+def report(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("replay")
+    log = directory / "log.blf"
+    _write_log(log)
+    config = directory / "replay.ini"
+    config.write_text("[can]\ntrigger_debounce_seconds = 0.5\nmin_clip_seconds = 2.0\n"
+                      "[camera]\npreroll_seconds = 1.0\n")
+    output = directory / "out"
+    assert replay.main([str(log), "--video", "synthetic:160x120@20", "--start-id", f"{START_ID:X}",
+                        "--stop-id", f"{STOP_ID:X}", "--config", str(config), "--output", str(output),
+                        "--encoder", "mjpg"]) == 0
+    with open(output / replay.REPORT_JSON, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_triggers_follow_log_time(report):
+    assert [item["action"] for item in report["triggers"]] == ["start", "stop", "start", "stop"]
+    offsets = [item["offset_s"] for item in report["triggers"]]
+    assert offsets[:3] == [2.001, 5.001, 7.001]
+    # Stop lúc 7.5 s bị hoãn đến start + min_clip_seconds, thực hiện ở frame video kế tiếp (20 fps)
+    assert 9.001 <= offsets[3] <= 9.001 + 0.05 + 1e-6
+    stats = report["trigger_stats"]
+    assert stats["dropped"] == {"debounce": 1}
+    assert stats["deferred"] == 1
+
+
+def test_clips(report):
+    clips = report["clips"]
+    assert [clip["event"] for clip in clips] == ["Evt", "Late"]
+    for clip in clips:
+        path, = clip["paths"]
+        assert os.path.exists(path)
+    first = clips[0]
+    # Pre-roll 1 s trước start + 3 s ghi trực tiếp, 20 fps
+    assert first["first_frame_time"] == pytest.approx(LOG_START + 1.0, abs=0.1)
+    assert first["duration_s"] == pytest.approx(4.0, abs=0.15)
+    assert clips[1]["stop_time"] == pytest.approx(LOG_START + 9.001, abs=0.051)
+
+
+def test_clip_index_on_log_clock(report):
+    path = report["clips"][0]["paths"][0]
+    index = ClipIndex.load(index_path_for(path))
+    assert index.wall_start == pytest.approx(report["clips"][0]["first_frame_time"])
+    assert set(index.can["arbitration_id"]) == {BACKGROUND_ID, START_ID} # Frame Stop đến sau frame cuối của clip
+
+
+def test_video_stops_after_log_tail(report):
+    video_end, = report["video_end"]
+    assert video_end <= report["log_end"] + replay.DEFAULT_TAIL_SECONDS + 0.1
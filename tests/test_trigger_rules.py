@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import can
+import pytest
+
+from can_pipeline import ACTION_EMERGENCY, ACTION_START, ACTION_STOP
+from dbc_decoder import Signal, SignalDecoder
+from trigger_rules import TriggerRuleEngine, compile_rule
+
+
+def _frame(arbitration_id, data, extended=False):
+    return can.Message(arbitration_id=arbitration_id, is_extended_id=extended, data=bytes(data))
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')",
+    "open('/etc/passwd')",
+    "data.__class__",
+    "(lambda: 1)()",
+    "[x for x in data]",
+    "data[0:2] == 1",
+    "data[id] == 1",
+    "'text' == 1",
+    "x := 1",
+    "id if data else dlc",
+    "{1: 2}",
+    "unknown_name > 1",
+])
+def test_unsafe_or_unsupported_syntax_is_rejected(expression):
+    with pytest.raises(ValueError):
+        compile_rule(f"start: {expression}")
+
+
+@pytest.mark.parametrize("text", [
+    "begin: id == 0x100",  # Hành động không hợp lệ
+    "start id == 0x100",   # Thiếu ':'
+    "start: id ==",        # Lỗi cú pháp
+    "stop: 1 == 1",        # Không phụ thuộc frame hay tín hiệu
+])
+def test_malformed_rules_are_rejected(text):
+    with pytest.raises(ValueError):
+        TriggerRuleEngine([text])
+
+
+def test_compile_rule_fields():
+    rule = compile_rule("stop(Overspeed): id == 0x100 and data[2] & 0x80 for 250ms")
+    assert rule.action == ACTION_STOP
+    assert rule.event == "Overspeed"
+    assert rule.ids == frozenset({0x100})
+    assert rule.duration == pytest.approx(0.25)
+    assert rule.predicate(0x100, 3, b"\x00\x00\x80", False, ())
+    assert not rule.predicate(0x100, 3, b"\x00\x00\x7F", False, ())
+
+
+def test_default_event_name():
+    engine = TriggerRuleEngine(["start: id == 1", "stop: id == 2"])
+    assert [rule.event for rule in engine.rules] == ["Rule1", "Rule2"]
+
+
+def test_id_constraint_inference():
+    assert compile_rule("start: id in (0x100, 0x200) and data[0] == 1").ids == frozenset({0x100, 0x200})
+    assert compile_rule("start: id == 0x100 or id == 0x101").ids == frozenset({0x100, 0x101})
+    assert compile_rule("start: id == 0x100 or data[0] == 1").ids is None
+    assert compile_rule("start: 0x100 == id").ids == frozenset({0x100})
+
+
+def test_rules_indexed_by_id_and_kind():
+    engine = TriggerRuleEngine(["start: id == 0x100 and not extended", "stop: id == 0x100 and extended",
+                                "emergency: id == 0x18FF00"])
+    assert engine.frame_ids() == [(0x100, False), (0x100, True), (0x18FF00, True)]
+    assert [r.action for r in engine.on_frame(_frame(0x100, b""))] == [ACTION_START]
+    assert [r.action for r in engine.on_frame(_frame(0x100, b"", extended=True))] == [ACTION_STOP]
+    assert [r.action for r in engine.on_frame(_frame(0x18FF00, b"", extended=True))] == [ACTION_EMERGENCY]
+    assert engine.on_frame(_frame(0x101, b"")) == ()
+
+
+def test_rule_without_id_sees_every_frame():
+    engine = TriggerRuleEngine(["start: data[0] == 0xFF"])
+    assert engine.frame_ids() is None
+    assert engine.on_frame(_frame(0x123, b"\xFF"))
+
+
+def test_rising_edge_and_duration():
+    engine = TriggerRuleEngine(["start: id == 0x10 and data[0] > 5 for 1s"])
+    assert engine.on_frame(_frame(0x10, b"\x09"), now=0.0) == []
+    assert engine.on_frame(_frame(0x10, b"\x09"), now=0.5) == []
+    assert len(engine.on_frame(_frame(0x10, b"\x09"), now=1.0)) == 1
+    assert engine.on_frame(_frame(0x10, b"\x09"), now=2.0) == [] # Đã kích hoạt trong lần đúng liên tục này
+    engine.on_frame(_frame(0x10, b"\x01"), now=2.1)
+    engine.on_frame(_frame(0x10, b"\x09"), now=2.2)
+    assert len(engine.on_frame(_frame(0x10, b"\x09"), now=3.2)) == 1
+
+
+def test_short_frame_evaluates_false():
+    engine = TriggerRuleEngine(["start: id == 0x10 and data[7] == 1"])
+    assert engine.on_frame(_frame(0x10, b"\x01")) == []
+
+
+def _duplicate_signal_decoder():
+    signals = [Signal("Speed", 0x100, False, 0, 16, True, False, 0.1, 0.0, 0.0, 0.0, "km/h", "Engine"),
+               Signal("Rpm", 0x100, False, 16, 16, True, False, 1.0, 0.0, 0.0, 0.0, "rpm", "Engine"),
+               Signal("Speed", 0x200, True, 0, 16, True, False, 0.01, 0.0, 0.0, 0.0, "km/h", "Wheel")]
+    return SignalDecoder(signals)
+
+
+def test_signal_rules_by_message():
+    decoder = _duplicate_signal_decoder()
+    engine = TriggerRuleEngine(["stop(Fast): Engine.Speed > 90", "start: Rpm > 10"], decoder)
+    assert set(engine.by_message) == {(0x100, False)}
+    decoder.push(_frame(0x100, (1000).to_bytes(2, "little") + (20).to_bytes(2, "little")))
+    results = decoder.decode_pending()
+    fired = engine.on_signals([compiled.key for compiled, _, _ in results], now=0.0)
+    assert sorted(rule.text for rule in fired) == ["start: Rpm > 10", "stop(Fast): Engine.Speed > 90"]
+
+
+def test_ambiguous_signal_name_is_rejected():
+    with pytest.raises(ValueError, match="Engine.Speed, Wheel.Speed"):
+        TriggerRuleEngine(["stop: Speed > 90"], _duplicate_signal_decoder())
+    with pytest.raises(ValueError):
+        TriggerRuleEngine(["stop: Brake.Speed > 90"], _duplicate_signal_decoder())
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Luật trigger biên dịch sẵn trên CAN ID, byte payload và tín hiệu DBC đã giải mã (không phụ thuộc Qt).
+
+Mỗi dòng một luật: '<hành động>[(<sự kiện>)]: <biểu thức> [for <thời lượng>]', ví dụ:
+
+    start: id == 0x100 and data[2] & 0x80
+    stop(Overspeed): speed > 80 for 2s
+    emergency: id in (0x7E0, 0x7E8) and data[0] == 0xFF
+
+Biểu thức là tập con cú pháp Python (so sánh, and/or/not, số học, phép bit, data[i]) được kiểm tra bằng ast
+và biên dịch một lần thành closure. Biến: id, dlc, data, extended và tín hiệu trong DBC: '<Message>.<Tín hiệu>'
+hoặc tên trần khi tên đó không trùng giữa các message.
+Luật có ràng buộc 'id == ...' được đánh chỉ mục theo (ID, extended) như bảng trigger: mỗi frame chỉ đánh giá các luật
+của đúng loại ID đó ('extended' / 'not extended' trong luật giới hạn loại ID; không có thì cả hai).
+Luật chỉ dùng tín hiệu được đánh giá sau mỗi lô giải mã có message chứa tín hiệu của nó.
+Luật kích hoạt theo sườn lên (sai -> đúng, hoặc đúng liên tục đủ thời lượng 'for').
+"""
+import ast
+import re
+import time
+
+from can_pipeline import ACTION_EMERGENCY, ACTION_START, ACTION_STOP, STD_ID_MASK
+
+RULE_ACTIONS = (ACTION_START, ACTION_STOP, ACTION_EMERGENCY)
+FRAME_NAMES = ("id", "dlc", "data", "extended")
+_RULE_RE = re.compile(r"^\s*(\w+)\s*(?:\(([^)]*)\))?\s*:\s*(.+?)\s*$")
+_FOR_RE = re.compile(r"\s+for\s+(\d+(?:\.\d+)?)\s*(ms|s)?\s*$")
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.Invert,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.BitAnd, ast.BitOr, ast.BitXor,
+    ast.LShift, ast.RShift, ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Name, ast.Load, ast.Constant, ast.Subscript, ast.Tuple, ast.Attribute,
+)
+
+
+def _qualified(node):
+    """'Message.Signal' của nút Attribute dạng <tên>.<tên>; None nếu không phải dạng đó."""
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return f"{node.value.id}.{node.attr}"
+    return None
+
+
+class _SignalRewriter(ast.NodeTransformer):
+    """Tên tín hiệu (trần hoặc 'Message.Signal') -> sig[cột] trong mảng giá trị mới nhất của SignalDecoder."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.used = set() # Cột tín hiệu mà luật dùng
+
+    def _column(self, name, node):
+        column = self.columns[name]
+        self.used.add(column)
+        subscript = ast.Subscript(value=ast.Name(id="sig", ctx=ast.Load()), slice=ast.Constant(column),
+                                  ctx=ast.Load())
+        return ast.copy_location(subscript, node)
+
+    def visit_Name(self, node):
+        if node.id in FRAME_NAMES:
+            return node
+        return self._column(node.id, node)
+
+    def visit_Attribute(self, node):
+        return self._column(_qualified(node), node)
+
+
+def _validate(tree, signal_names, ambiguous=None):
+    ambiguous = ambiguous or {}
+    # Tên message trong 'Message.Signal' không phải biến: chỉ kiểm tra cả tên đầy đủ
+    message_parts = {id(node.value) for node in ast.walk(tree) if _qualified(node) is not None}
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Cú pháp không được hỗ trợ: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Hằng số không hợp lệ: {node.value!r}")
+        if isinstance(node, ast.Attribute):
+            name = _qualified(node)
+            if name is None or name not in signal_names:
+                raise ValueError(f"Tín hiệu không xác định: '{name or ast.unparse(node)}'")
+        if isinstance(node, ast.Name) and id(node) not in message_parts and node.id not in FRAME_NAMES \
+                and node.id not in signal_names:
+            if node.id in ambiguous:
+                raise ValueError(f"Tín hiệu '{node.id}' có trong nhiều message, dùng tên đầy đủ: "
+                                 f"{', '.join(ambiguous[node.id])}")
+            raise ValueError(f"Tên không xác định: '{node.id}' (không phải biến frame hay tín hiệu DBC)")
+        if isinstance(node, ast.Subscript):
+            if not (isinstance(node.value, ast.Name) and node.value.id == "data"
+                    and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, int)):
+                raise ValueError("Chỉ hỗ trợ data[<số nguyên>].")
+
+
+def _id_constraint(node):
+    """Tập arbitration ID mà biểu thức chỉ có thể đúng với chúng; None nếu không suy ra được."""
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if isinstance(right, ast.Name) and right.id == "id" and isinstance(op, ast.Eq):
+            left, right = right, left
+        if isinstance(left, ast.Name) and left.id == "id":
+            if isinstance(op, ast.Eq) and isinstance(right, ast.Constant):
+                return {int(right.value)}
+            if isinstance(op, ast.In) and isinstance(right, ast.Tuple) \
+                    and all(isinstance(item, ast.Constant) for item in right.elts):
+                return {int(item.value) for item in right.elts}
+        return None
+    if isinstance(node, ast.BoolOp):
+        parts = [_id_constraint(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            known = [part for part in parts if part is not None]
+            return set.intersection(*known) if known else None
+        if all(part is not None for part in parts):
+            return set.union(*parts)
+    return None
+
+
+def _extended_constraint(node):
+    """True/False nếu biểu thức chỉ đúng với frame ID mở rộng/chuẩn ('extended', 'not extended'); None nếu không rõ."""
+    if isinstance(node, ast.Name) and node.id == "extended":
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        inner = _extended_constraint(node.operand)
+        return None if inner is None else not inner
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], (ast.Eq, ast.NotEq)):
+        left, right = node.left, node.comparators[0]
+        if isinstance(right, ast.Name):
+            left, right = right, left
+        if isinstance(left, ast.Name) and left.id == "extended" and isinstance(right, ast.Constant):
+            return bool(right.value) == isinstance(node.ops[0], ast.Eq)
+        return None
+    if isinstance(node, ast.BoolOp):
+        parts = {_extended_constraint(value) for value in node.values}
+        if isinstance(node.op, ast.And):
+            parts.discard(None)
+        return parts.pop() if len(parts) == 1 else None
+    return None
+
+
+def _uses_frame(tree):
+    return any(isinstance(node, ast.Name) and node.id in FRAME_NAMES for node in ast.walk(tree))
+
+
+class TriggerRule:
+    """Một luật đã biên dịch: predicate(id, dlc, data, extended, sig) -> bool, kèm trạng thái sườn/thời lượng."""
+
+    def __init__(self, text, action, event, predicate, ids, signals, uses_frame, duration, extended=None):
+        self.text = text
+        self.action = action
+        self.event = event
+        self.predicate = predicate
+        self.ids = ids # frozenset ID, None = mọi frame
+        self.extended = extended # True/False: luật chỉ đúng với frame ID mở rộng/chuẩn; None = cả hai
+        self.signals = signals # frozenset cột tín hiệu (SignalDecoder.latest) mà luật dùng
+        self.uses_frame = uses_frame
+        self.duration = duration
+        self.true_since = None # monotonic lúc biểu thức bắt đầu đúng liên tục
+        self.fired = False     # Đã kích hoạt trong lần đúng liên tục hiện tại
+        self.fire_count = 0
+
+    def update(self, result, now):
+        """Cập nhật theo kết quả đánh giá; True nếu luật kích hoạt ở lần này."""
+        if not result:
+            self.true_since = None
+            self.fired = False
+            return False
+        if self.true_since is None:
+            self.true_since = now
+        if self.fired or now - self.true_since < self.duration:
+            return False
+        self.fired = True
+        self.fire_count += 1
+        return True
+
+    def frame_keys(self):
+        """(arbitration ID, extended) mà luật có thể khớp; ID > 0x7FF chỉ có thể là ID mở rộng."""
+        if self.ids is None:
+            return None
+        kinds = (False, True) if self.extended is None else (self.extended,)
+        return {(can_id, extended) for can_id in self.ids for extended in kinds
+                if extended or can_id <= STD_ID_MASK}
+
+    def __repr__(self):
+        return f"TriggerRule({self.text!r})"
+
+
+def compile_rule(text, signal_columns=None, default_event=None, ambiguous=None):
+    """'stop(Overspeed): speed > 80 for 2s' -> TriggerRule.
+
+    signal_columns: tên tín hiệu -> cột trong decoder (SignalDecoder.index); ambiguous: tên trần trùng giữa
+    các message -> tên đầy đủ (SignalDecoder.ambiguous), để báo lỗi rõ thay vì 'tên không xác định'.
+    """
+    signal_columns = signal_columns or {}
+    match = _RULE_RE.match(text)
+    if not match:
+        raise ValueError(f"Luật không đúng dạng '<hành động>: <biểu thức>': {text}")
+    action, event, expression = match.group(1).lower(), match.group(2), match.group(3)
+    if action not in RULE_ACTIONS:
+        raise ValueError(f"Hành động không hợp lệ '{action}' (chỉ {', '.join(RULE_ACTIONS)})")
+    duration = 0.0
+    for_match = _FOR_RE.search(expression)
+    if for_match:
+        duration = float(for_match.group(1)) / (1000.0 if for_match.group(2) == "ms" else 1.0)
+        expression = expression[:for_match.start()]
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Lỗi cú pháp trong luật '{text}': {e.msg}")
+    _validate(tree, signal_columns, ambiguous)
+    ids = _id_constraint(tree.body)
+    extended = _extended_constraint(tree.body)
+    uses_frame = _uses_frame(tree)
+    rewriter = _SignalRewriter(signal_columns)
+    tree = ast.fix_missing_locations(rewriter.visit(tree))
+    # Biên dịch một lần thành hàm; không có builtins để biểu thức không gọi được gì ngoài phép toán
+    source = f"lambda id, dlc, data, extended, sig: bool({ast.unparse(tree.body)})"
+    predicate = eval(compile(source, f"<rule: {text}>", "eval"), {"__builtins__": {"bool": bool}})
+    return TriggerRule(text.strip(), action, event or default_event, predicate,
+                       frozenset(ids) if ids is not None else None, frozenset(rewriter.used), uses_frame, duration,
+                       extended)
+
+
+def load_rules(path):
+    """Đọc file luật: mỗi dòng một luật, bỏ dòng trống và dòng chú thích '#'."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+class TriggerRuleEngine:
+    """Đánh giá các luật: theo frame (chỉ mục theo ID) ở listener, theo lô tín hiệu ở luồng CanWorker.
+
+    on_frame() chạy trong luồng Notifier, on_signals()/tick() trong luồng CanWorker; mỗi luật chỉ thuộc
+    một trong hai nhóm nên trạng thái không bị hai luồng cùng sửa.
+    """
+
+    def __init__(self, rules_text, decoder=None):
+        columns = decoder.index if decoder is not None else {}
+        ambiguous = decoder.ambiguous if decoder is not None else {}
+        self.by_id = {}       # (arbitration ID, extended) -> [TriggerRule] (luật có dùng biến frame)
+        self.any_frame = []   # Luật dùng biến frame nhưng không ràng buộc ID: đánh giá mọi frame
+        self.by_message = {}  # khóa message DBC -> [TriggerRule] (luật chỉ dùng tín hiệu)
+        self.signal_rules = []
+        self.rules = []
+        # cột tín hiệu -> khóa message (hai message có thể có tín hiệu trùng tên)
+        message_of = ({column: (signal.message_id, signal.extended) for column, signal in enumerate(decoder.signals)}
+                      if decoder is not None else {})
+        for number, text in enumerate(rules_text, 1):
+            rule = compile_rule(text, columns, default_event=f"Rule{number}", ambiguous=ambiguous)
+            self.rules.append(rule)
+            if rule.uses_frame:
+                if rule.ids is None:
+                    print(f"TriggerRuleEngine: Warning: rule without id constraint runs on every frame: {rule.text}")
+                    self.any_frame.append(rule)
+                else:
+                    for key in rule.frame_keys():
+                        self.by_id.setdefault(key, []).append(rule)
+            elif rule.signals:
+                self.signal_rules.append(rule)
+                for key in {message_of[column] for column in rule.signals}:
+                    self.by_message.setdefault(key, []).append(rule)
+            else:
+                raise ValueError(f"Luật không phụ thuộc frame hay tín hiệu nào: {rule.text}")
+        self.decoder = decoder
+        self._sig = decoder.latest if decoder is not None else ()
+        self.evaluations = 0
+        self.clock = time.monotonic # Đồng hồ khi không truyền now (phát lại log: thời gian trong log)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def frame_ids(self):
+        """(arbitration ID, extended) cần cho bộ lọc bus; None nếu có luật phải xem mọi frame."""
+        return None if self.any_frame else sorted(self.by_id)
+
+    def _evaluate(self, rules, msg, now, fired):
+        data = msg.data if msg is not None else ()
+        args = ((msg.arbitration_id, msg.dlc, data, msg.is_extended_id) if msg is not None
+                else (None, 0, data, False))
+        for rule in rules:
+            try:
+                result = rule.predicate(*args, self._sig)
+            except (IndexError, ZeroDivisionError, TypeError):
+                result = False # vd: data[7] trên frame 4 byte
+            self.evaluations += 1
+            if rule.update(result, now):
+                fired.append(rule)
+
+    def on_frame(self, msg, now=None):
+        """Luật kích hoạt bởi frame này (thường là list rỗng: ID không có luật -> một lần tra dict)."""
+        rules = self.by_id.get((msg.arbitration_id, msg.is_extended_id))
+        if rules is None and not self.any_frame:
+            return ()
+        now = self.clock() if now is None else now
+        fired = []
+        if rules:
+            self._evaluate(rules, msg, now, fired)
+        if self.any_frame:
+            self._evaluate(self.any_frame, msg, now, fired)
+        return fired
+
+    def on_signals(self, message_keys, now=None):
+        """Sau một lô giải mã: chỉ đánh giá luật có tín hiệu thuộc các message vừa nhận."""
+        now = self.clock() if now is None else now
+        fired, seen = [], set()
+        for key in message_keys:
+            for rule in self.by_message.get(key, ()):
+                if id(rule) not in seen:
+                    seen.add(id(rule))
+                    self._evaluate((rule,), None, now, fired)
+        return fired
+
+    def tick(self, now=None):
+        """Luật tín hiệu đang chờ đủ thời lượng 'for' vẫn kích hoạt khi message ngừng gửi."""
+        now = self.clock() if now is None else now
+        fired = []
+        pending = [rule for rule in self.signal_rules if rule.true_since is not None and not rule.fired]
+        if pending:
+            self._evaluate(pending, None, now, fired)
+        return fired
+
+    def stats(self):
+        return {"rules": len(self.rules), "indexed_ids": len(self.by_id), "any_frame": len(self.any_frame),
+                "signal_rules": len(self.signal_rules), "evaluations": self.evaluations,
+                "fired": {rule.text: rule.fire_count for rule in self.rules if rule.fire_count}}
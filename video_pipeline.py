@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""Các thành phần xử lý frame dùng chung cho CameraThread (không phụ thuộc Qt)."""
+import array
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import HOP_FIRST_LIVE_WRITE, HOP_FIRST_WRITE, STAGE_ENCODE
+
+# ---- Cấu hình mặc định ----
+DEFAULT_PREROLL_SECONDS = 5.0
+DEFAULT_PREROLL_MAX_BYTES = 64 * 1024 * 1024 # 64 MB cho toàn bộ bộ đệm
+DEFAULT_PREROLL_JPEG_QUALITY = 80
+DEFAULT_WRITER_QUEUE_SIZE = 64 # Số frame tối đa chờ mã hóa
+
+# Chính sách khi hàng đợi ghi bị đầy
+OVERFLOW_BLOCK = "block"             # Chờ đến khi có chỗ (camera bị chặn)
+OVERFLOW_DROP_OLDEST = "drop_oldest" # Bỏ frame cũ nhất trong hàng đợi
+OVERFLOW_DROP_NEWEST = "drop_newest" # Bỏ frame vừa đến
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# Chế độ điều tốc vòng lặp camera
+PACING_CAMERA = "camera" # Chỉ chờ trên camera (grab/retrieve), không sleep
+PACING_FIXED = "fixed"   # Sleep cố định sau mỗi frame (hành vi cũ)
+DEFAULT_FPS_WINDOW = 60 # Số frame dùng để đo FPS thực tế
+DEFAULT_PREVIEW_FPS = 15.0 # Tần số cập nhật preview mặc định
+DEFAULT_PREVIEW_POOL_SIZE = 3 # Đang hiển thị + đang chờ GUI + đang được ghi
+
+
+# ---- Bộ đệm pre-roll ----
+class PreRollBuffer:
+    """Bộ đệm vòng giữ N giây frame gần nhất (nén JPEG), giới hạn theo tổng số byte."""
+
+    def __init__(self, seconds=DEFAULT_PREROLL_SECONDS, max_bytes=DEFAULT_PREROLL_MAX_BYTES,
+                 jpeg_quality=DEFAULT_PREROLL_JPEG_QUALITY):
+        self.seconds = float(seconds)
+        self.max_bytes = int(max_bytes)
+        self._encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+        self._frames = collections.deque() # Phần tử: (timestamp monotonic, bytes JPEG)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evicted_frames = 0
+
+    @property
+    def enabled(self):
+        return self.seconds > 0 and self.max_bytes > 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._frames)
+
+    def push(self, frame, timestamp=None):
+        """Nén frame BGR và thêm vào cuối bộ đệm, loại bỏ frame cũ nhất khi vượt giới hạn."""
+        if not self.enabled:
+            return False
+        if timestamp is None:
+            timestamp = time.monotonic()
+        ok, encoded = cv2.imencode('.jpg', frame, self._encode_params)
+        if not ok:
+            return False
+        data = encoded.tobytes()
+        if len(data) > self.max_bytes:
+            return False # Một frame đã vượt ngân sách -> bỏ qua
+
+        with self._lock:
+            self._frames.append((timestamp, data))
+            self._total_bytes += len(data)
+            # Loại bỏ theo thời gian trước, sau đó theo dung lượng (cũ nhất trước)
+            oldest_allowed = timestamp - self.seconds
+            while self._frames and (self._frames[0][0] < oldest_allowed or self._total_bytes > self.max_bytes):
+                _, old = self._frames.popleft()
+                self._total_bytes -= len(old)
+                self.evicted_frames += 1
+        return True
+
+    def drain(self):
+        """Lấy toàn bộ frame trong bộ đệm (cũ -> mới) và làm rỗng bộ đệm."""
+        with self._lock:
+            frames = list(self._frames)
+            self._frames.clear()
+            self._total_bytes = 0
+        return frames
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._total_bytes = 0
+
+    @staticmethod
+    def decode(jpeg_bytes):
+        """Giải nén một frame JPEG trong bộ đệm về mảng BGR."""
+        return cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+# ---- Đồng hồ frame ----
+class FrameClock:
+    """Ghi timestamp monotonic của từng frame và tính FPS thực tế trên cửa sổ trượt."""
+
+    def __init__(self, window=DEFAULT_FPS_WINDOW, min_samples=10):
+        self._stamps = collections.deque(maxlen=max(2, int(window)))
+        self.min_samples = max(2, int(min_samples))
+        self.frame_count = 0
+        self.last_timestamp = None
+
+    def tick(self, timestamp=None):
+        """Ghi nhận một frame vừa lấy từ camera, trả về timestamp đã dùng."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._stamps.append(timestamp)
+        self.last_timestamp = timestamp
+        self.frame_count += 1
+        return timestamp
+
+    @property
+    def ready(self):
+        return len(self._stamps) >= self.min_samples
+
+    @property
+    def fps(self):
+        """FPS thực tế trên cửa sổ hiện tại, 0.0 nếu chưa đủ mẫu."""
+        if len(self._stamps) < 2:
+            return 0.0
+        span = self._stamps[-1] - self._stamps[0]
+        if span <= 0:
+            return 0.0
+        return (len(self._stamps) - 1) / span
+
+    def reset(self):
+        self._stamps.clear()
+        self.frame_count = 0
+        self.last_timestamp = None
+
+
+def resolve_recording_fps(clock, cap_fps, default_fps=25.0, max_fps=120.0):
+    """Chọn FPS cho VideoWriter: ưu tiên FPS đo được, sau đó CAP_PROP_FPS, cuối cùng giá trị mặc định."""
+    if clock is not None and clock.ready and 0 < clock.fps <= max_fps:
+        return clock.fps
+    if cap_fps and 0 < cap_fps <= max_fps:
+        return cap_fps
+    return default_fps
+
+
+def read_frame(cap, clock=None):
+    """Đọc một frame bằng grab/retrieve, đóng dấu thời gian ngay sau grab. Trả về (ret, frame, timestamp).
+
+    Nguồn có capture_timestamp (vd: ProcessCapture) dùng timestamp do tiến trình camera đóng.
+    """
+    if not cap.grab():
+        return False, None, None
+    timestamp = getattr(cap, "capture_timestamp", None)
+    if timestamp is None: # 0.0 là timestamp hợp lệ (vd: log ASC phát lại bắt đầu từ 0)
+        timestamp = time.monotonic()
+    ret, frame = cap.retrieve()
+    if not ret:
+        return False, None, None
+    if clock is not None:
+        clock.tick(timestamp)
+    return True, frame, timestamp
+
+
+# ---- Preview ----
+def fit_size(src_w, src_h, max_w, max_h):
+    """Kích thước lớn nhất giữ nguyên tỉ lệ khung hình nằm gọn trong (max_w, max_h)."""
+    if src_w <= 0 or src_h <= 0 or max_w <= 0 or max_h <= 0:
+        return 0, 0
+    scale = min(max_w / src_w, max_h / src_h)
+    return max(1, int(src_w * scale)), max(1, int(src_h * scale))
+
+
+class PooledFrame:
+    """Một bộ đệm preview cấp phát sẵn; trả lại pool bằng release() khi GUI không dùng nữa."""
+    __slots__ = ("pool", "array", "generation", "timestamp")
+
+    def __init__(self, pool, array, generation):
+        self.pool = pool
+        self.array = array
+        self.generation = generation
+        self.timestamp = 0.0
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    def release(self):
+        self.pool.release(self)
+
+
+class FrameBufferPool:
+    """Pool nhỏ các mảng BGR cấp phát trước để trao frame preview cho GUI mà không cấp phát mỗi frame."""
+
+    def __init__(self, size=DEFAULT_PREVIEW_POOL_SIZE):
+        self.size = max(2, int(size))
+        self._lock = threading.Lock()
+        self._free = collections.deque()
+        self._shape = None
+        self._generation = 0
+        self.exhausted = 0 # Số lần không còn bộ đệm trống (GUI chưa kịp vẽ)
+
+    def _reallocate(self, shape):
+        # Đổi kích thước: bộ đệm cũ đang được GUI giữ sẽ bị bỏ khi release()
+        self._generation += 1
+        self._shape = shape
+        self._free.clear()
+        for _ in range(self.size):
+            self._free.append(PooledFrame(self, np.empty(shape, dtype=np.uint8), self._generation))
+
+    def acquire(self, shape):
+        """Lấy một bộ đệm trống có kích thước shape, None nếu tất cả đang bận."""
+        with self._lock:
+            if shape != self._shape:
+                self._reallocate(shape)
+            if not self._free:
+                self.exhausted += 1
+                return None
+            return self._free.popleft()
+
+    def release(self, frame):
+        with self._lock:
+            if frame.generation == self._generation:
+                self._free.append(frame)
+
+
+class PreviewThrottle:
+    """Giảm tần số preview và thu nhỏ frame về kích thước vùng hiển thị ngay trong luồng camera."""
+
+    def __init__(self, rate_hz=DEFAULT_PREVIEW_FPS):
+        self.enabled = True
+        self.target_size = None # (w, h) của vùng hiển thị, do GUI cập nhật
+        self._interval = 0.0
+        self._next_due = 0.0
+        self.shown_frames = 0
+        self.skipped_frames = 0
+        self.set_rate(rate_hz)
+
+    def set_rate(self, rate_hz):
+        # rate_hz <= 0: hiển thị mọi frame
+        self._interval = 1.0 / rate_hz if rate_hz and rate_hz > 0 else 0.0
+        self._next_due = 0.0
+
+    def set_target_size(self, width, height):
+        self.target_size = (int(width), int(height)) if width > 0 and height > 0 else None
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        self._next_due = 0.0
+
+    def due(self, timestamp):
+        """True nếu frame tại thời điểm này cần được hiển thị."""
+        if not self.enabled:
+            return False
+        if timestamp < self._next_due:
+            self.skipped_frames += 1
+            return False
+        # Giữ nhịp đều; nếu bị trễ quá một chu kỳ thì đặt lại mốc
+        self._next_due += self._interval
+        if self._next_due <= timestamp:
+            self._next_due = timestamp + self._interval
+        self.shown_frames += 1
+        return True
+
+    def render_into(self, frame, pool, swap_rb=False, timestamp=0.0):
+        """Co giãn frame thẳng vào một bộ đệm của pool. Trả về PooledFrame hoặc None nếu pool đang bận."""
+        h, w = frame.shape[:2]
+        dst_w, dst_h = fit_size(w, h, *self.target_size) if self.target_size else (w, h)
+        if dst_w <= 0:
+            return None
+        pooled = pool.acquire((dst_h, dst_w, 3))
+        if pooled is None:
+            self.skipped_frames += 1
+            return None
+        if (dst_w, dst_h) == (w, h):
+            np.copyto(pooled.array, frame)
+        else:
+            interpolation = cv2.INTER_AREA if dst_w < w else cv2.INTER_LINEAR
+            cv2.resize(frame, (dst_w, dst_h), dst=pooled.array, interpolation=interpolation)
+        if swap_rb: # Chỉ khi Qt không hỗ trợ QImage.Format_BGR888
+            cv2.cvtColor(pooled.array, cv2.COLOR_BGR2RGB, dst=pooled.array)
+        pooled.timestamp = timestamp
+        return pooled
+
+
+# ---- Luồng mã hóa video ----
+class FrameWriterThread(threading.Thread):
+    """Luồng ghi video riêng, nhận frame qua hàng đợi giới hạn để camera không bị chặn khi mã hóa chậm.
+
+    metrics (MetricsRegistry, tùy chọn): CPU mã hóa theo chặng và mốc ghi frame đầu của trigger Start.
+    """
+    TRACE_TRIGGER = True # Writer mở theo lệnh Start: lần ghi đầu là một chặng của trigger
+
+    def __init__(self, writer, frame_size, max_queue=DEFAULT_WRITER_QUEUE_SIZE,
+                 overflow=OVERFLOW_DROP_OLDEST, preroll=None, on_error=None, name="FrameWriter", metrics=None):
+        super().__init__(name=name, daemon=True)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Chính sách tràn hàng đợi không hợp lệ: {overflow}")
+        self.writer = writer
+        self.frame_size = tuple(frame_size)
+        self.max_queue = max(1, int(max_queue))
+        self.overflow = overflow
+        self.on_error = on_error
+        self.metrics = metrics
+        self._preroll = preroll or [] # Danh sách (timestamp, JPEG) ghi trước frame trực tiếp
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._failed = False
+        # Bộ đếm
+        self.submitted = 0
+        self.written = 0
+        self.preroll_written = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.write_errors = 0
+        self.release_error = None
+        # Timestamp monotonic của từng frame đã ghi vào video (theo thứ tự frame trong file)
+        self.frame_timestamps = array.array("d")
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def submit(self, frame, timestamp=None):
+        """Đưa frame vào hàng đợi ghi. Trả về False nếu frame bị bỏ."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._cond:
+            if self._closing or self._failed:
+                return False
+            self.submitted += 1
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped_newest += 1
+                    return False
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped_oldest += 1
+                else: # OVERFLOW_BLOCK
+                    while len(self._queue) >= self.max_queue and not (self._closing or self._failed):
+                        self._cond.wait(0.5)
+                    if self._closing or self._failed:
+                        return False
+            self._queue.append((timestamp, frame))
+            self._cond.notify_all()
+        return True
+
+    def close(self, timeout=None):
+        """Ghi nốt các frame còn lại, giải phóng VideoWriter và trả về thống kê."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+        return self.stats()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "preroll_written": self.preroll_written,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_newest": self.dropped_newest,
+            "write_errors": self.write_errors,
+            "queue_depth": len(self._queue),
+        }
+
+    def _write(self, frame, timestamp):
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        self.writer.write(frame)
+
+    def _fail(self, exc):
+        self.write_errors += 1
+        with self._cond:
+            self._failed = True
+            self._queue.clear()
+            self._cond.notify_all()
+        print(f"FrameWriter: Write frame error: {exc}")
+        if self.on_error:
+            self.on_error(exc)
+
+    def _write_measured(self, frame, timestamp):
+        cpu = time.thread_time() # CPU của riêng luồng này, không tính thời gian chờ
+        self._write(frame, timestamp)
+        self.metrics.add_cpu(STAGE_ENCODE, time.thread_time() - cpu)
+
+    def run(self):
+        metrics = self.metrics
+        write = self._write if metrics is None else self._write_measured
+        trace = metrics is not None and self.TRACE_TRIGGER
+        try:
+            # Ghi pre-roll trước, giải nén ngay trong luồng này
+            for ts, data in self._preroll:
+                frame = PreRollBuffer.decode(data)
+                if frame is None:
+                    continue
+                write(frame, ts)
+                if trace and not self.preroll_written:
+                    metrics.mark_trigger(HOP_FIRST_WRITE)
+                self.frame_timestamps.append(ts)
+                self.preroll_written += 1
+            self._preroll = []
+
+            while True:
+                with self._cond:
+                    while not self._queue and not self._closing:
+                        self._cond.wait()
+                    if not self._queue: # Đang đóng và đã ghi hết
+                        break
+                    ts, frame = self._queue.popleft()
+                    self._cond.notify_all() # Báo cho submit() đang chờ (chính sách block)
+                write(frame, ts)
+                if trace and not self.written:
+                    metrics.mark_trigger(HOP_FIRST_LIVE_WRITE)
+                    metrics.mark_trigger(HOP_FIRST_WRITE) # Chỉ có tác dụng khi không có pre-roll
+                self.frame_timestamps.append(ts)
+                self.written += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if metrics is not None:
+                metrics.increment("frames_written", self.written + self.preroll_written)
+                metrics.increment("frames_dropped", self.dropped)
+            self._release()
+
+    def _release(self):
+        try:
+            self.writer.release()
+        except Exception as release_e:
+            self.write_errors += 1
+            self.release_error = release_e # vd: ffmpeg thoát lỗi khi ghi nốt -> clip có thể hỏng
+            print(f"FrameWriter: Error releasing VideoWriter: {release_e}")
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Widget hiển thị video vẽ trực tiếp từ bộ đệm frame dùng chung (thay cho QLabel.setPixmap)."""
+from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtWidgets import QWidget, QStyle, QStyleOption
+
+# Qt >= 5.14 đọc thẳng dữ liệu BGR của OpenCV, không cần cvtColor
+HAS_BGR888 = hasattr(QImage, "Format_BGR888")
+FRAME_FORMAT = QImage.Format_BGR888 if HAS_BGR888 else QImage.Format_RGB888
+NEEDS_RB_SWAP = not HAS_BGR888
+
+
+class VideoWidget(QWidget):
+    """Vẽ frame mới nhất bằng QPainter; giữ một PooledFrame và trả lại pool khi có frame mới."""
+
+    def __init__(self, text="", parent=None):
+        super().__init__(parent)
+        self._frame = None
+        self._text = text
+
+    def setText(self, text):
+        self._text = text
+        self.update()
+
+    def text(self):
+        return self._text
+
+    @pyqtSlot(object)
+    def show_frame(self, frame):
+        previous, self._frame = self._frame, frame
+        if previous is not None and previous is not frame:
+            previous.release()
+        self.update()
+
+    def clear(self):
+        """Bỏ frame đang hiển thị (trả bộ đệm về pool)."""
+        if self._frame is not None:
+            self._frame.release()
+            self._frame = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        # Vẽ nền/viền theo styleSheet như QLabel
+        opt = QStyleOption()
+        opt.initFrom(self)
+        self.style().drawPrimitive(QStyle.PE_Widget, opt, painter, self)
+
+        area = self.contentsRect()
+        frame = self._frame
+        if frame is not None:
+            array = frame.array
+            h, w = array.shape[:2]
+            # Bọc thẳng bộ nhớ numpy, không sao chép; frame còn được giữ trong self._frame khi vẽ
+            image = QImage(array.data, w, h, array.strides[0], FRAME_FORMAT)
+            x = area.x() + (area.width() - w) // 2
+            y = area.y() + (area.height() - h) // 2
+            painter.drawImage(x, y, image)
+        elif self._text:
+            painter.drawText(area, Qt.AlignCenter, self._text)
+        painter.end()